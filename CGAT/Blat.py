@@ -35,6 +35,8 @@ Code
 '''
 import copy
 import string
+import array
+import itertools
 import collections
 
 try:
@@ -45,6 +47,11 @@ except ImportError:
 from CGAT import Components as Components
 from CGAT import Experiment as E
 
+try:
+    from CGAT import cblat
+except ImportError:
+    cblat = None
+
 
 class Error(Exception):
 
@@ -82,7 +89,43 @@ match   mis-    rep.    N's     Q gap   Q gap   T gap   T gap   strand  Q
 ---------------------------------------------------------------------------------------------------------------------------------------------------------------"""
 
 
-class Match:
+def _decodeBlocks(value):
+    """decode a comma-separated list of integers as in a psl file."""
+    value = value.rstrip(",")
+    if value:
+        return array.array("i", map(int, value.split(",")))
+    else:
+        return array.array("i")
+
+
+class _BlockField(object):
+
+    """a block field of a :class:`Match`.
+
+    Values are stored in the slot *name*. Strings from a psl file
+    are decoded into an :class:`array.array` on first access. Other
+    values, for example lists, are converted when they are set.
+    """
+
+    def __init__(self, name):
+        self.mName = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.mName)
+        if isinstance(value, str):
+            value = _decodeBlocks(value)
+            setattr(obj, self.mName, value)
+        return value
+
+    def __set__(self, obj, value):
+        if not isinstance(value, (str, array.array)):
+            value = array.array("i", value)
+        setattr(obj, self.mName, value)
+
+
+class Match(object):
 
     """a psl match.
 
@@ -91,8 +134,28 @@ class Match:
 
     The fields mQueryFrom/To and mSbjctFrom/To are always on the forward
     strand.
+
+    Block sizes and starts read from a file are decoded on first access
+    into arrays of integers.
     """
 
+    __slots__ = ("mNMatches", "mNMismatches", "mNRepMatches", "mNns",
+                 "mQueryNGapsCounts", "mQueryNGapsBases",
+                 "mSbjctNGapsCounts", "mSbjctNGapsBases",
+                 "strand",
+                 "mQueryId", "mQueryLength", "mQueryFrom", "mQueryTo",
+                 "mSbjctId", "mSbjctLength", "mSbjctFrom", "mSbjctTo",
+                 "mNBlocks",
+                 "_mBlockSizes", "_mQueryBlockStarts", "_mSbjctBlockStarts",
+                 "mQueryCoverage", "mSbjctCoverage", "mPid",
+                 "mMapQuery2Target", "mMapTarget2Query",
+                 # permit additional attributes
+                 "__dict__")
+
+    mBlockSizes = _BlockField("_mBlockSizes")
+    mQueryBlockStarts = _BlockField("_mQueryBlockStarts")
+    mSbjctBlockStarts = _BlockField("_mSbjctBlockStarts")
+
     def __init__(self):
         self.mNMatches = 0
         self.mNMismatches = 0
@@ -214,31 +277,36 @@ class Match:
             raise ParsingError("parsing error: %i fields" %
                                len(data), "\t".join(data))
 
-        nmatches, nmismatches, nrepmatches, nns = map(
-            int,
-            (nmatches, nmismatches, nrepmatches, nns))
-
-        self.mNMatches = nmatches
-        self.mNMismatches = nmismatches
-        self.mNRepMatches = nrepmatches
-        self.mNns = nns
-        self.mQueryNGapsCounts = int(query_ngaps_counts)
-        self.mQueryNGapsBases = int(query_ngaps_bases)
-        self.mSbjctNGapsCounts = int(sbjct_ngaps_counts)
-        self.mSbjctNGapsBases = int(sbjct_ngaps_bases)
+        try:
+            nmatches, nmismatches, nrepmatches, nns = map(
+                int,
+                (nmatches, nmismatches, nrepmatches, nns))
+
+            self.mNMatches = nmatches
+            self.mNMismatches = nmismatches
+            self.mNRepMatches = nrepmatches
+            self.mNns = nns
+            self.mQueryNGapsCounts = int(query_ngaps_counts)
+            self.mQueryNGapsBases = int(query_ngaps_bases)
+            self.mSbjctNGapsCounts = int(sbjct_ngaps_counts)
+            self.mSbjctNGapsBases = int(sbjct_ngaps_bases)
+            self.mQueryLength = int(query_length)
+            self.mQueryFrom = int(query_from)
+            self.mQueryTo = int(query_to)
+            self.mSbjctLength = int(sbjct_length)
+            self.mSbjctFrom = int(sbjct_from)
+            self.mSbjctTo = int(sbjct_to)
+            self.mNBlocks = int(nblocks)
+        except ValueError, msg:
+            raise ParsingError("parsing error: %s" % msg, "\t".join(data))
+
         self.strand = strand
         self.mQueryId = query_id
-        self.mQueryLength = int(query_length)
-        self.mQueryFrom = int(query_from)
-        self.mQueryTo = int(query_to)
         self.mSbjctId = sbjct_id
-        self.mSbjctLength = int(sbjct_length)
-        self.mSbjctFrom = int(sbjct_from)
-        self.mSbjctTo = int(sbjct_to)
-        self.mNBlocks = int(nblocks)
-        self.mBlockSizes = map(int, block_sizes[:-1].split(","))
-        self.mQueryBlockStarts = map(int, query_block_starts[:-1].split(","))
-        self.mSbjctBlockStarts = map(int, sbjct_block_starts[:-1].split(","))
+        # decoded on first access
+        self.mBlockSizes = block_sizes
+        self.mQueryBlockStarts = query_block_starts
+        self.mSbjctBlockStarts = sbjct_block_starts
 
         # this makes sure that the block positions are rescaled
         if self.mQueryLength != 0:
@@ -363,17 +431,6 @@ class Match:
             self.mQueryBlockStarts, self.mSbjctBlockStarts, self.mBlockSizes = str(
                 f).split("\t")
 
-        if self.mBlockSizes:
-            self.mBlockSizes = map(int, self.mBlockSizes[:-1].split(","))
-            self.mQueryBlockStarts = map(
-                int, self.mQueryBlockStarts[:-1].split(","))
-            self.mSbjctBlockStarts = map(
-                int, self.mSbjctBlockStarts[:-1].split(","))
-        else:
-            self.mBlockSizes = []
-            self.mQueryBlockStarts = []
-            self.mSbjctBlockStarts = []
-
         self.mNBlocks = len(self.mBlockSizes)
 
         self.mQueryFrom, self.mQueryTo, self.mSbjctFrom, self.mSbjctTo = \
@@ -577,34 +634,71 @@ class MatchPSLX(Match):
                 sbjct_sequence[start_sbjct - offset_sbjct:start_sbjct - offset_sbjct + size])
 
 
-def _iterate(infile):
-    """iterator over psl output.
+def _iterateLines(infile, batch_size=10000):
+    """iterate over data lines in a psl file.
+
+    Lines are read in chunks of *batch_size* lines. Header and
+    comment lines are removed.
 
     The header is optional.
     """
 
-    format = "ps3"
-
+    skip = 0
     while 1:
-        line = infile.readline()
-        if not line:
-            raise StopIteration
+        lines = list(itertools.islice(infile, batch_size))
+        if not lines:
+            break
 
-        if line[0] == "#":
-            continue
+        data = []
+        for line in lines:
+            if skip:
+                skip -= 1
+                continue
+            if line[0] == "#":
+                continue
+            if line.startswith("match"):
+                continue
+            if line.startswith("psLayout version 3"):
+                skip = 4
+                continue
+            data.append(line)
+
+        if data:
+            yield data
+
+
+def parseLines(lines, factory=Match):
+    """parse psl formatted lines.
+
+    Returns a list of :class:`Match` objects. The compiled parser
+    is used if it is available.
+    """
+    if cblat is not None and factory is Match:
+        return cblat.parseLines(lines, factory, ParsingError)
 
-        if line.startswith("match"):
-            continue
+    result = []
+    for line in lines:
+        match = factory()
+        match.fromTable(line[:-1].split())
+        result.append(match)
+    return result
 
-        if line.startswith("psLayout version 3"):
-            format = "ps3"
-            for x in range(4):
-                infile.readline()
-            continue
 
-        match = Match()
-        match.fromTable(line[:-1].split("\t"))
-        yield match
+def iterator_batched(infile, batch_size=10000):
+    """iterate over the contents of a psl file in batches.
+
+    Returns lists of up to *batch_size* :class:`Match` objects.
+    """
+    for lines in _iterateLines(infile, batch_size):
+        yield parseLines(lines)
+
+
+def _iterate(infile):
+    """iterator over psl output.
+
+    The header is optional.
+    """
+    return iterator(infile)
 
 
 class BlatIterator:
@@ -646,41 +740,23 @@ def iterator2(infile):
 def iterator(infile):
     """iterate over the contents of a psl file.
     """
-    while 1:
-        line = infile.readline()
-        if not line:
-            raise StopIteration
-        if line[0] == "#":
-            continue
-        if line.startswith("match"):
-            continue
-        if line.startswith("psLayout version 3"):
-            for x in range(4):
-                infile.readline()
-            continue
-        match = Match()
-        match.fromTable(line[:-1].split())
-        yield match
+    for lines in _iterateLines(infile):
+        try:
+            matches = parseLines(lines)
+        except ParsingError:
+            # parse line by line to return matches before
+            # the offending line
+            matches = (parseLines([line])[0] for line in lines)
+        for match in matches:
+            yield match
 
 
 def iterator_pslx(infile):
     """iterate over the contents of a pslx file.
     """
-    while 1:
-        line = infile.readline()
-        if not line:
-            raise StopIteration
-        if line[0] == "#":
-            continue
-        if line.startswith("match"):
-            continue
-        if line.startswith("psLayout version 3"):
-            for x in range(4):
-                infile.readline()
-            continue
-        match = MatchPSLX()
-        match.fromTable(line[:-1].split())
-        yield match
+    for lines in _iterateLines(infile):
+        for match in parseLines(lines, factory=MatchPSLX):
+            yield match
 
 
 def iterator_target_overlap(infile, merge_distance):
@@ -693,12 +769,8 @@ def iterator_target_overlap(infile, merge_distance):
     matches = []
     processed_contigs = set()
 
-    while 1:
-
-        match = infile.next()
-
-        if match is None:
-            break
+    # accepts BlatIterator (returns None at end) and iterators
+    for match in iter(infile.next, None):
 
         if match.mSbjctId != last_sbjct_id or match.mSbjctFrom >= (end + merge_distance):
             if last_sbjct_id:
@@ -734,12 +806,8 @@ def iterator_query_overlap(infile, merge_distance):
     matches = []
     processed_contigs = set()
 
-    while 1:
-
-        match = infile.next()
-
-        if match is None:
-            break
+    # accepts BlatIterator (returns None at end) and iterators
+    for match in iter(infile.next, None):
 
         if match.mQueryId != last_query_id or match.mQueryFrom >= (end + merge_distance):
             if last_query_id:
@@ -902,9 +970,32 @@ def getComponents(matches, max_distance=0, min_overlap=0, by_query=False):
                 matches[y].mMapTarget2Query,
                 alignlib_lite.py_RR) <= max_distance
 
-    for x in range(len(matches)):
-        for y in range(0, x):
+    # only test pairs of matches whose aligned regions are
+    # within max_distance. Matches without blocks use the
+    # coordinates of the match.
+    starts, ends = [], []
+    for x in matches:
+        if by_query:
+            block_starts = x.mQueryBlockStarts
+            match_from, match_to = x.mQueryFrom, x.mQueryTo
+        else:
+            block_starts = x.mSbjctBlockStarts
+            match_from, match_to = x.mSbjctFrom, x.mSbjctTo
+        if x.mNBlocks == 0:
+            starts.append(match_from)
+            ends.append(match_to)
+        else:
+            starts.append(min(block_starts))
+            ends.append(max([y + z for y, z in zip(block_starts,
+                                                   x.mBlockSizes)]))
+
+    active = []
+    for x in sorted(range(len(matches)), key=lambda x: starts[x]):
+        active = [y for y in active
+                  if ends[y] + max_distance >= starts[x]]
+        for y in active:
             if f(x, y):
                 components.add(x, y)
+        active.append(x)
 
     return components.getComponents()
@@ -12,6 +12,10 @@ CSV.py - Tools for parsing CSV files
 import re
 import types
 import csv
+import collections
+import itertools
+import numpy
+import pandas
 
 
 def ConvertDictionary(d, map={}):
@@ -214,55 +218,349 @@ class DictReaderLarge:
         assert len(data) == self.mNFields
         return dict(zip(self.mFieldNames, data))
 
-##########################################################################
 
+class ReaderLarge:
 
-def ReadTable(lines,
-              as_rows=True,
-              with_header=True,
-              ignore_incomplete=False,
-              dialect="excel-tab"):
-    """read a table from infile
+    """drop-in for csv.reader - handles very large fields
 
-    returns table as rows or as columns.
-    If remove_incomplete, incomplete rows are simply ignored.
+    Rows need to have *nfields* fields.
+
+    Warning - minimal implementation - does not handle dialects
     """
 
-    if isinstance(lines, file):
-        lines = lines.readlines()
+    def __init__(self, infile, nfields):
+        self.mFile = infile
+        self.mNFields = nfields
 
-    lines = filter(lambda x: x[0] != "#", lines)
+    def __iter__(self):
+        return self
 
-    if len(lines) == 0:
-        return [], []
+    def next(self):
 
-    if with_header:
-        fields = lines[0][:-1].split("\t")
-        del lines[0]
-    else:
-        fields = lines[0][:-1].split("\t")
+        line = self.mFile.next()
+        if not line:
+            raise StopIteration
+        data = line[:-1].split("\t")
+        assert len(data) == self.mNFields
+        return data
+
+##########################################################################
+# Chunked reading of tables into typed columns
+
+# number of rows parsed at a time
+CHUNK_SIZE = 100000
+
+# number of values examined to infer the type of a column
+SAMPLE_SIZE = 1000
+
+
+def iterateTableChunks(lines,
+                       with_header=True,
+                       ignore_incomplete=False,
+                       pad_incomplete=False,
+                       dialect="excel-tab",
+                       chunk_size=CHUNK_SIZE,
+                       counter=None):
+    """read a table from *lines* in chunks of *chunk_size* rows.
+
+    Lines starting with ``#`` are skipped. If *dialect* is None,
+    lines are split at tabs instead of using the csv module, which
+    permits very large fields.
+
+    Rows with a different number of fields than the header raise a
+    ValueError unless *ignore_incomplete* is set, in which case they
+    are skipped. If *pad_incomplete* is set, empty rows are skipped
+    and short rows are padded with empty fields.
+
+    If *counter* is given, rows that can not be parsed are skipped
+    and counted in ``counter.errors``.
+
+    returns the fields and an iterator over chunks. Each chunk is a
+    list of rows.
+    """
+
+    lines = (x for x in lines if x[0] != "#")
+
+    try:
+        first = lines.next()
+    except StopIteration:
+        return [], iter([])
+
+    fields = first[:-1].split("\t")
+    if not with_header:
+        lines = itertools.chain([first], lines)
         fields = map(str, range(len(fields)))
 
     nfields = len(fields)
 
+    if dialect is None:
+        reader = (x[:-1].split("\t") if x[:-1] else [] for x in lines)
+    else:
+        try:
+            reader = csv.reader(lines, dialect=dialect)
+        except TypeError:
+            reader = csv.reader(lines)
+
+    if counter is not None:
+        reader = _iterateValidRows(reader, counter)
+
+    def _iterate():
+        nrows = 0
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if not rows:
+                break
+            if ignore_incomplete:
+                rows = [x for x in rows if len(x) == nfields]
+            elif pad_incomplete:
+                rows = [x for x in rows if x]
+                for row in rows:
+                    if len(row) < nfields:
+                        row.extend([""] * (nfields - len(row)))
+            else:
+                for r, row in enumerate(rows):
+                    if len(row) != nfields:
+                        raise ValueError(
+                            "missing elements in line %s, received=%s, "
+                            "expected=%s" %
+                            (nrows + r, str(row), str(fields)))
+            nrows += len(rows)
+            yield rows
+
+    return fields, _iterate()
+
+
+def _iterateValidRows(reader, counter):
+    """iterate over rows in *reader* skipping rows with parsing
+    errors."""
+    while True:
+        try:
+            yield reader.next()
+        except csv.Error:
+            counter.errors += 1
+        except StopIteration:
+            return
+
+
+def getColumnType(values, sample_size=SAMPLE_SIZE, missing_value="na"):
+    """infer the type of a column from a sample of *values*.
+
+    Up to *sample_size* values spread evenly across the column are
+    examined. Empty and missing values are ignored.
+
+    returns int, float or str.
+    """
+    step = max(1, len(values) // sample_size)
+    sample = [x for x in values[::step]
+              if x != "" and x != missing_value]
+
+    for dtype in (int, float):
+        try:
+            for x in sample:
+                dtype(x)
+        except ValueError:
+            continue
+        return dtype
+    return str
+
+
+class Column(object):
+
+    """a column of a table stored in a numpy array.
+
+    If not all cells of a column could be converted, *valid* marks the
+    converted cells. The original strings of cells that could not be
+    converted are kept in *strings*. Both are None if all cells were
+    converted.
+    """
+
+    def __init__(self, values, valid=None, strings=None):
+        self.values = values
+        self.valid = valid
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.values)
+
+    def select(self, index):
+        """return a new column with cells selected by *index*."""
+        return Column(self.values[index],
+                      self.valid[index] if self.valid is not None else None,
+                      self.strings[index]
+                      if self.strings is not None else None)
+
+    def isNumeric(self):
+        """return True if the column contains numbers."""
+        return self.values.dtype.kind in "biuf"
+
+    def setValues(self, values, where=None):
+        """set values of converted cells.
+
+        If *where* is given, set only values in cells marked by *where*.
+        Other cells become invalid.
+        """
+        if where is not None:
+            self.values = numpy.where(where, values, self.values)
+            if self.valid is None:
+                self.valid = where.copy()
+            else:
+                self.valid = self.valid & where
+        elif self.valid is None:
+            self.values = values
+        else:
+            self.values = numpy.where(self.valid, values, self.values)
+
+    def setMissing(self, where, missing_value):
+        """set cells marked by *where* to *missing_value*."""
+        if not where.any():
+            return
+        if self.strings is None:
+            self.strings = numpy.zeros(len(self.values), dtype=object)
+        self.strings[where] = missing_value
+        if self.valid is None:
+            self.valid = ~where
+        else:
+            self.valid = self.valid & ~where
+
+    def tolist(self, format=None):
+        """return cells as a list of strings.
+
+        Converted floating point values are formatted with *format*.
+        """
+        if format is not None and self.values.dtype.kind == "f":
+            result = [format % x for x in self.values.tolist()]
+        else:
+            result = map(str, self.values.tolist())
+
+        if self.valid is not None:
+            for x in numpy.flatnonzero(~self.valid):
+                result[x] = self.strings[x]
+        return result
+
+
+def convertColumn(values, dtype=float):
+    """convert a column of strings to a :class:`Column` of type
+    *dtype*.
+
+    Columns of type str are stored as object arrays. Cells in numeric
+    columns that can not be converted are marked as invalid.
+    """
+
+    if dtype == str:
+        return Column(numpy.array(values, dtype=object))
+
     try:
-        reader = csv.reader(lines.__iter__(),
-                            dialect=dialect)
-    except TypeError:
-        reader = csv.reader(lines.__iter__())
+        return Column(numpy.array(values, dtype=dtype))
+    except ValueError:
+        pass
+
+    # columns that are not all integers are stored as floats
+    dtype = float
+    strings = numpy.array(values, dtype=object)
+    converted = pandas.to_numeric(pandas.Series(strings),
+                                  errors="coerce").values
+    valid = ~numpy.isnan(converted)
+    # check cells python converts but pandas does not, for example
+    # "nan"
+    for x in numpy.flatnonzero(~valid):
+        try:
+            converted[x] = dtype(strings[x])
+            valid[x] = True
+        except ValueError:
+            converted[x] = 0
+
+    return Column(converted, valid, strings)
+
 
-    table = list(reader)
+def readTypedTable(lines,
+                   columns=None,
+                   dtype=None,
+                   with_header=True,
+                   chunk_size=CHUNK_SIZE,
+                   sample_size=SAMPLE_SIZE,
+                   missing_value="na"):
+    """read a table from *lines* into a list of :class:`Column`.
 
-    if ignore_incomplete:
-        table = [x for x in table if len(x) == nfields]
+    The table is parsed in chunks of *chunk_size* rows. *columns* is
+    a function that receives the fields and returns the indices of
+    the columns to convert. If None, all columns are converted. Other
+    columns are kept as strings.
+
+    If *dtype* is None, the type of each converted column is inferred
+    from a sample of *sample_size* values in the first chunk.
+    Otherwise all converted columns are of type *dtype*.
+
+    returns the fields and a list of columns.
+    """
+
+    fields, chunks = iterateTableChunks(lines,
+                                        with_header=with_header,
+                                        chunk_size=chunk_size)
+    if columns is None:
+        columns = range(len(fields))
     else:
-        for r, row in enumerate(table):
-            if len(row) != nfields:
-                if not ignore_incomplete:
-                    raise ValueError("missing elements in line %s, received=%s, expected=%s" %
-                                     (r, str(row),  str(fields)))
+        columns = columns(fields)
+
+    dtypes = [str] * len(fields)
+    chunked = [[] for x in fields]
+
+    for chunk_index, chunk in enumerate(chunks):
+        data = zip(*chunk)
+        if chunk_index == 0:
+            for c in columns:
+                if dtype is None:
+                    dtypes[c] = getColumnType(data[c],
+                                              sample_size=sample_size,
+                                              missing_value=missing_value)
+                else:
+                    dtypes[c] = dtype
+        for c, values in enumerate(data):
+            chunked[c].append(convertColumn(values, dtypes[c]))
+
+    return fields, [concatenateColumns(x) for x in chunked]
+
+
+def concatenateColumns(columns):
+    """return a single :class:`Column` from a list of columns."""
+
+    if len(columns) == 1:
+        return columns[0]
+
+    if not columns:
+        return Column(numpy.zeros(0, dtype=object))
+
+    values = numpy.concatenate([x.values for x in columns])
+    if all([x.valid is None for x in columns]):
+        return Column(values)
+
+    valid = numpy.concatenate(
+        [x.valid if x.valid is not None else
+         numpy.ones(len(x), dtype=numpy.bool) for x in columns])
+    strings = numpy.concatenate(
+        [x.strings if x.strings is not None else
+         numpy.zeros(len(x), dtype=object) for x in columns])
+    return Column(values, valid, strings)
+
+
+def ReadTable(lines,
+              as_rows=True,
+              with_header=True,
+              ignore_incomplete=False,
+              dialect="excel-tab"):
+    """read a table from infile
 
-                raise ValueError
+    returns table as rows or as columns.
+    If remove_incomplete, incomplete rows are simply ignored.
+    """
+
+    fields, chunks = iterateTableChunks(iter(lines),
+                                        with_header=with_header,
+                                        ignore_incomplete=ignore_incomplete,
+                                        dialect=dialect)
+    if not fields:
+        return [], []
+
+    table = list(itertools.chain.from_iterable(chunks))
 
     if not as_rows:
         table = zip(*table)
@@ -303,54 +601,64 @@ def ReadTables(infile, *args, **kwargs):
 # group rows in table
 
 
-def __DoGroup(rows, group_column, group_function, missing_value="na"):
-
-    values = []
-    for x in range(len(rows[0])):
-        if x == group_column:
-            values.append(rows[0][x])
-        else:
-            v = filter(lambda x: x != missing_value, map(lambda y: y[x], rows))
-            if len(v) == 0:
-                values.append(missing_value)
-            else:
-                values.append(group_function(map(lambda y: y[x], rows)))
+def groupColumns(keys, columns, function, missing_value="na"):
+    """group values in *columns* by *keys*.
 
-    return values
+    Rows are grouped with a hash table and groups are returned sorted
+    by key. *columns* is a list of :class:`Column`. Cells that have
+    not been converted are taken to be missing.
 
+    *function* is either the name of an aggregation of numbers
+    (``min``, ``max``, ``sum`` or ``mean``) or a python function. A
+    python function is called with all values of a group. Missing
+    values are skipped by numeric aggregations. Groups without any
+    value are set to *missing_value*.
 
-def GroupTable(table,
-               group_column=0,
-               group_function=min,
-               missing_value="na"):
-    '''group table by *group_column*.
-
-    The table need not be sorted.
-    '''
-
-    table.sort(lambda x, y: cmp(x[group_column], y[group_column]))
-
-    rows = []
-    last_value = None
-    new_table = []
-
-    for row in table:
-        if row[group_column] != last_value:
-
-            if last_value is not None:
-                new_table.append(
-                    __DoGroup(rows, group_column, group_function, missing_value))
-
-            rows = []
-            last_value = row[group_column]
-
-        rows.append(row)
+    returns the sorted keys and a list of grouped columns. Numeric
+    aggregations return :class:`Column` objects, python functions
+    return lists.
+    """
 
-    if last_value is not None:
-        new_table.append(
-            __DoGroup(rows, group_column, group_function, missing_value))
+    groups = pandas.Series(numpy.arange(len(keys))).groupby(
+        numpy.asarray(keys, dtype=object), sort=False).indices
+    sorted_keys = sorted(groups)
 
-    return new_table
+    result = []
+    if isinstance(function, str):
+        codes = numpy.empty(len(keys), dtype=numpy.int64)
+        for x, key in enumerate(sorted_keys):
+            codes[groups[key]] = x
+        for column in columns:
+            values = pandas.Series(column.values, dtype=numpy.float)
+            if column.valid is not None:
+                values[~column.valid] = numpy.nan
+            grouped = values.groupby(codes, sort=True)
+            if function == "sum":
+                grouped = grouped.sum(min_count=1)
+            else:
+                grouped = getattr(grouped, function)()
+            grouped = grouped.values
+            new_column = Column(grouped)
+            new_column.setMissing(numpy.isnan(grouped), missing_value)
+            result.append(new_column)
+    else:
+        for column in columns:
+            new_column = []
+            for key in sorted_keys:
+                index = groups[key]
+                if column.valid is not None and \
+                        not column.valid[index].any():
+                    new_column.append(missing_value)
+                    continue
+                values = column.values[index]
+                if column.valid is not None:
+                    values = numpy.where(column.valid[index],
+                                         values,
+                                         column.strings[index])
+                new_column.append(function(values.tolist()))
+            result.append(new_column)
+
+    return sorted_keys, result
 
 
 def getConvertedTable(table, columns, function=float,
@@ -0,0 +1,454 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+'''
+Chain.py - Tools for working with UCSC chain files
+==================================================
+
+:Author: Andreas Heger
+:Release: $Id$
+:Date: |today|
+:Tags: Python
+
+This module parses UCSC `chain
+<https://genome.ucsc.edu/goldenPath/help/chain.html>`_ formatted
+files into a :class:`ChainIndex`. The index stores the ungapped
+blocks of all chains in numpy arrays sorted by target contig and
+target start. Points and intervals on the target are mapped to the
+query by binary search.
+
+Query coordinates in the index are as in the chain file, i.e. on the
+reverse strand for chains with a negative query strand. The mapping
+functions return forward strand coordinates.
+
+The parsed index can be saved to and loaded from a numpy ``.npz``
+file. :func:`loadChainIndex` caches the index next to the chain
+file so that it is only parsed once::
+
+   index = Chain.loadChainIndex("hg19ToMm10.over.chain.gz")
+   print index.mapInterval("chr1", 10000, 20000)
+
+Code
+----
+
+'''
+import os
+import collections
+import numpy
+
+import CGAT.IOTools as IOTools
+import CGAT.Experiment as E
+
+ChainHeader = collections.namedtuple(
+    "ChainHeader",
+    "score target_contig target_length target_strand target_start target_end "
+    "query_contig query_length query_strand query_start query_end chain_id")
+
+
+def chain_iterator(infile):
+    '''iterate over a chain formatted file.
+
+    Yields the lines of each chain including the header.
+    '''
+    lines = []
+    for line in infile:
+
+        if line.startswith("#"):
+            continue
+        if line.strip() == "":
+            continue
+        if line.startswith("chain"):
+            if lines:
+                yield lines
+            lines = []
+        lines.append(line)
+
+    if lines:
+        yield lines
+
+
+class ChainIndex(object):
+
+    '''index of ungapped blocks in a chain file.
+
+    Chains are numbered in the order they appear in the file. Block
+    arrays are in chain order, sorted arrays for mapping are built
+    with :meth:`buildIndex`.
+    '''
+
+    # arrays saved in the cache file
+    array_names = ("chain_target", "chain_query", "chain_strand",
+                   "chain_score", "chain_id",
+                   "chain_target_start", "chain_target_end",
+                   "chain_query_start", "chain_query_end",
+                   "chain_offsets",
+                   "block_target_start", "block_query_start",
+                   "block_size")
+
+    def __init__(self):
+        self.target_contigs = []
+        self.target_sizes = []
+        self.query_contigs = []
+        self.query_sizes = []
+        self.target2id = {}
+        self.query2id = {}
+        self.index = {}
+
+    def __len__(self):
+        return len(self.chain_id)
+
+    def getNumBlocks(self):
+        return len(self.block_size)
+
+    def read(self, infile):
+        '''read chains from *infile*.'''
+
+        target2id, query2id = self.target2id, self.query2id
+
+        chains = []
+        offsets = [0]
+        block_target_start, block_query_start, block_size = [], [], []
+
+        for lines in chain_iterator(infile):
+            (_,
+             score,
+             target_contig,
+             target_length,
+             target_strand,
+             target_start,
+             target_end,
+             query_contig,
+             query_length,
+             query_strand,
+             query_start,
+             query_end,
+             chain_id) = lines[0][:-1].split()
+
+            # target_strand is always positive
+            assert target_strand == "+", \
+                "negative target strand in chain %s" % chain_id
+
+            if target_contig not in target2id:
+                target2id[target_contig] = len(self.target_contigs)
+                self.target_contigs.append(target_contig)
+                self.target_sizes.append(int(target_length))
+            if query_contig not in query2id:
+                query2id[query_contig] = len(self.query_contigs)
+                self.query_contigs.append(query_contig)
+                self.query_sizes.append(int(query_length))
+
+            tstart, qstart = int(target_start), int(query_start)
+            chains.append((target2id[target_contig],
+                           query2id[query_contig],
+                           (1, -1)[query_strand == "-"],
+                           float(score),
+                           int(chain_id),
+                           tstart, int(target_end),
+                           qstart, int(query_end)))
+
+            for line in lines[1:-1]:
+                size, dt, dq = [int(x) for x in line[:-1].split()]
+                block_target_start.append(tstart)
+                block_query_start.append(qstart)
+                block_size.append(size)
+                tstart += size + dt
+                qstart += size + dq
+
+            block_target_start.append(tstart)
+            block_query_start.append(qstart)
+            block_size.append(int(lines[-1][:-1]))
+            offsets.append(len(block_size))
+
+        if chains:
+            columns = zip(*chains)
+        else:
+            columns = [[]] * 9
+
+        self.chain_target = numpy.array(columns[0], dtype=numpy.int32)
+        self.chain_query = numpy.array(columns[1], dtype=numpy.int32)
+        self.chain_strand = numpy.array(columns[2], dtype=numpy.int8)
+        self.chain_score = numpy.array(columns[3], dtype=numpy.float64)
+        self.chain_id = numpy.array(columns[4], dtype=numpy.int64)
+        self.chain_target_start = numpy.array(columns[5], dtype=numpy.int64)
+        self.chain_target_end = numpy.array(columns[6], dtype=numpy.int64)
+        self.chain_query_start = numpy.array(columns[7], dtype=numpy.int64)
+        self.chain_query_end = numpy.array(columns[8], dtype=numpy.int64)
+        self.chain_offsets = numpy.array(offsets, dtype=numpy.int64)
+        self.block_target_start = numpy.array(block_target_start,
+                                              dtype=numpy.int64)
+        self.block_query_start = numpy.array(block_query_start,
+                                             dtype=numpy.int64)
+        self.block_size = numpy.array(block_size, dtype=numpy.int64)
+
+        self.buildIndex()
+
+    def buildIndex(self):
+        '''build per target contig arrays of blocks sorted by
+        target start.
+
+        Blocks are assumed not to overlap on the target, as is the
+        case for liftover files.
+        '''
+        block_chain = numpy.repeat(
+            numpy.arange(len(self.chain_id), dtype=numpy.int32),
+            numpy.diff(self.chain_offsets))
+        block_target = self.chain_target[block_chain]
+        order = numpy.lexsort((self.block_target_start, block_target))
+
+        block_target = block_target[order]
+        block_chain = block_chain[order]
+        tstart = self.block_target_start[order]
+        tend = tstart + self.block_size[order]
+        qstart = self.block_query_start[order]
+
+        self.index = {}
+        bounds = numpy.searchsorted(
+            block_target,
+            numpy.arange(len(self.target_contigs) + 1))
+        for x, contig in enumerate(self.target_contigs):
+            first, last = bounds[x], bounds[x + 1]
+            self.index[contig] = (tstart[first:last],
+                                  tend[first:last],
+                                  qstart[first:last],
+                                  block_chain[first:last])
+
+    def save(self, filename):
+        '''save index to *filename* in numpy ``.npz`` format.'''
+
+        arrays = dict([(x, getattr(self, x)) for x in self.array_names])
+        outfile = open(filename, "wb")
+        numpy.savez(outfile,
+                    target_contigs=numpy.array(self.target_contigs),
+                    target_sizes=numpy.array(self.target_sizes,
+                                             dtype=numpy.int64),
+                    query_contigs=numpy.array(self.query_contigs),
+                    query_sizes=numpy.array(self.query_sizes,
+                                            dtype=numpy.int64),
+                    **arrays)
+        outfile.close()
+
+    def load(self, filename):
+        '''load index from *filename*.'''
+
+        data = numpy.load(filename)
+        self.target_contigs = list(data["target_contigs"])
+        self.target_sizes = list(data["target_sizes"])
+        self.query_contigs = list(data["query_contigs"])
+        self.query_sizes = list(data["query_sizes"])
+        self.target2id = dict([(y, x) for x, y in
+                               enumerate(self.target_contigs)])
+        self.query2id = dict([(y, x) for x, y in
+                              enumerate(self.query_contigs)])
+        for x in self.array_names:
+            setattr(self, x, data[x])
+        self.buildIndex()
+
+    def getChain(self, chain):
+        '''return header and blocks of *chain*.
+
+        Blocks are returned as arrays of target starts, query
+        starts and sizes.
+        '''
+        first, last = self.chain_offsets[chain], self.chain_offsets[chain + 1]
+        header = ChainHeader._make((
+            self.chain_score[chain],
+            self.target_contigs[self.chain_target[chain]],
+            self.target_sizes[self.chain_target[chain]],
+            "+",
+            self.chain_target_start[chain],
+            self.chain_target_end[chain],
+            self.query_contigs[self.chain_query[chain]],
+            self.query_sizes[self.chain_query[chain]],
+            ("+", "-")[int(self.chain_strand[chain] < 0)],
+            self.chain_query_start[chain],
+            self.chain_query_end[chain],
+            self.chain_id[chain]))
+        return (header,
+                self.block_target_start[first:last],
+                self.block_query_start[first:last],
+                self.block_size[first:last])
+
+    def iterChains(self):
+        '''iterate over chains in file order.
+
+        Yields tuples as returned by :meth:`getChain`.
+        '''
+        for chain in xrange(len(self.chain_id)):
+            yield self.getChain(chain)
+
+    def iterBlocks(self, contig):
+        '''iterate over blocks on target *contig* sorted by position.
+
+        Yields tuples of (target start, target end, query start,
+        chain).
+        '''
+        if contig not in self.index:
+            return
+        tstart, tend, qstart, chain = self.index[contig]
+        for x in xrange(len(tstart)):
+            yield tstart[x], tend[x], qstart[x], chain[x]
+
+    def mapPoints(self, contig, positions):
+        '''map *positions* on target *contig* to the query.
+
+        Returns a tuple of arrays with the chain, query contig id,
+        forward strand query position and strand (1 or -1) for each
+        position. Unmapped positions have a chain of -1.
+        '''
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        npositions = len(positions)
+        chains = -numpy.ones(npositions, dtype=numpy.int64)
+        query_ids = -numpy.ones(npositions, dtype=numpy.int32)
+        query_positions = -numpy.ones(npositions, dtype=numpy.int64)
+        strands = numpy.zeros(npositions, dtype=numpy.int8)
+
+        if contig not in self.index or npositions == 0:
+            return chains, query_ids, query_positions, strands
+
+        tstart, tend, qstart, chain = self.index[contig]
+        if len(tstart) == 0:
+            return chains, query_ids, query_positions, strands
+
+        blocks = numpy.searchsorted(tstart, positions, side="right") - 1
+        mapped = blocks >= 0
+        mapped[mapped] = positions[mapped] < tend[blocks[mapped]]
+        blocks = blocks[mapped]
+
+        chains[mapped] = chain[blocks]
+        query_ids[mapped] = self.chain_query[chain[blocks]]
+        strands[mapped] = self.chain_strand[chain[blocks]]
+        pos = qstart[blocks] + positions[mapped] - tstart[blocks]
+
+        # convert negative strand to forward coordinates
+        reverse = strands[mapped] < 0
+        sizes = numpy.array(self.query_sizes,
+                            dtype=numpy.int64)[query_ids[mapped]]
+        pos[reverse] = sizes[reverse] - pos[reverse] - 1
+        query_positions[mapped] = pos
+
+        return chains, query_ids, query_positions, strands
+
+    def mapIntervals(self, contig, starts, ends):
+        '''map intervals on target *contig* to the query.
+
+        Intervals spanning several blocks are split at block
+        boundaries. Returns a tuple of arrays with the index of the
+        input interval, chain, target start, target end, query contig
+        id, forward strand query start, query end and strand for each
+        mapped segment. The segments of an interval are sorted by
+        target position.
+        '''
+
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+
+        if contig not in self.index:
+            tstart = tend = qstart = chain = numpy.zeros(0, dtype=numpy.int64)
+        else:
+            tstart, tend, qstart, chain = self.index[contig]
+
+        # blocks with end > start and start < end
+        first = numpy.searchsorted(tend, starts, side="right")
+        last = numpy.searchsorted(tstart, ends, side="left")
+        counts = numpy.maximum(0, last - first)
+
+        intervals = numpy.repeat(numpy.arange(len(starts)), counts)
+        offsets = numpy.arange(counts.sum()) - \
+            numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        blocks = first[intervals] + offsets
+
+        segment_start = numpy.maximum(starts[intervals], tstart[blocks])
+        segment_end = numpy.minimum(ends[intervals], tend[blocks])
+        qs = qstart[blocks] + segment_start - tstart[blocks]
+        qe = qs + segment_end - segment_start
+
+        chains = chain[blocks]
+        query_ids = self.chain_query[chains]
+        strands = self.chain_strand[chains]
+
+        # convert negative strand to forward coordinates
+        reverse = strands < 0
+        sizes = numpy.array(self.query_sizes,
+                            dtype=numpy.int64)[query_ids[reverse]]
+        qs[reverse], qe[reverse] = sizes - qe[reverse], sizes - qs[reverse]
+
+        return (intervals, chains, segment_start, segment_end,
+                query_ids, qs, qe, strands)
+
+    def mapPoint(self, contig, position):
+        '''map a single *position*.
+
+        Returns a tuple (query contig, position, strand) or None if
+        the position can not be mapped.
+        '''
+        chains, query_ids, positions, strands = self.mapPoints(
+            contig, [position])
+        if chains[0] < 0:
+            return None
+        return (self.query_contigs[query_ids[0]],
+                positions[0],
+                ("+", "-")[int(strands[0] < 0)])
+
+    def mapInterval(self, contig, start, end):
+        '''map a single interval.
+
+        Returns a list of tuples (query contig, start, end, strand)
+        with one tuple per mapped segment.
+        '''
+        (intervals, chains, segment_start, segment_end,
+         query_ids, qs, qe, strands) = self.mapIntervals(
+            contig, [start], [end])
+        return [(self.query_contigs[query_ids[x]],
+                 qs[x], qe[x],
+                 ("+", "-")[int(strands[x] < 0)])
+                for x in xrange(len(intervals))]
+
+
+def loadChainIndex(filename, use_cache=True):
+    '''return a :class:`ChainIndex` for chain file *filename*.
+
+    If *use_cache* is set, the parsed index is saved to
+    :file:`filename.index.npz` and re-used as long as it is newer
+    than the chain file.
+    '''
+
+    cache = filename + ".index.npz"
+    index = ChainIndex()
+
+    if use_cache and os.path.exists(cache) and \
+       os.path.getmtime(cache) >= os.path.getmtime(filename):
+        E.info("loading chain index from %s" % cache)
+        index.load(cache)
+        return index
+
+    E.info("reading chains from %s" % filename)
+    index.read(IOTools.openFile(filename))
+    E.info("read %i chains with %i blocks" %
+           (len(index), index.getNumBlocks()))
+
+    if use_cache:
+        try:
+            index.save(cache)
+        except IOError, msg:
+            E.warn("could not save chain index to %s: %s" % (cache, msg))
+
+    return index
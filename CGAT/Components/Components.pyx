@@ -21,8 +21,21 @@ USAGE:
 # retrieve components
 >>> print x.getComponents()
 
+Large graphs with vertices numbered from 0 can be added in bulk
+from arrays of edges with :class:`ArrayComponents`::
+
+>>> x = ArrayComponents()
+>>> x.addEdges(numpy.array([0, 0, 3]), numpy.array([1, 2, 4]))
+>>> print x.getLabels()
+
+Link files are read with :func:`readComponents`.
+
 This is a cython extension class."""
 
+import numpy
+cimport numpy as np
+cimport cython
+
 cdef extern from "connected_components.h":
 
     ctypedef struct cSComponents "CharComponents":
@@ -150,3 +163,161 @@ cdef class IComponents:
         """clear graph.
         """
         self.thisptr.reset()
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline np.int64_t _find(np.int64_t[:] parents, np.int64_t x):
+    """return root of *x* halving the path on the way."""
+    while parents[x] != x:
+        parents[x] = parents[parents[x]]
+        x = parents[x]
+    return x
+
+
+cdef class ArrayComponents:
+    """Components for a graph with vertices numbered from 0.
+
+    Edges are added in bulk from arrays of integers into a
+    union-find structure with path compression and union by
+    size. The number of vertices grows with the largest vertex seen.
+    Vertices without edges below that form components of their own.
+    """
+    cdef object parents
+    cdef object sizes
+    cdef readonly long nvertices
+    cdef readonly long njoins
+
+    def __init__(self, nvertices=0):
+        self.parents = numpy.arange(nvertices, dtype=numpy.int64)
+        self.sizes = numpy.ones(nvertices, dtype=numpy.int64)
+        self.nvertices = nvertices
+        self.njoins = 0
+
+    def resize(self, long nvertices):
+        """make room for at least *nvertices* vertices."""
+        cdef long capacity = len(self.parents)
+        if nvertices > capacity:
+            capacity = max(nvertices, 2 * capacity)
+            parents = numpy.arange(capacity, dtype=numpy.int64)
+            parents[:self.nvertices] = self.parents[:self.nvertices]
+            sizes = numpy.ones(capacity, dtype=numpy.int64)
+            sizes[:self.nvertices] = self.sizes[:self.nvertices]
+            self.parents, self.sizes = parents, sizes
+        self.nvertices = max(self.nvertices, nvertices)
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def addEdges(self, sources, targets):
+        """add edges between vertices in *sources* and *targets*.
+        return the number of edges that joined two previously
+        disconnected components.
+        """
+        cdef np.int64_t[:] s = numpy.ascontiguousarray(sources,
+                                                        dtype=numpy.int64)
+        cdef np.int64_t[:] t = numpy.ascontiguousarray(targets,
+                                                        dtype=numpy.int64)
+        if s.shape[0] != t.shape[0]:
+            raise ValueError("number of sources and targets differ: %i != %i" %
+                             (s.shape[0], t.shape[0]))
+        if s.shape[0] == 0:
+            return 0
+
+        if min(numpy.min(s), numpy.min(t)) < 0:
+            raise ValueError("vertex ids need to be positive")
+        self.resize(max(numpy.max(s), numpy.max(t)) + 1)
+
+        cdef np.int64_t[:] parents = self.parents
+        cdef np.int64_t[:] sizes = self.sizes
+        cdef np.int64_t a, b
+        cdef long i, njoins = 0
+
+        for i in range(s.shape[0]):
+            a = _find(parents, s[i])
+            b = _find(parents, t[i])
+            if a == b:
+                continue
+            if sizes[a] < sizes[b]:
+                a, b = b, a
+            parents[b] = a
+            sizes[a] += sizes[b]
+            njoins += 1
+
+        self.njoins += njoins
+        return njoins
+
+    def add(self, a, b):
+        """add an edge between nodes a and b
+        return True, if the link joins two previously disconnected componenents.
+        """
+        return self.addEdges((a,), (b,)) > 0
+
+    def getNumNodes(self):
+        """return the number of nodes in the graph."""
+        return self.nvertices
+
+    def getNumComponents(self):
+        """return the number of components."""
+        return self.nvertices - self.njoins
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def getRoots(self):
+        """return the root vertex of the component of each vertex."""
+        cdef np.int64_t[:] parents = self.parents
+        cdef long x
+        for x in range(self.nvertices):
+            parents[x] = _find(parents, x)
+        return numpy.array(self.parents[:self.nvertices])
+
+    def getLabels(self):
+        """return the component of each vertex.
+
+        Components are numbered from 0 in the order of their first
+        vertex.
+        """
+        roots, first, labels = numpy.unique(self.getRoots(),
+                                            return_index=True,
+                                            return_inverse=True)
+        ranks = numpy.empty(len(first), dtype=numpy.int64)
+        ranks[numpy.argsort(first)] = numpy.arange(len(first))
+        return ranks[labels]
+
+    def getComponents(self):
+        """return all connected components as a list of lists."""
+        labels = self.getLabels()
+        order = numpy.argsort(labels, kind="mergesort")
+        starts = numpy.searchsorted(labels[order],
+                                    numpy.arange(self.getNumComponents()))
+        return [x.tolist() for x in numpy.split(order, starts[1:])]
+
+    def reset(self):
+        """clear graph.
+        """
+        self.__init__()
+
+
+def readComponents(infile, tokens=None, components=None,
+                   chunk_size=1000000):
+    """add links in *infile* to *components*.
+
+    Tokens are mapped to vertex ids with *tokens*, a
+    :class:`LinkGraph.Tokens` object. Links are read in chunks of
+    *chunk_size* links (see :func:`LinkGraph.iterateLinks`).
+
+    returns a tuple of tokens and components. Both can be used to
+    add further links.
+    """
+    import CGAT.LinkGraph as LinkGraph
+
+    if tokens is None:
+        tokens = LinkGraph.Tokens()
+    if components is None:
+        components = ArrayComponents()
+
+    for sources, targets, weights in LinkGraph.iterateLinks(
+            infile, columns=(), tokens=tokens, chunk_size=chunk_size):
+        components.addEdges(sources, targets)
+    components.resize(len(tokens))
+
+    return tokens, components
@@ -44,6 +44,8 @@ import pandas as pd
 import numpy as np
 import numpy.ma as ma
 import copy
+import itertools
+import multiprocessing
 import random
 import sys
 
@@ -181,9 +183,13 @@ class Counts(object):
     def sort(self, sort_columns, reset_index=True):
         ''' sort counts table by columns supplied and reset '''
         index = range(0, len(self.table.index))
-        self.table = self.table.sort(columns=sort_columns)
+        # DataFrame.sort has been removed in newer pandas versions
+        if hasattr(self.table, "sort_values"):
+            self.table = self.table.sort_values(by=sort_columns)
+        else:
+            self.table = self.table.sort(columns=sort_columns)
         if reset_index:
-            self.table.set_index(index, inplace=True)
+            self.table.index = index
 
     def shuffleRows(self,
                     min_cbin, max_cbin, width_cbin,
@@ -311,8 +317,7 @@ class Counts(object):
 
         if output_method == "append":
             self.table = self.table.ix[:, header]
-            self.table.to_csv(sys.stdout, index=index, header=True, sep="\t",
-                              dtype={'position': int})
+            self.table.to_csv(sys.stdout, index=index, header=True, sep="\t")
         else:
             sys.stdout.write("%s\n" % "\t".join(map(str, header)))
 
@@ -358,7 +363,7 @@ class Counts(object):
                     cluster_id = "_".join(
                         map(str, ("spike-in", initial, change,
                                   size, c1rs-c1s, n)))
-                    temp_cluster_df = self.table.ix[c1s:c1e, keep_cols]
+                    temp_cluster_df = self.table.ix[c1s:c1e, header]
                     temp_cluster_df['contig'] = cluster_id
                     temp_cluster_swap = self.table.ix[
                         c2rs:c2re, tracks_map[groups[1]]]
@@ -367,8 +372,7 @@ class Counts(object):
                     temp_cluster_df.ix[c1rs:c1re, tracks_map[
                         groups[1]]] = temp_cluster_swap
                     temp_cluster_df.to_csv(sys.stdout, index=index,
-                                           header=False, sep="\t",
-                                           dtype={'position': int})
+                                           header=False, sep="\t")
                     n += 1
 
 ########################################################################
@@ -381,15 +385,17 @@ def means2idxarrays(g1, g2, i_bins, c_bins, difference):
     '''take two arrays of values and return the initial values
     and differences as numpy digitised arrays'''
 
+    g1 = np.asarray(g1, dtype=np.float)
+    g2 = np.asarray(g2, dtype=np.float)
+
     if difference == "relative":
         # calculate difference between mean values for group1 and group2
         # g1 and g2 always the same length
-        change = [g2[x] - g1[x] for x in range(0, len(g1))]
+        change = g2 - g1
         initial = g1
     elif difference == "logfold":
-        change = [np.log2((g2[x]+1.0) / (g1[x]+1.0))
-                  for x in range(0, len(g1))]
-        initial = [np.log2(g1[x]+1.0) for x in range(0, len(g1))]
+        change = np.log2((g2 + 1.0) / (g1 + 1.0))
+        initial = np.log2(g1 + 1.0)
 
     # return arrays of len(change) with the index position in c_bins
     # corresponding to the bin in which the value of change falls
@@ -431,13 +437,111 @@ def findClusters(df, distance, size, tracks_map, groups):
     return (cluster_dfs)
 
 
+def clusters2arrays(clusters_dict, tracks_map, groups):
+    '''store the clusters in *clusters_dict* as contiguous arrays.
+
+    Clusters are sorted by their key. Rows of cluster ``x`` are
+    ``offsets[x]:offsets[x+1]`` and the label of its first row in the
+    original dataframe is ``starts[x]``. For each group, the sums of
+    the values in the group columns and the number of values that are
+    not missing are returned as cumulative sums along all rows, so
+    that the mean of any window of rows can be computed in constant
+    time.
+
+    returns keys, offsets, starts and a tuple of (cumulative sums,
+    cumulative counts) for each group.
+    '''
+
+    keys = sorted(clusters_dict.keys())
+    frames = [clusters_dict[x] for x in keys]
+    offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(x) for x in frames])
+    starts = np.array([x.index.values[0] for x in frames], dtype=np.int64)
+
+    sums = []
+    for group in groups[:2]:
+        values = np.concatenate(
+            [x.ix[:, tracks_map[group]].values.astype(np.float)
+             for x in frames])
+        valid = ~np.isnan(values)
+        # prepend a zero so that windows are differences of two entries
+        cumsum = np.zeros(len(values) + 1)
+        cumsum[1:] = np.cumsum(np.where(valid, values, 0).sum(axis=1))
+        cumcount = np.zeros(len(values) + 1)
+        cumcount[1:] = np.cumsum(valid.sum(axis=1))
+        sums.append((cumsum, cumcount))
+
+    return keys, offsets, starts, sums
+
+
+def initShuffleCluster(*args):
+    '''initialize state for :func:`sampleSubclusters`.'''
+    global SHUFFLE_STATE
+    SHUFFLE_STATE = args
+
+
+def sampleSubclusters(args):
+    '''sample subclusters of all sizes for one iteration.
+
+    For each size, the clusters are permuted twice and a random
+    window of ``size + 1`` rows is chosen within each cluster. The
+    random number generator is seeded by the iteration number so
+    that results do not depend on the number of processes used.
+
+    returns a list with a tuple of (permutation1, permutation2,
+    window starts1, window starts2, initial bins, change bins) for
+    each size.
+    '''
+
+    iteration, seed = args
+    offsets, sums, s_bins, i_bins, c_bins, difference = SHUFFLE_STATE
+
+    rng = np.random.RandomState([seed, iteration])
+    nclusters = len(offsets) - 1
+    lengths = np.diff(offsets)
+
+    results = []
+    for size in s_bins:
+        rand1 = rng.permutation(nclusters)
+        rand2 = rng.permutation(nclusters)
+        means = []
+        window_starts = []
+        for rand, (cumsum, cumcount) in zip((rand1, rand2), sums):
+            # random start of window within cluster
+            nstarts = np.maximum(lengths[rand] - size, 1)
+            start = (rng.random_sample(nclusters) * nstarts).astype(np.int64)
+            first = offsets[rand] + start
+            last = np.minimum(first + size + 1, offsets[rand + 1])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                means.append((cumsum[last] - cumsum[first]) /
+                             (cumcount[last] - cumcount[first]))
+            window_starts.append(start)
+
+        change_idx, initial_idx = means2idxarrays(
+            means[0], means[1], i_bins, c_bins, difference)
+        results.append((rand1, rand2,
+                        window_starts[0], window_starts[1],
+                        initial_idx, change_idx))
+
+    return results
+
+
 def shuffleCluster(i_bins, c_bins, tracks_map, groups,
                    difference, s_max, i, clusters_dict,
-                   s_bins_max, s_bins_min, s_bins_width):
+                   s_bins_max, s_bins_min, s_bins_width,
+                   seed=None, num_threads=1):
     '''take a dictionary containing clusters (subdataframes) and shuffle
     subregions of clusters to obtain spike in clusters.
     return indeces from which the spike in clusters can be obtained from the
     original dataframe
+
+    Clusters are stored as contiguous arrays (see
+    :func:`clusters2arrays`) and all windows of an iteration are
+    sampled at once. If *num_threads* is larger than 1, iterations
+    are sampled by a pool of worker processes. Bins are filled in the
+    order of iterations, so that for a given *seed* the results are
+    the same for any number of processes. If *seed* is not given, it
+    is drawn from the python random number generator.
     '''
     s_bins = range(s_bins_min, s_bins_max+1, s_bins_width, )
 
@@ -448,56 +552,61 @@ def shuffleCluster(i_bins, c_bins, tracks_map, groups,
                for key2 in np.digitize(c_bins, c_bins)
                for key3 in np.digitize(s_bins, s_bins)}
 
-    for iteration in range(0,  i):
+    keys, offsets, starts, sums = clusters2arrays(
+        clusters_dict, tracks_map, groups)
+    ends = starts + np.diff(offsets) - 1
+    size_idx = np.digitize(s_bins, s_bins)
+
+    if seed is None:
+        seed = random.randint(0, 2 ** 31 - 1)
+
+    state = (offsets, sums, s_bins, i_bins, c_bins, difference)
+    jobs = [(iteration, seed) for iteration in range(0, i)]
+    if num_threads > 1:
+        pool = multiprocessing.Pool(num_threads,
+                                    initializer=initShuffleCluster,
+                                    initargs=state)
+        results = pool.imap(sampleSubclusters, jobs)
+    else:
+        initShuffleCluster(*state)
+        results = itertools.imap(sampleSubclusters, jobs)
+
+    for iteration, samples in enumerate(results):
         E.info("performing shuffling iteration number %i.." % (iteration + 1))
-        for size in s_bins:
-            group1_mean = []
-            group2_mean = []
-            g1_rand_s = []
-            g2_rand_s = []
-            g1_rand = np.random.permutation(clusters_dict.keys())
-            g2_rand = np.random.permutation(clusters_dict.keys())
-            for perm in range(0, len(g1_rand)):
-                cluster1 = clusters_dict[g1_rand[perm]].ix[
-                    :, tracks_map[groups[0]]]
-                cluster2 = clusters_dict[g2_rand[perm]].ix[
-                    :, tracks_map[groups[1]]]
-                c1_rand_s = random.randint(
-                    min(cluster1.index), max(cluster1.index)-size)
-                c1_e = int(c1_rand_s + size)
-                c2_rand_s = random.randint(
-                    min(cluster2.index), max(cluster2.index)-size)
-                c2_e = int(c2_rand_s + size)
-
-                c1_mean = np.mean(np.mean(cluster1.ix[c1_rand_s: c1_e]))
-                c2_mean = np.mean(np.mean(cluster2.ix[c2_rand_s: c2_e]))
-                group1_mean.append(c1_mean)
-                group2_mean.append(c2_mean)
-                g1_rand_s.append(c1_rand_s)
-                g2_rand_s.append(c2_rand_s)
-
-            change_idx, initial_idx,  = means2idxarrays(
-                group1_mean, group2_mean, i_bins,
-                c_bins,  difference)
-            size_idx = np.digitize([size]*len(initial_idx), s_bins)
-            for idx, coord in enumerate(zip(
-                    initial_idx, change_idx, size_idx)):
-                if counts[coord] < s_max:
-                    counts[coord] += 1
-                    cluster1_ix = clusters_dict[g1_rand[idx]].index.values
-                    cluster1_start = cluster1_ix[0]
-                    cluster1_end = cluster1_ix[-1]
-                    cluster2_ix = clusters_dict[g2_rand[idx]].index.values
-                    cluster2_start = cluster2_ix[0]
-                    cluster2_end = cluster2_ix[-1]
-                    c1_rand_s = g1_rand_s[idx]
-                    c1_rand_e = int(c1_rand_s + size)
-                    c2_rand_s = g2_rand_s[idx]
-                    c2_rand_e = int(c2_rand_s + size)
-                    indices[coord].append((
-                        cluster1_start, cluster1_end, cluster2_start,
-                        cluster2_end, c1_rand_s, c1_rand_e, c2_rand_s,
-                        c2_rand_e))
+        for size, s_idx, sample in zip(s_bins, size_idx, samples):
+            rand1, rand2, start1, start2, initial_idx, change_idx = sample
+
+            # ignore spike-ins outside of the bins
+            take = np.flatnonzero(
+                (initial_idx >= 1) & (initial_idx <= len(i_bins)) &
+                (change_idx >= 1) & (change_idx <= len(c_bins)))
+
+            # accept spike-ins in order until the bins are full
+            coords = initial_idx[take] * counts.shape[1] + change_idx[take]
+            order = np.argsort(coords, kind="mergesort")
+            sorted_coords = coords[order]
+            first = np.searchsorted(sorted_coords, sorted_coords)
+            rank = np.empty(len(take), dtype=np.int64)
+            rank[order] = np.arange(len(take)) - first
+            free = s_max - counts[:, :, s_idx].ravel()[coords]
+            take = take[rank < free]
+
+            np.add.at(counts[:, :, s_idx],
+                      (initial_idx[take], change_idx[take]), 1)
+
+            c1_rand_s = starts[rand1] + start1
+            c2_rand_s = starts[rand2] + start2
+            for idx in take:
+                indices[(initial_idx[idx], change_idx[idx], s_idx)].append((
+                    starts[rand1[idx]], ends[rand1[idx]],
+                    starts[rand2[idx]], ends[rand2[idx]],
+                    c1_rand_s[idx], int(c1_rand_s[idx] + size),
+                    c2_rand_s[idx], int(c2_rand_s[idx] + size)))
+
+    if num_threads > 1:
+        pool.close()
+        pool.join()
+
     return indices, counts
 
 
@@ -3,8 +3,11 @@ import sys
 import re
 import os
 import collections
+import csv
 import CGAT.Experiment as E
 import random
+import numpy
+import pandas
 
 
 #######################################################
@@ -134,3 +137,149 @@ def best_alignment_iterator(query_iterator):
             best_alignments = random.sample(best_alignments, 1)
         best_alignment = best_alignments[0]
         yield best_alignment
+
+#######################################################
+#######################################################
+#######################################################
+
+
+def parse_ref(ref):
+    '''
+    return reference name from the subject field,
+    see :func:`alignment_iterator`
+    '''
+    ref = ref.split("|")
+    if len(ref) == 1:
+        return ref[0]
+    else:
+        return ref[3]
+
+
+def chunk_iterator(alignment_file, chunksize=1000000, seed=None):
+    '''
+    iterate over alignments in chunks of about *chunksize*
+    lines. Each chunk is a dataframe with the columns qid, ref,
+    score and key. Alignments of a query are not split between
+    chunks.
+
+    key is a random number drawn from a generator seeded with
+    *seed* to break ties between alignments with the same score.
+    One number is drawn per alignment, so keys do not depend
+    on *chunksize*.
+    '''
+    random_state = numpy.random.RandomState(seed)
+
+    try:
+        reader = pandas.read_csv(alignment_file,
+                                 sep="\t",
+                                 header=None,
+                                 usecols=(0, 1, 11),
+                                 quoting=csv.QUOTE_NONE,
+                                 names=("qid", "ref", "score"),
+                                 dtype={"qid": str, "ref": str,
+                                        "score": numpy.float64},
+                                 chunksize=chunksize)
+    except ValueError:
+        # empty input
+        return
+
+    last = None
+    for chunk in reader:
+        chunk["key"] = random_state.random_sample(len(chunk))
+        if last is not None:
+            chunk = pandas.concat((last, chunk), ignore_index=True)
+
+        # hold back the last query, it might continue
+        # in the next chunk
+        qid = chunk["qid"].values
+        ends = numpy.nonzero(qid[1:] != qid[:-1])[0]
+        if len(ends) == 0:
+            last = chunk
+            continue
+        last = chunk.iloc[ends[-1] + 1:]
+        yield chunk.iloc[:ends[-1] + 1]
+
+    if last is not None and len(last):
+        yield last
+
+
+def best_alignments(chunk):
+    '''
+    return the row indices of the best alignment for each query
+    in *chunk*, see :func:`chunk_iterator`.
+
+    The best alignment has the highest bit score, ties are broken
+    by the smallest key. Queries are consecutive runs of the same
+    qid as in :func:`query_iterator`.
+    '''
+    qid = chunk["qid"].values
+    starts = numpy.ones(len(qid), dtype=bool)
+    starts[1:] = qid[1:] != qid[:-1]
+    groups = numpy.cumsum(starts)
+
+    order = numpy.lexsort((chunk["key"].values,
+                           -chunk["score"].values,
+                           groups))
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = groups[order][1:] != groups[order][:-1]
+    return order[first]
+
+
+def count_best_alignments(alignment_file,
+                          map_gene2cog=None,
+                          chunksize=1000000,
+                          seed=None):
+    '''
+    count the best alignment for each query per gene and
+    per function (COG).
+
+    *map_gene2cog* is a tuple of a dictionary mapping each
+    gene to an integer code and a list of COGs indexed by code.
+    Genes with a negative code are not counted, see
+    :func:`build_cog_map`.
+
+    Returns dictionaries of gene counts and COG counts. Keys
+    are inserted in the order they are first encountered.
+    '''
+    gene_counts, cog_counts = {}, {}
+    if map_gene2cog:
+        map_gene2code, cogs = map_gene2cog
+
+    for chunk in chunk_iterator(alignment_file, chunksize, seed):
+        refs = chunk["ref"].values[best_alignments(chunk)]
+        labels, uniques = pandas.factorize(refs)
+        genes = [parse_ref(x) for x in uniques]
+        for gene, count in zip(genes, numpy.bincount(labels)):
+            gene_counts[gene] = gene_counts.get(gene, 0) + count
+
+        if map_gene2cog:
+            codes = numpy.array([map_gene2code[x] for x in genes],
+                                dtype=numpy.int64)[labels]
+            labels, uniques = pandas.factorize(codes[codes >= 0])
+            for code, count in zip(uniques, numpy.bincount(labels)):
+                cog = cogs[code]
+                cog_counts[cog] = cog_counts.get(cog, 0) + count
+
+    return gene_counts, cog_counts
+
+
+def build_cog_map(gene2cog):
+    '''
+    return a mapping of genes to integer codes for COGs
+    and a list of COGs indexed by code.
+
+    Genes that are unassigned or assigned to multiple
+    COGs receive a code of -1.
+    '''
+    map_gene2code, map_cog2code, cogs = {}, {}, []
+    for gene, cog in gene2cog.iteritems():
+        if cog == "unknown" or cog.find(";") != -1:
+            map_gene2code[gene] = -1
+            continue
+        try:
+            code = map_cog2code[cog]
+        except KeyError:
+            code = map_cog2code[cog] = len(cogs)
+            cogs.append(cog)
+        map_gene2code[gene] = code
+    return map_gene2code, cogs
@@ -787,24 +787,25 @@ class WelchsTTest(object):
         nskipped = 0
         results = []
 
-        for probeset, treatment, control in zip(
-                probesets, zip(*treatments), zip(*controls)):
+        # compute all tests at once, one row per probeset
+        tests = Stats.doWelchsTTests(numpy.array(treatments).T,
+                                     numpy.array(controls).T,
+                                     alpha=0.05)
+        attributes = vars(tests)
 
-            nval1, nval2 = len(treatment), len(control)
-            mean1, mean2 = numpy.mean(treatment), numpy.mean(control)
-            stddev1, stddev2 = numpy.std(treatment), numpy.std(control)
+        for x, probeset in enumerate(probesets):
 
-            try:
-                s = Stats.doWelchsTTest(nval1, mean1, stddev1,
-                                        nval2, mean2, stddev2,
-                                        alpha=0.05)
-            except ValueError:
+            if numpy.isnan(tests.mPValue[x]):
                 E.warn(
-                    "expressionDifferences: standard deviations are 0 for "
+                    "expressionDifferences: standard deviations are 0 or "
+                    "fewer than two observations in a group for "
                     "probeset %s - skipped" % probeset)
                 nskipped += 1
                 continue
 
+            s = Stats.WelchTTest()
+            for key, values in attributes.items():
+                setattr(s, key, values[x])
             s.mProbeset = probeset
             results.append(s)
 
@@ -5,6 +5,78 @@
 ########################################
 ########################################
 
+import itertools
+import CGAT.Taxonomy as Taxonomy
+
+# taxonomic levels and the corresponding attributes
+# of :class:`LCA` objects
+LEVELS = ("kingdom", "kingdom+",
+          "phylum", "phylum+",
+          "class", "class+",
+          "order", "order+",
+          "family", "family+",
+          "genus", "genus+",
+          "species", "species+",
+          "subspecies", "subspecies+")
+
+ATTRIBUTES = ("kingdom", "kingdom_plus",
+              "phylum", "phylum_plus",
+              "_class", "_class_plus",
+              "order", "order_plus",
+              "family", "family_plus",
+              "genus", "genus_plus",
+              "species", "species_plus",
+              "subspecies", "subspecies_plus")
+
+
+# substrings identifying the level of a taxon and the index of the
+# attribute it is stored in. Substrings are tested in this order.
+# Taxa at the "Kingdom" level are ignored and the phylum+ attribute
+# stores the level instead of the taxon.
+LEVEL_PATTERNS = (("Kingdom+", 1), ("Kingdom", None),
+                  ("Phylum+", 3), ("Phylum", 2),
+                  ("Class+", 5), ("Class", 4),
+                  ("Order+", 7), ("Order", 6),
+                  ("Family+", 9), ("Family", 8),
+                  ("Genus+", 11), ("Genus", 10),
+                  ("Species+", 13), ("Species", 12),
+                  ("Subspecies+", 15), ("Subspecies", 14))
+
+# number of lines parsed at a time by readTable
+CHUNK_SIZE = 100000
+
+
+def parseLine(line):
+    '''
+    return the identifier and a tuple of taxa, one for
+    each of :data:`ATTRIBUTES`, from a line of LCA output.
+    Unassigned taxa are "NA".
+    '''
+    data = line.split(";")
+    values = ["NA"] * len(ATTRIBUTES)
+    for taxa in data[2:]:
+        taxa = taxa.strip()
+        # ignore root
+        if "root" in taxa:
+            continue
+        if "[" not in taxa:
+            continue
+        taxa = taxa.split(" ")
+        level, tax = taxa[0], taxa[1:]
+        if len(tax) > 1:
+            tax = "_".join(tax)
+        else:
+            tax = tax[0]
+        for pattern, index in LEVEL_PATTERNS:
+            if pattern in level:
+                if index == 3:
+                    tax = level
+                if index is not None:
+                    values[index] = tax
+                break
+
+    return data[0], tuple(values)
+
 
 class LCA(object):
     '''
@@ -35,87 +107,9 @@ class LCA(object):
         '''
         parse the line
         '''
-        data = line.split(";")
-        self.identifier = data[0]
-        for taxa in data[2:]:
-            taxa = taxa.strip()
-            # ignore root
-            if "root" in taxa:
-                continue
-            if "[" not in taxa:
-                continue
-            taxa = taxa.split(" ")
-            level, tax = taxa[0], taxa[1:]
-            if len(tax) > 1:
-                tax = "_".join(tax)
-            else:
-                tax = tax[0]
-            if "Kingdom+" in level:
-                self.kingdom_plus = tax
-            elif "Kingdom" in level:
-                self.kingdon = tax
-            elif "Phylum+" in level:
-                self.phylum_plus = level
-            elif "Phylum" in level:
-                self.phylum = tax
-            elif "Class+" in level:
-                self._class_plus = tax
-            elif "Class" in level:
-                self._class = tax
-            elif "Order+" in level:
-                self.order_plus = tax
-            elif "Order" in level:
-                self.order = tax
-            elif "Family+" in level:
-                self.family_plus = tax
-            elif "Family" in level:
-                self.family = tax
-            elif "Genus+" in level:
-                self.genus_plus = tax
-            elif "Genus" in level:
-                self.genus = tax
-            elif "Species+" in level:
-                self.species_plus = tax
-            elif "Species" in level:
-                self.species = tax
-            elif "Subspecies+" in level:
-                self.subspecies_plus = tax
-            elif "Subspecies" in level:
-                self.subspecies = tax
-
-        if not self.kingdom:
-            self.kingdom = "NA"
-        if not self.kingdom_plus:
-            self.kingdom_plus = "NA"
-        if not self.phylum:
-            self.phylum = "NA"
-        if not self.phylum_plus:
-            self.phylum_plus = "NA"
-        if not self._class:
-            self._class = "NA"
-        if not self._class_plus:
-            self._class_plus = "NA"
-        if not self.order:
-            self.order = "NA"
-        if not self.order_plus:
-            self.order_plus = "NA"
-        if not self.family:
-            self.family = "NA"
-        if not self.family_plus:
-            self.family_plus = "NA"
-        if not self.genus:
-            self.genus = "NA"
-        if not self.genus_plus:
-            self.genus_plus = "NA"
-        if not self.species:
-            self.species = "NA"
-        if not self.species_plus:
-            self.species_plus = "NA"
-        if not self.subspecies:
-            self.subspecies = "NA"
-        if not self.subspecies_plus:
-            self.subspecies_plus = "NA"
-
+        self.identifier, values = parseLine(line)
+        for attribute, value in zip(ATTRIBUTES, values):
+            setattr(self, attribute, value)
         return self
 
 
@@ -128,7 +122,25 @@ def iterate(infile):
     '''
     LCA results iterator
     '''
-    for line in infile.readlines():
+    for line in infile:
         lca = LCA()
         lca = lca.parse(line)
         yield lca
+
+
+def readTable(infile):
+    '''
+    read LCA results into a :class:`Taxonomy.TaxonomyTable`
+    with one column for each of :data:`LEVELS`
+
+    Lines are parsed in chunks and the taxa of each chunk
+    are added to the table column by column.
+    '''
+    table = Taxonomy.TaxonomyTable(LEVELS, missing=("NA",))
+    while True:
+        rows = [parseLine(line)[1]
+                for line in itertools.islice(infile, CHUNK_SIZE)]
+        if not rows:
+            break
+        table.addColumns(zip(*rows))
+    return table
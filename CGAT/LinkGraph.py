@@ -0,0 +1,466 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+'''
+LinkGraph.py - integer encoded graphs of links between tokens
+==============================================================
+
+:Author: Andreas Heger
+:Release: $Id$
+:Date: |today|
+:Tags: Python
+
+This module reads tab-separated link tables such as BLAST graphs
+into arrays. Vertex tokens are interned as integer ids in the order
+they are first encountered (see :class:`Tokens`, or
+:class:`DiskTokens` to keep the ids on disk) and each link is
+stored as a source id, a target id and one or more weights::
+
+   tokens, sources, targets, weights = LinkGraph.readLinks(infile)
+
+Links can be arranged into a :class:`LinkGraph` in compressed
+sparse row format. The links of vertex *x* are at positions
+``offsets[x]:offsets[x+1]`` of the ``targets`` and ``weights``
+arrays::
+
+   graph = LinkGraph.buildLinkGraph(
+       tokens, sources, targets, weights, symmetric=True)
+   targets, weights = graph.getLinks("seq1")
+
+A graph is saved with :meth:`LinkGraph.save` as a set of
+:file:`.npy` files that :func:`loadLinkGraph` memory-maps again
+without reading them into memory.
+
+Code
+----
+
+'''
+import array
+import os
+import sqlite3
+import numpy
+
+
+class Tokens(object):
+
+    '''map tokens to integer ids.
+
+    Ids are assigned in the order tokens are first encountered.
+    '''
+
+    def __init__(self, tokens=()):
+        self.tokens = list(tokens)
+        self.map_token2id = dict([(y, x) for x, y in enumerate(self.tokens)])
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, key):
+        return self.tokens[key]
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def getId(self, token):
+        '''return id for *token*.
+
+        raises KeyError if *token* is unknown.
+        '''
+        return self.map_token2id[token]
+
+    def encode(self, token):
+        '''return id for *token*, adding it if necessary.'''
+        try:
+            return self.map_token2id[token]
+        except KeyError:
+            code = self.map_token2id[token] = len(self.tokens)
+            self.tokens.append(token)
+            return code
+
+    def decode(self, ids):
+        '''return tokens for a sequence of *ids*.'''
+        tokens = self.tokens
+        return [tokens[x] for x in ids]
+
+    def getRanks(self):
+        '''return the rank of each id if tokens are sorted.'''
+        order = sorted(range(len(self.tokens)), key=self.tokens.__getitem__)
+        ranks = numpy.empty(len(order), dtype=numpy.int64)
+        ranks[order] = numpy.arange(len(order))
+        return ranks
+
+
+class DiskTokens(Tokens):
+
+    '''map tokens to integer ids stored in an sqlite database.
+
+    Use instead of :class:`Tokens` if the tokens do not fit into
+    memory. Up to *cache_size* recently used tokens are kept in
+    memory. An existing database in *filename* is extended.
+    '''
+
+    def __init__(self, filename, cache_size=1000000):
+        self.dbhandle = sqlite3.connect(filename)
+        self.dbhandle.text_factory = str
+        self.dbhandle.execute(
+            "CREATE TABLE IF NOT EXISTS tokens "
+            "(id INTEGER PRIMARY KEY, token TEXT UNIQUE)")
+        self.ntokens = self.dbhandle.execute(
+            "SELECT COUNT(*) FROM tokens").fetchone()[0]
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def __len__(self):
+        return self.ntokens
+
+    def __getitem__(self, key):
+        if key < 0:
+            key += self.ntokens
+        row = self.dbhandle.execute(
+            "SELECT token FROM tokens WHERE id = ?", (key,)).fetchone()
+        if row is None:
+            raise IndexError("token id %i out of range" % key)
+        return row[0]
+
+    def __iter__(self):
+        for row in self.dbhandle.execute(
+                "SELECT token FROM tokens ORDER BY id"):
+            yield row[0]
+
+    def getId(self, token):
+        row = self.dbhandle.execute(
+            "SELECT id FROM tokens WHERE token = ?", (token,)).fetchone()
+        if row is None:
+            raise KeyError(token)
+        return row[0]
+
+    def encode(self, token):
+        try:
+            return self.cache[token]
+        except KeyError:
+            pass
+
+        try:
+            code = self.getId(token)
+        except KeyError:
+            code = self.ntokens
+            self.dbhandle.execute("INSERT INTO tokens VALUES (?, ?)",
+                                  (code, token))
+            self.ntokens += 1
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[token] = code
+        return code
+
+    def decode(self, ids):
+        return [self[x] for x in ids]
+
+    def getRanks(self):
+        ranks = numpy.empty(self.ntokens, dtype=numpy.int64)
+        for rank, row in enumerate(self.dbhandle.execute(
+                "SELECT id FROM tokens ORDER BY token")):
+            ranks[row[0]] = rank
+        return ranks
+
+    def close(self):
+        '''write tokens to disk and close the database.'''
+        self.dbhandle.commit()
+        self.dbhandle.close()
+
+
+def _asArray(values, dtype):
+    if len(values) == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.frombuffer(values, dtype=dtype)
+
+
+def iterateLinks(infile,
+                 columns=(2,),
+                 tokens=None,
+                 convert=float,
+                 chunk_size=1000000,
+                 remove_self_links=False):
+    '''iterate over links in *infile* in chunks of *chunk_size* links.
+
+    Each link is a line with two tokens in the first two fields
+    followed by weights. *columns* are the fields with weights that
+    are converted with *convert*. Lines starting with ``#`` and lines
+    in which a weight can not be converted (headers) are skipped.
+
+    Tokens are added to *tokens*, which is shared between chunks.
+
+    yields tuples of sources, targets and weights. Weights are a
+    two-dimensional array with one column per field in *columns*.
+    '''
+
+    if tokens is None:
+        tokens = Tokens()
+
+    encode = tokens.encode
+    ncolumns = len(columns)
+
+    sources, targets = array.array("l"), array.array("l")
+    weights = array.array("d")
+
+    def _build():
+        return (_asArray(sources, numpy.int_),
+                _asArray(targets, numpy.int_),
+                _asArray(weights, numpy.float64).reshape(
+                    (len(sources), ncolumns)))
+
+    for line in infile:
+        if line[0] == "#":
+            continue
+
+        data = line[:-1].split("\t")
+        try:
+            w = [convert(data[x]) for x in columns]
+        except ValueError:
+            continue
+
+        if remove_self_links and data[0] == data[1]:
+            continue
+
+        sources.append(encode(data[0]))
+        targets.append(encode(data[1]))
+        weights.extend(w)
+
+        if len(sources) >= chunk_size:
+            yield _build()
+            sources, targets = array.array("l"), array.array("l")
+            weights = array.array("d")
+
+    if len(sources):
+        yield _build()
+
+
+def readLinks(infile, columns=(2,), tokens=None, **kwargs):
+    '''read all links from *infile*.
+
+    See :func:`iterateLinks` for the arguments.
+
+    returns a tuple of tokens, sources, targets and weights.
+    '''
+    if tokens is None:
+        tokens = Tokens()
+
+    chunks = list(iterateLinks(infile, columns=columns,
+                               tokens=tokens, **kwargs))
+    if chunks:
+        sources, targets, weights = zip(*chunks)
+        return (tokens,
+                numpy.concatenate(sources),
+                numpy.concatenate(targets),
+                numpy.concatenate(weights))
+    else:
+        return (tokens,
+                numpy.zeros(0, dtype=numpy.int_),
+                numpy.zeros(0, dtype=numpy.int_),
+                numpy.zeros((0, len(columns)), dtype=numpy.float64))
+
+
+def getRunStarts(sources, targets):
+    '''return start positions of runs of identical consecutive
+    links.'''
+    if len(sources) == 0:
+        return numpy.zeros(0, dtype=numpy.int_)
+    changed = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+    return numpy.concatenate(([0], numpy.flatnonzero(changed) + 1))
+
+
+def combineLinks(sources, targets, weights):
+    '''combine runs of identical consecutive links.
+
+    returns a tuple of sources, targets, minimum, maximum, count and
+    total of *weights* for each run.
+    '''
+    starts = getRunStarts(sources, targets)
+    if len(starts) == 0:
+        empty = numpy.zeros(0)
+        return (sources, targets, empty, empty,
+                numpy.zeros(0, dtype=numpy.int_), empty)
+
+    counts = numpy.diff(numpy.concatenate((starts, [len(sources)])))
+    return (sources[starts],
+            targets[starts],
+            numpy.minimum.reduceat(weights, starts),
+            numpy.maximum.reduceat(weights, starts),
+            counts,
+            numpy.add.reduceat(weights, starts))
+
+
+class LinkGraph(object):
+
+    '''a graph of links in compressed sparse row format.
+
+    *tokens* is a :class:`Tokens` object. The links of vertex *x*
+    are at positions ``offsets[x]:offsets[x+1]`` of *targets* and
+    *weights*.
+    '''
+
+    def __init__(self, tokens, offsets, targets, weights):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def getNumLinks(self):
+        '''return the number of links.'''
+        return len(self.targets)
+
+    def getDegrees(self):
+        '''return the number of links of each vertex.'''
+        return numpy.diff(self.offsets)
+
+    def getSources(self):
+        '''return the source vertex of each link.'''
+        return numpy.repeat(numpy.arange(len(self), dtype=numpy.int_),
+                            self.getDegrees())
+
+    def getLinks(self, token):
+        '''return targets and weights of links of *token*.'''
+        x = self.tokens.getId(token)
+        start, end = self.offsets[x], self.offsets[x + 1]
+        return self.targets[start:end], self.weights[start:end]
+
+    def getPaths(self):
+        '''return all paths of length two.
+
+        returns two arrays of link positions. Path *i* leads from
+        ``targets[first[i]]`` through the source vertex of both links
+        to ``targets[second[i]]``. Paths returning along the same
+        link are included.
+        '''
+        sources = self.getSources()
+        npaths = self.getDegrees()[sources]
+        starts = numpy.repeat(numpy.cumsum(npaths) - npaths, npaths)
+        first = numpy.repeat(numpy.arange(len(sources)), npaths)
+        second = numpy.arange(len(first)) - starts + \
+            numpy.repeat(self.offsets[sources], npaths)
+        return first, second
+
+    def sortLinks(self):
+        '''sort the links of each vertex by target and weights.
+
+        Returns a new graph.
+        '''
+        keys = [self.weights[:, x]
+                for x in range(self.weights.shape[1] - 1, -1, -1)]
+        order = numpy.lexsort(keys + [self.targets, self.getSources()])
+        return LinkGraph(self.tokens,
+                         self.offsets,
+                         self.targets[order],
+                         self.weights[order])
+
+    def removeDuplicates(self):
+        '''remove links with identical target and weights.
+
+        Links need to be sorted with :meth:`sortLinks`.
+        Returns a new graph.
+        '''
+        sources = self.getSources()
+        if len(sources) == 0:
+            return self
+        keep = numpy.ones(len(sources), dtype=numpy.bool)
+        keep[1:] = ((sources[1:] != sources[:-1]) |
+                    (self.targets[1:] != self.targets[:-1]) |
+                    numpy.any(self.weights[1:] != self.weights[:-1], axis=1))
+        return buildLinkGraph(self.tokens,
+                              sources[keep],
+                              self.targets[keep],
+                              self.weights[keep])
+
+    def hasLinks(self, sources, targets):
+        '''return a boolean array indicating which links between
+        *sources* and *targets* exist.
+
+        Links need to be sorted with :meth:`sortLinks`.
+        '''
+        nvertices = len(self)
+        keys = self.getSources().astype(numpy.int64) * nvertices + \
+            self.targets
+        query = numpy.asarray(sources, dtype=numpy.int64) * nvertices + \
+            numpy.asarray(targets)
+        if len(keys) == 0:
+            return numpy.zeros(len(query), dtype=numpy.bool)
+        index = numpy.minimum(numpy.searchsorted(keys, query), len(keys) - 1)
+        return keys[index] == query
+
+    def save(self, prefix):
+        '''save graph to files starting with *prefix*.'''
+        with open(prefix + ".tokens", "w") as outf:
+            for token in self.tokens:
+                outf.write("%s\n" % token)
+        numpy.save(prefix + ".offsets.npy", self.offsets)
+        numpy.save(prefix + ".targets.npy", self.targets)
+        numpy.save(prefix + ".weights.npy", self.weights)
+
+
+def buildLinkGraph(tokens, sources, targets, weights, symmetric=False):
+    '''build a :class:`LinkGraph` from arrays of links.
+
+    The links of each vertex remain in input order. If *symmetric* is
+    set, the reverse of each link is added.
+    '''
+
+    if symmetric:
+        sources, targets = (numpy.concatenate((sources, targets)),
+                            numpy.concatenate((targets, sources)))
+        weights = numpy.concatenate((weights, weights))
+
+    order = numpy.argsort(sources, kind="mergesort")
+    offsets = numpy.zeros(len(tokens) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(sources, minlength=len(tokens)),
+                 out=offsets[1:])
+
+    return LinkGraph(tokens, offsets, targets[order], weights[order])
+
+
+def readLinkGraph(infile, columns=(2,), symmetric=False, **kwargs):
+    '''read links from *infile* into a :class:`LinkGraph`.
+
+    See :func:`iterateLinks` for the arguments.
+    '''
+    return buildLinkGraph(*readLinks(infile, columns=columns, **kwargs),
+                          symmetric=symmetric)
+
+
+def loadLinkGraph(prefix, mmap_mode="r"):
+    '''load a graph saved with :meth:`LinkGraph.save`.
+
+    Arrays are memory-mapped according to *mmap_mode*.
+    '''
+    if not os.path.exists(prefix + ".tokens"):
+        raise IOError("graph %s does not exist" % prefix)
+
+    with open(prefix + ".tokens") as inf:
+        tokens = Tokens([x[:-1] for x in inf])
+
+    return LinkGraph(
+        tokens,
+        numpy.load(prefix + ".offsets.npy", mmap_mode=mmap_mode),
+        numpy.load(prefix + ".targets.npy", mmap_mode=mmap_mode),
+        numpy.load(prefix + ".weights.npy", mmap_mode=mmap_mode))
@@ -39,6 +39,7 @@ import string
 import math
 import copy
 import random
+import numpy
 
 
 class AlignedString:
@@ -1252,6 +1253,216 @@ class Mali:
         self.mMali = vals
 
 
+class MaliArray(Mali):
+
+    """multiple alignment with vectorised column operations.
+
+    Rows are kept as :class:`AlignedString` objects so that the
+    interface of :class:`Mali` is unchanged. Column operations convert
+    the alignment into a two-dimensional array of bytes (rows in
+    the order of :meth:`getIdentifiers`), operate on all rows at
+    once and write the result back.
+
+    All rows need to have the same length.
+    """
+
+    def getArray(self):
+        """return alignment as a 2D array of bytes."""
+        nrows, ncols = len(self.mIdentifiers), self.getNumColumns()
+        if nrows == 0:
+            return numpy.zeros((0, 0), dtype=numpy.uint8)
+        if not self.checkLength():
+            raise ValueError("rows in multiple alignment differ in length")
+        return numpy.fromstring(
+            "".join([self.mMali[x].mString for x in self.mIdentifiers]),
+            dtype=numpy.uint8).reshape(nrows, ncols)
+
+    def setArray(self, array):
+        """set rows of the alignment from a 2D array of bytes."""
+        for identifier, row in zip(self.mIdentifiers, array):
+            self.mMali[identifier].mString = row.tostring()
+
+    def _encodeChars(self, chars):
+        return numpy.array([ord(x) for x in chars], dtype=numpy.uint8)
+
+    def _isGap(self, array):
+        is_gap = numpy.zeros(256, dtype=bool)
+        is_gap[self._encodeChars(self.mGapChars)] = True
+        return is_gap[array]
+
+    def getColumns(self):
+        """return mali in column orientation."""
+        return [x.tostring() for x in self.getArray().T]
+
+    def getConsensus(self, mark_with_gaps=False):
+        """return consensus string.
+
+        The consensus string returns the most frequent character per column
+        that is not a gap. Ties are resolved by choosing the smallest
+        character. If mark_with_gaps is set to True, positions with any
+        gap characater are set to gaps.
+        """
+        array = self.getArray()
+        ncols = array.shape[1]
+        gap = ord(self.mGapChar)
+        columns = numpy.tile(numpy.arange(ncols), array.shape[0])
+        counts = numpy.bincount(columns * 256 + array.ravel(),
+                                minlength=ncols * 256).reshape(ncols, 256)
+        has_gaps = counts[:, gap] > 0
+        counts[:, gap] = 0
+        consensus = counts.argmax(axis=1).astype(numpy.uint8)
+        consensus[counts.max(axis=1) == 0] = gap
+        if mark_with_gaps:
+            consensus[has_gaps] = gap
+        return consensus.tostring()
+
+    def _selectColumns(self, nmatches,
+                       allowed_matches, minimum_matches, delete_frame):
+        """return columns to keep given number of matches per column."""
+        keep = (nmatches >= allowed_matches) & (nmatches < minimum_matches)
+        if delete_frame != 1:
+            blocks = numpy.arange(len(keep)) // delete_frame
+            deleted = numpy.bincount(blocks[~keep],
+                                     minlength=blocks[-1] + 1) > 0
+            keep &= ~deleted[blocks]
+        return numpy.nonzero(keep)[0]
+
+    def removeGaps(self,
+                   allowed_gaps=0,
+                   minimum_gaps=1,
+                   frame=1):
+        """remove gappy columns.
+
+        See :meth:`Mali.removeGaps`.
+        """
+        if self.getNumColumns() == 0:
+            return
+        nmatches = self._isGap(self.getArray()).sum(axis=0)
+        self.takeColumns(self._selectColumns(nmatches,
+                                             allowed_gaps,
+                                             minimum_gaps,
+                                             frame))
+
+    def removePattern(self,
+                      match_function,
+                      allowed_matches=0,
+                      minimum_matches=1,
+                      delete_frame=1,
+                      search_frame=1):
+        """remove columns (or group of columns), that match a certain pattern.
+
+        See :meth:`Mali.removePattern`. *match_function* is called
+        once for each distinct segment in the alignment.
+        """
+        array = self.getArray()
+        nrows, ncols = array.shape
+        if ncols == 0:
+            return
+
+        nmatches = numpy.zeros(ncols, dtype=numpy.int64)
+        nsegments = ncols // search_frame
+        full = nsegments * search_frame
+
+        if nsegments > 0:
+            segments = numpy.ascontiguousarray(array[:, :full]).view(
+                "S%i" % search_frame).reshape(nrows, nsegments)
+            keys, inverse = numpy.unique(segments, return_inverse=True)
+            matches = numpy.array([match_function(k) for k in keys],
+                                  dtype=bool)
+            nmatches[:full:search_frame] = matches[
+                inverse.reshape(nrows, nsegments)].sum(axis=0)
+
+        if full < ncols:
+            nmatches[full] = sum([match_function(x[full:].tostring())
+                                  for x in array])
+
+        self.takeColumns(self._selectColumns(nmatches,
+                                             allowed_matches,
+                                             minimum_matches,
+                                             delete_frame))
+
+    def markCodons(self, mode="case"):
+        """mark codons.
+        """
+        array = self.getArray()
+        ncols = array.shape[1]
+        if ncols % 3 != 0:
+            raise ValueError("alignment not divisible by 3")
+
+        lower = (numpy.arange(ncols) // 3) % 2 == 1
+        array[:, ~lower] = self._toUpper(array[:, ~lower])
+        array[:, lower] = self._toLower(array[:, lower])
+        self.setArray(array)
+
+    def _toUpper(self, array):
+        is_lower = (array >= ord("a")) & (array <= ord("z"))
+        return numpy.where(is_lower, array - 32, array).astype(numpy.uint8)
+
+    def _toLower(self, array):
+        is_upper = (array >= ord("A")) & (array <= ord("Z"))
+        return numpy.where(is_upper, array + 32, array).astype(numpy.uint8)
+
+    def propagateMasks(self, min_chars=1, mask_char="x"):
+        """propagate masked characters to all rows of a multiple alignment
+        within a column.
+
+        If there is at least min_chars in a mali column, that are masks,
+        propagate the masks to all other rows.
+        """
+        array = self._toLower(self.getArray())
+        nmasks = (array == ord(mask_char)).sum(axis=0)
+        self.maskColumns(numpy.nonzero(nmasks >= min_chars)[0],
+                         mask_char=mask_char)
+
+    def propagateTransitions(self, min_chars=1):
+        """propagate lower case in a column to all residues.
+        """
+        array = self.getArray()
+        is_lower = (array >= ord("a")) & (array <= ord("z"))
+        columns = numpy.nonzero(is_lower.any(axis=0))[0]
+        self.mapColumns(columns, string.lower)
+
+    def takeColumns(self, columns):
+        """restrict alignments to certain columns."""
+        columns = numpy.asarray(columns, dtype=numpy.int64)
+        self.setArray(self.getArray()[:, columns])
+
+        for key, anno in self.mAnnotations.items():
+            self.mAnnotations[key] = "".join([anno[c] for c in columns])
+
+    def maskColumns(self, columns, mask_char="x"):
+        """mask columns in a multiple alignment."""
+        columns = numpy.asarray(columns, dtype=numpy.int64)
+        array = self.getArray()
+        if len(columns) == 0 or array.size == 0:
+            return
+        block = array[:, columns]
+        block[~self._isGap(block)] = ord(mask_char)
+        array[:, columns] = block
+        self.setArray(array)
+
+    def maskColumn(self, column, mask_char="x"):
+        """mask a column."""
+        self.maskColumns([column], mask_char=mask_char)
+
+    def mapColumns(self, columns, map_function):
+        """apply map_function to all residues in columns.
+
+        *map_function* needs to map a character to a single character.
+        """
+        columns = numpy.asarray(columns, dtype=numpy.int64)
+        array = self.getArray()
+        if len(columns) == 0 or array.size == 0:
+            return
+        block = array[:, columns]
+        gaps = self._encodeChars(self.mGapChars)
+        table = numpy.arange(256, dtype=numpy.uint8)
+        for x in numpy.setdiff1d(numpy.unique(block), gaps):
+            table[x] = ord(map_function(chr(x)))
+        array[:, columns] = table[block]
+        self.setArray(array)
+
+
 class SequenceCollection(Mali):
 
     """reads in a sequence collection, but permits several entries per id.
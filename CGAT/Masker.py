@@ -29,6 +29,27 @@ Masker.py - Wrapper for sequence masking tools
 :Date: |today|
 :Tags: Python
 
+The maskers :class:`MaskerSeg` and :class:`MaskerDustMasker` call
+the external programs ``segmasker`` and ``dustmasker``. Both can
+alternatively use native implementations of the algorithms by
+setting ``method="native"``::
+
+   masker = MaskerDustMasker(method="native")
+   masked = masker.maskSequences(sequences, num_threads=4)
+
+The native DUST implementation follows the symmetric DUST algorithm
+(Morgulis et al. (2006), J Comput Biol 13:1028-40) with the defaults
+of ``dustmasker`` (window 64, level 20). The scan over the sequence
+is sequential and runs in the compiled module :mod:`cmasker` if it
+has been built. :func:`maskSequences` uses it with
+``masker="dust-native"``. The native SEG
+implementation follows Wootton & Federhen (1993), Comput Chem
+17:149-163, with the defaults of ``segmasker`` (window 12, locut 2.2,
+hicut 2.5). It has not been validated against the output of
+``segmasker``, so :class:`MaskerSeg` runs ``segmasker`` by default
+and ``fasta2fasta.py`` selects the native version with the separate
+method ``mask-seg-native``.
+
 Code
 ----
 
@@ -39,12 +60,352 @@ import tempfile
 import string
 import re
 import random
+import math
+import collections
+import multiprocessing
+import numpy
 
 from CGAT import Experiment as E
 from CGAT import Genomics as Genomics
 from CGAT import FastaIterator as FastaIterator
 import cStringIO as StringIO
 
+try:
+    from CGAT import cmasker
+except ImportError:
+    cmasker = None
+
+# DUST: number of bases per word and word alphabet size
+DUST_WORD_LENGTH = 3
+DUST_NWORDS = 4 ** DUST_WORD_LENGTH
+
+# SEG: residues with composition counts
+SEG_ALPHABET = "ACDEFGHIKLMNPQRSTVWY"
+
+LN20 = math.log(20.0)
+LN2 = math.log(2.0)
+
+
+def encodeSequence(sequence, alphabet):
+    '''return sequence as numpy array of indices into *alphabet*.
+
+    Characters not in *alphabet* are set to ``len(alphabet)``. The
+    encoding is case-insensitive.
+    '''
+    codes = numpy.zeros(256, dtype=numpy.int8) + len(alphabet)
+    for x, c in enumerate(alphabet):
+        codes[ord(c.upper())] = x
+        codes[ord(c.lower())] = x
+    return codes[numpy.fromstring(sequence, dtype=numpy.uint8)]
+
+
+def applyMaskIntervals(sequence, intervals, soft_mask=True,
+                       mask_char="N"):
+    '''mask *intervals* in *sequence*.
+
+    Intervals are half-open. If *soft_mask* is set, masked residues
+    are converted to lower case, otherwise to *mask_char*.
+    '''
+    if not intervals:
+        return sequence
+    s = list(sequence)
+    for start, end in intervals:
+        if soft_mask:
+            s[start:end] = sequence[start:end].lower()
+        else:
+            s[start:end] = mask_char * (end - start)
+    return "".join(s)
+
+
+def dust(sequence, window=64, level=20):
+    '''return low complexity regions in a nucleotide *sequence*
+    according to the symmetric DUST algorithm.
+
+    Returns a list of half-open intervals. Characters other than
+    ACGT break the sequence into independent segments.
+
+    The compiled implementation in :mod:`cmasker` is used if it
+    is available.
+    '''
+
+    bases = encodeSequence(sequence, "ACGT")
+    if cmasker is not None:
+        return cmasker.DustScanner(window, level).scan(bases)
+
+    bases = bases.tolist()
+    nbases = len(bases)
+
+    # perfect intervals as lists of [start, finish, r, l], sorted by
+    # decreasing start
+    perfect = []
+    result = []
+    window_words = collections.deque()
+    # counts of words in window (w) and in the current suffix (v)
+    cw = [0] * DUST_NWORDS
+    cv = [0] * DUST_NWORDS
+    rw, rv, L = 0, 0, 0
+    max_words = window - DUST_WORD_LENGTH + 1
+    word_mask = DUST_NWORDS - 1
+
+    def saveMaskedRegions(start):
+        if not perfect or perfect[-1][0] >= start:
+            return
+        p_start, p_finish = perfect[-1][:2]
+        if result and p_start <= result[-1][1]:
+            result[-1] = (result[-1][0], max(result[-1][1], p_finish))
+        else:
+            result.append((p_start, p_finish))
+        x = len(perfect) - 1
+        while x >= 0 and perfect[x][0] < start:
+            x -= 1
+        del perfect[x + 1:]
+
+    def findPerfect(start):
+        c = list(cv)
+        r = rv
+        max_r, max_l = 0, 0
+        nwords = len(window_words)
+        for x in xrange(nwords - L - 1, -1, -1):
+            t = window_words[x]
+            r += c[t]
+            c[t] += 1
+            new_l = nwords - x - 1
+            if r * 10 > level * new_l:
+                y = 0
+                while y < len(perfect) and perfect[y][0] >= x + start:
+                    p = perfect[y]
+                    if max_r == 0 or p[2] * max_l > max_r * p[3]:
+                        max_r, max_l = p[2], p[3]
+                    y += 1
+                if max_r == 0 or r * max_l >= max_r * new_l:
+                    max_r, max_l = r, new_l
+                    perfect.insert(
+                        y, [x + start,
+                            nwords + DUST_WORD_LENGTH - 1 + start,
+                            r, new_l])
+
+    l, t = 0, 0
+    for x in xrange(nbases + 1):
+        if x < nbases:
+            b = bases[x]
+        else:
+            b = 4
+
+        if b < 4:
+            l += 1
+            t = ((t << 2) | b) & word_mask
+            if l < DUST_WORD_LENGTH:
+                continue
+
+            start = max(l - window, 0) + (x + 1 - l)
+            saveMaskedRegions(start)
+
+            # shift window
+            if len(window_words) >= max_words:
+                s = window_words.popleft()
+                cw[s] -= 1
+                rw -= cw[s]
+                if L > len(window_words):
+                    L -= 1
+                    cv[s] -= 1
+                    rv -= cv[s]
+            window_words.append(t)
+            L += 1
+            rw += cw[t]
+            cw[t] += 1
+            rv += cv[t]
+            cv[t] += 1
+            if cv[t] * 10 > level * 2:
+                while 1:
+                    s = window_words[len(window_words) - L]
+                    cv[s] -= 1
+                    rv -= cv[s]
+                    L -= 1
+                    if s == t:
+                        break
+
+            if rw * 10 > L * level:
+                findPerfect(start)
+        else:
+            start = max(l - window + 1, 0) + (x + 1 - l)
+            while perfect:
+                saveMaskedRegions(start)
+                start += 1
+            # start a new, independent segment
+            l, t = 0, 0
+            window_words.clear()
+            cw = [0] * DUST_NWORDS
+            cv = [0] * DUST_NWORDS
+            rw, rv, L = 0, 0, 0
+
+    return result
+
+
+class SegState:
+
+    '''lookup tables for the SEG algorithm.'''
+
+    def __init__(self, maxlen):
+        self.lnfac = numpy.array(
+            [math.lgamma(x + 1) for x in xrange(maxlen + 1)])
+        self.lnrank = numpy.log(numpy.arange(1, len(SEG_ALPHABET) + 1))
+
+
+def segEntropies(counts, window):
+    '''return entropies of windows with residue *counts*.
+
+    Windows without residues have an entropy of -1.
+    '''
+    total = counts.sum(axis=1).astype(numpy.float64)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        freqs = counts / total[:, numpy.newaxis]
+        ent = numpy.where(counts > 0, freqs * numpy.log(freqs), 0)
+    entropies = numpy.abs(ent.sum(axis=1) / LN2)
+    entropies[total == 0] = -1
+    return entropies
+
+
+def segTrim(prefix, first, last, state, maxtrim=100):
+    '''find the segment within *first* and *last* (inclusive)
+    with the lowest compositional probability.
+
+    *prefix* are cumulative residue counts. Returns the trimmed
+    coordinates.
+    '''
+    length = last - first + 1
+    lend, rend = 0, length - 1
+    minlen = 1
+    if length - maxtrim > minlen:
+        minlen = length - maxtrim
+
+    minprob = 1.0
+    lnfac, lnrank = state.lnfac, state.lnrank
+    nalphabet = len(SEG_ALPHABET)
+    idx = numpy.arange(nalphabet)
+
+    for l in xrange(length, minlen, -1):
+        counts = prefix[first + l:last + 2] - prefix[first:last + 2 - l]
+
+        # number of permutations of the composition
+        lnperm = lnfac[l] - lnfac[counts].sum(axis=1)
+
+        # number of compositions with the same state vector
+        counts = numpy.sort(counts, axis=1)
+        is_start = numpy.ones(counts.shape, dtype=numpy.bool)
+        is_start[:, 1:] = counts[:, 1:] != counts[:, :-1]
+        run_start = numpy.maximum.accumulate(
+            numpy.where(is_start, idx, 0), axis=1)
+        lnass = lnfac[nalphabet] - lnrank[idx - run_start].sum(axis=1)
+
+        probs = lnass + lnperm - l * LN20
+        x = numpy.argmin(probs)
+        if probs[x] < minprob:
+            minprob = probs[x]
+            lend, rend = x, l + x - 1
+
+    return first + lend, first + rend
+
+
+def segSegments(prefix, first, last, state,
+                window=12, locut=2.2, hicut=2.5):
+    '''return low complexity segments within *first* and *last*
+    (inclusive).'''
+
+    length = last - first + 1
+    if window > length:
+        return []
+
+    downset = (window + 1) // 2 - 1
+    upset = window - downset
+
+    entropies = -numpy.ones(length)
+    entropies[downset:length - upset + 1] = segEntropies(
+        prefix[first + window:last + 2] - prefix[first:last + 2 - window],
+        window)
+
+    segments = []
+    lowlim = downset
+    hilim = length - upset
+    i = downset
+    while i <= hilim:
+        h = entropies[i]
+        if h == -1 or h > locut:
+            i += 1
+            continue
+
+        loi = i
+        while loi >= lowlim and \
+                entropies[loi] != -1 and entropies[loi] <= hicut:
+            loi -= 1
+        loi += 1
+        hii = i
+        while hii <= hilim and \
+                entropies[hii] != -1 and entropies[hii] <= hicut:
+            hii += 1
+        hii -= 1
+
+        leftend, rightend = segTrim(prefix,
+                                    first + loi - downset,
+                                    first + hii + upset - 1,
+                                    state)
+        leftend -= first
+        rightend -= first
+
+        # check for trigger window in left trim
+        if i + upset - 1 < leftend:
+            segments.extend(
+                segSegments(prefix,
+                            first + loi - downset,
+                            first + leftend - 1,
+                            state, window, locut, hicut))
+
+        segments.append((first + leftend, first + rightend))
+        i = min(hii, rightend + downset) + 1
+        lowlim = i
+
+    return segments
+
+
+def seg(sequence, window=12, locut=2.2, hicut=2.5):
+    '''return low complexity regions in a peptide *sequence*
+    according to the SEG algorithm.
+
+    Returns a list of half-open intervals.
+    '''
+
+    residues = encodeSequence(sequence, SEG_ALPHABET)
+    nresidues = len(residues)
+    if nresidues < window:
+        return []
+
+    # cumulative residue counts, ignoring unknown residues
+    nalphabet = len(SEG_ALPHABET)
+    valid = residues < nalphabet
+    onehot = numpy.zeros((nresidues + 1, nalphabet), dtype=numpy.int64)
+    onehot[numpy.arange(1, nresidues + 1)[valid], residues[valid]] = 1
+    prefix = numpy.cumsum(onehot, axis=0)
+
+    segments = segSegments(prefix, 0, nresidues - 1,
+                           SegState(max(nresidues, len(SEG_ALPHABET))),
+                           window, locut, hicut)
+
+    # merge overlapping segments
+    result = []
+    for start, end in segments:
+        if result and result[-1][1] >= start:
+            result[-1][1] = end
+        else:
+            result.append([start, end])
+
+    return [(start, end + 1) for start, end in result]
+
+
+def _maskSequence(args):
+    '''mask a sequence - called by worker processes.'''
+    masker, sequence = args
+    return masker.maskSequence(sequence)
+
+
 # Class for calling masking programs.
 
 
@@ -61,8 +422,16 @@ class Masker:
     # set to true if masker outputs softmasked sequence
     soft_mask = False
 
-    def __init__(self):
-        pass
+    # external or native
+    method = "external"
+
+    def __init__(self, method="external"):
+        if method not in ("external", "native"):
+            raise ValueError("unknown masking method %s" % method)
+        if method == "native" and not hasattr(self, "maskIntervals"):
+            raise ValueError("%s has no native masking method" %
+                             self.__class__.__name__)
+        self.method = method
 
     def getAlphabet(self, sequence):
         """get sequence type (aa,na,codons)."""
@@ -136,7 +505,11 @@ class Masker:
         """mask peptide sequence
         """
 
-        Masker.__init__(self)
+        if self.method == "native":
+            # unmasked residues are returned in upper case
+            # as by the external tools
+            return applyMaskIntervals(peptide_sequence.upper(),
+                                      self.maskIntervals(peptide_sequence))
 
         outfile, filename_peptide = tempfile.mkstemp()
         os.write(outfile, ">test\n%s\n" % (peptide_sequence))
@@ -165,8 +538,25 @@ class Masker:
             "\s", "", string.join(out.split("\n")[1:], ""))
         return masked_sequence
 
-    def maskSequences(self, sequences):
-        '''mask a collection of sequences.'''
+    def maskSequences(self, sequences, num_threads=1):
+        '''mask a collection of sequences.
+
+        With the native method, sequences are masked in
+        *num_threads* worker processes.
+        '''
+
+        if self.method == "native":
+            args = [(self, x) for x in sequences]
+            if num_threads > 1:
+                pool = multiprocessing.Pool(num_threads)
+                result = pool.map(_maskSequence, args,
+                                  chunksize=max(1, len(args) //
+                                                (4 * num_threads)))
+                pool.close()
+                pool.join()
+            else:
+                result = map(_maskSequence, args)
+            return result
 
         outfile, infile = tempfile.mkstemp()
 
@@ -207,21 +597,34 @@ class MaskerBias (Masker):
 
 
 class MaskerSeg (Masker):
+
+    '''use segmasker or the native SEG implementation.
+
+    The native implementation is not validated against
+    segmasker and needs to be requested explicitly.
+    '''
+
     # mCommand = "seg %(infile)s 12 2.2 2.5 -x"
     mCommand = ("segmasker -in %(infile)s -window 12 -locut 2.2 "
                 "-hicut 2.5 -outfmt fasta")
     mHasPeptideMasking = True
     soft_mask = True
 
+    def maskIntervals(self, sequence):
+        return seg(sequence, window=12, locut=2.2, hicut=2.5)
+
 
 class MaskerDustMasker(Masker):
 
-    '''use dustmasker. masked chars are returned as
-    lower case characters.'''
+    '''use dustmasker or the native DUST implementation. masked
+    chars are returned as lower case characters.'''
 
     mCommand = "dustmasker -outfmt fasta -in %(infile)s"
     mHasNucleicAcidMasking = True
 
+    def maskIntervals(self, sequence):
+        return dust(sequence, window=64, level=20)
+
 
 class MaskerRandom (Masker):
     """randomly mask a proportion of positions in a sequence
@@ -266,26 +669,30 @@ if __name__ == "__main__":
                            "GGGGGGGGGG", ))
 
 
-def maskSequences(sequences, masker=None):
+def maskSequences(sequences, masker=None, num_threads=1):
     '''return a list of masked sequence.
 
     *masker* can be one of
         dust/dustmasker * run dustmasker on sequences
+        dust-native     * run native DUST on sequences
         softmask        * use softmask to hardmask sequences
     '''
 
     if masker in ("dust", "dustmasker"):
         masker_object = MaskerDustMasker()
+    elif masker == "dust-native":
+        masker_object = MaskerDustMasker(method="native")
     else:
         masker_object = None
 
     if masker == "softmask":
         # the genome sequence is repeat soft-masked
         masked_seq = sequences
-    elif masker in ("dust", "dustmasker"):
+    elif masker in ("dust", "dustmasker", "dust-native"):
         # run dust
         masked_seq = masker_object.maskSequences(
-            [x.upper() for x in sequences])
+            [x.upper() for x in sequences],
+            num_threads=num_threads)
     elif masker is None:
         masked_seq = [x.upper() for x in sequences]
     else:
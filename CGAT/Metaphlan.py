@@ -6,6 +6,12 @@ import sys
 import os
 import gzip
 import collections
+import csv
+import pandas
+import CGAT.Taxonomy as Taxonomy
+
+# taxonomic levels in a read map
+LEVELS = ("kingdom", "phylum", "class", "order", "family", "genus", "species")
 
 
 class ReadMap(object):
@@ -116,7 +122,7 @@ def read_map_iterator(infile):
     iterate over read_map file
     from metaphlan
     '''
-    for line in infile.readlines():
+    for line in infile:
         data = line[:-1].split("\t")
         seq_id = data[0]
         data = data[1].split("|")
@@ -146,6 +152,45 @@ def read_map_iterator(infile):
             raise ValueError("could not assign taxonomy at the phylum level")
         yield ReadMap().read(seq_id, kingdom, phylum, c_lass, order, family, genus, species)
 
+##############################
+# read map as a table
+##############################
+
+
+def read_map_table(infile, chunk_size=100000):
+    '''
+    read a read_map file from metaphlan into a
+    :class:`Taxonomy.TaxonomyTable` with one column
+    for each of :data:`LEVELS`
+
+    The file is read in chunks of *chunk_size* lines. Lineages
+    are split into levels for all reads of a chunk at once.
+    '''
+    table = Taxonomy.TaxonomyTable(LEVELS, missing=("unclassified",))
+    try:
+        chunks = pandas.read_csv(infile,
+                                 sep="\t",
+                                 header=None,
+                                 usecols=[0, 1],
+                                 dtype=str,
+                                 quoting=csv.QUOTE_NONE,
+                                 chunksize=chunk_size)
+    except pandas.errors.EmptyDataError:
+        return table
+
+    for chunk in chunks:
+        levels = chunk[1].str.split("|", expand=True)
+        if levels.shape[1] < 2 or levels[1].isnull().any():
+            raise ValueError("could not assign taxonomy at the phylum level")
+        # remove the level prefix, levels missing from the lineage
+        # are unclassified
+        levels = levels.stack().str.split("__").str[1].unstack()
+        levels = levels.reindex(columns=range(len(LEVELS)))
+        table.addColumns(
+            [levels[x].fillna("unclassified").values
+             for x in range(len(LEVELS))])
+    return table
+
 ##############################
 # count by taxonomic group
 ##############################
@@ -155,11 +200,29 @@ class Counter(ReadMap):
 
     '''
     counter class for taxonomic counts
+
+    A file is read only once, the per-level
+    methods share the counts if called with
+    the same file.
     '''
 
     def __init__(self):
         self.counts = collections.defaultdict(int)
         self.total = 0
+        self.table = None
+        self.infile = None
+
+    def load(self, infile):
+        '''
+        read infile unless it has been read before
+        '''
+        if self.table is None or infile is not self.infile:
+            self.table = read_map_table(infile)
+            self.infile = infile
+            self.total = self.table.nreads
+            self.counts = collections.defaultdict(
+                int, zip(LEVELS, self.table.countAssigned()))
+        return self.table
 
     def count(self, infile):
         '''
@@ -167,66 +230,37 @@ class Counter(ReadMap):
         that were assigned to a taxonomic group in that
         particular taxonomic group
         '''
-        taxonomies = [
-            "kingdom", "phylum", "class", "order", "family", "genus", "species"]
-        for read in read_map_iterator(infile):
-            self.total += 1
-            if read.kingdom != "unclassified":
-                self.counts["kingdom"] += 1
-            if read.phylum != "unclassified":
-                self.counts["phylum"] += 1
-            if read.c_lass != "unclassified":
-                self.counts["class"] += 1
-            if read.order != "unclassified":
-                self.counts["order"] += 1
-            if read.family != "unclassified":
-                self.counts["family"] += 1
-            if read.genus != "unclassified":
-                self.counts["genus"] += 1
-            if read.genus != "unclassified":
-                self.counts["species"] += 1
+        self.load(infile)
         return self.counts
 
     def total_count(self, infile):
-        for read in read_map_iterator(infile):
-            self.total += 1
+        self.load(infile)
         return self.total
 
     def count_kingdom(self, infile):
-        counts = self.count(infile)
-        return x["kingdom"]
+        return self.count(infile)["kingdom"]
 
     def count_phylum(self, infile):
-        counts = self.count(infile)
-        return counts["phylum"]
+        return self.count(infile)["phylum"]
 
     def count_class(self, infile):
-        counts = self.count(infile)
-        return counts["class"]
+        return self.count(infile)["class"]
 
     def count_order(self, infile):
-        counts = self.count(infile)
-        return counts["order"]
+        return self.count(infile)["order"]
 
     def count_family(self, infile):
-        counts = self.count(infile)
-        return counts["family"]
+        return self.count(infile)["family"]
 
     def count_genus(self, infile):
-        counts = self.count(infile)
-        return counts["genus"]
+        return self.count(infile)["genus"]
 
     def count_species(self, infile):
-        counts = self.count(infile)
-        return counts["species"]
+        return self.count(infile)["species"]
 
     def count_total_species(self, infile):
-        species = set()
-        for read in read_map_iterator(infile):
-            if read.species.find("unclassified") == -1:
-                continue
-            species.add(read.species)
-        return len(species)
+        taxa, counts = self.load(infile).getCounts("species")
+        return len([x for x in taxa if x.find("unclassified") == -1])
 
     def proportion_with_clade_assignment(self, infile, total_reads):
         return float(total_reads) / self.total_count(infile)
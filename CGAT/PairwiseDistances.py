@@ -0,0 +1,599 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+'''
+PairwiseDistances.py - distances between many pairs of aligned sequences
+========================================================================
+
+:Author: Andreas Heger
+:Release: $Id$
+:Date: |today|
+:Tags: Python
+
+This module computes counts and distances for many pairs of
+aligned sequences at once. The sequences are encoded a single
+time as a matrix of byte codes with one row per sequence::
+
+   codes = PairwiseDistances.encodeNucleotides(sequences)
+   matrices = PairwiseDistances.calculatePairs(
+       PairwiseDistances.countSubstitutions, (codes,), pairs,
+       num_threads=4)
+   distance, variance = PairwiseDistances.calculateDistances(
+       matrices, "T92")
+
+Pairs of rows are processed in blocks. The columns of a block are
+counted with :func:`numpy.bincount`, and blocks can be spread over
+several processes. Collections of pairs with sequences of different
+lengths are processed with :func:`calculateSequencePairs`.
+
+Substitution matrices follow :func:`Genomics.CalculatePairIndices`.
+The order of the nucleotides is ``ACGT`` followed by the gap
+character, and characters outside this alphabet are ignored.
+Distances are computed in closed form for all pairs at once.
+Undefined distances are returned as ``nan``.
+
+Code
+----
+
+'''
+import itertools
+import multiprocessing
+import numpy
+
+from CGAT import Genomics as Genomics
+
+# the matrices of the current block computation, set in
+# worker processes by _setMatrices
+_MATRICES = None
+
+# number of cells in a block before it is split
+BLOCK_CELLS = 10000000
+
+NA_ALPHABET = "ACGT"
+# codes of nucleotides, the gap character and other characters
+NA_GAP = len(NA_ALPHABET)
+NA_OTHER = NA_GAP + 1
+
+# transitions and transversions as (row, column) in the
+# substitution matrix
+TRANSITIONS = ((0, 2), (2, 0), (1, 3), (3, 1))
+TRANSVERSIONS = ((0, 3), (3, 0), (2, 3), (3, 2),
+                 (2, 1), (1, 2), (0, 1), (1, 0))
+
+
+def encodeSequences(sequences):
+    '''return aligned *sequences* as a matrix of bytes.
+
+    Raises a ValueError if the sequences are not of equal length.
+    '''
+    sequences = list(sequences)
+    if len(sequences) == 0:
+        return numpy.zeros((0, 0), dtype=numpy.uint8)
+
+    ncolumns = len(sequences[0])
+    for sequence in sequences:
+        if len(sequence) != ncolumns:
+            raise ValueError("sequences of unequal length")
+
+    return numpy.fromstring(
+        "".join(sequences),
+        dtype=numpy.uint8).reshape(len(sequences), ncolumns)
+
+
+def encodeNucleotides(sequences, gap_char="-"):
+    '''return aligned *sequences* as a matrix of nucleotide codes.
+
+    ``A``, ``C``, ``G`` and ``T`` are encoded as 0 to 3, *gap_char*
+    as :data:`NA_GAP` and all other characters as :data:`NA_OTHER`.
+    The encoding is case sensitive.
+    '''
+    lookup = numpy.empty(256, dtype=numpy.uint8)
+    lookup.fill(NA_OTHER)
+    for x, c in enumerate(NA_ALPHABET):
+        lookup[ord(c)] = x
+    lookup[ord(gap_char)] = NA_GAP
+    return lookup[encodeSequences(sequences)]
+
+
+def encodeGaps(sequences, gap_chars=("-", ".")):
+    '''return a boolean matrix marking *gap_chars* in *sequences*.'''
+    lookup = numpy.zeros(256, dtype=bool)
+    for c in gap_chars:
+        lookup[ord(c)] = True
+    return lookup[encodeSequences(sequences)]
+
+
+def encodeAminoAcids(sequences):
+    '''return the translation of each position in *sequences*.
+
+    Each position is assigned the amino acid of the codon it is part
+    of as returned by :func:`Genomics.MapCodon2AA`. Each distinct
+    codon is only translated once.
+    '''
+    sequences = list(sequences)
+    codons = {}
+    result = []
+    for sequence in sequences:
+        row = []
+        for x in range(0, len(sequence), 3):
+            codon = sequence[x:x + 3]
+            if codon not in codons:
+                codons[codon] = Genomics.MapCodon2AA(codon)
+            row.append(codons[codon] * len(codon))
+        result.append("".join(row))
+    return encodeSequences(result)
+
+
+def encodeDegenerateSites(sequences,
+                          degeneracy=4,
+                          position=3,
+                          gap_char="-",
+                          ignore_case=False):
+    '''encode degenerate sites in *sequences*.
+
+    Returns a tuple of two matrices with one column per codon. The
+    first contains the nucleotide codes at *position* in the codon,
+    see :func:`encodeNucleotides`. The second contains the amino acid
+    of codons with the given *degeneracy* at *position* as byte code
+    and 0 for all other codons. A site is used by a pair of sequences
+    if both have the same non-zero code, see
+    :func:`Genomics.GetDegenerateSites`.
+
+    If *ignore_case* is set, lower case codons are looked up as upper
+    case codons.
+    '''
+    sequences = list(sequences)
+    nsequences = len(sequences)
+    ncodons = 0
+    if nsequences:
+        ncodons = len(sequences[0]) // 3
+    sequences = [x[:ncodons * 3] for x in sequences]
+
+    nucleotides = encodeNucleotides(
+        [x[position - 1::3] for x in sequences], gap_char=gap_char)
+
+    if nsequences == 0 or ncodons == 0:
+        return nucleotides, numpy.zeros((nsequences, ncodons),
+                                        dtype=numpy.uint8)
+
+    # translate each distinct codon once
+    codons = encodeSequences(sequences).view("S3").reshape(
+        nsequences, ncodons)
+    distinct, inverse = numpy.unique(codons, return_inverse=True)
+    lookup = numpy.zeros(len(distinct), dtype=numpy.uint8)
+    for x, codon in enumerate(distinct):
+        if ignore_case:
+            codon = codon.upper()
+        if codon in Genomics.GeneticCodeAA:
+            aa, deg1, deg2, deg3 = Genomics.Degeneracy[codon]
+            if (deg1, deg2, deg3)[position - 1] == degeneracy:
+                lookup[x] = ord(aa)
+
+    return nucleotides, lookup[inverse].reshape(nsequences, ncodons)
+
+
+def _countBlock(ncells, codes, offsets):
+    '''count *codes* per pair with offsets.'''
+    return numpy.bincount(
+        (codes + offsets).ravel(),
+        minlength=len(offsets) * ncells).reshape(len(offsets), ncells)
+
+
+def countSubstitutions(x, y):
+    '''return substitution matrices between rows in *x* and *y*.
+
+    *x* and *y* contain a single matrix of nucleotide codes, see
+    :func:`encodeNucleotides`. Returns an array of shape (npairs, 5,
+    5).
+    '''
+    x, y = x[0], y[0]
+    nchars = NA_OTHER + 1
+    codes = x.astype(numpy.int64) * nchars + y
+    offsets = numpy.arange(len(x))[:, numpy.newaxis] * nchars * nchars
+    counts = _countBlock(nchars * nchars, codes, offsets)
+    return counts.reshape(len(x), nchars, nchars)[:, :NA_OTHER, :NA_OTHER]
+
+
+def countDegenerateSubstitutions(x, y):
+    '''return substitution matrices between degenerate sites.
+
+    *x* and *y* contain nucleotide codes and codon codes as returned
+    by :func:`encodeDegenerateSites`. Only sites at which both codon
+    codes are identical and non-zero are counted.
+    '''
+    nucleotides = numpy.where((x[1] == y[1]) & (x[1] != 0),
+                              x[0], NA_OTHER)
+    return countSubstitutions((nucleotides,), (y[0],))
+
+
+def countIdentities(x, y):
+    '''return aligned, identical and unaligned positions.
+
+    *x* and *y* contain a matrix of bytes and a matrix of gaps, see
+    :func:`encodeSequences` and :func:`encodeGaps`. A position is
+    aligned if it is not a gap in both sequences and unaligned if it
+    is a gap in exactly one sequence.
+
+    Returns an array of shape (npairs, 3).
+    '''
+    aligned = ~(x[1] | y[1])
+    result = numpy.empty((len(aligned), 3), dtype=numpy.int64)
+    result[:, 0] = aligned.sum(axis=1)
+    result[:, 1] = (aligned & (x[0] == y[0])).sum(axis=1)
+    result[:, 2] = (x[1] ^ y[1]).sum(axis=1)
+    return result
+
+
+def countSynonymous(x, y):
+    '''return synonymous and non-synonymous changes.
+
+    *x* and *y* contain a matrix of bytes and the translation of each
+    position, see :func:`encodeSequences` and
+    :func:`encodeAminoAcids`. Changes in codons translating to gaps
+    are ignored, see :func:`Genomics.CalculatePairIndices`.
+
+    Returns an array of shape (npairs, 2).
+    '''
+    gap = ord(Genomics.GAP_CHAR)
+    changed = (x[0] != y[0]) & (x[1] != gap) & (y[1] != gap)
+    synonymous = changed & (x[1] == y[1])
+    result = numpy.empty((len(changed), 2), dtype=numpy.int64)
+    result[:, 0] = synonymous.sum(axis=1)
+    result[:, 1] = changed.sum(axis=1) - result[:, 0]
+    return result
+
+
+def _setMatrices(matrices):
+    global _MATRICES
+    _MATRICES = matrices
+
+
+def _calculateBlock(args):
+    '''apply counter to a block of pairs.'''
+    counter, first, second = args
+    return counter(tuple([m[first] for m in _MATRICES]),
+                   tuple([m[second] for m in _MATRICES]))
+
+
+def iteratePairBlocks(pairs, block_size):
+    '''iterate over *pairs* in blocks of *block_size*.
+
+    Yields tuples of arrays with the first and second row indices.
+    '''
+    pairs = numpy.asarray(pairs, dtype=numpy.int64).reshape(-1, 2)
+    for start in range(0, len(pairs), block_size):
+        block = pairs[start:start + block_size]
+        yield block[:, 0], block[:, 1]
+
+
+def calculatePairs(counter, matrices, pairs,
+                   block_size=None,
+                   num_threads=1):
+    '''apply *counter* to *pairs* of rows in *matrices*.
+
+    *matrices* is a tuple of matrices with one row per sequence.
+    *counter* is called with two tuples containing the rows of the
+    first and second members of a block of pairs and returns one
+    result per pair.
+
+    Pairs are processed in blocks of *block_size* pairs. By default,
+    the size is chosen such that a block covers about
+    :data:`BLOCK_CELLS` cells. If *num_threads* is larger than 1,
+    blocks are processed by a pool of worker processes.
+
+    Returns the results for all pairs as an array.
+    '''
+
+    if block_size is None:
+        ncolumns = max(1, sum([m.shape[1] for m in matrices]))
+        block_size = max(1, BLOCK_CELLS // ncolumns)
+
+    args = [(counter, first, second) for first, second in
+            iteratePairBlocks(pairs, block_size)]
+
+    if len(args) == 0:
+        return counter(tuple([m[:0] for m in matrices]),
+                       tuple([m[:0] for m in matrices]))
+
+    if num_threads > 1:
+        pool = multiprocessing.Pool(num_threads,
+                                    initializer=_setMatrices,
+                                    initargs=(matrices,))
+        result = list(pool.imap(_calculateBlock, args))
+        pool.close()
+        pool.join()
+    else:
+        _setMatrices(matrices)
+        result = list(itertools.imap(_calculateBlock, args))
+        _setMatrices(None)
+
+    return numpy.concatenate(result)
+
+
+def calculateSequencePairs(counter, encoder, sequences, pairs,
+                           block_size=None,
+                           num_threads=1):
+    '''apply *counter* to *pairs* of *sequences*.
+
+    Sequences need only be of equal length within a pair. Pairs are
+    grouped by length and the sequences in each group are encoded
+    with *encoder*, a function returning a tuple of matrices, see
+    :func:`calculatePairs`.
+
+    Returns the results for all pairs as an array in the order of
+    *pairs*.
+    '''
+
+    groups = {}
+    for index, pair in enumerate(pairs):
+        x, y = pair
+        if len(sequences[x]) != len(sequences[y]):
+            raise ValueError("sequences %i and %i of unequal length" %
+                             (x, y))
+        groups.setdefault(len(sequences[x]), []).append(index)
+
+    if len(groups) == 0:
+        return calculatePairs(counter, encoder([]), [])
+
+    result = None
+    for length, indices in sorted(groups.items()):
+        rows = sorted(set([x for index in indices for x in pairs[index]]))
+        map_row2local = dict([(x, y) for y, x in enumerate(rows)])
+        local = [(map_row2local[pairs[index][0]],
+                  map_row2local[pairs[index][1]])
+                 for index in indices]
+        counts = calculatePairs(counter,
+                                encoder([sequences[x] for x in rows]),
+                                local,
+                                block_size=block_size,
+                                num_threads=num_threads)
+        if result is None:
+            result = numpy.zeros((len(pairs),) + counts.shape[1:],
+                                 dtype=counts.dtype)
+        result[indices] = counts
+
+    return result
+
+
+def getPairIndices(matrices):
+    '''return counts from substitution *matrices*.
+
+    Returns a dictionary of arrays with the number of aligned,
+    identical, different, transitions, transversions, unaligned1 and
+    unaligned2 positions per pair, see
+    :func:`Genomics.CalculatePairIndices`.
+    '''
+    acgt = matrices[:, :NA_GAP, :NA_GAP]
+    result = {}
+    result["aligned"] = acgt.sum(axis=2).sum(axis=1)
+    result["identical"] = numpy.trace(acgt, axis1=1, axis2=2)
+    result["different"] = result["aligned"] - result["identical"]
+    result["transitions"] = sum([matrices[:, x, y] for x, y in TRANSITIONS])
+    result["transversions"] = sum(
+        [matrices[:, x, y] for x, y in TRANSVERSIONS])
+    result["unaligned1"] = matrices[:, :NA_GAP, NA_GAP].sum(axis=1)
+    result["unaligned2"] = matrices[:, NA_GAP, :NA_GAP].sum(axis=1)
+    return result
+
+
+def buildPairInfo(matrix, synonymous=None):
+    '''return a :class:`Genomics.SequencePairInfo` for a single
+    substitution *matrix*.
+
+    If *synonymous* is given as a tuple of synonymous and
+    non-synonymous changes, a :class:`Genomics.SequencePairInfoCodons`
+    is returned.
+    '''
+    if synonymous is not None:
+        info = Genomics.SequencePairInfoCodons()
+        info.mNSynonymous, info.mNNonSynonymous = synonymous
+    else:
+        info = Genomics.SequencePairInfo()
+
+    indices = getPairIndices(matrix[numpy.newaxis, :, :])
+    info.mMatrix = matrix
+    info.mMapChar2Pos = dict([(c, x) for x, c in
+                              enumerate(NA_ALPHABET + Genomics.GAP_CHAR)])
+    info.mNAligned = indices["aligned"][0]
+    info.mNIdentical = indices["identical"][0]
+    info.mNDifferent = indices["different"][0]
+    info.mNTransitions = indices["transitions"][0]
+    info.mNTransversions = indices["transversions"][0]
+    info.mNUnaligned1 = indices["unaligned1"][0]
+    info.mNUnaligned2 = indices["unaligned2"][0]
+    return info
+
+
+def getGCContent(matrices):
+    '''return G+C content of aligned positions, see
+    :meth:`Genomics.SequencePairInfo.getGCContent`.
+    '''
+    c, g = NA_ALPHABET.index("C"), NA_ALPHABET.index("G")
+    aligned = matrices[:, :NA_GAP, :NA_GAP].sum(axis=2).sum(axis=1)
+    gc = matrices[:, :NA_GAP, c].sum(axis=1) + \
+        matrices[:, :NA_GAP, g].sum(axis=1) + \
+        matrices[:, c, :NA_GAP].sum(axis=1) + \
+        matrices[:, g, :NA_GAP].sum(axis=1) - \
+        matrices[:, c, c] - matrices[:, g, g] - \
+        matrices[:, c, g] - matrices[:, g, c]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return gc / 2.0 / aligned
+
+
+def _undefined(distance, variance, mask):
+    '''set *distance* and *variance* to nan where *mask* is set.'''
+    mask = mask | ~numpy.isfinite(distance)
+    distance[mask] = numpy.nan
+    variance[mask] = numpy.nan
+    return distance, variance
+
+
+def calculateJC69(matrices):
+    '''return Jukes-Cantor distances and variances.'''
+    indices = getPairIndices(matrices)
+    n = indices["aligned"].astype(float)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        p = indices["different"] / n
+        a = 1.0 - 4.0 * p / 3.0
+        distance = -0.75 * numpy.log(a)
+        variance = p * (1.0 - p) / (a * a * n)
+        return _undefined(distance, variance, a <= 0)
+
+
+def calculateT92(matrices):
+    '''return Tamura (1992) distances and variances.
+
+    Distances are undefined if the G+C content is 0 or 1 or if there
+    are too many transversions.
+    '''
+    indices = getPairIndices(matrices)
+    n = indices["aligned"].astype(float)
+    gc = getGCContent(matrices)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        wg = 2.0 * gc * (1.0 - gc)
+        P = indices["transitions"] / n
+        Q = indices["transversions"] / n
+        a1 = 1.0 - P / wg - Q
+        a2 = 1.0 - 2.0 * Q
+        distance = -wg * numpy.log(a1) - 0.5 * (1.0 - wg) * numpy.log(a2)
+        c1 = 1.0 / a1
+        c2 = 1.0 / a2
+        c3 = wg * (c1 - c2) + c2
+        variance = (c1 * c1 * P + c3 * c3 * Q -
+                    (c1 * P + c3 * Q) ** 2) / n
+        return _undefined(distance, variance,
+                          (gc == 0) | (gc == 1) | (a1 <= 0) | (a2 <= 0))
+
+
+def calculateK80(matrices):
+    '''return Kimura (1980) distances and variances.'''
+    indices = getPairIndices(matrices)
+    n = indices["aligned"].astype(float)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        P = indices["transitions"] / n
+        Q = indices["transversions"] / n
+        a1 = 1.0 - 2.0 * P - Q
+        a2 = 1.0 - 2.0 * Q
+        distance = -0.5 * numpy.log(a1) - 0.25 * numpy.log(a2)
+        c1 = 1.0 / a1
+        c3 = (c1 + 1.0 / a2) / 2.0
+        variance = (c1 * c1 * P + c3 * c3 * Q -
+                    (c1 * P + c3 * Q) ** 2) / n
+        return _undefined(distance, variance, (a1 <= 0) | (a2 <= 0))
+
+
+def calculateTN93(matrices):
+    '''return Tamura and Nei (1993) distances and variances.
+
+    Nucleotide frequencies are estimated from the aligned positions
+    of both sequences in a pair.
+    '''
+    a, c, g, t = [NA_ALPHABET.index(x) for x in "ACGT"]
+    acgt = matrices[:, :NA_GAP, :NA_GAP].astype(float)
+    n = acgt.sum(axis=2).sum(axis=1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        freqs = (acgt.sum(axis=1) + acgt.sum(axis=2)) / \
+            (2.0 * n[:, numpy.newaxis])
+        fa, fc, fg, ft = freqs[:, a], freqs[:, c], freqs[:, g], freqs[:, t]
+        fr, fy = fa + fg, fc + ft
+        P1 = (acgt[:, a, g] + acgt[:, g, a]) / n
+        P2 = (acgt[:, c, t] + acgt[:, t, c]) / n
+        Q = sum([acgt[:, x, y] for x, y in TRANSVERSIONS]) / n
+        k1 = 2.0 * fa * fg / fr
+        k2 = 2.0 * fc * ft / fy
+        k3 = 2.0 * (fr * fy - fa * fg * fy / fr - fc * ft * fr / fy)
+        w1 = 1.0 - P1 / k1 - Q / (2.0 * fr)
+        w2 = 1.0 - P2 / k2 - Q / (2.0 * fy)
+        w3 = 1.0 - Q / (2.0 * fr * fy)
+        distance = - k1 * numpy.log(w1) - k2 * numpy.log(w2) - \
+            k3 * numpy.log(w3)
+        c1 = 1.0 / w1
+        c2 = 1.0 / w2
+        c4 = k1 * c1 / (2.0 * fr) + k2 * c2 / (2.0 * fy) + \
+            k3 / (w3 * 2.0 * fr * fy)
+        variance = (c1 * c1 * P1 + c2 * c2 * P2 + c4 * c4 * Q -
+                    (c1 * P1 + c2 * P2 + c4 * Q) ** 2) / n
+        return _undefined(distance, variance,
+                          (w1 <= 0) | (w2 <= 0) | (w3 <= 0) |
+                          (freqs <= 0).any(axis=1))
+
+
+def calculateLogDet(matrices):
+    '''return LogDet distances.
+
+    The distance is computed as
+    -1/4 (ln det F - 1/2 (ln det Px + ln det Py)) with F the
+    divergence matrix and Px and Py the diagonal matrices of
+    nucleotide frequencies (Lockhart et al. (1994), Mol Biol Evol
+    11:605-612). Variances are not computed and set to 0.
+    '''
+    acgt = matrices[:, :NA_GAP, :NA_GAP].astype(float)
+    n = acgt.sum(axis=2).sum(axis=1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        F = acgt / n[:, numpy.newaxis, numpy.newaxis]
+        fx = F.sum(axis=2)
+        fy = F.sum(axis=1)
+        if len(F):
+            det = numpy.linalg.det(F)
+        else:
+            det = numpy.zeros(0)
+        distance = -0.25 * (numpy.log(det) -
+                            0.5 * (numpy.log(fx).sum(axis=1) +
+                                   numpy.log(fy).sum(axis=1)))
+        variance = numpy.zeros(len(distance))
+        return _undefined(distance, variance,
+                          (det <= 0) | (fx <= 0).any(axis=1) |
+                          (fy <= 0).any(axis=1))
+
+
+def calculatePID(counts):
+    '''return percent identities from :func:`countIdentities`.'''
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        distance = 100.0 * counts[:, 1] / counts[:, 0]
+    return distance, numpy.zeros(len(distance))
+
+
+def calculatePOVL(counts):
+    '''return percent overlap from :func:`countIdentities`.'''
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        distance = 100.0 * counts[:, 0] / (counts[:, 0] + counts[:, 2])
+    return distance, numpy.zeros(len(distance))
+
+
+NA_DISTANCES = {
+    "JC69": calculateJC69,
+    "T92": calculateT92,
+    "K80": calculateK80,
+    "TN93": calculateTN93,
+    "LogDet": calculateLogDet,
+}
+
+
+def calculateDistances(matrices, method):
+    '''return distances and variances for substitution *matrices*
+    with *method*, see :data:`NA_DISTANCES`.
+    '''
+    try:
+        f = NA_DISTANCES[method]
+    except KeyError:
+        raise ValueError("unknown distance method %s" % method)
+    return f(matrices)
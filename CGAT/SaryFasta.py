@@ -43,6 +43,8 @@ import gzip
 import subprocess
 import glob
 import random
+import itertools
+from CGAT import SuffixArray as SuffixArray
 
 # ------------------------------------------------------------
 
@@ -73,10 +75,22 @@ def getHID(sequence):
 # ------------------------------------------------------------
 
 
+def iterateDatabase(index_name, filenames):
+    """iterate over (identifier, sequence) tuples in the
+    sequence chunks of a database."""
+
+    identifiers = (line[:-1].split("\t")[1] for line in open(index_name))
+    for filename in filenames:
+        for line in open(filename):
+            yield identifiers.next(), line[:-1]
+
+
 def createDatabase(db, filenames,
                    buf_size=400000000,
                    force=False,
-                   regex_identifier=None):
+                   regex_identifier=None,
+                   method="sary",
+                   num_threads=1):
     """index files in filenames to create database.
 
     buf_size: buffer size for a sary chunk.
@@ -85,6 +99,13 @@ def createDatabase(db, filenames,
 
     regex_identifier: pattern to extract identifier from description line.
     If None, the part until the first white-space character is used.
+
+    method: ``sary`` builds indices with mksary, ``native``
+    builds a :class:`SuffixArray.SuffixArrayIndex` using
+    num_threads processes. buf_size is the part size of the
+    native index. Each process needs about 35 bytes of memory
+    per residue of a part, see
+    :func:`SuffixArray.createSuffixArrayIndex`.
     """
 
     index_name = db + ".idx"
@@ -177,6 +198,17 @@ def createDatabase(db, filenames,
 
         infile.close()
 
+    outfile_src.close()
+    outfile_index.close()
+
+    if method == "native":
+        SuffixArray.createSuffixArrayIndex(
+            db + ".sai",
+            iterateDatabase(index_name, files_to_index),
+            part_size=buf_size,
+            num_threads=num_threads)
+        return
+
     # build indicies
     for filename in files_to_index:
 
@@ -207,6 +239,13 @@ class SaryFasta:
 
         self.mDbname = dbname
         self.mIsLoaded = False
+
+        # use native index if present
+        self.mNativeIndex = None
+        if os.path.exists(dbname + ".sai"):
+            self.mNativeIndex = SuffixArray.SuffixArrayIndex(dbname + ".sai")
+            return
+
         self.mFilenames = map(
             lambda x: x[:-4], glob.glob(self.mNameData + "/part*.ary"))
 
@@ -238,6 +277,9 @@ class SaryFasta:
         """search indices with a pattern.
         """
 
+        if self.mNativeIndex:
+            return self.searchBatch([pattern])[0]
+
         if not self.mIsLoaded:
             self.__loadIndex()
 
@@ -255,6 +297,22 @@ class SaryFasta:
 
         return result
 
+    def searchBatch(self, patterns):
+        """search indices with a list of patterns.
+
+        Returns a list of identifiers for each pattern.
+        """
+
+        if not self.mNativeIndex:
+            return [self.search(pattern) for pattern in patterns]
+
+        result = []
+        for matches in self.mNativeIndex.locate(patterns):
+            # report each sequence once in sequence order
+            result.append([x[0] for x in itertools.groupby(
+                [name for name, strand, pos in matches])])
+        return result
+
 # Test function for benchmarking purposes
 
 
@@ -43,12 +43,87 @@ import math
 import hashlib
 import base64
 import itertools
+import numpy
 
 from CGAT import Genomics as Genomics
 
 import Bio.Alphabet.IUPAC
 
 ###########################################################################
+# Counting core. Sequences are counted as arrays of bytes. Nucleotides
+# are encoded as 0-3 (ACGT), all other characters as 4.
+
+NA_ALPHABET = "ACGT"
+
+NA_CODES = numpy.zeros(256, dtype=numpy.int64) + len(NA_ALPHABET)
+for code, char in enumerate(NA_ALPHABET):
+    NA_CODES[ord(char)] = code
+
+
+def encodeSequence(sequence):
+    """return *sequence* as an array of bytes."""
+    return numpy.frombuffer(sequence, dtype=numpy.uint8)
+
+
+def countCharacters(sequence):
+    """return counts of each character in *sequence*.
+
+    Returns an array of size 256 indexed by character code.
+    """
+    return numpy.bincount(encodeSequence(sequence), minlength=256)
+
+
+def countDinucleotides(sequence):
+    """return counts of overlapping dinucleotides in *sequence*.
+
+    Returns a 5x5 array indexed by encoded nucleotides. Index 4
+    collects characters other than ACGT.
+    """
+    codes = NA_CODES[encodeSequence(sequence)]
+    n = len(NA_ALPHABET) + 1
+    return numpy.bincount(codes[:-1] * n + codes[1:],
+                          minlength=n * n).reshape(n, n)
+
+
+def countCodons(sequence):
+    """return counts of codons in frame 1 of *sequence*.
+
+    Returns a 5x5x5 array indexed by encoded nucleotides. Index 4
+    collects characters other than ACGT.
+    """
+    codes = NA_CODES[encodeSequence(sequence)]
+    codes = codes[:len(codes) - len(codes) % 3].reshape(-1, 3)
+    n = len(NA_ALPHABET) + 1
+    return numpy.bincount(codes[:, 0] * n * n + codes[:, 1] * n + codes[:, 2],
+                          minlength=n * n * n).reshape(n, n, n)
+
+
+def countDistinctCodons(sequence):
+    """return a dictionary with counts of all distinct codons in
+    frame 1 of *sequence*.
+    """
+    ncodons = len(sequence) // 3
+    if ncodons == 0:
+        return {}
+    codons = encodeSequence(sequence)[:ncodons * 3].view("S3")
+    keys, counts = numpy.unique(codons, return_counts=True)
+    return dict(zip(keys, [int(x) for x in counts]))
+
+
+def countSenseCodons(sequence):
+    """return a dictionary with counts of sense codons in frame 1
+    of *sequence*.
+
+    The result is the same as :func:`Genomics.CountCodons`.
+    """
+    counts = countCodons(sequence)
+    result = {}
+    for codon in Genomics.GeneticCodeAA.keys():
+        a, b, c = [NA_CODES[ord(x)] for x in codon]
+        result[codon] = int(counts[a, b, c])
+    return result
+
+###########################################################################
 
 
 class SequenceProperties(object):
@@ -225,19 +300,14 @@ class SequencePropertiesNA(SequenceProperties):
         """load sequence properties from a sequence."""
         SequenceProperties.loadSequence(self, sequence, seqtype)
         # counts of nucleotides
+        counts = countCharacters(sequence.upper())
         self.mCountsNA = {}
         for x in self.mAlphabet:
-            self.mCountsNA[x] = 0
+            self.mCountsNA[x] = int(counts[ord(x)])
 
-        for na in sequence.upper():
-            if na in ('G', 'C'):
-                self.mCountsGC += 1
-            elif na in ('A', 'T'):
-                self.mCountsAT += 1
-            try:
-                self.mCountsNA[na] += 1
-            except KeyError:
-                self.mCountsOthers += 1
+        self.mCountsGC += self.mCountsNA["G"] + self.mCountsNA["C"]
+        self.mCountsAT += self.mCountsNA["A"] + self.mCountsNA["T"]
+        self.mCountsOthers += len(sequence) - sum(self.mCountsNA.values())
 
     def getFields(self):
         fields = SequenceProperties.getFields(self)
@@ -309,14 +379,16 @@ class SequencePropertiesDN(SequenceProperties):
         """load sequence properties from a sequence."""
         SequenceProperties.loadSequence(self, sequence, seqtype)
 
-        # IMS: generator rather than list
-        # to save memory for might be a neater way of doing this.
-        for dinuc in (sequence[x - 2:x]
-                      for x in xrange(2, len(sequence) + 1, 1)):
-            try:
-                self.mCountsDinuc[dinuc] += 1
-            except KeyError:
-                self.mCountsOthers += 1
+        if len(sequence) < 2:
+            return
+
+        counts = countDinucleotides(sequence)
+        total = 0
+        for a, b in itertools.product(self.mAlphabet, repeat=2):
+            c = int(counts[NA_CODES[ord(a)], NA_CODES[ord(b)]])
+            self.mCountsDinuc[a + b] += c
+            total += c
+        self.mCountsOthers += len(sequence) - 1 - total
 
     def getFields(self):
 
@@ -420,32 +492,17 @@ class SequencePropertiesGaps(SequenceProperties):
         """load sequence properties from a sequence."""
         SequenceProperties.loadSequence(self, sequence, seqtype)
 
-        totals = {'A': 0, 'C': 0, 'G': 0, 'T': 0, 'X': 0, 'N': 0}
+        is_gap_char = numpy.zeros(256, dtype=bool)
+        is_gap_char[[ord(x) for x in self.gap_chars]] = True
+        is_gap = is_gap_char[encodeSequence(sequence)]
 
-        gap_chars = self.gap_chars
-        ngaps = 0
-        was_gap = not (sequence[0] in gap_chars)
+        # first position of each region of gaps or sequence
+        is_start = numpy.ones(len(is_gap), dtype=bool)
+        is_start[1:] = is_gap[1:] != is_gap[:-1]
 
-        ngap_regions = 0
-        nseq_regions = 0
-
-        x = 0
-        xx = len(sequence)
-        for x, c in enumerate(sequence):
-
-            is_gap = c in gap_chars
-            if is_gap:
-                ngaps += 1
-                if not was_gap:
-                    ngap_regions += 1
-            else:
-                if was_gap:
-                    nseq_regions += 1
-            was_gap = is_gap
-
-        self.ngaps = ngaps
-        self.ngap_regions = ngap_regions
-        self.nseq_regions = nseq_regions
+        self.ngaps = int(is_gap.sum())
+        self.ngap_regions = int((is_start & is_gap).sum())
+        self.nseq_regions = int((is_start & ~is_gap).sum())
 
     def addProperties(self, other):
         SequenceProperties.addProperties(self, other)
@@ -557,21 +614,21 @@ class SequencePropertiesDegeneracy (SequencePropertiesLength):
                 xx.append(yy)
             self.mCountsDegeneracy.append(xx)
 
-        # use generator rather than list to save memory
-        for codon in (sequence[x:x + 3] for x in xrange(0, len(sequence), 3)):
+        # process each distinct codon once
+        for codon, count in countDistinctCodons(sequence).items():
 
             for x in (0, 1, 2):
-                self.mCounts[x][codon[x]] += 1
+                self.mCounts[x][codon[x]] += count
 
             if Genomics.IsStopCodon(codon):
-                self.mNStopCodons += 1
+                self.mNStopCodons += count
                 continue
 
             try:
                 aa, deg1, deg2, deg3 = Genomics.GetDegeneracy(codon)
                 degrees = (deg1, deg2, deg3)
                 for x in range(len(degrees)):
-                    self.mCountsDegeneracy[x][degrees[x]][codon[x]] += 1
+                    self.mCountsDegeneracy[x][degrees[x]][codon[x]] += count
 
             except KeyError:
                 pass
@@ -729,9 +786,10 @@ class SequencePropertiesAA(SequenceProperties):
         for x in Bio.Alphabet.IUPAC.extended_protein.letters:
             self.mCountsAA[x] = 0
 
-        for codon in (sequence[x:x + 3] for x in xrange(0, len(sequence), 3)):
+        # translate each distinct codon once
+        for codon, count in countDistinctCodons(sequence).items():
             aa = Genomics.MapCodon2AA(codon)
-            self.mCountsAA[aa] += 1
+            self.mCountsAA[aa] += count
 
     def getFields(self):
 
@@ -788,13 +846,11 @@ class SequencePropertiesAminoAcids(SequenceProperties):
             self.mCountsAA[x] = 0
         self.mOtherCounts = 0
 
-        for aa in sequence:
-            if aa == "-":
-                continue
-            try:
-                self.mCountsAA[aa] += 1
-            except KeyError:
-                self.mOtherCounts += 1
+        counts = countCharacters(sequence)
+        for x in Bio.Alphabet.IUPAC.extended_protein.letters:
+            self.mCountsAA[x] = int(counts[ord(x)])
+        self.mOtherCounts = len(sequence) - int(counts[ord("-")]) - \
+            sum(self.mCountsAA.values())
 
     def getFields(self):
 
@@ -863,7 +919,7 @@ class SequencePropertiesCodons(SequencePropertiesLength):
         SequencePropertiesLength.loadSequence(self, sequence, seqtype)
 
         # uppercase all letters and count codons
-        self.mCodonCounts = Genomics.CountCodons(sequence.upper())
+        self.mCodonCounts = countSenseCodons(sequence.upper())
 
     def getFields(self):
 
@@ -1106,11 +1162,10 @@ class SequencePropertiesCounts(SequenceProperties):
             self.mCounts[x] = 0
         self.mCountsOthers = 0
 
-        for na in sequence.upper():
-            try:
-                self.mCounts[na] += 1
-            except KeyError:
-                self.mCountsOthers += 1
+        counts = countCharacters(sequence.upper())
+        for x in self.mAlphabet:
+            self.mCounts[x] = int(counts[ord(x)])
+        self.mCountsOthers = len(sequence) - sum(self.mCounts.values())
 
     def getFields(self):
         fields = SequenceProperties.getFields(self)
@@ -556,11 +556,7 @@ def smoothPValues(pvalues,
 
     m = len(pvalues)
 
-    pi0 = numpy.zeros(len(vlambda), numpy.float)
-
-    for i in range(len(vlambda)):
-        pi0[i] = numpy.mean([x >= vlambda[i]
-                            for x in pvalues]) / (1.0 - vlambda[i])
+    pi0 = estimatePi0s(pvalues, vlambda)
 
     R.assign("pi0", pi0)
     R.assign("vlambda", vlambda)
@@ -607,17 +603,13 @@ def getPi0(pvalues,
         if vlambda < 0 or vlambda >= 1:
             raise ValueError("vlambda must be within [0, 1).")
 
-        pi0 = numpy.mean([x >= vlambda for x in pvalues]) / (1.0 - vlambda)
+        pi0 = estimatePi0s(pvalues, (vlambda,))[0]
         pi0 = min(pi0, 1.0)
         R.assign("pi0", pi0)
 
     else:
 
-        pi0 = numpy.zeros(len(vlambda), numpy.float)
-
-        for i in range(len(vlambda)):
-            pi0[i] = numpy.mean([x >= vlambda[i]
-                                for x in pvalues]) / (1.0 - vlambda[i])
+        pi0 = estimatePi0s(pvalues, vlambda)
 
         R.assign("pi0", pi0)
         R.assign("vlambda", vlambda)
@@ -671,6 +663,54 @@ def getPi0(pvalues,
     return pi0
 
 
+def estimatePi0s(pvalues, vlambda):
+    '''return estimates of the proportion of true null
+    hypotheses for each threshold in *vlambda*.
+
+    The estimate is the proportion of *pvalues* that are at least
+    lambda divided by 1 - lambda.
+
+    Raises ValueError if *pvalues* contain NaN.
+    '''
+    pvalues = numpy.sort(numpy.asarray(pvalues, dtype=numpy.float))
+    if numpy.isnan(pvalues).any():
+        raise ValueError("p-values contain NaN")
+    vlambda = numpy.asarray(vlambda, dtype=numpy.float)
+    m = len(pvalues)
+    nlarger = m - numpy.searchsorted(pvalues, vlambda, side="left")
+    return nlarger / float(m) / (1.0 - vlambda)
+
+
+def computeQValues(pvalues, pi0, robust=False):
+    '''compute q-values from *pvalues* given an estimate of
+    the proportion of true null hypotheses *pi0*.
+
+    This is the q-value computation of Storey et al. (2002)
+    as in the qvalue package. With *pi0* = 1, the result
+    corresponds to the method by Benjamini and Hochberg (1995).
+
+    returns a numpy array of q-values.
+    '''
+    pvalues = numpy.asarray(pvalues, dtype=numpy.float)
+    m = len(pvalues)
+    if m == 0:
+        return numpy.zeros(0, dtype=numpy.float)
+
+    # v[i] = number of observations less than or equal to pvalue[i]
+    v = numpy.searchsorted(numpy.sort(pvalues), pvalues, side="right")
+
+    qvalues = pi0 * m * pvalues / v
+    if robust:
+        qvalues = pi0 * m * pvalues / (v * (1.0 - (1.0 - pvalues) ** m))
+
+    # bound qvalues by 1 and make them monotonic
+    idx = numpy.argsort(pvalues, kind="mergesort")
+    qvalues[idx] = numpy.minimum.accumulate(
+        numpy.minimum(qvalues[idx], 1.0)[::-1])[::-1]
+
+    return qvalues
+
+
 class FDRResult:
 
     def __init__(self):
@@ -740,15 +780,11 @@ http://genomics.princeton.edu/storeylab/qvalue/linux.html.
         if vlambda < 0 or vlambda >= 1:
             raise ValueError("vlambda must be within [0, 1).")
 
-        pi0 = numpy.mean([x >= vlambda for x in pvalues]) / (1.0 - vlambda)
+        pi0 = estimatePi0s(pvalues, (vlambda,))[0]
         pi0 = min(pi0, 1.0)
         R.assign("pi0", pi0)
     else:
-        pi0 = numpy.zeros(len(vlambda), numpy.float)
-
-        for i in range(len(vlambda)):
-            pi0[i] = numpy.mean([x >= vlambda[i]
-                                for x in pvalues]) / (1.0 - vlambda[i])
+        pi0 = estimatePi0s(pvalues, vlambda)
 
         R.assign("pi0", pi0)
         R.assign("vlambda", vlambda)
@@ -812,49 +848,9 @@ http://genomics.princeton.edu/storeylab/qvalue/linux.html.
     if fdr_level is not None and (fdr_level <= 0 or fdr_level > 1):
         raise ValueError("'fdr_level' must be within (0, 1].")
 
-    # The estimated q-values calculated here
-    # u = numpy.argsort( p )
-
-    # change by Alan
-    # ranking function which returns number of observations less than or equal
-    ro.globalenv['pvalues'] = ro.FloatVector(pvalues)
-    R.assign("robust", robust)
-    qvalues = R("""u <- order(pvalues)
-    qvalues.rank <- function(x)
-{
-      idx <- sort.list(x)
-
-      fc <- factor(x)
-      nl <- length(levels(fc))
-      bin <- as.integer(fc)
-      tbl <- tabulate(bin)
-      cs <- cumsum(tbl)
-
-      tbl <- rep(cs, tbl)
-      tbl[idx] <- tbl
-
-      return(tbl)
-}
-
-v <- qvalues.rank(pvalues)
-m <- length(pvalues)
-qvalues <- pi0 * m * pvalues / v
-
-if(robust)
-{
-        qvalues <- pi0*m*pvalues/(v*(1-(1-pvalues)^m))
-}
-qvalues[u[m]] <- min(qvalues[u[m]],1)
-
-rqvalues <- qvalues
-for(i in (m-1):1)
-{
-   qvalues[u[i]] <- min(qvalues[u[i]],qvalues[u[i+1]],1)
-}
-
-
-qvalues
-""")
+    # The estimated q-values calculated here, returned
+    # as an R vector as before.
+    qvalues = ro.FloatVector(computeQValues(pvalues, pi0, robust=robust))
 
     result = FDRResult()
     result.mQValues = qvalues
@@ -916,15 +912,11 @@ def doFDRPython(pvalues,
             if vlambda < 0 or vlambda >= 1:
                 raise ValueError("vlambda must be within [0, 1).")
 
-            pi0 = numpy.mean([x >= vlambda for x in pvalues]) / (1.0 - vlambda)
+            pi0 = estimatePi0s(pvalues, (vlambda,))[0]
             pi0 = min(pi0, 1.0)
         else:
 
-            pi0 = numpy.zeros(len(vlambda), numpy.float)
-
-            for i in range(len(vlambda)):
-                pi0[i] = numpy.mean([x >= vlambda[i]
-                                    for x in pvalues]) / (1.0 - vlambda[i])
+            pi0 = estimatePi0s(pvalues, vlambda)
 
             if pi0_method == "smoother":
 
@@ -981,31 +973,7 @@ def doFDRPython(pvalues,
     if fdr_level is not None and (fdr_level <= 0 or fdr_level > 1):
         raise ValueError("'fdr_level' must be within (0, 1].")
 
-    # compute qvalues
-    idx = numpy.argsort(pvalues)
-    # monotonically decreasing bins, so that bins[i-1] > x >=  bins[i]
-    bins = numpy.unique(pvalues)[::-1]
-
-    # v[i] = number of observations less than or equal to pvalue[i]
-    # could this be done more elegantly?
-    val2bin = len(bins) - numpy.digitize(pvalues, bins)
-    v = numpy.zeros(m, dtype=numpy.int)
-    lastbin = None
-    for x in xrange(m - 1, -1, -1):
-        bin = val2bin[idx[x]]
-        if bin != lastbin:
-            c = x
-        v[idx[x]] = c + 1
-        lastbin = bin
-
-    qvalues = pvalues * pi0 * m / v
-    if robust:
-        qvalues /= (1.0 - (1.0 - pvalues) ** m)
-
-    # bound qvalues by 1 and make them monotonic
-    qvalues[idx[m - 1]] = min(qvalues[idx[m - 1]], 1.0)
-    for i in xrange(m - 2, -1, -1):
-        qvalues[idx[i]] = min(min(qvalues[idx[i]], qvalues[idx[i + 1]]), 1.0)
+    qvalues = computeQValues(pvalues, pi0, robust=robust)
 
     result = FDRResult()
     result.mQValues = qvalues
@@ -1249,6 +1217,97 @@ def doWelchsTTest(n1, mean1, std1,
 
     return result
 
+
+def doWelchsTTests(values1, values2, alpha=0.05):
+    '''Welch''s approximate t-test for many tests at once.
+
+    *values1* and *values2* are matrices with one row per test
+    and one column per observation. NaN values are ignored.
+
+    This is the vectorised version of :func:`doWelchsTTest`.
+    Results are NaN for tests in which the standard deviations
+    in both samples are 0 or which have fewer than two observations
+    in a sample.
+
+    returns a WelchTTest with arrays as attributes.
+    '''
+    values1 = numpy.asarray(values1, dtype=numpy.float)
+    values2 = numpy.asarray(values2, dtype=numpy.float)
+
+    n1 = numpy.sum(~numpy.isnan(values1), axis=1).astype(numpy.float)
+    n2 = numpy.sum(~numpy.isnan(values2), axis=1).astype(numpy.float)
+    mean1, mean2 = numpy.nanmean(values1, axis=1), \
+        numpy.nanmean(values2, axis=1)
+    std1, std2 = numpy.nanstd(values1, axis=1), \
+        numpy.nanstd(values2, axis=1)
+
+    invalid = ((std1 == 0) & (std2 == 0)) | (n1 < 2) | (n2 < 2)
+    # avoid division by zero warnings for invalid tests
+    n1[invalid] = 2
+    n2[invalid] = 2
+    std1[invalid] = 1.0
+
+    # convert standard deviation to sample variance
+    svar1 = std1 ** 2 * n1 / (n1 - 1)
+    svar2 = std2 ** 2 * n2 / (n2 - 1)
+
+    # compute df and test statistic
+    df = ((svar1 / n1 + svar2 / n2) ** 2) / \
+        (((svar1 / n1) ** 2) / (n1 - 1) + ((svar2 / n2) ** 2) / (n2 - 1))
+    denom = numpy.sqrt(svar1 / n1 + svar2 / n2)
+    z = abs(mean1 - mean2) / denom
+
+    result = WelchTTest()
+    result.mPValue = 2 * scipy.stats.t.sf(z, df)
+    result.mDegreesFreedom = df
+    result.mZ = z
+    result.mMean1 = mean1
+    result.mMean2 = mean2
+    result.mSampleVariance1 = svar1
+    result.mSampleVariance2 = svar2
+    result.mDifference = mean1 - mean2
+    result.mZLower = scipy.stats.t.ppf(alpha, df)
+    result.mZUpper = scipy.stats.t.ppf(1.0 - alpha, df)
+    result.mDifferenceLower = result.mZLower * denom
+    result.mDifferenceUpper = result.mZUpper * denom
+
+    for key, value in vars(result).items():
+        value[invalid] = numpy.nan
+
+    return result
+
+
+def doPairedTTests(values1, values2):
+    '''perform paired t-tests for many tests at once.
+
+    *values1* and *values2* are matrices of the same shape with
+    one row per test and one column per pair of observations.
+    Pairs with NaN values are ignored.
+
+    This is the vectorised version of :func:`doPairedTTest`.
+    Results are NaN for tests in which the differences have
+    no variance or which have fewer than two pairs.
+
+    returns a PairedTTest tuple of arrays.
+    '''
+    differences = numpy.asarray(values1, dtype=numpy.float) - \
+        numpy.asarray(values2, dtype=numpy.float)
+
+    n = numpy.sum(~numpy.isnan(differences), axis=1).astype(numpy.float)
+    mean = numpy.nanmean(differences, axis=1)
+    invalid = n < 2
+    n[invalid] = 2
+    std = numpy.nanstd(differences, axis=1, ddof=1)
+    invalid |= (std == 0)
+    std[invalid] = 1.0
+
+    statistic = mean / (std / numpy.sqrt(n))
+    pvalue = 2 * scipy.stats.t.sf(numpy.abs(statistic), n - 1)
+    statistic[invalid] = numpy.nan
+    pvalue[invalid] = numpy.nan
+
+    return PairedTTest._make((statistic, pvalue))
+
 ###################################################################
 ###################################################################
 ###################################################################
@@ -1451,6 +1510,75 @@ def doMannWhitneyUTest(xvals, yvals):
     return result
 
 
+MannWhitneyUTest = collections.namedtuple("MannWhitneyUTest",
+                                          "statistic pvalue")
+
+
+def doMannWhitneyUTests(values1, values2):
+    '''apply the Mann-Whitney U test to many tests at once.
+
+    *values1* and *values2* are matrices with one row per test
+    and one column per observation. NaN values are ignored.
+
+    The statistic is the U statistic of *values1*. P-values are
+    two-sided and computed from the normal approximation with
+    correction for ties and continuity. This corresponds to
+    ``wilcox.test(exact=FALSE, correct=TRUE)`` in R. P-values are
+    NaN for tests in which all values are tied.
+
+    returns a MannWhitneyUTest tuple of arrays.
+    '''
+    values1 = numpy.asarray(values1, dtype=numpy.float)
+    values2 = numpy.asarray(values2, dtype=numpy.float)
+    values = numpy.concatenate((values1, values2), axis=1)
+    nrows, ncols = values.shape
+    rows = numpy.arange(nrows)[:, numpy.newaxis]
+
+    # rank values within each row, NaN values are sorted last
+    # and each NaN is a group of its own.
+    order = numpy.argsort(values, axis=1, kind="mergesort")
+    sorted_values = values[rows, order]
+    is_start = numpy.ones(values.shape, dtype=numpy.bool)
+    is_start[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    is_start = is_start.ravel()
+
+    starts = numpy.flatnonzero(is_start)
+    sizes = numpy.diff(numpy.append(starts, is_start.size))
+    # average rank of a group of tied values
+    group_ranks = starts % ncols + (sizes + 1) / 2.0
+    ranks = numpy.empty(values.shape, dtype=numpy.float)
+    ranks[rows, order] = group_ranks[
+        numpy.cumsum(is_start) - 1].reshape(values.shape)
+
+    valid = ~numpy.isnan(values)
+    ncols1 = values1.shape[1]
+    n1 = valid[:, :ncols1].sum(axis=1).astype(numpy.float)
+    n2 = valid[:, ncols1:].sum(axis=1).astype(numpy.float)
+    n = n1 + n2
+
+    statistic = numpy.where(valid[:, :ncols1],
+                            ranks[:, :ncols1],
+                            0).sum(axis=1) - n1 * (n1 + 1) / 2.0
+
+    # correction for ties
+    group_valid = ~numpy.isnan(sorted_values.ravel()[starts])
+    ties = numpy.bincount(starts // ncols,
+                          weights=numpy.where(group_valid,
+                                              sizes ** 3 - sizes, 0),
+                          minlength=nrows)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        sigma = numpy.sqrt(n1 * n2 / 12.0 *
+                           ((n + 1) - ties / (n * (n - 1))))
+        z = statistic - n1 * n2 / 2.0
+        z = (z - numpy.sign(z) * 0.5) / sigma
+        pvalue = numpy.minimum(2 * scipy.stats.norm.sf(numpy.abs(z)), 1.0)
+
+    pvalue[~(sigma > 0)] = numpy.nan
+
+    return MannWhitneyUTest._make((statistic, pvalue))
+
+
 ###################################################################
 ###################################################################
 ###################################################################
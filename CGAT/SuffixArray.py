@@ -29,6 +29,23 @@ SuffixArray.py - sarry frontend
 :Date: |today|
 :Tags: Python
 
+This module provides :func:`Search` to search suffix arrays built
+with the ``sary`` tool suite and a native suffix array index
+(:class:`SuffixArrayIndex`) that is searched in-process.
+
+The native index is created from an :class:`IndexedFasta.IndexedFasta`
+database or any other collection of sequences with
+:func:`createSuffixArrayIndex`. Sequences are grouped into parts,
+the suffix arrays of parts are built in parallel and stored on
+disk. Parts are memory-mapped when the index is loaded::
+
+   fasta = IndexedFasta.IndexedFasta("hg19")
+   index = createSuffixArrayIndex("hg19.sai",
+                                  iterateIndexedFasta(fasta),
+                                  num_threads=4)
+   counts = index.count(["ACGTACGT", "GATTACA"],
+                        reverse_complement=True)
+
 Code
 ----
 
@@ -37,9 +54,21 @@ Code
 import os
 import string
 import sys
+import time
+import multiprocessing
+import numpy
 
 ParamExecutableLookup = "sary"
 
+# byte separating sequences within a part
+SEPARATOR = 0
+
+# largest text for which the sort keys of :func:`buildSuffixArray`
+# fit into 64 bits
+MAX_PART_SIZE = 3037000498
+
+COMPLEMENT = string.maketrans("ACGTacgt", "TGCAtgca")
+
 
 def Search(pattern, suffix_arrays):
 
@@ -50,3 +79,314 @@ def Search(pattern, suffix_arrays):
         matches += map(lambda x: x[:-1], os.popen(statement).readlines())
 
     return matches
+
+
+def buildSuffixArray(text):
+    '''return the suffix array of *text*, a numpy array of bytes.
+
+    The suffix array is computed by prefix doubling. Each round sorts
+    a 64 bit key combining the rank of a suffix with the rank of the
+    suffix k positions downstream. Memory usage peaks at about 35
+    bytes per byte of *text*.
+
+    Raises a ValueError if *text* is longer than
+    :data:`MAX_PART_SIZE`, as the keys would overflow.
+    '''
+    ntext = len(text)
+    if ntext == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    if ntext > MAX_PART_SIZE:
+        raise ValueError(
+            "text of length %i exceeds maximum part size %i" %
+            (ntext, MAX_PART_SIZE))
+
+    # ranks are smaller than multiplier
+    multiplier = max(ntext, 256) + 1
+    rank = numpy.array(text, dtype=numpy.int64)
+    k = 1
+    while 1:
+        # rank of suffix k positions downstream plus one, 0 past the end
+        key = rank * multiplier
+        key[:ntext - k] += rank[k:] + 1
+        sa = numpy.argsort(key)
+        key = key[sa]
+        rank[sa[0]] = 0
+        rank[sa[1:]] = numpy.cumsum(key[1:] != key[:-1])
+        del key
+        if rank[sa[-1]] == ntext - 1 or k >= ntext:
+            break
+        k *= 2
+
+    return sa
+
+
+def _buildPart(args):
+    '''build and save the suffix array for a part.
+
+    This method is called by worker processes.
+    '''
+    filename_text, filename_sa = args
+    text = numpy.fromfile(filename_text, dtype=numpy.uint8)
+    sa = buildSuffixArray(text)
+    if len(text) < 2 ** 31:
+        sa = sa.astype(numpy.int32)
+    numpy.save(filename_sa, sa)
+    return len(text)
+
+
+def iterateIndexedFasta(fasta):
+    '''iterate over (contig, sequence) tuples in an
+    :class:`IndexedFasta.IndexedFasta` database.'''
+
+    for contig in sorted(fasta.getContigs()):
+        yield contig, fasta.getSequence(contig)
+
+
+def createSuffixArrayIndex(prefix, iterator,
+                           part_size=100000000,
+                           num_threads=1):
+    '''create a native suffix array index at *prefix*.
+
+    *iterator* yields tuples of (name, sequence). Sequences are
+    concatenated into parts of up to *part_size* bytes. Suffix arrays
+    for parts are built using *num_threads* processes.
+
+    Building the suffix array of a part needs about 35 bytes of
+    memory per residue (see :func:`buildSuffixArray`). With the
+    default *part_size* each process needs about 3.5 Gb. Reduce
+    *part_size* or *num_threads* if less memory is available.
+    Neither *part_size* nor any single sequence may exceed
+    :data:`MAX_PART_SIZE`.
+
+    Returns the :class:`SuffixArrayIndex`.
+    '''
+
+    if part_size > MAX_PART_SIZE:
+        raise ValueError("part_size %i exceeds maximum part size %i" %
+                         (part_size, MAX_PART_SIZE))
+
+    outfile_index = open(prefix, "w")
+    outfile_index.write("part\tname\toffset\tlength\n")
+
+    parts = []
+    outfile_part, offset = None, 0
+    for name, sequence in iterator:
+        if outfile_part is None or \
+           (offset > 0 and offset + len(sequence) > part_size):
+            if outfile_part:
+                outfile_part.close()
+            filename_part = "%s.part%i" % (prefix, len(parts))
+            parts.append((filename_part + ".txt", filename_part + ".sa.npy"))
+            outfile_part = open(parts[-1][0], "wb")
+            offset = 0
+
+        outfile_part.write(sequence.upper())
+        outfile_part.write(chr(SEPARATOR))
+        outfile_index.write("%i\t%s\t%i\t%i\n" %
+                            (len(parts) - 1, name, offset, len(sequence)))
+        offset += len(sequence) + 1
+
+    if outfile_part:
+        outfile_part.close()
+    outfile_index.close()
+
+    if num_threads > 1:
+        pool = multiprocessing.Pool(num_threads)
+        pool.map(_buildPart, parts)
+        pool.close()
+        pool.join()
+    else:
+        map(_buildPart, parts)
+
+    return SuffixArrayIndex(prefix)
+
+
+class SuffixArrayIndex:
+
+    '''a native suffix array index.
+
+    Texts and suffix arrays of parts are memory-mapped on first
+    access.
+    '''
+
+    def __init__(self, prefix):
+
+        self.mPrefix = prefix
+        self.mNames = []
+        self.mParts = []
+        offsets = []
+        infile = open(prefix)
+        infile.readline()
+        for line in infile:
+            part, name, offset, length = line[:-1].split("\t")
+            part = int(part)
+            while len(offsets) <= part:
+                offsets.append([])
+                self.mNames.append([])
+            offsets[part].append(int(offset))
+            self.mNames[part].append(name)
+        infile.close()
+
+        self.mOffsets = [numpy.array(x, dtype=numpy.int64) for x in offsets]
+        self.mParts = [None] * len(offsets)
+
+    def getPart(self, part):
+        '''return text and suffix array of *part*.'''
+        if self.mParts[part] is None:
+            filename = "%s.part%i" % (self.mPrefix, part)
+            self.mParts[part] = (
+                numpy.memmap(filename + ".txt", dtype=numpy.uint8, mode="r"),
+                numpy.load(filename + ".sa.npy", mmap_mode="r"))
+        return self.mParts[part]
+
+    def _compare(self, text, sa, positions, patterns, mask):
+        '''compare suffixes at *positions* in the suffix array
+        with *patterns*.
+
+        Returns an array that is negative if the suffix is smaller,
+        0 if the pattern is a prefix of the suffix and positive
+        otherwise.
+        '''
+        ntext = len(text)
+        pos = sa[positions][:, numpy.newaxis].astype(numpy.int64) + \
+            numpy.arange(patterns.shape[1])
+        inside = pos < ntext
+        window = numpy.zeros(pos.shape, dtype=numpy.int16)
+        window[inside] = text[pos[inside]]
+        diff = window - patterns
+        diff[mask] = 0
+        first = (diff != 0).argmax(axis=1)
+        return diff[numpy.arange(len(diff)), first]
+
+    def _searchPart(self, part, patterns, lengths):
+        '''return the range of suffixes in *part* starting with
+        each pattern.'''
+
+        text, sa = self.getPart(part)
+        nsuffixes = len(sa)
+        npatterns = len(patterns)
+        mask = numpy.arange(patterns.shape[1]) >= lengths[:, numpy.newaxis]
+
+        bounds = []
+        for upper in (False, True):
+            lo = numpy.zeros(npatterns, dtype=numpy.int64)
+            hi = numpy.zeros(npatterns, dtype=numpy.int64) + nsuffixes
+            active = lo < hi
+            while active.any():
+                mid = (lo + hi) // 2
+                c = self._compare(text, sa,
+                                  numpy.minimum(mid[active], nsuffixes - 1),
+                                  patterns[active], mask[active])
+                if upper:
+                    smaller = c <= 0
+                else:
+                    smaller = c < 0
+                idx = numpy.nonzero(active)[0]
+                lo[idx[smaller]] = mid[idx[smaller]] + 1
+                hi[idx[~smaller]] = mid[idx[~smaller]]
+                active = lo < hi
+            bounds.append(lo)
+
+        return bounds[0], bounds[1]
+
+    def _encodePatterns(self, patterns, reverse_complement):
+        '''encode *patterns* for searching.
+
+        If *reverse_complement* is set, the reverse complement of
+        each pattern is appended unless the pattern is its own
+        reverse complement.
+
+        Returns a tuple (encoded patterns, lengths, index of the
+        original pattern for each encoded pattern).
+        '''
+        patterns = [x.upper() for x in patterns]
+        origins = range(len(patterns))
+        if reverse_complement:
+            for x in range(len(patterns)):
+                reverse = patterns[x].translate(COMPLEMENT)[::-1]
+                if reverse != patterns[x]:
+                    patterns.append(reverse)
+                    origins.append(x)
+
+        lengths = numpy.array([len(x) for x in patterns], dtype=numpy.int64)
+        if len(patterns) and lengths.min() == 0:
+            raise ValueError("empty pattern")
+        maxlen = max(1, lengths.max()) if len(patterns) else 1
+        encoded = numpy.zeros((len(patterns), maxlen), dtype=numpy.int16)
+        for x, pattern in enumerate(patterns):
+            encoded[x, :len(pattern)] = numpy.fromstring(pattern,
+                                                         dtype=numpy.uint8)
+        return encoded, lengths, numpy.array(origins, dtype=numpy.int64)
+
+    def count(self, patterns, reverse_complement=False):
+        '''return the number of occurances of each pattern.
+
+        If *reverse_complement* is set, occurances on the reverse
+        strand are included. Occurances of patterns that are their
+        own reverse complement (for example ``ACGT``) are the same
+        on both strands and are counted once.
+        '''
+        encoded, lengths, origins = self._encodePatterns(
+            patterns, reverse_complement)
+        if len(encoded) == 0:
+            return []
+        counts = numpy.zeros(len(patterns), dtype=numpy.int64)
+        for part in range(len(self.mParts)):
+            lower, upper = self._searchPart(part, encoded, lengths)
+            numpy.add.at(counts, origins, upper - lower)
+
+        return list(counts)
+
+    def locate(self, patterns, reverse_complement=False):
+        '''return the locations of each pattern.
+
+        Returns a list with a list of (name, strand, position) tuples
+        for each pattern. Positions are forward strand coordinates of
+        the first residue of the match. Matches of patterns that are
+        their own reverse complement are only reported on the
+        forward strand.
+        '''
+        encoded, lengths, origins = self._encodePatterns(
+            patterns, reverse_complement)
+        npatterns = len(patterns)
+        result = [[] for x in patterns]
+        if len(encoded) == 0:
+            return result
+
+        for part in range(len(self.mParts)):
+            text, sa = self.getPart(part)
+            offsets, names = self.mOffsets[part], self.mNames[part]
+            lower, upper = self._searchPart(part, encoded, lengths)
+            for x in numpy.nonzero(upper > lower)[0]:
+                positions = numpy.sort(sa[lower[x]:upper[x]])
+                docs = numpy.searchsorted(offsets, positions, side="right") - 1
+                positions = positions - offsets[docs]
+                if x < npatterns:
+                    strand = "+"
+                else:
+                    strand = "-"
+                result[origins[x]].extend(
+                    [(names[d], strand, p) for d, p in zip(docs, positions)])
+
+        return result
+
+
+def benchmark(index, suffix_arrays, patterns):
+    '''compare the native *index* against searching
+    *suffix_arrays* with sary.
+
+    Returns a list of tuples (method, number of patterns, number of
+    matches, seconds).
+    '''
+
+    result = []
+    t = time.time()
+    nmatches = sum(index.count(patterns))
+    result.append(("native", len(patterns), nmatches, time.time() - t))
+
+    t = time.time()
+    nmatches = sum([len(Search(pattern, suffix_arrays))
+                    for pattern in patterns])
+    result.append(("sary", len(patterns), nmatches, time.time() - t))
+
+    return result
@@ -0,0 +1,185 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+'''
+Taxonomy.py - taxonomic assignments of reads as columns
+=======================================================
+
+:Author: Andreas Heger
+:Release: $Id$
+:Date: |today|
+:Tags: Python
+
+This module stores the taxonomic assignments of many reads
+in a :class:`TaxonomyTable`. There is one column per taxonomic
+level. Each column is an array of integer codes into a list of
+taxa, with -1 denoting reads not assigned at that level::
+
+   table = LCA.readTable(infile)
+   nreads = table.countAssigned()
+   ntaxa = table.countDistinct()
+   taxa, counts = table.getCounts("phylum")
+
+Taxa receive codes in the order they are first encountered.
+Many reads can be added at once with :meth:`TaxonomyTable.addColumns`,
+which interns each column as a whole.
+
+Tables from several samples can be combined into a matrix
+of counts with :func:`buildMatrix`.
+
+'''
+
+import array
+import numpy
+import pandas
+
+
+class TaxonomyTable(object):
+
+    '''taxonomic assignments of reads.
+
+    *levels* are the names of the columns. Values in *missing*
+    denote reads without an assignment.
+    '''
+
+    def __init__(self, levels, missing=("NA",)):
+
+        self.levels = tuple(levels)
+        self.missing = set(missing)
+        self.nreads = 0
+
+        # taxa for each level, indexed by code
+        self.taxa = [[] for x in self.levels]
+        self._map_taxon2code = [{} for x in self.levels]
+        self._codes = [array.array("i") for x in self.levels]
+        self._columns = None
+
+    def add(self, values):
+        '''add a read with taxa *values*, one for each level.'''
+
+        for taxa, mapping, codes, value in zip(self.taxa,
+                                               self._map_taxon2code,
+                                               self._codes,
+                                               values):
+            try:
+                code = mapping[value]
+            except KeyError:
+                if value in self.missing:
+                    code = -1
+                else:
+                    code = len(taxa)
+                    taxa.append(value)
+                mapping[value] = code
+            codes.append(code)
+
+        self.nreads += 1
+        self._columns = None
+
+    def addColumns(self, columns):
+        '''add reads with taxa in *columns*, one sequence of taxa
+        for each level. Cells that are None are missing.'''
+
+        nreads = None
+        for taxa, mapping, codes, values in zip(self.taxa,
+                                                self._map_taxon2code,
+                                                self._codes,
+                                                columns):
+            values = numpy.asarray(values, dtype=object)
+            if nreads is None:
+                nreads = len(values)
+            assert len(values) == nreads, "columns of different length"
+
+            # codes of distinct values in order of appearance. Empty
+            # cells (None) receive the code -1, which is mapped to
+            # the last element of remap.
+            chunk_codes, uniques = pandas.factorize(values)
+            remap = numpy.empty(len(uniques) + 1, dtype=numpy.int32)
+            remap[-1] = -1
+            for x, value in enumerate(uniques):
+                try:
+                    code = mapping[value]
+                except KeyError:
+                    if value in self.missing:
+                        code = -1
+                    else:
+                        code = len(taxa)
+                        taxa.append(value)
+                    mapping[value] = code
+                remap[x] = code
+            codes.fromstring(remap[chunk_codes].tostring())
+
+        if nreads:
+            self.nreads += nreads
+            self._columns = None
+
+    def getColumn(self, level):
+        '''return codes for *level* as a read-only numpy array.
+
+        The array is a copy and is not changed by later calls
+        to :meth:`add`.
+        '''
+        if self._columns is None:
+            self._columns = [
+                numpy.frombuffer(x, dtype=numpy.int32).copy()
+                if len(x) else numpy.zeros(0, dtype=numpy.int32)
+                for x in self._codes]
+            for column in self._columns:
+                column.flags.writeable = False
+        return self._columns[self.levels.index(level)]
+
+    def countAssigned(self):
+        '''return the number of reads assigned at each level.'''
+        return numpy.array([numpy.count_nonzero(self.getColumn(x) >= 0)
+                            for x in self.levels])
+
+    def countDistinct(self):
+        '''return the number of distinct taxa at each level.'''
+        return numpy.array([len(x) for x in self.taxa])
+
+    def getCounts(self, level):
+        '''return taxa and the number of reads assigned to each
+        taxon at *level*.
+        '''
+        codes = self.getColumn(level)
+        taxa = self.taxa[self.levels.index(level)]
+        return taxa, numpy.bincount(codes[codes >= 0], minlength=len(taxa))
+
+
+def buildMatrix(tables, level):
+    '''return taxa and a matrix of read counts at *level* with
+    one row per taxon and one column per table.
+
+    Taxa are sorted alphabetically.
+    '''
+
+    taxa = sorted(set().union(*[x.taxa[x.levels.index(level)]
+                                for x in tables]))
+    map_taxon2row = dict([(y, x) for x, y in enumerate(taxa)])
+
+    matrix = numpy.zeros((len(taxa), len(tables)), dtype=numpy.int64)
+    for column, table in enumerate(tables):
+        names, counts = table.getCounts(level)
+        rows = numpy.array([map_taxon2row[x] for x in names],
+                           dtype=numpy.int64)
+        matrix[rows, column] = counts
+
+    return taxa, matrix
@@ -873,6 +873,248 @@ def IsCompatible(tree1, tree2):
         return True, ""
 
 
+def IteratePostOrder(tree, node=None):
+    """iterate over nodes below node in post-order.
+
+    Children are visited in the order of the successors.
+    """
+    if node is None:
+        node = tree.root
+
+    stack = [(node, False)]
+    while stack:
+        node_id, visited = stack.pop()
+        if visited:
+            yield node_id
+        else:
+            stack.append((node_id, True))
+            for n in reversed(tree.node(node_id).succ):
+                stack.append((n, False))
+
+
+class TreeClades:
+
+    """clades of a tree as bitsets.
+
+    The taxa below each node are stored as an integer with one bit
+    set per taxon. Bits are assigned to taxa by a
+    :class:`TreeCollectionIndex`.
+
+    The methods correspond to :func:`IsMonophyleticForTaxa`,
+    :func:`GetCommonAncestor`, :func:`IsCompatible` and
+    :func:`GetSubsets`, but do not modify the tree. Results refer to
+    the rooting of the tree at the time it was indexed.
+    """
+
+    def __init__(self, tree, index):
+
+        self.mTree = tree
+        self.mIndex = index
+        self.mClades = {}
+        self.mNTerminals = 0
+
+        for node_id in IteratePostOrder(tree):
+            node = tree.node(node_id)
+            if node.succ:
+                clade = 0
+                for n in node.succ:
+                    clade |= self.mClades[n]
+            else:
+                clade = index.getBit(node.data.taxon)
+                self.mNTerminals += 1
+            self.mClades[node_id] = clade
+
+        self.mTaxa = self.mClades[tree.root]
+
+        # map each clade to the node closest to the root.
+        # Equal clades are on a chain of single-child nodes.
+        self.mMapClade2Node = {}
+        for node_id in reversed(list(IteratePostOrder(tree))):
+            self.mMapClade2Node.setdefault(self.mClades[node_id], node_id)
+
+        # internal clades for compatibility checks
+        self.mInternalClades = set(
+            [self.mClades[x] for x in self.mClades
+             if tree.node(x).succ])
+
+    def getNode(self, clade):
+        """return node for clade or -1 if clade is not
+        monophyletic."""
+        if clade is None:
+            return -1
+        return self.mMapClade2Node.get(clade, -1)
+
+    def isMonophyletic(self, taxa, support=None):
+        """check if a tree is monophyletic for a list of taxa.
+
+        If support is given, minimum support is checked as in
+        :func:`IsMonophyleticForTaxa`.
+        """
+        node_id = self.getNode(self.mIndex.encode(taxa))
+        if node_id == -1:
+            return False
+
+        if support:
+            tree = self.mTree
+            succ = tree.node(tree.root).succ
+            # rerooting creates a root with the ingroup as first child
+            if node_id == tree.root or (len(succ) == 2 and node_id in succ):
+                node_id = succ[0]
+            return tree.node(node_id).data.support >= support
+
+        return True
+
+    def getCommonAncestor(self, taxa):
+        """retrieve common ancestor for a list of taxa.
+
+        Returns -1 if the taxa are not monophyletic, see
+        :func:`GetCommonAncestor`.
+        """
+        if type(taxa) in StringTypes:
+            taxa = (taxa,)
+
+        node_id = self.getNode(self.mIndex.encode(taxa))
+        if node_id == -1 or node_id != self.mTree.root:
+            return node_id
+
+        # return child of root containing the first taxon
+        bit = self.mIndex.encode((taxa[0],))
+        for n in self.mTree.node(node_id).succ:
+            if self.mClades[n] & bit:
+                return n
+
+    def isCompatible(self, other):
+        """check if two trees are compatible.
+
+        Returns a tuple (is_compatible, reason) as
+        :func:`IsCompatible`.
+        """
+        if self.mNTerminals != other.mNTerminals:
+            return False, "leaves"
+
+        if self.mTaxa & ~other.mTaxa:
+            return False, "taxa"
+
+        if other.mTaxa & ~self.mTaxa:
+            raise Bio.Nexus.Trees.TreeError(
+                "Can't compare trees with different taxon compositions.")
+
+        # clades of a tree are compatible with each other, so only
+        # clades absent from this tree need to be checked.
+        for b in other.mInternalClades.difference(self.mInternalClades):
+            for a in self.mInternalClades:
+                c = a & b
+                if c and c != a and c != b:
+                    return False, "topology"
+
+        return True, ""
+
+    def getSubsets(self, node=None):
+        """return clades below node in the order of
+        :func:`GetSubsets`."""
+        return [self.mClades[x] for x in IteratePostOrder(self.mTree, node)]
+
+
+class TreeCollectionIndex:
+
+    """index of clades in a collection of trees.
+
+    Taxa are assigned to bit positions in the order they are
+    encountered and the clades of each tree are stored in a
+    :class:`TreeClades` object::
+
+       index = TreeCollectionIndex(nexus.trees)
+       results = index.isCompatible(reference_tree)
+
+    """
+
+    def __init__(self, trees=()):
+
+        self.mMapTaxon2Bit = {}
+        self.mTaxa = []
+        self.mTrees = []
+
+        for tree in trees:
+            self.add(tree)
+
+    def getBit(self, taxon):
+        """return bit for taxon, assigning a new one if necessary."""
+        try:
+            return self.mMapTaxon2Bit[taxon]
+        except KeyError:
+            bit = 1 << len(self.mTaxa)
+            self.mMapTaxon2Bit[taxon] = bit
+            self.mTaxa.append(taxon)
+            return bit
+
+    def encode(self, taxa):
+        """return bitset for taxa.
+
+        Returns None if a taxon is not in the index.
+        """
+        if type(taxa) in StringTypes:
+            taxa = (taxa,)
+
+        clade = 0
+        for taxon in taxa:
+            try:
+                clade |= self.mMapTaxon2Bit[taxon]
+            except KeyError:
+                return None
+        return clade
+
+    def decode(self, clade):
+        """return list of taxa in bitset."""
+        taxa = []
+        x = 0
+        while clade:
+            if clade & 1:
+                taxa.append(self.mTaxa[x])
+            clade >>= 1
+            x += 1
+        return taxa
+
+    def add(self, tree):
+        """add tree to index and return its clades."""
+        clades = TreeClades(tree, self)
+        self.mTrees.append(clades)
+        return clades
+
+    def __len__(self):
+        return len(self.mTrees)
+
+    def __getitem__(self, key):
+        return self.mTrees[key]
+
+    def __iter__(self):
+        return iter(self.mTrees)
+
+    def isCompatible(self, reference):
+        """compare reference tree against all trees in the index.
+
+        Returns a list of tuples (is_compatible, reason), see
+        :func:`IsCompatible`.
+        """
+        if not isinstance(reference, TreeClades):
+            reference = TreeClades(reference, self)
+        return [reference.isCompatible(x) for x in self.mTrees]
+
+    def isMonophyletic(self, taxa, support=None):
+        """check all trees for monophyly of taxa.
+
+        Returns a list of booleans, see
+        :func:`IsMonophyleticForTaxa`.
+        """
+        return [x.isMonophyletic(taxa, support) for x in self.mTrees]
+
+    def getCommonAncestor(self, taxa):
+        """return common ancestor of taxa in all trees.
+
+        Returns a list of node ids, see :func:`GetCommonAncestor`.
+        """
+        return [x.getCommonAncestor(taxa) for x in self.mTrees]
+
+
 def Tree2Graph(tree):
     """return tree as a list of edges in a graph."""
     links = []
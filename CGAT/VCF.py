@@ -34,6 +34,18 @@ here:
 
 http://www.1000genomes.org/wiki/doku.php?id=1000_genomes:analysis:vcf4.0
 
+Records are returned as :class:`VCFEntry` objects. The sample
+columns of a record are kept as a string and are only split
+when genotypes are accessed.
+
+For analyses across many samples, :meth:`VCFFile.iterateBlocks`
+decodes chunks of records into numpy matrices of allele codes
+for a subset of samples::
+
+   infile = VCF.VCFFile(IOTools.openFile("in.vcf.gz"))
+   for block in infile.iterateBlocks(samples=["NA12878"],
+                                     fields=("DP",)):
+       ncalled = (~block.missing).sum(axis=1)
 
 Code
 ----
@@ -41,24 +53,67 @@ Code
 '''
 import sys
 import gzip
+import collections
+import numpy
+
+VCFBlock = collections.namedtuple(
+    "VCFBlock",
+    "contig pos id ref alt alleles missing values")
 
 
 class VCFEntry:
 
-    def __init__(self, data, samples):
+    '''a record in a vcf file.
+
+    The sample columns are kept as a string and split into
+    the dictionary *genotypes* on first access.
+    '''
 
-        assert len(data) == len(samples) + 9
-        self.contig, self.pos, self.id, self.ref, self.alt, self.qual, self.filter, self.info, self.format = \
-            data[:9]
+    def __init__(self, line, samples):
 
-        self.genotypes = dict(zip(samples, data[9:]))
+        data = line.split("\t", 9)
+        self.contig, self.pos, self.id, self.ref, self.alt, self.qual, \
+            self.filter, self.info, self.format = data[:9]
+        if len(data) > 9:
+            self.data = data[9]
+        else:
+            self.data = ""
+
+        self.samples = samples
         self.order = samples
 
+    def __getattr__(self, key):
+        if key == "genotypes":
+            self.genotypes = dict(zip(self.samples, self.getColumns()))
+            return self.genotypes
+        raise AttributeError(key)
+
+    def getColumns(self):
+        '''return sample columns in the order of samples in the file.'''
+        columns = self.data.split("\t")
+        assert len(columns) == len(self.samples), \
+            "number of samples do not match: %i != %i" % (
+                len(columns), len(self.samples))
+        return columns
+
+    def toString(self, indices):
+        '''return record as a string with the sample columns
+        given by *indices*.'''
+        columns = self.getColumns()
+        return "\t".join((
+            self.contig, self.pos, self.id, self.ref, self.alt, self.qual,
+            self.filter, self.info, self.format,
+            "\t".join([columns[x] for x in indices])))
+
     def __str__(self):
+        if self.order is self.samples and "genotypes" not in self.__dict__:
+            genotypes = self.data
+        else:
+            genotypes = "\t".join([self.genotypes[x] for x in self.order])
         return "\t".join(map(str, (
             self.contig, self.pos, self.id, self.ref, self.alt, self.qual,
             self.filter, self.info, self.format,
-            "\t".join([self.genotypes[x] for x in self.order]))))
+            genotypes)))
 
 
 class VCFFile:
@@ -118,11 +173,114 @@ class VCFFile:
 
     def next(self):
 
-        data = self.line[:-1].split("\t")
+        line = self.line[:-1]
         self.line = self.infile.readline()
         if not self.line:
             raise StopIteration
-        return VCFEntry(data, self.samples)
+        return VCFEntry(line, self.samples)
+
+    def getSampleIndices(self, samples):
+        '''return column indices of *samples*.'''
+        map_sample2index = dict([(y, x) for x, y in enumerate(self.samples)])
+        return [map_sample2index[x] for x in samples]
+
+    def iterateBlocks(self,
+                      block_size=10000,
+                      samples=None,
+                      fields=(),
+                      ploidy=2):
+        '''iterate over records in blocks of *block_size* records.
+
+        Genotypes are decoded for *samples* (all samples if not given)
+        into a matrix of allele codes with the dimensions records x
+        samples x *ploidy*. Missing alleles have the code -1. The
+        matrix *missing* flags genotypes without a call.
+
+        *fields* are numeric FORMAT fields with a single value, for
+        example ``DP`` or ``GQ``. They are returned in the dictionary
+        *values* as matrices with the dimensions records x samples.
+        Missing values are set to NaN.
+
+        Yields :class:`VCFBlock` tuples.
+        '''
+
+        if samples is None:
+            samples = self.samples
+        indices = self.getSampleIndices(samples)
+        nsamples = len(indices)
+
+        # cache genotype strings, there are few distinct ones
+        map_genotype2alleles = {}
+
+        def _decodeGenotype(genotype):
+            try:
+                return map_genotype2alleles[genotype]
+            except KeyError:
+                pass
+            alleles = [-1] * ploidy
+            for x, allele in enumerate(
+                    genotype.replace("|", "/").split("/")[:ploidy]):
+                if allele != ".":
+                    alleles[x] = int(allele)
+            map_genotype2alleles[genotype] = alleles
+            return alleles
+
+        def _decodeValue(value):
+            if value in ("", "."):
+                return numpy.nan
+            return float(value)
+
+        while True:
+            entries = []
+            for entry in self:
+                entries.append(entry)
+                if len(entries) == block_size:
+                    break
+
+            if not entries:
+                break
+
+            nrecords = len(entries)
+            alleles = numpy.empty((nrecords, nsamples, ploidy),
+                                  dtype=numpy.int16)
+            values = dict([(x, numpy.empty((nrecords, nsamples),
+                                            dtype=numpy.float))
+                           for x in fields])
+
+            for row, entry in enumerate(entries):
+                columns = entry.getColumns()
+                columns = [columns[x].split(":") for x in indices]
+                keys = entry.format.split(":")
+
+                if "GT" in keys:
+                    idx = keys.index("GT")
+                    alleles[row] = [_decodeGenotype(x[idx])
+                                    if len(x) > idx else [-1] * ploidy
+                                    for x in columns]
+                else:
+                    alleles[row] = -1
+
+                for field, matrix in values.items():
+                    if field in keys:
+                        idx = keys.index(field)
+                        matrix[row] = [_decodeValue(x[idx])
+                                       if len(x) > idx else numpy.nan
+                                       for x in columns]
+                    else:
+                        matrix[row] = numpy.nan
+
+            yield VCFBlock._make((
+                [x.contig for x in entries],
+                numpy.array([int(x.pos) for x in entries], dtype=numpy.int64),
+                [x.id for x in entries],
+                [x.ref for x in entries],
+                [x.alt for x in entries],
+                alleles,
+                alleles[:, :, 0] < 0,
+                values))
+
+            if len(entries) < block_size:
+                break
 
 if __name__ == "__main__":
 
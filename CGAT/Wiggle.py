@@ -14,6 +14,8 @@ Wiggle.py - Support for the `wiggle`_ format used by `ucsc`_.
 # I had to re-implement the reader, so that random access would work.
 
 
+import struct
+import zlib
 import numpy
 from bx import interval_index_file
 import bx.wiggle
@@ -74,3 +76,253 @@ class WiggleMultiIndexedAccess(interval_index_file.AbstractMultiIndexedAccess):
         for index in self.indexes:
             blocks.extend(index.get(src, start, end, dtype))
         return blocks
+
+
+class BigWigWriter(object):
+
+    """write a `bigwig`_ formatted file.
+
+    Values are added per contig as arrays of intervals and values
+    (bedGraph records). Contigs need to be added one at a time, and
+    intervals within a contig need to be sorted and non-overlapping::
+
+       writer = BigWigWriter(outfile, contig_sizes)
+       writer.add("chr1", starts, ends, values)
+       writer.close()
+
+    The file contains no zoom levels.
+
+    .. _bigwig: http://genome.ucsc.edu/goldenPath/help/bigWig.html
+    """
+
+    BIGWIG_MAGIC = 0x888FFC26
+    BPT_MAGIC = 0x78CA8C91
+    CIRTREE_MAGIC = 0x2468ACE0
+    VERSION = 4
+
+    # number of records per data section
+    items_per_slot = 1024
+    # number of children per index node
+    block_size = 256
+
+    def __init__(self, outfile, contig_sizes):
+        self.outfile = outfile
+        self.contig_sizes = contig_sizes
+        self.contig2id = {}
+        # index items: (chrom_id, start, end, offset, size)
+        self.sections = []
+        self.max_buffer_size = 0
+        self.summary = [0, None, None, 0.0, 0.0]
+
+        # placeholders for header and total summary
+        self.outfile.write(b"\0" * 64)
+        self.summary_offset = self.outfile.tell()
+        self.outfile.write(b"\0" * 40)
+        self.data_offset = self.outfile.tell()
+        self.outfile.write(struct.pack("<Q", 0))
+
+    def add(self, contig, starts, ends, values):
+        """add intervals with *values* on *contig*."""
+
+        if contig in self.contig2id:
+            raise ValueError("contig %s has already been added" % contig)
+        chrom_id = len(self.contig2id)
+        self.contig2id[contig] = chrom_id
+
+        starts = numpy.asarray(starts, numpy.uint32)
+        ends = numpy.asarray(ends, numpy.uint32)
+        values = numpy.asarray(values, numpy.float32)
+
+        if len(values) == 0:
+            return
+
+        lengths = (ends - starts).astype(numpy.float64)
+        summary = self.summary
+        summary[0] += int(lengths.sum())
+        vmin, vmax = float(values.min()), float(values.max())
+        if summary[1] is None:
+            summary[1], summary[2] = vmin, vmax
+        else:
+            summary[1] = min(summary[1], vmin)
+            summary[2] = max(summary[2], vmax)
+        summary[3] += float((lengths * values).sum())
+        summary[4] += float((lengths * values * values).sum())
+
+        records = numpy.zeros(len(values), dtype=[("start", "<u4"),
+                                                  ("end", "<u4"),
+                                                  ("value", "<f4")])
+        records["start"] = starts
+        records["end"] = ends
+        records["value"] = values
+
+        for x in range(0, len(records), self.items_per_slot):
+            chunk = records[x:x + self.items_per_slot]
+            start, end = int(chunk["start"][0]), int(chunk["end"][-1])
+            # bedGraph section
+            data = struct.pack("<IIIIIBBH",
+                               chrom_id, start, end, 0, 0, 1, 0,
+                               len(chunk)) + chunk.tobytes()
+            self.max_buffer_size = max(self.max_buffer_size, len(data))
+            data = zlib.compress(data)
+            offset = self.outfile.tell()
+            self.outfile.write(data)
+            self.sections.append((chrom_id, start, end, offset, len(data)))
+
+    def writeChromosomeTree(self):
+        """write B+ tree mapping contig names to ids and sizes."""
+
+        for contig in sorted(self.contig_sizes):
+            if contig not in self.contig2id:
+                self.contig2id[contig] = len(self.contig2id)
+
+        items = sorted(self.contig2id.items())
+        nitems = len(items)
+        key_size = max([len(x[0]) for x in items])
+        block_size = max(1, min(self.block_size, nitems))
+        item_size = key_size + 8
+        node_size = 4 + block_size * item_size
+
+        self.outfile.write(struct.pack("<IIIIQQ", self.BPT_MAGIC,
+                                       block_size, key_size, 8,
+                                       nitems, 0))
+
+        # number of nodes on each level, starting from the leaves
+        level_sizes = [(nitems + block_size - 1) // block_size]
+        while level_sizes[-1] > 1:
+            level_sizes.append(
+                (level_sizes[-1] + block_size - 1) // block_size)
+
+        offset = self.outfile.tell()
+        level_offsets = []
+        for level_size in reversed(level_sizes):
+            level_offsets.insert(0, offset)
+            offset += level_size * node_size
+
+        for level in range(len(level_sizes) - 1, -1, -1):
+            # items covered by a node on this level
+            span = block_size ** (level + 1)
+            for node in range(level_sizes[level]):
+                first = node * span
+                last = min(nitems, first + span)
+                if level == 0:
+                    data = [struct.pack("<%isII" % key_size,
+                                        name, chrom_id,
+                                        self.contig_sizes[name])
+                            for name, chrom_id in items[first:last]]
+                    is_leaf = 1
+                else:
+                    child_span = block_size ** level
+                    data = []
+                    for child, x in enumerate(
+                            range(first, last, child_span)):
+                        data.append(struct.pack(
+                            "<%isQ" % key_size,
+                            items[x][0],
+                            level_offsets[level - 1] +
+                            (node * block_size + child) * node_size))
+                    is_leaf = 0
+                self.outfile.write(struct.pack("<BBH", is_leaf, 0,
+                                               len(data)))
+                self.outfile.write(b"".join(data))
+                self.outfile.write(
+                    b"\0" * (item_size * (block_size - len(data))))
+
+    def writeIndex(self):
+        """write R tree index of data sections."""
+
+        sections = self.sections
+        nitems = len(sections)
+        block_size = max(1, min(self.block_size, nitems))
+        leaf_size = 4 + block_size * 32
+        node_size = 4 + block_size * 24
+
+        if nitems:
+            bounds = (sections[0][0], sections[0][1],
+                      sections[-1][0], sections[-1][2])
+        else:
+            bounds = (0, 0, 0, 0)
+
+        self.outfile.write(struct.pack("<IIQIIIIQII", self.CIRTREE_MAGIC,
+                                       block_size, nitems,
+                                       bounds[0], bounds[1],
+                                       bounds[2], bounds[3],
+                                       self.data_end, 1, 0))
+
+        level_sizes = [max(1, (nitems + block_size - 1) // block_size)]
+        while level_sizes[-1] > 1:
+            level_sizes.append(
+                (level_sizes[-1] + block_size - 1) // block_size)
+
+        offset = self.outfile.tell()
+        level_offsets = []
+        for level in range(len(level_sizes) - 1, -1, -1):
+            level_offsets.insert(0, offset)
+            if level == 0:
+                offset += level_sizes[level] * leaf_size
+            else:
+                offset += level_sizes[level] * node_size
+
+        for level in range(len(level_sizes) - 1, -1, -1):
+            span = block_size ** (level + 1)
+            for node in range(level_sizes[level]):
+                first = node * span
+                last = min(nitems, first + span)
+                if level == 0:
+                    data = [struct.pack("<IIIIQQ", chrom_id, start,
+                                        chrom_id, end, offset, size)
+                            for chrom_id, start, end, offset, size in
+                            sections[first:last]]
+                    item_size = 32
+                    is_leaf = 1
+                else:
+                    child_span = block_size ** level
+                    data = []
+                    for child, x in enumerate(
+                            range(first, last, child_span)):
+                        y = min(last, x + child_span) - 1
+                        if level == 1:
+                            child_offset = level_offsets[0] + \
+                                (node * block_size + child) * leaf_size
+                        else:
+                            child_offset = level_offsets[level - 1] + \
+                                (node * block_size + child) * node_size
+                        data.append(struct.pack(
+                            "<IIIIQ",
+                            sections[x][0], sections[x][1],
+                            sections[y][0], sections[y][2],
+                            child_offset))
+                    item_size = 24
+                    is_leaf = 0
+                self.outfile.write(struct.pack("<BBH", is_leaf, 0,
+                                               len(data)))
+                self.outfile.write(b"".join(data))
+                self.outfile.write(
+                    b"\0" * (item_size * (block_size - len(data))))
+
+    def close(self):
+        """write index and header and close file."""
+
+        self.data_end = self.outfile.tell()
+        chrom_tree_offset = self.outfile.tell()
+        self.writeChromosomeTree()
+        self.index_offset = self.outfile.tell()
+        self.writeIndex()
+
+        self.outfile.seek(0)
+        self.outfile.write(struct.pack("<IHHQQQHHQQIQ",
+                                       self.BIGWIG_MAGIC,
+                                       self.VERSION,
+                                       0,
+                                       chrom_tree_offset,
+                                       self.data_offset,
+                                       self.index_offset,
+                                       0, 0, 0,
+                                       self.summary_offset,
+                                       self.max_buffer_size,
+                                       0))
+        valid, vmin, vmax, vsum, vsquares = self.summary
+        self.outfile.write(struct.pack("<Qdddd", valid,
+                                       vmin or 0, vmax or 0,
+                                       vsum, vsquares))
+        self.outfile.write(struct.pack("<Q", len(self.sections)))
+        self.outfile.close()
@@ -0,0 +1,103 @@
+#cython: embedsignature=True
+'''cblat.pyx - compiled parsing of psl formatted lines
+====================================================
+
+This module is used by :mod:`Blat` to parse psl formatted
+lines into :class:`Blat.Match` objects. Block sizes and
+starts are not decoded, see :class:`Blat.Match`.
+'''
+
+from libc.stdlib cimport strtol
+from libc.errno cimport errno, ERANGE
+
+
+cdef long toLong(bytes s) except? -1:
+    '''convert *s* to an integer.
+
+    Raises ValueError if *s* is not a complete integer.
+    '''
+    cdef char * start = s
+    cdef char * end
+    cdef long value
+    errno = 0
+    value = strtol(start, &end, 10)
+    if end == start or end[0] != 0 or errno == ERANGE:
+        raise ValueError("invalid literal for int() with base 10: '%s'" % s)
+    return value
+
+
+def parseLines(lines, factory, error):
+    '''parse psl formatted *lines*.
+
+    Objects are created with *factory* and filled without
+    calling its constructor. *error* is the exception class
+    to raise for lines with missing fields or invalid numbers.
+
+    Returns a list of objects.
+    '''
+
+    cdef list result = []
+    cdef list data
+    cdef long nmatches, nmismatches, query_length, sbjct_length
+    cdef bytes line
+
+    for line in lines:
+        data = line.split()
+        if len(data) < 21:
+            raise error("parsing error: %i fields" % len(data), line)
+
+        match = factory.__new__(factory)
+
+        try:
+            nmatches = toLong(data[0])
+            nmismatches = toLong(data[1])
+            query_length = toLong(data[10])
+            sbjct_length = toLong(data[14])
+
+            match.mNMatches = nmatches
+            match.mNMismatches = nmismatches
+            match.mNRepMatches = toLong(data[2])
+            match.mNns = toLong(data[3])
+            match.mQueryNGapsCounts = toLong(data[4])
+            match.mQueryNGapsBases = toLong(data[5])
+            match.mSbjctNGapsCounts = toLong(data[6])
+            match.mSbjctNGapsBases = toLong(data[7])
+            match.mQueryFrom = toLong(data[11])
+            match.mQueryTo = toLong(data[12])
+            match.mSbjctFrom = toLong(data[15])
+            match.mSbjctTo = toLong(data[16])
+            match.mNBlocks = toLong(data[17])
+        except ValueError, msg:
+            raise error("parsing error: %s" % msg, line)
+
+        match.strand = data[8]
+        match.mQueryId = data[9]
+        match.mQueryLength = query_length
+        match.mSbjctId = data[13]
+        match.mSbjctLength = sbjct_length
+
+        # block coordinates are decoded on first access
+        match.mBlockSizes = data[18]
+        match.mQueryBlockStarts = data[19]
+        match.mSbjctBlockStarts = data[20]
+
+        if query_length != 0:
+            match.mQueryCoverage = 100.0 * \
+                (nmismatches + nmatches) / query_length
+        else:
+            match.mQueryCoverage = 0
+
+        if sbjct_length != 0:
+            match.mSbjctCoverage = 100.0 * \
+                (nmismatches + nmatches) / sbjct_length
+        else:
+            match.mSbjctCoverage = 0
+
+        if nmatches + nmismatches > 0:
+            match.mPid = 100.0 * nmatches / (nmatches + nmismatches)
+        else:
+            match.mPid = 100.0
+
+        result.append(match)
+
+    return result
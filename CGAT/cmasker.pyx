@@ -0,0 +1,201 @@
+#cython: embedsignature=True
+'''cmasker.pyx - compiled low complexity masking
+===============================================
+
+This module is used by :mod:`Masker` to find low complexity
+regions in nucleotide sequences with the symmetric DUST
+algorithm. It follows the python implementation in
+:func:`Masker.dust`.
+'''
+
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memcpy, memmove, memset
+
+DEF WORD_LENGTH = 3
+DEF NWORDS = 64
+
+
+cdef struct Perfect:
+    long start
+    long finish
+    int r
+    int l
+
+
+cdef class DustScanner:
+    '''scan sequences for low complexity regions.'''
+
+    cdef int window, level, max_words
+    # counts of words in window (w) and in the current suffix (v)
+    cdef int cw[NWORDS]
+    cdef int cv[NWORDS]
+    cdef int rw, rv, L
+    # words in window as a ring buffer
+    cdef int * words
+    cdef int head, nwords
+    # perfect intervals sorted by decreasing start
+    cdef Perfect * perfect
+    cdef int nperfect, capacity
+    cdef list result
+
+    def __cinit__(self, int window=64, int level=20):
+        self.window = window
+        self.level = level
+        self.max_words = window - WORD_LENGTH + 1
+        self.words = <int *>malloc(self.max_words * sizeof(int))
+        self.capacity = 16
+        self.perfect = <Perfect *>malloc(self.capacity * sizeof(Perfect))
+        if self.words == NULL or self.perfect == NULL:
+            raise MemoryError()
+        self.nperfect = 0
+        self.reset()
+
+    def __dealloc__(self):
+        free(self.words)
+        free(self.perfect)
+
+    cdef void reset(self):
+        memset(self.cw, 0, sizeof(self.cw))
+        memset(self.cv, 0, sizeof(self.cv))
+        self.rw = self.rv = self.L = 0
+        self.head = self.nwords = 0
+
+    cdef inline int word(self, int x):
+        return self.words[(self.head + x) % self.max_words]
+
+    cdef void saveMaskedRegions(self, long start):
+        cdef int x
+        cdef long p_start, p_finish, last_start, last_finish
+        if self.nperfect == 0 or self.perfect[self.nperfect - 1].start >= start:
+            return
+        p_start = self.perfect[self.nperfect - 1].start
+        p_finish = self.perfect[self.nperfect - 1].finish
+        if self.result:
+            last_start, last_finish = self.result[-1]
+            if p_start <= last_finish:
+                self.result[-1] = (last_start, max(last_finish, p_finish))
+            else:
+                self.result.append((p_start, p_finish))
+        else:
+            self.result.append((p_start, p_finish))
+        x = self.nperfect - 1
+        while x >= 0 and self.perfect[x].start < start:
+            x -= 1
+        self.nperfect = x + 1
+
+    cdef int insertPerfect(self, int y, long start, long finish,
+                           int r, int l) except -1:
+        cdef Perfect * p
+        if self.nperfect == self.capacity:
+            p = <Perfect *>realloc(self.perfect,
+                                   2 * self.capacity * sizeof(Perfect))
+            if p == NULL:
+                raise MemoryError()
+            self.perfect = p
+            self.capacity *= 2
+        memmove(&self.perfect[y + 1], &self.perfect[y],
+                (self.nperfect - y) * sizeof(Perfect))
+        self.perfect[y].start = start
+        self.perfect[y].finish = finish
+        self.perfect[y].r = r
+        self.perfect[y].l = l
+        self.nperfect += 1
+        return 0
+
+    cdef int findPerfect(self, long start) except -1:
+        cdef int c[NWORDS]
+        cdef int r = self.rv
+        cdef int max_r = 0, max_l = 0
+        cdef int x, y, t, new_l
+        memcpy(c, self.cv, sizeof(c))
+        for x from self.nwords - self.L - 1 >= x >= 0:
+            t = self.word(x)
+            r += c[t]
+            c[t] += 1
+            new_l = self.nwords - x - 1
+            if r * 10 > self.level * new_l:
+                y = 0
+                while y < self.nperfect and \
+                        self.perfect[y].start >= x + start:
+                    if max_r == 0 or \
+                       self.perfect[y].r * max_l > max_r * self.perfect[y].l:
+                        max_r = self.perfect[y].r
+                        max_l = self.perfect[y].l
+                    y += 1
+                if max_r == 0 or r * max_l >= max_r * new_l:
+                    max_r, max_l = r, new_l
+                    self.insertPerfect(
+                        y, x + start,
+                        self.nwords + WORD_LENGTH - 1 + start,
+                        r, new_l)
+        return 0
+
+    def scan(self, signed char[:] bases):
+        '''return low complexity regions in *bases*, a sequence
+        encoded by :func:`Masker.encodeSequence`.
+
+        Returns a list of half-open intervals.
+        '''
+        cdef long nbases = len(bases)
+        cdef long x, start
+        cdef int l = 0, t = 0, b, s
+        cdef int word_mask = NWORDS - 1
+
+        self.result = []
+        self.nperfect = 0
+        self.reset()
+
+        for x in range(nbases + 1):
+            if x < nbases:
+                b = bases[x]
+            else:
+                b = 4
+
+            if b >= 0 and b < 4:
+                l += 1
+                t = ((t << 2) | b) & word_mask
+                if l < WORD_LENGTH:
+                    continue
+
+                start = max(l - self.window, 0) + (x + 1 - l)
+                self.saveMaskedRegions(start)
+
+                # shift window
+                if self.nwords >= self.max_words:
+                    s = self.words[self.head]
+                    self.head = (self.head + 1) % self.max_words
+                    self.nwords -= 1
+                    self.cw[s] -= 1
+                    self.rw -= self.cw[s]
+                    if self.L > self.nwords:
+                        self.L -= 1
+                        self.cv[s] -= 1
+                        self.rv -= self.cv[s]
+                self.words[(self.head + self.nwords) % self.max_words] = t
+                self.nwords += 1
+                self.L += 1
+                self.rw += self.cw[t]
+                self.cw[t] += 1
+                self.rv += self.cv[t]
+                self.cv[t] += 1
+                if self.cv[t] * 10 > self.level * 2:
+                    while 1:
+                        s = self.word(self.nwords - self.L)
+                        self.cv[s] -= 1
+                        self.rv -= self.cv[s]
+                        self.L -= 1
+                        if s == t:
+                            break
+
+                if self.rw * 10 > self.L * self.level:
+                    self.findPerfect(start)
+            else:
+                start = max(l - self.window + 1, 0) + (x + 1 - l)
+                while self.nperfect > 0:
+                    self.saveMaskedRegions(start)
+                    start += 1
+                # start a new, independent segment
+                l, t = 0, 0
+                self.reset()
+
+        return self.result
@@ -18,6 +18,56 @@ PeakShapeCounts = collections.namedtuple(
     "PeakShapeCounts",
     "nreads median counts" )
 
+
+class CoverageTrack(object):
+    '''coverage in a region on a contig that is shared between
+    all windows within the region.
+
+    *counts* is the number of reads per base starting at *start*.
+    Reads are counted in windows through their *tag_starts* and
+    *tag_ends*, which need to be sorted.
+    '''
+
+    def __init__(self, start, counts, tag_starts, tag_ends):
+        self.start = start
+        self.end = start + len(counts)
+        self.counts = counts
+        self.cumcounts = numpy.concatenate(([0], numpy.cumsum(counts)))
+        self.tag_starts = tag_starts
+        self.tag_ends = tag_ends
+
+    def countReads(self, starts, ends):
+        '''return the number of reads overlapping each of the
+        windows given by *starts* and *ends*.'''
+        return numpy.where(
+            ends > starts,
+            numpy.searchsorted(self.tag_starts, ends) -
+            numpy.searchsorted(self.tag_ends, starts, side="right"),
+            0)
+
+    def sumCounts(self, starts, ends):
+        '''return the sum of counts in each of the windows given by
+        *starts* and *ends*.'''
+        return (self.cumcounts[ends - self.start] -
+                self.cumcounts[starts - self.start])
+
+
+class CoverageTrackBigwig(CoverageTrack):
+    '''coverage from a bigwig file. Reads are counted as
+    the number of valid bases in *valid_counts*.'''
+
+    def __init__(self, start, counts, valid_counts):
+        CoverageTrack.__init__(self, start, counts, None, None)
+        self.cumvalid = numpy.concatenate(([0], numpy.cumsum(valid_counts)))
+
+    def countReads(self, starts, ends):
+        return numpy.where(
+            ends > starts,
+            self.cumvalid[numpy.maximum(starts, ends) - self.start] -
+            self.cumvalid[starts - self.start],
+            0)
+
+
 cdef class Counter:
     '''base class for counters computing densities 
     from genomic data.
@@ -234,6 +284,227 @@ cdef class Counter:
         return result
 
 
+    def coverageInRegion(self, infile, contig, int start, int end):
+        '''return a :class:`CoverageTrack` for the region
+        on *contig* bounded by *start* and *end* or None if
+        there is no data for *contig*.'''
+        raise NotImplementedError(
+            "coverageInRegion not implemented in %s" %
+            self.__class__.__name__)
+
+    def countAroundPositions(self,
+                             track,
+                             positions,
+                             bins):
+        '''count and bin in bins around each of *positions*
+        using coverage in *track*.
+
+        This is the vectorised version of :meth:`countAroundPos`.
+        The windows around *positions* need to be within *track*.
+
+        return a list of PeakShapeCounts tuples.
+        '''
+        cdef int i
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        npositions = len(positions)
+        nbins = len(bins) - 1
+
+        if track is None:
+            return [PeakShapeCounts._make(
+                (0, numpy.nan, numpy.zeros(nbins, dtype=numpy.int)))
+                for x in range(npositions)]
+
+        window_starts = numpy.maximum(0, positions + bins[0])
+        window_ends = positions + bins[-1]
+        lcounts = window_ends - window_starts
+        nreads = track.countReads(window_starts, window_ends)
+
+        # bins are positioned relative to the start of the window,
+        # only take complete bins.
+        edges = window_starts[:, numpy.newaxis] + (bins - bins[0])
+        complete = (edges[:, 1:] - window_starts[:, numpy.newaxis] <
+                    lcounts[:, numpy.newaxis])
+        edges = numpy.minimum(edges, track.end)
+        hist = numpy.where(complete,
+                           track.sumCounts(edges[:, :-1], edges[:, 1:]),
+                           0).astype(numpy.int)
+
+        result = []
+        for i from 0 <= i < npositions:
+            if lcounts[i] > 0:
+                counts = track.counts[window_starts[i] - track.start:
+                                      window_ends[i] - track.start]
+                median = numpy.median(counts)
+            else:
+                median = numpy.nan
+            result.append(PeakShapeCounts._make((nreads[i],
+                                                 median,
+                                                 hist[i])))
+        return result
+
+    def countInIntervals(self,
+                         track,
+                         starts,
+                         ends,
+                         bins,
+                         int window_size=0,
+                         float peak_ratio=0.90,
+                         use_interval=False,
+                         centring_method="reads",
+                         int chunk_size=10000000):
+        '''count density in windows and compute peak-shape
+        summary parameters for all intervals given by
+        *starts* and *ends* using coverage in *track*.
+
+        This is the vectorised version of :meth:`countInInterval`.
+        Intervals extended by *window_size* need to be within
+        *track*. Intervals are processed in chunks such that
+        no more than *chunk_size* values are held in a matrix
+        at a time.
+
+        return a list of result objects. Empty intervals are
+        returned as None.
+        '''
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+
+        result = []
+        if len(starts) == 0:
+            return result
+
+        cdef int x
+        cdef int step = max(1, chunk_size // max(1, (ends - starts).max()))
+        for x from 0 <= x < len(starts) by step:
+            result.extend(self._countInIntervals(
+                track, starts[x:x + step], ends[x:x + step],
+                bins, window_size, peak_ratio,
+                use_interval, centring_method))
+
+        return result
+
+    def _countInIntervals(self,
+                          track,
+                          starts,
+                          ends,
+                          bins,
+                          int window_size,
+                          float peak_ratio,
+                          use_interval,
+                          centring_method):
+        '''compute peak shape parameters in a matrix with one row
+        per interval. Parameters are as in :meth:`countInInterval`.
+        '''
+        cdef int i
+
+        window_starts = numpy.maximum(0, starts - window_size)
+        window_ends = ends + window_size
+        interval_widths = ends - starts
+
+        # counts only in interval - used to define peak center.
+        # The matrix is padded on the right.
+        columns = numpy.arange(max(1, interval_widths.max()))
+        valid = columns < interval_widths[:, numpy.newaxis]
+        positions = numpy.minimum(starts[:, numpy.newaxis] + columns,
+                                  track.end - 1) - track.start
+        counts_in_interval = track.counts[positions]
+
+        def _first(m, default):
+            return numpy.where(m.any(axis=1), m.argmax(axis=1), default)
+
+        def _last(m, default):
+            return numpy.where(m.any(axis=1),
+                               len(columns) - 1 - m[:, ::-1].argmax(axis=1),
+                               default)
+
+        #################################################
+        # compute peak shape parameters
+        peak_nreads = numpy.where(valid,
+                                  counts_in_interval,
+                                  0).max(axis=1).astype(numpy.int)
+        is_peak = valid & (counts_in_interval >=
+                           peak_nreads[:, numpy.newaxis])
+        if centring_method == "reads":
+            # select the middle one of all positions at peak height
+            peak_centers = (is_peak.cumsum(axis=1) >
+                            (is_peak.sum(axis=1) // 2)[:, numpy.newaxis]
+                            ).argmax(axis=1)
+        elif centring_method == "middle":
+            peak_centers = interval_widths // 2
+        else:
+            raise ValueError("unknown centring method '%s'" % centring_method)
+
+        # define peak height
+        # multiply in single precision as in countInInterval
+        peak_heights = numpy.ceil(
+            numpy.float32(peak_ratio) *
+            peak_nreads.astype(numpy.float32)).astype(numpy.int)
+        is_peak = valid & (counts_in_interval >=
+                           peak_heights[:, numpy.newaxis])
+        npeaks = is_peak.sum(axis=1)
+        peak_widths = _last(is_peak, 0) - _first(is_peak, 0)
+
+        # closest and furthest distance of peak to half-height
+        half_heights = (peak_heights // 2)[:, numpy.newaxis]
+        centers = peak_centers[:, numpy.newaxis]
+        above = counts_in_interval >= half_heights
+        below = counts_in_interval <= half_heights
+        left_first = _first(above & (columns < centers), peak_centers)
+        left_last = _last(below & (columns < centers), 0)
+        right_first = _first(below & (columns > centers) & valid,
+                             interval_widths)
+        right_last = _last(above & (columns >= centers) & valid,
+                           peak_centers)
+
+        furthest_dists = numpy.maximum(peak_centers - left_first,
+                                       right_last - peak_centers)
+        closest_dists = numpy.minimum(peak_centers - left_last,
+                                      right_first - peak_centers)
+
+        #################################################
+        # compute histogram
+        # decide in which region to count - interval or window
+        if use_interval:
+            region_starts, region_ends = starts, ends
+            offsets = peak_centers
+        else:
+            region_starts, region_ends = window_starts, window_ends
+            offsets = peak_centers + starts - window_starts
+
+        lcounts = (region_ends - region_starts)[:, numpy.newaxis]
+        edges = offsets[:, numpy.newaxis] + bins
+        # only take complete bins
+        complete = (edges[:, :-1] >= 0) & (edges[:, 1:] < lcounts)
+        edges = numpy.clip(edges, 0, lcounts) + \
+            region_starts[:, numpy.newaxis]
+        hist = numpy.where(complete,
+                           track.sumCounts(edges[:, :-1], edges[:, 1:]),
+                           0).astype(numpy.int)
+
+        nreads = track.countReads(window_starts, window_ends)
+
+        result = []
+        for i from 0 <= i < len(starts):
+            if interval_widths[i] <= 0:
+                E.warn("empty interval: %i - %i" % (starts[i], ends[i]))
+                result.append(None)
+                continue
+
+            counts = track.counts[region_starts[i] - track.start:
+                                  region_ends[i] - track.start]
+            result.append(PeakShapeResult._make((
+                interval_widths[i], npeaks[i],
+                starts[i] + peak_centers[i],
+                peak_widths[i], peak_nreads[i],
+                abs((interval_widths[i] // 2) - peak_centers[i]),
+                nreads[i],
+                numpy.median(counts),
+                closest_dists[i], furthest_dists[i],
+                bins,
+                hist[i])))
+
+        return result
+
+
 cdef class CounterBam(Counter):
     '''compute densities in intervals from bam files.'''
 
@@ -344,6 +615,83 @@ cdef class CounterBam(Counter):
 
         return nreads, counts
 
+    def coverageInRegion(self,
+                         Samfile samfile,
+                         contig,
+                         int start,
+                         int end):
+        '''return coverage in region on *contig* bounded by
+        *start* and *end* as a :class:`CoverageTrack`.
+
+        Reads are shifted and extended as in :meth:`coverageInInterval`.
+        Reads are collected in a single pass through the region and
+        coverage is accumulated over the whole region rather than
+        within individual windows.
+        '''
+        cdef int offset = self.shift // 2
+        cdef int interval_width = end - start
+        cdef int rstart, rend
+
+        if interval_width <= 0 or contig not in samfile.references:
+            return None
+
+        # tags are the aligned part of a read as used by fetch,
+        # coverage is from the shifted and extended read.
+        tag_starts, tag_ends = [], []
+        coverage_starts, coverage_ends = [], []
+
+        for read in samfile.fetch(contig,
+                                  max(0, start - 3 * offset),
+                                  end + 3 * offset):
+            rstart = read.pos
+            try:
+                rend = read.aend
+                has_end = True
+            except TypeError:
+                # read.aend can be None if CIGAR string is missing
+                rend = rstart + 1
+                has_end = False
+
+            if offset == 0:
+                tag_starts.append(rstart)
+                tag_ends.append(rend)
+                if has_end:
+                    coverage_starts.append(rstart)
+                    coverage_ends.append(rend)
+            elif not read.is_reverse:
+                # on + strand shift tags upstream
+                tag_starts.append(rstart + offset)
+                tag_ends.append(rend + offset)
+                coverage_starts.append(rstart + offset)
+                coverage_ends.append(rstart + 3 * offset)
+            else:
+                # on the - strand, shift tags downstream
+                tag_starts.append(rstart - offset)
+                tag_ends.append(rend - offset)
+                if has_end:
+                    coverage_starts.append(rend - 3 * offset)
+                    coverage_ends.append(rend - offset)
+
+        coverage_starts = numpy.clip(
+            numpy.array(coverage_starts, dtype=numpy.int64) - start,
+            0, interval_width)
+        coverage_ends = numpy.clip(
+            numpy.array(coverage_ends, dtype=numpy.int64) - start,
+            0, interval_width)
+
+        counts = numpy.cumsum(
+            numpy.bincount(coverage_starts, minlength=interval_width + 1) -
+            numpy.bincount(coverage_ends, minlength=interval_width + 1)
+        )[:interval_width].astype(numpy.int)
+
+        return CoverageTrack(start,
+                             counts,
+                             numpy.sort(numpy.array(tag_starts,
+                                                    dtype=numpy.int64)),
+                             numpy.sort(numpy.array(tag_ends,
+                                                    dtype=numpy.int64)))
+
+
 cdef class CounterBigwig(Counter):
     '''compute densities in intervals from bigwig files.'''
 
@@ -377,5 +725,19 @@ cdef class CounterBigwig(Counter):
 
         return nreads, d.sum_data
 
-    
+    def coverageInRegion(self,
+                         wigfile,
+                         contig,
+                         int start,
+                         int end):
+        '''return coverage in region on *contig* bounded by
+        *start* and *end* as a :class:`CoverageTrackBigwig`.
+        '''
+        if end - start <= 0:
+            return None
+
+        d = wigfile.summarize(contig, start, end, end - start)
+        if d is None:
+            return None
 
+        return CoverageTrackBigwig(start, d.sum_data, d.valid_count)
@@ -0,0 +1,315 @@
+from pysam.chtslib cimport *
+from pysam.csamfile cimport *
+from libc.stdint cimport uint32_t, uint64_t
+from libc.stdlib cimport calloc, free
+from libc.string cimport strcmp
+
+import array
+import numpy
+import pysam
+import CGAT.Experiment as E
+
+# flag bits that distinguish alignments of the same read:
+# paired, reverse, read1, read2, secondary
+DEF FLAG_MASK = 0x1d1
+
+# FNV-1a hashing constants
+cdef uint64_t FNV_OFFSET = 14695981039346656037ULL
+cdef uint64_t FNV_PRIME = 1099511628211ULL
+
+
+cdef inline uint64_t hashBytes(uint64_t h, unsigned char * data, int n):
+    '''update hash value *h* with *n* bytes in *data*.'''
+    cdef int x
+    for x from 0 <= x < n:
+        h ^= data[x]
+        h *= FNV_PRIME
+    return h
+
+
+cdef uint64_t getAlignmentKey(bam1_t * b):
+    '''return a key identifying the alignment *b* at its position.
+
+    The key is a hash of the read name, the flag and the cigar
+    string. Contig and position are not part of the key as
+    alignments are compared at the same position only.
+    '''
+    cdef uint32_t flag = b.core.flag & FLAG_MASK
+    cdef uint64_t h = FNV_OFFSET
+    h = hashBytes(h, <unsigned char *>pysam_bam_get_qname(b),
+                  b.core.l_qname)
+    h = hashBytes(h, <unsigned char *>&flag, sizeof(uint32_t))
+    h = hashBytes(h, <unsigned char *>pysam_bam_get_cigar(b),
+                  b.core.n_cigar * sizeof(uint32_t))
+    return h
+
+
+def compareNameSorted(samfiles, outfile,
+                      int max_distance=50,
+                      output_reads="all"):
+    '''compare reads in BAM files sorted by read name.
+
+    All alignments of a read are collected across files and locations
+    within *max_distance* of each other are merged. For each read,
+    the number of alignments (NH) and the coded locations per file are
+    written to *outfile*.
+
+    *output_reads* can be ``all`` to output all reads, ``different``
+    to output only reads whose alignments differ between files or
+    ``none``.
+
+    returns a counter with summary counts.
+    '''
+
+    cdef int nfiles = len(samfiles)
+    cdef int x, last_tid, last_pos, nlocations, nmatches
+    cdef bint output_all = output_reads == "all"
+    cdef bint output_different = output_reads == "different"
+    cdef Samfile samfile
+    cdef bam1_t * b
+    cdef char * target
+    cdef bam1_t ** buffers = <bam1_t **>calloc(nfiles, sizeof(bam1_t *))
+    cdef int * status = <int *>calloc(nfiles, sizeof(int))
+    cdef BGZF ** bgzfs = <BGZF **>calloc(nfiles, sizeof(BGZF *))
+
+    for x from 0 <= x < nfiles:
+        samfile = samfiles[x]
+        bgzfs[x] = hts_get_bgzfp(samfile.htsfile)
+        buffers[x] = <bam1_t *>calloc(1, sizeof(bam1_t))
+        status[x] = bam_read1(bgzfs[x], buffers[x])
+
+    counter = E.Counter()
+
+    while True:
+
+        # find smallest read name
+        target = NULL
+        for x from 0 <= x < nfiles:
+            if status[x] <= 0:
+                continue
+            if target == NULL or \
+               strcmp(pysam_bam_get_qname(buffers[x]), target) < 0:
+                target = pysam_bam_get_qname(buffers[x])
+
+        if target == NULL:
+            break
+
+        # copy, as buffers will be overwritten
+        readname = <bytes>target
+        target = readname
+
+        # collect locations for read in each file
+        result = []
+        for x from 0 <= x < nfiles:
+            locations = []
+            b = buffers[x]
+            while status[x] > 0 and \
+                    strcmp(pysam_bam_get_qname(b), target) == 0:
+                if not b.core.flag & 4:
+                    locations.append((b.core.tid, b.core.pos))
+                status[x] = bam_read1(bgzfs[x], b)
+            result.append(locations)
+
+        counter.input += 1
+
+        # permit a certain fuzzyness in locations
+        # as some mappers clip and others don't.
+        pos2loc = {}
+        last_tid, last_pos, nlocations = -1, 0, -1
+        for tid, pos in sorted(set([y for r in result for y in r])):
+            if tid != last_tid or pos - last_pos > max_distance:
+                nlocations += 1
+            pos2loc[(tid, pos)] = nlocations
+            last_tid, last_pos = tid, pos
+        nlocations += 1
+
+        # code locations
+        codes, nh = [], []
+        nmatches = 0
+        for locations in result:
+            codes.append(",".join(
+                map(str, sorted([pos2loc[y] for y in locations]))))
+            nh.append(len(locations))
+            if len(locations):
+                nmatches += 1
+
+        if nmatches < nfiles:
+            counter.missing += 1
+
+        if len(set(codes)) == 1:
+            counter.identical += 1
+            if not output_all:
+                continue
+        else:
+            counter.different += 1
+            if not (output_all or output_different):
+                continue
+
+        counter.output += 1
+        outfile.write("%s\t%i\t%i\t%s\t%s\n" % (
+            readname,
+            nlocations,
+            nmatches,
+            "\t".join(["%i" % y for y in nh]),
+            "\t".join(codes)))
+
+    for x from 0 <= x < nfiles:
+        bam_destroy1(buffers[x])
+    free(buffers)
+    free(status)
+    free(bgzfs)
+
+    return counter
+
+
+cdef AlignedSegment nextRead(iterator, int start, int end):
+    '''return next mapped read starting within *start* and *end*.
+
+    returns None if there are no more reads.
+    '''
+    cdef AlignedSegment read
+    for read in iterator:
+        if read._delegate.core.flag & 4:
+            continue
+        if read._delegate.core.pos < start:
+            continue
+        if read._delegate.core.pos >= end:
+            return None
+        return read
+    return None
+
+
+cdef scanRegion(iterator, int start, int end):
+    '''return arrays of positions, alignment keys and flags of
+    mapped reads starting within *start* and *end*.'''
+    cdef AlignedSegment read
+    positions = array.array("l")
+    keys = array.array("L")
+    flags = array.array("i")
+    read = nextRead(iterator, start, end)
+    while read is not None:
+        positions.append(read._delegate.core.pos)
+        keys.append(getAlignmentKey(read._delegate))
+        flags.append(read._delegate.core.flag)
+        read = nextRead(iterator, start, end)
+    return (toNumpy(positions, numpy.int_),
+            toNumpy(keys, numpy.uint),
+            toNumpy(flags, numpy.intc))
+
+
+def toNumpy(values, dtype):
+    '''return the array.array *values* as a numpy array.'''
+    if len(values) == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.frombuffer(values, dtype=dtype)
+
+
+def getReadNames(iterator, int start, int end, indices):
+    '''return names of the mapped reads at *indices* among the
+    reads starting within *start* and *end*. *indices* need to
+    be sorted.'''
+    cdef AlignedSegment read
+    cdef long x = 0
+    names = []
+    if len(indices) == 0:
+        return names
+    it = iter(indices)
+    index = next(it)
+    read = nextRead(iterator, start, end)
+    while read is not None:
+        if x == index:
+            names.append(read.qname)
+            index = next(it, -1)
+            if index < 0:
+                break
+        x += 1
+        read = nextRead(iterator, start, end)
+    return names
+
+
+def compareCoordinateSorted(filenames, contig, int start, int end,
+                            output_reads="none"):
+    '''compare alignments in BAM files sorted by coordinate.
+
+    Alignments starting within *contig*:*start*-*end* are merged by
+    position and compared by a key built from read name, flag and
+    cigar string. Positions, keys and flags of the alignments in
+    each file are collected in arrays and grouped by sorting.
+
+    returns a tuple (counts, reads). *counts* maps a bit pattern
+    of files containing an alignment to the number of such
+    alignments. *reads* is a tuple of arrays (positions, read names,
+    flags, patterns) of alignments that are missing in at least one
+    file if *output_reads* is ``different`` or of all alignments if
+    *output_reads* is ``all``. Alignments are sorted by position,
+    read name, flag and pattern.
+    '''
+
+    cdef int nfiles = len(filenames)
+    cdef int x
+    cdef int all_pattern = (1 << nfiles) - 1
+    cdef bint output_all = output_reads == "all"
+    cdef bint output_different = output_reads == "different"
+
+    positions, keys, flags, files, indices = [], [], [], [], []
+    for x from 0 <= x < nfiles:
+        samfile = pysam.Samfile(filenames[x], "rb")
+        p, k, f = scanRegion(samfile.fetch(contig, start, end), start, end)
+        samfile.close()
+        positions.append(p)
+        keys.append(k)
+        flags.append(f)
+        files.append(numpy.zeros(len(p), dtype=numpy.intc) + x)
+        indices.append(numpy.arange(len(p)))
+
+    positions = numpy.concatenate(positions)
+    keys = numpy.concatenate(keys)
+    flags = numpy.concatenate(flags)
+    files = numpy.concatenate(files)
+    indices = numpy.concatenate(indices)
+
+    # group identical alignments at the same position. The sort is
+    # stable, so the last alignment of a group is from the last file.
+    order = numpy.lexsort((keys, positions))
+    positions, keys = positions[order], keys[order]
+    flags, files, indices = flags[order], files[order], indices[order]
+    first = numpy.ones(len(positions), dtype=numpy.bool)
+    first[1:] = (positions[1:] != positions[:-1]) | (keys[1:] != keys[:-1])
+    starts = numpy.flatnonzero(first)
+    if len(starts):
+        patterns = numpy.bitwise_or.reduceat(
+            numpy.left_shift(1, files), starts)
+    else:
+        patterns = numpy.zeros(0, dtype=numpy.int_)
+
+    counts = dict([(pattern, int(count)) for pattern, count in
+                   enumerate(numpy.bincount(patterns)) if count])
+
+    if output_all:
+        selected = numpy.arange(len(starts))
+    elif output_different:
+        selected = numpy.flatnonzero(patterns != all_pattern)
+    else:
+        selected = numpy.zeros(0, dtype=numpy.int_)
+
+    # the last alignment of each selected group
+    last = numpy.append(starts[1:], len(positions)) - 1
+    last = last[selected]
+
+    # read names are only needed for output, they are collected
+    # in a second pass
+    names = numpy.zeros(len(last), dtype=object)
+    for x from 0 <= x < nfiles:
+        in_file = numpy.flatnonzero(files[last] == x)
+        in_file = in_file[numpy.argsort(indices[last][in_file])]
+        samfile = pysam.Samfile(filenames[x], "rb")
+        names[in_file] = getReadNames(samfile.fetch(contig, start, end),
+                                      start, end,
+                                      indices[last][in_file])
+        samfile.close()
+
+    reads = (positions[last], names.astype(str), flags[last],
+             patterns[selected])
+    order = numpy.lexsort((reads[3], reads[2], reads[1], reads[0]))
+
+    return counts, tuple([values[order] for values in reads])
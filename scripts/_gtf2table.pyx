@@ -601,6 +601,206 @@ class CounterBAM(Counter):
             ['quality_pairs', 'quality_reads']
 
 
+def _asArray(values, dtype):
+    '''return numpy view of array.array *values*.'''
+    if len(values) == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.frombuffer(values, dtype=dtype)
+
+
+class BarcodeCounts(object):
+    '''sparse counts of reads per gene, barcode and category.
+
+    Barcodes and UMIs are interned to integer ids. Reads are
+    accumulated for one gene at a time (:meth:`startGene`,
+    :meth:`add` and :meth:`finishGene`) and the counts of each gene
+    are appended to growable coordinate arrays.
+
+    The barcode and UMI of a read are taken from the tags *barcode_tag*
+    and *umi_tag* or from the groups ``barcode`` and ``umi`` of the
+    regular expression *barcode_regex* applied to the read name. By
+    default, the barcode is the last field of the read name, where
+    fields are separated by underscores.
+
+    If *collapse_umis* is set, only the first read of each barcode,
+    UMI and category is counted within a gene.
+
+    Reads without the barcode tag, or without the UMI tag if
+    *umi_tag* is given, are skipped and counted in :attr:`nskipped`.
+    '''
+
+    def __init__(self, categories,
+                 barcode_regex=None,
+                 barcode_tag=None,
+                 umi_tag=None,
+                 collapse_umis=True):
+
+        self.categories = list(categories)
+        self.collapse_umis = collapse_umis
+        self.barcode_tag = barcode_tag
+        self.umi_tag = umi_tag
+        if barcode_regex is not None:
+            self.barcode_regex = re.compile(barcode_regex)
+        else:
+            self.barcode_regex = None
+
+        self.nskipped = 0
+        self.gene_ids = []
+        self.barcodes = []
+        self.map_barcode2id = {}
+        self.map_umi2id = {}
+
+        # coordinates and counts of all genes
+        self.gene_index = array.array("l")
+        self.barcode_index = array.array("l")
+        self.category_index = array.array("l")
+        self.counts = array.array("d")
+
+    def getBarcode(self, read):
+        '''return barcode and UMI id of *read*.
+
+        The UMI id is -1 if no UMI is given. The barcode id is -1 if
+        the read has no barcode or UMI tag.
+        '''
+        umi = None
+        if self.barcode_regex is not None:
+            match = self.barcode_regex.search(read.qname)
+            if match is None:
+                raise ValueError(
+                    "could not extract barcode from read %s" % read.qname)
+            groups = match.groupdict()
+            barcode = groups.get("barcode", None)
+            umi = groups.get("umi", None)
+        elif self.barcode_tag is None:
+            barcode = read.qname.split("_")[-1]
+        else:
+            barcode = None
+
+        try:
+            if self.barcode_tag is not None:
+                barcode = read.opt(self.barcode_tag)
+            if self.umi_tag is not None:
+                umi = read.opt(self.umi_tag)
+        except KeyError:
+            self.nskipped += 1
+            return -1, -1
+
+        try:
+            barcode_id = self.map_barcode2id[barcode]
+        except KeyError:
+            barcode_id = self.map_barcode2id[barcode] = len(self.barcodes)
+            self.barcodes.append(barcode)
+
+        if umi is None:
+            return barcode_id, -1
+
+        try:
+            umi_id = self.map_umi2id[umi]
+        except KeyError:
+            umi_id = self.map_umi2id[umi] = len(self.map_umi2id)
+
+        return barcode_id, umi_id
+
+    def startGene(self, gene_id):
+        '''start counting reads for *gene_id*.'''
+        self.gene_ids.append(gene_id)
+        self._barcodes = array.array("l")
+        self._umis = array.array("l")
+        self._categories = array.array("l")
+        self._weights = array.array("d")
+
+    def add(self, barcode_id, umi_id, category, weight):
+        '''add a read to the current gene.'''
+        self._barcodes.append(barcode_id)
+        self._umis.append(umi_id)
+        self._categories.append(category)
+        self._weights.append(weight)
+
+    def finishGene(self):
+        '''collect the counts of the current gene.
+
+        returns the counts per category summed over all barcodes.
+        '''
+        ncategories = len(self.categories)
+        if len(self._weights) == 0:
+            return numpy.zeros(ncategories, numpy.float)
+
+        barcodes = _asArray(self._barcodes, numpy.int_)
+        categories = _asArray(self._categories, numpy.int_)
+        weights = _asArray(self._weights, numpy.float)
+
+        if self.collapse_umis:
+            # keep the first read of each barcode, umi and category
+            umis = _asArray(self._umis, numpy.int_)
+            key = (barcodes * (len(self.map_umi2id) + 1) +
+                   umis + 1) * ncategories + categories
+            key, first = numpy.unique(key, return_index=True)
+            barcodes = barcodes[first]
+            categories = categories[first]
+            weights = weights[first]
+
+        key, inverse = numpy.unique(barcodes * ncategories + categories,
+                                    return_inverse=True)
+        counts = numpy.bincount(inverse, weights=weights)
+
+        self.gene_index.extend([len(self.gene_ids) - 1] * len(key))
+        self.barcode_index.extend(key // ncategories)
+        self.category_index.extend(key % ncategories)
+        self.counts.extend(counts)
+
+        return numpy.bincount(categories, weights=weights,
+                              minlength=ncategories)
+
+    def getMatrix(self):
+        '''return counts as a sparse matrix.
+
+        Rows are all combinations of genes and categories and columns
+        are barcodes.
+        '''
+        import scipy.sparse
+        rows = (_asArray(self.gene_index, numpy.int_) *
+                len(self.categories) +
+                _asArray(self.category_index, numpy.int_))
+        return scipy.sparse.coo_matrix(
+            (_asArray(self.counts, numpy.float),
+             (rows, _asArray(self.barcode_index, numpy.int_))),
+            shape=(len(self.gene_ids) * len(self.categories),
+                   len(self.barcodes)))
+
+    def writeMatrixMarket(self, filename_pattern):
+        '''write counts in Matrix Market format.
+
+        Row and column names are written to separate files.
+        '''
+        import scipy.io
+        scipy.io.mmwrite(filename_pattern % "matrix.mtx", self.getMatrix())
+
+        outf = IOTools.openFile(filename_pattern % "rows.tsv.gz", "w")
+        outf.write("gene_id\tcategory\n")
+        for gene_id in self.gene_ids:
+            for category in self.categories:
+                outf.write("%s\t%s\n" % (gene_id, category))
+        outf.close()
+
+        outf = IOTools.openFile(filename_pattern % "barcodes.tsv.gz", "w")
+        outf.write("barcode\n")
+        for barcode in self.barcodes:
+            outf.write("%s\n" % barcode)
+        outf.close()
+
+    def writeNumpy(self, filename):
+        '''write coordinates and counts as a compressed numpy archive.'''
+        numpy.savez_compressed(
+            filename,
+            gene=_asArray(self.gene_index, numpy.int_),
+            barcode=_asArray(self.barcode_index, numpy.int_),
+            category=_asArray(self.category_index, numpy.int_),
+            counts=_asArray(self.counts, numpy.float),
+            gene_ids=numpy.array(self.gene_ids),
+            barcodes=numpy.array(self.barcodes),
+            categories=numpy.array(self.categories))
+
+
 class CounterReadCountsFull(CounterBAM):
     '''compute number of reads overlapping with exoIsoform
 
@@ -669,7 +869,14 @@ class CounterReadCountsFull(CounterBAM):
     ``True``. The barcode of a read is given as a suffix of the read
     name starting with an underscore. For example, for read
     ``illq_1231_XYZ`` the barcode will be XYZ. When barcodes are enabled,
-    counts will be computed per barcode.
+    counts will be computed per barcode and, if *collapse_umis* is set,
+    only the first read of each barcode (and UMI) is counted in each
+    category. Alternatively,
+    barcodes and UMIs can be taken from the read name with
+    *barcode_regex* or from the tags *barcode_tag* and *umi_tag*,
+    see :class:`BarcodeCounts`. The counts per barcode are collected in
+    :attr:`barcode_counts`, the table output contains the counts summed
+    over all barcodes.
     '''
     
     headers_direction = ('sense', 'antisense')
@@ -679,6 +886,10 @@ class CounterReadCountsFull(CounterBAM):
     def __init__(self, 
                  *args,
                  use_barcodes=False,
+                 barcode_regex=None,
+                 barcode_tag=None,
+                 umi_tag=None,
+                 collapse_umis=True,
                  **kwargs ):
         CounterBAM.__init__(self, *args, **kwargs)
         self.use_barcodes = use_barcodes
@@ -690,6 +901,16 @@ class CounterReadCountsFull(CounterBAM):
                                 self.headers_splicing)] +\
             ['quality_reads']
 
+        if use_barcodes:
+            self.barcode_counts = BarcodeCounts(
+                self.header[:-1],
+                barcode_regex=barcode_regex,
+                barcode_tag=barcode_tag,
+                umi_tag=umi_tag,
+                collapse_umis=collapse_umis)
+        else:
+            self.barcode_counts = None
+
     def count(self):
         '''count all reads equally.'''
 
@@ -790,8 +1011,15 @@ class CounterReadCountsFull(CounterBAM):
         # retrieve all reads
         reads = []
 
+        cdef int barcode_id = 0
+        cdef int umi_id = -1
+        barcode_counts = self.barcode_counts
         if use_barcodes:
-            barcode_counters = {}
+            if self.options is not None and \
+               self.options.reporter == "transcripts":
+                barcode_counts.startGene(self.mGFFs[0].transcript_id)
+            else:
+                barcode_counts.startGene(self.getGeneId())
         else:
             counters = get_counters()
 
@@ -812,8 +1040,9 @@ class CounterReadCountsFull(CounterBAM):
                     continue                   
 
                 if use_barcodes:
-                    barcode = read.qname.split("_")[-1]
-                    barcode_counters[barcode] = get_counters()
+                    barcode_id, umi_id = barcode_counts.getBarcode(read)
+                    if barcode_id < 0:
+                        continue
 
                 # Iterate over blocks within reads and 
                 # compute overlap with exons, introns, etc.
@@ -937,11 +1166,13 @@ class CounterReadCountsFull(CounterBAM):
                 counters_index = (direction_status, exons_status, spliced_status)
 
                 if use_barcodes:
-                    '''only the first read is counted'''
-                    if barcode_counters[barcode][counters_index] == 0:
-                        barcode_counters[barcode][counters_index] += weight
-                    else:
-                        continue
+                    # only the first read is counted, see
+                    # BarcodeCounts.finishGene
+                    barcode_counts.add(
+                        barcode_id, umi_id,
+                        (direction_status * nexons_status +
+                         exons_status) * nspliced_status + spliced_status,
+                        weight)
                 else:
                     counters[counters_index] += weight
 
@@ -951,9 +1182,10 @@ class CounterReadCountsFull(CounterBAM):
         free(exon_ends)
 
         if use_barcodes:
-            counters = get_counters()
-            for key, value in barcode_counters.iteritems():
-                counters += value
+            counters = barcode_counts.finishGene()
+            counters.shape = (ndirection_status,
+                              nexons_status,
+                              nspliced_status)
 
         if not weight_multi_mapping:
             # convert to full counts
@@ -21,6 +21,19 @@ statistical significance of the observed counts.
 
 The script implements various sampling and counting methods.
 
+Samples are simulated in batches (``--batch-size``). Within a batch,
+segment positions for all samples in a workspace are computed at once
+and counted with numpy. Batches can be distributed over several
+processes (``--num-threads``). Each batch is seeded from the
+``--random-seed`` and its batch number, so results are reproducible
+independent of the number of processes used.
+
+The FDR (q-value) of an observed p-value is estimated from the
+p-values of the simulated samples. The simulated p-values are pooled
+over all counters and labels (``--no-fdr`` disables the estimation).
+Previous versions only used the simulated p-values of the last counter
+and label, so q-values differ from those versions.
+
 Usage
 -----
 
@@ -39,6 +52,7 @@ import sys
 import optparse
 import collections
 import itertools
+import multiprocessing
 import CGAT.GTF as GTF
 import CGAT.Bed as Bed
 import CGAT.Intervals as Intervals
@@ -62,6 +76,50 @@ cumulative_transform = lambda x, y: numpy.cumsum(
     numpy.array(x, float) / (sum(x) + y))
 
 
+def resolveArray(values, resolution):
+    """return bins for an array of *values* at *resolution*."""
+    if resolution > 1:
+        return values // resolution
+    else:
+        return values
+
+
+def percentileOfScore(values, scores):
+    """return percentiles of *scores* within the sorted array *values*.
+
+    This is a vectorized version of :func:`scipy.stats.percentileofscore`
+    with ``kind="rank"``.
+    """
+    left = numpy.searchsorted(values, scores, side="left")
+    right = numpy.searchsorted(values, scores, side="right")
+    return (left + right + (right > left)) * 50.0 / len(values)
+
+
+def mergeSorted(values, new_values):
+    """merge *new_values* into the sorted array *values*."""
+    new_values = numpy.sort(numpy.asarray(new_values, numpy.float))
+    return numpy.insert(values,
+                        numpy.searchsorted(values, new_values),
+                        new_values)
+
+
+def getSimulatedPValues(counters, labels):
+    """return sorted p-values of the simulated medians.
+
+    P-values of the medians of each sample are computed within each
+    counter and label and are pooled over all *counters* and *labels*.
+    """
+    sim_pvalues = []
+    for counter in counters:
+        for label in labels:
+            E.info("working on counter:%s label:%s" % (counter, label))
+            medians = numpy.sort(counter.getMedians(label))
+            sim_pvalues.extend(percentileOfScore(medians, medians) / 100.0)
+
+    sim_pvalues.sort()
+    return sim_pvalues
+
+
 def readWorkspace(infile,
                   workspace_builder="raw",
                   label="none",
@@ -276,6 +334,24 @@ class Sampler(object):
     def sample(self):
         raise NotImplementedError("define sample() in base classes")
 
+    def sampleBatch(self, num_samples, rng=numpy.random):
+        """return simulated fragments for *num_samples* samples.
+
+        returns a tuple of two arrays (starts, ends) with one row per
+        sample and one column per segment. Segments within a row are
+        sorted by position.
+
+        The default implementation calls :meth:`sample` repeatedly.
+        """
+        nsegments = len(self.mLengths)
+        starts = numpy.zeros((num_samples, nsegments), numpy.int64)
+        ends = numpy.zeros((num_samples, nsegments), numpy.int64)
+        for x in range(num_samples):
+            simulated = self.sample()
+            starts[x] = [s for s, e in simulated]
+            ends[x] = [e for s, e in simulated]
+        return starts, ends
+
 
 class SamplerPermutation(Sampler):
 
@@ -313,6 +389,26 @@ class SamplerPermutation(Sampler):
 
         return simulated
 
+    def sampleBatch(self, num_samples, rng=numpy.random):
+        """return simulated fragments for *num_samples* samples.
+
+        Vectorized version of :meth:`sample`.
+        """
+        nsegments = len(self.mLengths)
+        # 1. permutate order of segments in each sample
+        order = numpy.argsort(
+            rng.random_sample((num_samples, nsegments)), axis=1)
+        lengths = numpy.array(self.mLengths, numpy.int64)[order]
+        # 2. determine size of space between samples
+        points = rng.randint(0, self.mFreeLength + 1,
+                             size=(num_samples, nsegments + 1))
+        points.sort(axis=1)
+        # 3. a segment starts after its gap and all segments before it
+        starts = self.mWorkStart + points[:, :nsegments] + \
+            numpy.cumsum(lengths, axis=1) - lengths
+
+        return starts, starts + lengths
+
 
 class SamplerBlocks(Sampler):
 
@@ -350,6 +446,27 @@ class SamplerGaps(Sampler):
 
         return simulated
 
+    def sampleBatch(self, num_samples, rng=numpy.random):
+        """return simulated fragments for *num_samples* samples.
+
+        Vectorized version of :meth:`sample`.
+        """
+        nsegments = len(self.mLengths)
+        # pad with empty gaps for adjacent segments, but keep all
+        # real gaps as in :meth:`sample`
+        gaps = numpy.zeros(max(nsegments, len(self.mGapLengths)),
+                           numpy.int64)
+        gaps[:len(self.mGapLengths)] = self.mGapLengths
+        order = numpy.argsort(
+            rng.random_sample((num_samples, len(gaps))), axis=1)
+        gaps = gaps[order][:, :nsegments]
+        lengths = numpy.array(self.mLengths, numpy.int64)
+
+        starts = self.mWorkStart + numpy.cumsum(gaps, axis=1) + \
+            numpy.cumsum(lengths) - lengths
+
+        return starts, starts + lengths
+
 
 class CountingResults(object):
 
@@ -367,6 +484,10 @@ class CountingResults(object):
         self.mSimulatedCounts = None
         self.mStats = None
 
+        # sorted p-values seen by updateFDR
+        self.mObservedPValues = numpy.array([], numpy.float)
+        self.mSimulatedPValues = numpy.array([], numpy.float)
+
     def updateFDR(self, obs_pvalues, sim_pvalues):
         """compute fdr stats with given counts.
 
@@ -381,17 +502,27 @@ class CountingResults(object):
         As there are several counters and labels, all observed and simulated pvalues
         are taken into account.
 
+        The method can be called repeatedly. P-Values are added to those
+        of previous calls, so the FDR can be updated incrementally as
+        more simulations become available.
+
         The method needs to be called after :meth:update.
         """
 
         assert self.mStats is not None, "updateFDR called before calling update."
 
+        self.mObservedPValues = mergeSorted(
+            self.mObservedPValues, obs_pvalues)
+        self.mSimulatedPValues = mergeSorted(
+            self.mSimulatedPValues, sim_pvalues)
+
+        nobserved = len(self.mObservedPValues)
         for label in self.mLabels:
             pvalue = self.mStats[label].pvalue
-            a = scipy.stats.percentileofscore(sim_palues, pvalue) / 100.0
-            b = scipy.stats.percentileofscore(
-                obs_pvalues, pvalue) / 100.0 * len(obs_pvalues)
-            if b >= 0:
+            a = percentileOfScore(self.mSimulatedPValues, pvalue) / 100.0
+            b = percentileOfScore(
+                self.mObservedPValues, pvalue) / 100.0 * nobserved
+            if b > 0:
                 qvalue = min(1.0, a / b)
             else:
                 qvalue = 0
@@ -437,14 +568,11 @@ class CountingResults(object):
             medians = []
 
             for x in range(num_samples):
-                data = self.mSimulatedCounts[x][label]
+                data = numpy.cumsum(self.mSimulatedCounts[x][label])
                 threshold = self.mSimulatedCounts[x].mTotals[label] / 2
-                t = 0
-                for d in range(len(data)):
-                    if t > threshold:
-                        break
-                    t += data[d]
-                medians.append(d)
+                # first bin after the cumulative counts exceed threshold
+                d = numpy.searchsorted(data, threshold, side="right") + 1
+                medians.append(min(d, len(data) - 1))
 
             self.mMedians[label] = medians
 
@@ -505,6 +633,9 @@ class Counter(object):
     mBuildCounts = lambda self, num_bins, dtype: array.array(
         "I", [0] * num_bins)
 
+    # segments are counted in a single bin
+    mCountRanges = False
+
     def __init__(self, labels, num_bins, resolution=1, dtype=numpy.int8):
 
         self.mCounts = {}
@@ -534,6 +665,20 @@ class Counter(object):
         else:
             return value
 
+    @staticmethod
+    def getBatchPositions(starts, ends, start, end, resolution):
+        """return bins for a batch of simulated samples.
+
+        *starts* and *ends* are arrays with one row per sample as
+        returned by :meth:`Sampler.sampleBatch`.
+
+        returns a tuple for the left and for the right end of the
+        workspace. Each tuple contains a mask of counted segments,
+        the bin of each segment and the number of bins to count.
+        """
+        raise NotImplementedError(
+            "define getBatchPositions() in base classes")
+
 
 class CounterTranscription(Counter):
 
@@ -544,6 +689,17 @@ class CounterTranscription(Counter):
     # numpy is fastest for counting with blocks of data
     mBuildCounts = lambda self, num_bins, dtype: numpy.zeros(num_bins, dtype)
 
+    # segments are counted in all bins they cover
+    mCountRanges = True
+
+    @staticmethod
+    def getBatchPositions(starts, ends, start, end, resolution):
+        lengths = resolveArray(ends - starts, resolution)
+        dl = starts - start
+        dr = end - ends
+        return ((dl < dr, resolveArray(dl, resolution), lengths),
+                (dl > dr, resolveArray(dr, resolution), lengths))
+
     def addCounts(self, rr, start, end, left_labels, right_labels):
 
         counts = self.mCounts
@@ -582,6 +738,14 @@ class CounterClosestDistance(Counter):
 
     mName = "Closest distance"
 
+    @staticmethod
+    def getBatchPositions(starts, ends, start, end, resolution):
+        left = resolveArray(starts[:, :1] - start, resolution)
+        right = resolveArray(end - ends[:, -1:], resolution)
+        mask = numpy.ones(left.shape, numpy.bool)
+        ones = numpy.ones(left.shape, numpy.int64)
+        return ((mask, left, ones), (mask, right, ones))
+
     def addCounts(self, rr, start, end, left_labels, right_labels):
 
         counts = self.mCounts
@@ -612,6 +776,14 @@ class CounterAllDistances(Counter):
 
     mName = "All distances"
 
+    @staticmethod
+    def getBatchPositions(starts, ends, start, end, resolution):
+        dl = starts - start
+        dr = end - ends
+        ones = numpy.ones(starts.shape, numpy.int64)
+        return ((dl < dr, resolveArray(dl, resolution), ones),
+                (dl > dr, resolveArray(dr, resolution), ones))
+
     def addCounts(self, rr, start, end, left_labels, right_labels):
 
         counts = self.mCounts
@@ -642,6 +814,131 @@ class CounterAllDistances(Counter):
                     totals[label] += 1
 
 
+class SampleCounts(object):
+
+    """counts for a batch of simulated samples.
+
+    Counts are kept in a matrix with one row per sample and
+    are updated for all samples in a workspace at once.
+    """
+
+    def __init__(self, counter, labels, num_samples, num_bins, resolution=1):
+
+        self.mCounter = counter
+        self.mNumSamples = num_samples
+        self.mNumBins = num_bins
+        self.mResolution = resolution
+
+        self.mCounts = {}
+        self.mTotals = {}
+        self.mOutOfBounds = {}
+        for l in labels:
+            self.mCounts[l] = numpy.zeros((num_samples, num_bins), numpy.int64)
+            self.mTotals[l] = numpy.zeros(num_samples, numpy.int64)
+            self.mOutOfBounds[l] = numpy.zeros(num_samples, numpy.int64)
+
+    def addCounts(self, starts, ends, start, end, left_labels, right_labels):
+        """add counts for simulated segments in a workspace."""
+
+        nsamples, nbins = self.mNumSamples, self.mNumBins
+
+        sides = self.mCounter.getBatchPositions(
+            starts, ends, start, end, self.mResolution)
+
+        for labels, (mask, pos, lengths) in zip((left_labels, right_labels),
+                                                sides):
+            if not labels:
+                continue
+
+            rows, cols = numpy.nonzero(mask)
+            pos, lengths = pos[rows, cols], lengths[rows, cols]
+            inside = pos < nbins
+
+            totals = numpy.bincount(
+                rows, weights=lengths, minlength=nsamples).astype(numpy.int64)
+            ofb = numpy.bincount(
+                rows[~inside], weights=lengths[~inside],
+                minlength=nsamples).astype(numpy.int64)
+
+            rows, pos, lengths = rows[inside], pos[inside], lengths[inside]
+            if self.mCounter.mCountRanges:
+                # difference array with an extra column for overhangs
+                width = nbins + 1
+                delta = numpy.bincount(
+                    rows * width + pos,
+                    minlength=nsamples * width) - \
+                    numpy.bincount(
+                        rows * width + numpy.minimum(pos + lengths, nbins),
+                        minlength=nsamples * width)
+                counts = numpy.cumsum(
+                    delta.reshape(nsamples, width), axis=1)[:, :nbins]
+            else:
+                counts = numpy.bincount(
+                    rows * nbins + pos,
+                    minlength=nsamples * nbins).reshape(nsamples, nbins)
+
+            for label in labels:
+                self.mCounts[label] += counts
+                self.mTotals[label] += totals
+                self.mOutOfBounds[label] += ofb
+
+    def toCounters(self, dtype):
+        """return a list of counters, one for each sample."""
+        labels = self.mCounts.keys()
+        result = []
+        for x in range(self.mNumSamples):
+            counter = self.mCounter(
+                labels, 0, self.mResolution, dtype=dtype)
+            counter.mNumBins = self.mNumBins
+            for label in labels:
+                counter.mCounts[label] = self.mCounts[label][x].astype(dtype)
+                counter.mTotals[label] = int(self.mTotals[label][x])
+                counter.mOutOfBounds[label] = int(
+                    self.mOutOfBounds[label][x])
+            result.append(counter)
+        return result
+
+
+# shared state of sampling processes, see initSampling()
+SAMPLING_STATE = None
+
+
+def initSampling(*args):
+    """initialize state for :func:`sampleBatch`."""
+    global SAMPLING_STATE
+    SAMPLING_STATE = args
+
+
+def sampleBatch(args):
+    """simulate a batch of samples in all workspaces.
+
+    The random number generator is seeded by the batch number so that
+    results do not depend on the number of processes used.
+
+    returns a list of per-sample counters for each counter class.
+    """
+
+    batch, num_samples, seed = args
+    workspaces, sampler, counters, labels, num_bins, resolution, dtype = \
+        SAMPLING_STATE
+
+    rng = numpy.random.RandomState([seed, batch])
+
+    sample_counts = [SampleCounts(counter, labels, num_samples,
+                                  num_bins, resolution)
+                     for counter in counters]
+
+    for observed, work_start, work_end, left_labels, right_labels in \
+            workspaces:
+        starts, ends = sampler(
+            observed, work_start, work_end).sampleBatch(num_samples, rng)
+        for c in sample_counts:
+            c.addCounts(starts, ends, work_start, work_end,
+                        left_labels, right_labels)
+
+    return [c.toCounters(dtype) for c in sample_counts]
+
+
 def indexIntervals(intervals, with_values=False):
     """index intervals using bx.
     """
@@ -790,6 +1087,12 @@ def main(argv=sys.argv):
     parser.add_option("--keep-ambiguous", dest="keep_ambiguous", action="store_true",
                       help="keep segments extending to more than one workspace [default=%default]")
 
+    parser.add_option("--batch-size", dest="batch_size", type="int",
+                      help="number of samples to simulate at once [default=%default]")
+
+    parser.add_option("--num-threads", dest="num_threads", type="int",
+                      help="number of processes to use for simulation [default=%default]")
+
     parser.set_defaults(
         filename_annotations=None,
         filename_workspace="workspace.gff",
@@ -816,6 +1119,8 @@ def main(argv=sys.argv):
         hardcopy="%s.png",
         segments_format="gtf",
         remove_overhangs=False,
+        batch_size=100,
+        num_threads=1,
     )
 
     (options, args) = E.Start(parser, argv=argv, add_output_options=True)
@@ -930,19 +1235,16 @@ def main(argv=sys.argv):
         c = CountingResults(labels)
         c.mObservedCounts = counter(
             labels, options.num_bins, options.resolution, dtype=dtype)
-
-        simulated_counts = []
-        for x in range(options.num_samples):
-            simulated_counts.append(
-                counter(labels, options.num_bins, options.resolution, dtype=dtype))
-        c.mSimulatedCounts = simulated_counts
+        c.mSimulatedCounts = []
         c.mName = c.mObservedCounts.mName
+        c.mCounter = counter
 
         counters.append(c)
 
         E.info("allocated memory successfully")
 
     segments_per_workspace = []
+    sample_workspaces = []
     segment_sizes = []
     segments_per_label = collections.defaultdict(int)
     workspaces_per_label = collections.defaultdict(int)
@@ -999,17 +1301,46 @@ def main(argv=sys.argv):
                 counter.mObservedCounts.addCounts(
                     observed, work_start, work_end, left_labels, right_labels)
 
-            # create sampler
-            s = sampler(observed, work_start, work_end)
-
-            # add simulated counts
-            for iteration in range(options.num_samples):
-                simulated = s.sample()
-                for counter in counters:
-                    counter.mSimulatedCounts[iteration].addCounts(
-                        simulated, work_start, work_end, left_labels, right_labels)
+            sample_workspaces.append(
+                (observed, work_start, work_end, left_labels, right_labels))
 
     E.info("counting finished")
+
+    ############################################
+    # get simulated counts in batches of samples
+    batches = []
+    for batch, start in enumerate(range(0, options.num_samples,
+                                        options.batch_size)):
+        batches.append(
+            (batch, min(options.batch_size, options.num_samples - start)))
+
+    seed = random.randint(0, 2 ** 31 - 1)
+    state = (sample_workspaces, sampler, [c.mCounter for c in counters],
+             labels, options.num_bins, options.resolution, dtype)
+
+    E.info("simulating %i samples in %i batches using %i processes" %
+           (options.num_samples, len(batches), options.num_threads))
+
+    jobs = [(batch, num_samples, seed) for batch, num_samples in batches]
+    if options.num_threads > 1:
+        pool = multiprocessing.Pool(options.num_threads,
+                                    initializer=initSampling,
+                                    initargs=state)
+        results = pool.imap(sampleBatch, jobs)
+    else:
+        initSampling(*state)
+        results = itertools.imap(sampleBatch, jobs)
+
+    for batch, simulated in enumerate(results):
+        E.debug("finished batch %i/%i" % (batch + 1, len(batches)))
+        for counter, counts in zip(counters, simulated):
+            counter.mSimulatedCounts.extend(counts)
+
+    if options.num_threads > 1:
+        pool.close()
+        pool.join()
+
+    E.info("simulation finished")
     E.info("nworkspaces=%i, nmiddle=%i, nempty_workspaces=%i, nempty_contigs=%i" %
            (nworkspaces, nmiddle, nempty_workspaces, nempty_contigs))
 
@@ -1041,20 +1372,7 @@ def main(argv=sys.argv):
     # qvalue = expected false positives /
     if options.do_fdr:
         E.info("computing pvalues for fdr")
-        for counter in counters:
-            for label in labels:
-                E.info("working on counter:%s label:%s" % (counter, label))
-
-                # collect all P-Values of simulated results to compute FDR
-                sim_pvalues = []
-                medians = counter.getMedians(label)
-
-                for median in medians:
-                    pvalue = float(
-                        scipy.stats.percentileofscore(medians, median)) / 100.0
-                    sim_pvalues.append(pvalue)
-
-        sim_pvalues.sort()
+        sim_pvalues = getSimulatedPValues(counters, labels)
     else:
         sim_pvalues = []
 
@@ -148,6 +148,23 @@ exactly 1000000.
 The detail normalization algorithm as follows: norm = sum(all counts
 in all features)/1000000.0 normalized count = normalized count / norm
 
+Option: Batch
++++++++++++++
+
+By default, coverage is computed separately for each interval. With
+``--batch``, intervals are sorted by position and coverage is computed
+once for blocks of neighbouring intervals (see ``--block-size``) in
+the foreground and in each control file. Densities and peak shape
+features for all intervals in a block are then computed at once. This
+is much faster for large numbers of intervals. The output is the same
+and in input order.
+
+If ``--shift-size`` is given, reads are shifted and extended
+consistently across a block. Without ``--batch``, reads are only
+counted if they overlap a window before they are extended, and
+forward strand reads are not shifted fully in windows close to the
+start of a contig, so counts close to the window edges can differ.
+
 .. todo::
 
    paired-endedness is not fully implemented.
@@ -166,6 +183,7 @@ import pysam
 import CGAT.Bed as Bed
 import numpy
 import collections
+import itertools
 import bx.bbi.bigwig_file
 
 try:
@@ -272,7 +290,25 @@ def buildOptionParser(argv):
         "reads will be shifted upstream/downstream by this amount. "
         "[%default]")
 
+    parser.add_option(
+        "--batch", dest="batch", action="store_true",
+        help="compute densities for all intervals from coverage "
+        "that is computed once for blocks of neighbouring intervals. "
+        "Intervals are processed sorted by position, but output "
+        "in input order. With --shift-size, counts close to window "
+        "edges can differ from the default mode, see the "
+        "documentation "
+        "[%default]")
+
+    parser.add_option(
+        "--block-size", dest="block_size", type="int",
+        help="maximum size of a genomic region for which coverage is "
+        "computed at once in batch mode "
+        "[%default]")
+
     parser.set_defaults(
+        batch=False,
+        block_size=1000000,
         bin_size=10,
         shift=0,
         window_size=1000,
@@ -454,6 +490,20 @@ def outputMatrices(features_per_interval,
                                   sort_order)
 
 
+def buildIntervalData(features, bed, control, shifted, strand_specific):
+    '''return an IntervalData tuple for *bed*.'''
+
+    if strand_specific and bed.strand == "-":
+        features._replace(hist=features.hist[::-1])
+        if control:
+            for c in control:
+                c._replace(hist=c.hist[::-1])
+        if shifted:
+            shifted._replace(hist=shifted.hist[::-1])
+
+    return IntervalData._make((features, bed, control, shifted))
+
+
 def buildDensityMatrices(bedfile,
                          fg_file,
                          control_files,
@@ -533,15 +583,157 @@ def buildDensityMatrices(bedfile,
         else:
             shifted = None
 
-        if strand_specific and bed.strand == "-":
-            features._replace(hist=features.hist[::-1])
-            if control:
-                for c in control:
-                    c._replace(hist=c.hist[::-1])
-            if shifted:
-                shifted._replace(hist=shifted.hist[::-1])
+        result.append(buildIntervalData(features, bed, control, shifted,
+                                        strand_specific))
+        c.added += 1
+
+    E.info("interval processing: %s" % c)
+
+    return result, bins
+
+
+def iterateBlocks(intervals, padding, block_size):
+    '''group sorted *intervals* into blocks of overlapping windows.
+
+    Windows extend intervals by *padding* on either side. Blocks are
+    not extended beyond *block_size* unless a single window is
+    larger.
+
+    Yields tuples of (start, end, intervals).
+    '''
+    block_start, block_end, block = None, None, []
+    for interval in intervals:
+        start = max(0, interval.start - padding)
+        end = interval.end + padding
+        if block and (start > block_end or
+                      max(block_end, end) - block_start > block_size):
+            yield block_start, block_end, block
+            block = []
+        if not block:
+            block_start, block_end = start, end
+        block_end = max(block_end, end)
+        block.append(interval)
+
+    if block:
+        yield block_start, block_end, block
+
+
+def buildDensityMatricesBatch(bedfile,
+                              fg_file,
+                              control_files,
+                              counter,
+                              window_size=1000,
+                              bin_size=10,
+                              strand_specific=False,
+                              centring_method="reads",
+                              use_interval=False,
+                              random_shift=False,
+                              smooth_method="none",
+                              report_step=1000,
+                              block_size=1000000):
+    '''compute densities and peakshape parameters
+    in intervals given by *bedfile* using reads in *fg_file*.
+
+    This is a batched version of :func:`buildDensityMatrices`.
+    Intervals are sorted by position and coverage is computed
+    once for blocks of up to *block_size* bases in the foreground
+    and in each of the control files. Densities and peakshape
+    parameters for all intervals within a block are then computed
+    from the shared coverage arrays.
+
+    Results are returned in the same order as in *bedfile*.
+    '''
+
+    bins = numpy.arange(-window_size + bin_size // 2,
+                        +window_size,
+                        bin_size)
+
+    # windows around randomly shifted peaks are further out
+    if random_shift:
+        padding = 3 * window_size
+    else:
+        padding = window_size
+
+    intervals = list(bedfile)
+    c = E.Counter()
+    c.input = len(intervals)
+
+    order = sorted(range(len(intervals)),
+                   key=lambda x: (intervals[x].contig, intervals[x].start))
+
+    features_per_interval = [None] * len(intervals)
+    nblocks = 0
+    for contig, indices in itertools.groupby(
+            order, key=lambda x: intervals[x].contig):
+        indices = list(indices)
+        for block_start, block_end, block in iterateBlocks(
+                [intervals[x] for x in indices], padding, block_size):
+            block_indices, indices = indices[:len(block)], indices[len(block):]
+
+            nblocks += 1
+            if nblocks % report_step == 0:
+                E.info("iteration: %i" % nblocks)
+
+            track = counter.coverageInRegion(fg_file, contig,
+                                             block_start, block_end)
+            if track is None:
+                continue
+
+            features = counter.countInIntervals(
+                track,
+                [x.start for x in block],
+                [x.end for x in block],
+                bins=bins,
+                window_size=window_size,
+                use_interval=use_interval,
+                centring_method=centring_method)
+
+            peak_centers = [x.peak_center for x in features if x is not None]
 
-        result.append(IntervalData._make((features, bed, control, shifted)))
+            controls = []
+            for control_file in control_files:
+                controls.append(iter(counter.countAroundPositions(
+                    counter.coverageInRegion(control_file, contig,
+                                             block_start, block_end),
+                    peak_centers,
+                    bins=bins)))
+
+            # compute both directions, the direction is chosen later
+            if random_shift:
+                shifted = iter(zip(
+                    counter.countAroundPositions(
+                        track,
+                        [x + 2 * bins[0] for x in peak_centers],
+                        bins=bins),
+                    counter.countAroundPositions(
+                        track,
+                        [x + 2 * bins[-1] for x in peak_centers],
+                        bins=bins)))
+
+            for index, feature in zip(block_indices, features):
+                if feature is None:
+                    continue
+                features_per_interval[index] = (
+                    feature,
+                    [next(x) for x in controls],
+                    next(shifted) if random_shift else None)
+
+    result = []
+    for bed, data in zip(intervals, features_per_interval):
+        if data is None:
+            c.skipped += 1
+            continue
+
+        features, control, shifted = data
+        if not control_files:
+            control = None
+
+        if random_shift:
+            direction = numpy.random.randint(0, 2)
+            shifted = shifted[0] if direction else shifted[1]
+
+        result.append(buildIntervalData(features, bed, control, shifted,
+                                        strand_specific))
         c.added += 1
 
     E.info("interval processing: %s" % c)
@@ -586,7 +778,14 @@ def main(argv=None):
             shift=options.shift,
             smooth_method=options.smooth_method)
 
-    features_per_interval, bins = buildDensityMatrices(
+    kwargs = {}
+    if options.batch:
+        builder = buildDensityMatricesBatch
+        kwargs["block_size"] = options.block_size
+    else:
+        builder = buildDensityMatrices
+
+    features_per_interval, bins = builder(
         Bed.iterator(IOTools.openFile(bedfile)),
         fg_file,
         control_files,
@@ -598,7 +797,8 @@ def main(argv=None):
         use_interval=options.use_interval,
         random_shift=options.random_shift,
         smooth_method=options.smooth_method,
-        report_step=options.report_step)
+        report_step=options.report_step,
+        **kwargs)
 
     if len(features_per_interval) == 0:
         E.warn("no data - no output")
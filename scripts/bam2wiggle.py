@@ -30,6 +30,18 @@ amount.
 For RNASEQ data it might be best to run genomeCoverageBed directly on
 the bam file.
 
+With ``--method=native``, coverage is computed within the script
+without intermediate text files or external tools. For each contig,
+read intervals (after shifting, extending or merging pairs) are
+converted into coverage runs by sorting the interval end points and
+computing a cumulative sum. The runs are output directly in
+:term:`bedGraph`, :term:`wiggle` or :term:`bigwig` format. Contigs can
+be processed in parallel with ``--num-threads``.
+
+Note that the runs output by the native method include the last base
+of each run, which the pileup based bedGraph and wiggle output of the
+default method omits.
+
 Usage
 -----
 
@@ -52,9 +64,13 @@ import sys
 import tempfile
 import shutil
 import subprocess
+import itertools
+import multiprocessing
+import numpy
 import CGAT.Experiment as E
 import pysam
 import CGAT.IOTools as IOTools
+import CGAT.Wiggle as Wiggle
 
 # for merging pairs
 try:
@@ -154,6 +170,224 @@ class SpanWriter(object):
                 self.val / (self.lastend % self.span)))
 
 
+def getReadIntervals(samfile, contig, lcontig, shift=0, extend=0):
+    """return start and end coordinates of reads on *contig*.
+
+    If *shift* or *extend* are given, reads are shifted and extended
+    as in ChIP-Seq experiments. Otherwise the aligned region of each
+    read is returned.
+    """
+
+    starts, ends = [], []
+    shift_extend = shift + extend
+
+    if shift > 0 or extend > 0:
+        for read in samfile.fetch(contig):
+            if read.is_reverse:
+                start = max(0, read.pos + read.alen - shift_extend)
+            else:
+                start = max(0, read.pos + shift)
+
+            # intervals extending beyond contig are removed
+            if start >= lcontig:
+                continue
+            starts.append(start)
+            ends.append(min(lcontig, start + extend))
+    else:
+        for read in samfile.fetch(contig):
+            # skip unmapped, secondary, qc failed and duplicate
+            # reads like the pileup engine
+            if read.flag & 0x704:
+                continue
+            starts.append(read.pos)
+            ends.append(read.aend)
+
+    return (numpy.array(starts, dtype=numpy.int64),
+            numpy.array(ends, dtype=numpy.int64))
+
+
+def getCoverageRuns(starts, ends, lcontig):
+    """compute coverage from intervals given by *starts* and *ends*.
+
+    Returns a tuple of arrays with start, end and coverage of each
+    run of constant, non-zero coverage. Runs are clipped to
+    *lcontig*.
+    """
+
+    starts = numpy.clip(starts, 0, lcontig)
+    ends = numpy.clip(ends, 0, lcontig)
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+
+    if len(starts) == 0:
+        return (numpy.zeros(0, dtype=numpy.int64),
+                numpy.zeros(0, dtype=numpy.int64),
+                numpy.zeros(0, dtype=numpy.int64))
+
+    positions = numpy.concatenate((starts, ends))
+    deltas = numpy.concatenate((numpy.ones(len(starts), dtype=numpy.int64),
+                                -numpy.ones(len(ends), dtype=numpy.int64)))
+    order = numpy.argsort(positions, kind="mergesort")
+    positions = positions[order]
+    coverage = numpy.cumsum(deltas[order])
+
+    # coverage after the last event at each position
+    last = numpy.append(positions[1:] != positions[:-1], True)
+    positions, coverage = positions[last], coverage[last]
+
+    run_starts, values = positions[:-1], coverage[:-1]
+    # merge adjacent runs with the same coverage
+    change = numpy.append(True, values[1:] != values[:-1])
+    run_starts, values = run_starts[change], values[change]
+    run_ends = numpy.append(run_starts[1:], positions[-1])
+
+    keep = values > 0
+    return run_starts[keep], run_ends[keep], values[keep]
+
+
+def buildCoverage(args):
+    """compute coverage runs for a contig in a :term:`bam` file.
+
+    This method is called by worker processes.
+    """
+    filename, contig, lcontig, shift, extend = args
+    samfile = pysam.Samfile(filename, "rb")
+    starts, ends = getReadIntervals(samfile, contig, lcontig,
+                                    shift, extend)
+    samfile.close()
+    return (contig, len(starts)) + getCoverageRuns(starts, ends, lcontig)
+
+
+def readBedIntervals(filename):
+    """read intervals from a bed file grouped by contig."""
+
+    intervals = {}
+    for line in IOTools.openFile(filename):
+        contig, start, end = line[:-1].split("\t")[:3]
+        if contig not in intervals:
+            intervals[contig] = ([], [])
+        intervals[contig][0].append(int(start))
+        intervals[contig][1].append(int(end))
+
+    return dict([(contig, (numpy.array(x[0], dtype=numpy.int64),
+                           numpy.array(x[1], dtype=numpy.int64)))
+                 for contig, x in intervals.items()])
+
+
+def buildNative(options, samfile, contig_sizes, tmpdir):
+    """compute coverage within the script and output it
+    as bedGraph, wiggle or bigWig.
+    """
+
+    if options.output_format not in ("bedgraph", "wiggle", "bigwig"):
+        raise ValueError(
+            "output format `%s` not available for native method" %
+            options.output_format)
+
+    if options.merge_pairs:
+        E.info("merging pairs to temporary file")
+        tmpfile_bed = os.path.join(tmpdir, "pairs")
+        outf = open(tmpfile_bed, "w")
+        _bam2bed.merge_pairs(
+            samfile,
+            outf,
+            min_insert_size=options.min_insert_size,
+            max_insert_size=options.max_insert_size,
+            bed_format=3)
+        outf.close()
+        intervals = readBedIntervals(tmpfile_bed)
+
+        def _iter():
+            for contig in samfile.references:
+                if contig not in intervals:
+                    continue
+                lcontig = contig_sizes[contig]
+                starts, ends = intervals.pop(contig)
+                yield (contig, len(starts)) + \
+                    getCoverageRuns(starts, ends, lcontig)
+
+        results = _iter()
+        pool = None
+    else:
+        args = [(options.samfile, contig, contig_sizes[contig],
+                 options.shift, options.extend)
+                for contig in samfile.references]
+        if options.num_threads > 1:
+            pool = multiprocessing.Pool(options.num_threads)
+            results = pool.imap(buildCoverage, args)
+        else:
+            pool = None
+            results = itertools.imap(buildCoverage, args)
+
+    # scaling requires the total number of reads before output
+    if options.scale_method == "reads":
+        results = list(results)
+        noutput = sum([x[1] for x in results])
+        scale_factor = float(options.scale_base) / max(1, noutput)
+        E.info("scaling: method=%s scale_quantity=%i scale_factor=%f" %
+               (options.scale_method,
+                noutput,
+                scale_factor))
+    else:
+        scale_factor = None
+
+    counter = E.Counter()
+
+    if options.output_format == "bigwig":
+        writer = Wiggle.BigWigWriter(
+            open(options.output_filename_pattern, "wb"),
+            contig_sizes)
+    else:
+        outfile = options.stdout
+        if options.output_format == "bedgraph":
+            outfile.write("track type=bedGraph\n")
+
+    for contig, nreads, run_starts, run_ends, values in results:
+        E.debug("output for %s" % contig)
+        counter.contigs += 1
+        counter.reads += nreads
+        counter.runs += len(values)
+
+        if scale_factor is not None:
+            values = values * scale_factor
+            value_format = "%f"
+        else:
+            value_format = "%i"
+
+        if options.output_format == "bigwig":
+            writer.add(contig, run_starts, run_ends, values)
+        elif options.output_format == "wiggle":
+            # wiggle is one-based
+            outfile.write("variableStep chrom=%s span=%i\n" %
+                          (contig, options.span))
+            if options.span == 1:
+                line_format = "%%i\t%s\n" % value_format
+                outfile.write("".join(
+                    [line_format % (x, value) for start, end, value in
+                     itertools.izip(run_starts, run_ends, values)
+                     for x in xrange(start + 1, end + 1)]))
+            else:
+                outf = SpanWriter(options.span)
+                for start, end, value in itertools.izip(
+                        run_starts, run_ends, values):
+                    outf(outfile, contig, start, end, value)
+                outf.flush(outfile)
+        else:
+            line_format = "%s\t%%i\t%%i\t%s\n" % (contig, value_format)
+            outfile.write("".join(
+                [line_format % x for x in
+                 itertools.izip(run_starts, run_ends, values)]))
+
+    if options.output_format == "bigwig":
+        writer.close()
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    E.info("%s" % str(counter))
+
+
 def main(argv=None):
     """script main.
     """
@@ -216,6 +450,16 @@ def main(argv=None):
                       "at least # bases apart. "
                       "0 turns of this filter. [default=%default]")
 
+    parser.add_option("--method", dest="method", type="choice",
+                      choices=("external", "native"),
+                      help="method to compute coverage. 'external' uses "
+                      "pileup or bedtools and UCSC tools, 'native' computes "
+                      "coverage within the script [default=%default]")
+
+    parser.add_option("--num-threads", dest="num_threads", type="int",
+                      help="number of processes to use for computing "
+                      "coverage with the native method [default=%default]")
+
     parser.set_defaults(
         samfile=None,
         output_format="wiggle",
@@ -227,6 +471,8 @@ def main(argv=None):
         max_insert_size=0,
         scale_method='none',
         scale_base=1000000,
+        method="external",
+        num_threads=1,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -256,6 +502,16 @@ def main(argv=None):
         outfile_size.write("%s\t%s\n" % (contig, size))
     outfile_size.close()
 
+    if options.method == "native":
+        if options.output_format == "bigwig" and \
+           not options.output_filename_pattern:
+            raise ValueError(
+                "please specify an output file for bigwig computation.")
+        buildNative(options, samfile, contig_sizes, tmpdir)
+        shutil.rmtree(tmpdir)
+        E.Stop()
+        return
+
     # Shift and extend only available for bigwig format
     if options.shift or options.extend:
         if options.output_format != "bigwig":
@@ -287,21 +543,29 @@ def main(argv=None):
         outfile = options.stdout
         E.info("starting output to stdout")
 
+    # scaled values are output as floats
+    if options.scale_method == "none":
+        value_format = "%i"
+    else:
+        value_format = "%f"
+
     # Set up output write functions
     if options.output_format in ("wiggle", "bigwig"):
         # wiggle is one-based, so add 1, also step-size is 1, so need
         # to output all bases
         if options.span == 1:
+            line_format = "%%i\t%s\n" % value_format
             outf = lambda outfile, contig, start, end, val: \
                 outfile.write(
-                    "".join(["%i\t%i\n" % (x, val)
+                    "".join([line_format % (x, val)
                              for x in xrange(start + 1, end + 1)]))
         else:
             outf = SpanWriter(options.span)
     elif options.output_format == "bedgraph":
         # bed is 0-based, open-closed
+        line_format = "%%s\t%%i\t%%i\t%s\n" % value_format
         outf = lambda outfile, contig, start, end, val: \
-            outfile.write("%s\t%i\t%i\t%i\n" % (contig, start, end, val))
+            outfile.write(line_format % (contig, start, end, val))
 
     # initialise counters
     ninput, nskipped, ncontigs = 0, 0, 0
@@ -399,9 +663,15 @@ def main(argv=None):
                 end = t.pos
             yield start, end, n
 
-        if options.scale_method != "none":
-            raise NotImplementedError(
-                "scaling not implemented for pileup method")
+        if options.scale_method == "reads":
+            # pileup counts all mapped reads
+            scale_factor = float(options.scale_base) / samfile.mapped
+            E.info("scaling: method=%s scale_quantity=%i scale_factor=%f" %
+                   (options.scale_method,
+                    samfile.mapped,
+                    scale_factor))
+        else:
+            scale_factor = None
 
         # Bedgraph track definition
         if options.output_format == "bedgraph":
@@ -430,6 +700,8 @@ def main(argv=None):
                         continue
 
                 if val > 0:
+                    if scale_factor is not None:
+                        val *= scale_factor
                     outf(outfile, contig, start, end, val)
             ncontigs += 1
 
@@ -71,7 +71,8 @@ def main(argv=None):
                       "sequences from.")
 
     parser.add_option("-m", "--masker", dest="masker", type="choice",
-                      choices=("dust", "dustmasker", "softmask", "none"),
+                      choices=("dust", "dustmasker", "dust-native",
+                               "softmask", "none"),
                       help="apply masker to mask output sequences "
                       "[%default].")
 
@@ -40,6 +40,13 @@ For example::
 
    cgat chain2psl.py < in.chain > out.psl
 
+If the chain file is given as an argument, the parsed chain file can
+be cached on disk with ``--cache-index`` (see :mod:`CGAT.Chain`). The
+cache is shared with other scripts such as :doc:`diff_chains` and
+:doc:`liftover`::
+
+   cgat chain2psl.py --cache-index in.chain > out.psl
+
 Type::
 
    cgat chain2psl.py --help
@@ -54,7 +61,7 @@ Command line options
 import sys
 import CGAT.Experiment as E
 import CGAT.Blat as Blat
-import alignlib_lite
+import CGAT.Chain as Chain
 
 
 def main(argv=None):
@@ -70,78 +77,45 @@ def main(argv=None):
     parser = E.OptionParser(version="%prog version: $Id$",
                             usage=globals()["__doc__"])
 
+    parser.add_option("--cache-index", dest="use_cache", action="store_true",
+                      help="cache the parsed chain file on disk if a "
+                      "filename is given [%default]")
+
+    parser.set_defaults(
+        use_cache=False,
+    )
+
     # add common options (-h/--help, ...) and parse command line
     (options, args) = E.Start(parser, argv=argv)
 
     # do sth
     ninput, nskipped, noutput = 0, 0, 0
 
-    psl = None
-
-    def chain_iterator(infile):
-        lines = []
-        for line in options.stdin:
-
-            if line.startswith("#"):
-                continue
-            if line.strip() == "":
-                continue
-            if line.startswith("chain"):
-                if lines:
-                    yield lines
-                lines = []
-            lines.append(line)
-
-        yield lines
+    if len(args) == 1:
+        index = Chain.loadChainIndex(args[0], use_cache=options.use_cache)
+    else:
+        index = Chain.ChainIndex()
+        index.read(options.stdin)
 
-    for lines in chain_iterator(options.stdin):
+    for header, target_starts, query_starts, sizes in index.iterChains():
 
         ninput += 1
         psl = Blat.Match()
 
-        (_,
-         _,
-         psl.mSbjctId,
-         target_length,
-         target_strand,
-         target_start,
-         target_end,
-         psl.mQueryId,
-         query_length,
-         query_strand,
-         query_start,
-         query_end,
-         alignment_id) = lines[0][:-1].split()
-
-        (psl.mQueryStart, psl.mQueryEnd, psl.mQueryLength,
-         psl.mSbjctStart, psl.mSbjctEnd, psl.mSbjctLength) = \
-            [int(x) for x in
-             (query_start,
-              query_end,
-              query_length,
-              target_start,
-              target_end,
-              target_length)]
-
-        map_query2target = alignlib_lite.py_makeAlignmentBlocks()
-
-        qstart, tstart = psl.mQueryStart, psl.mSbjctStart
-
-        for line in lines[1:-1]:
-            size, dt, dq = [int(x) for x in line[:-1].split()]
-            map_query2target.addDiagonal(qstart,
-                                         qstart + size,
-                                         tstart - qstart)
-            qstart += size + dq
-            tstart += size + dt
-
-        size = int(lines[-1][:-1])
-
-        map_query2target.addDiagonal(qstart,
-                                     qstart + size,
-                                     tstart - qstart)
-
-        psl.fromMap(map_query2target)
+        psl.mSbjctId, psl.mQueryId = header.target_contig, header.query_contig
+        target_strand, query_strand = header.target_strand, header.query_strand
+        psl.mQueryLength = header.query_length
+        psl.mSbjctLength = header.target_length
+
+        psl.mNMatches = int(sizes.sum())
+        psl.mNBlocks = len(sizes)
+        psl.mBlockSizes = list(sizes)
+        psl.mQueryBlockStarts = list(query_starts)
+        psl.mSbjctBlockStarts = list(target_starts)
+        psl.mQueryFrom = query_starts[0]
+        psl.mQueryTo = query_starts[-1] + sizes[-1]
+        psl.mSbjctFrom = target_starts[0]
+        psl.mSbjctTo = target_starts[-1] + sizes[-1]
 
         # sort out strand
         # target_strand is always positive
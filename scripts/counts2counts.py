@@ -149,6 +149,12 @@ The generation of spike-ins is extensively parameterised:
 
     Defines how many iterations of random shuffling should be performed.
 
+--num-threads=[int]
+
+    If spike-type=cluster, iterations are computed by this number of
+    processes. For a given --random-seed, the spike-ins do not depend
+    on the number of processes.
+
 --spike-shuffle-column-suffix=[string]
 --spike-keep-column-suffix=[string]
 
@@ -261,6 +267,10 @@ def main(argv=None):
                       help="number of iterations to generate spike-ins\
                       [default=%default].")
 
+    parser.add_option("--num-threads", dest="num_threads", type="int",
+                      help="number of processes to use for shuffling "
+                      "clusters [default=%default].")
+
     parser.add_option("--spike-cluster-maximum-distance",
                       dest="cluster_max_distance", type="int",
                       help="maximum distance between adjacent loci in cluster\
@@ -334,6 +344,7 @@ def main(argv=None):
         max_spike=100,
         min_spike=None,
         iterations=1,
+        num_threads=1,
         cluster_max_distance=100,
         cluster_min_size=10,
         min_sbin=1,
@@ -368,7 +379,7 @@ def main(argv=None):
         # TS if spike type is cluster, need to keep "contig" and "position"
         # columns out of index
         if options.spike_type == "cluster":
-            index = None,
+            index = None
         else:
             index = 0
 
@@ -488,17 +499,18 @@ def main(argv=None):
         if options.spike_type == "cluster":
             E.info("looking for clusters...")
             clusters_dict = Counts.findClusters(
-                counts_sort, options.cluster_max_distance,
-                options.cluster_min_size, g_to_spike_tracks, groups)
+                counts.table, options.cluster_max_distance,
+                options.cluster_min_size, g_to_spike_tracks, design.groups)
             if len(clusters_dict) == 0:
                 raise Exception("no clusters were found, check parameters")
 
             E.info("shuffling subcluster regions...")
-            output_indices, counts = Counts.shuffleCluster(
-                initial_bins, change_bins, g_to_spike_tracks, groups,
+            output_indices, bin_counts = Counts.shuffleCluster(
+                initial_bins, change_bins, g_to_spike_tracks, design.groups,
                 options.difference, options.max_spike,
                 options.iterations, clusters_dict,
-                options.max_sbin, options.min_sbin, options.width_sbin)
+                options.max_sbin, options.min_sbin, options.width_sbin,
+                num_threads=options.num_threads)
 
         elif options.spike_type == "row":
 
@@ -51,7 +51,6 @@ import tempfile
 
 import CGAT.Experiment as E
 import csv
-import _csv
 import hashlib
 import CGAT.CSV as CSV
 
@@ -69,26 +68,6 @@ class UniqueBuffer:
             self.mOutfile.write(out)
 
 
-class CommentStripper:
-
-    """iterator class for stripping comments from file.
-    """
-
-    def __init__(self, file):
-        self.mFile = file
-
-    def __iter__(self):
-        return self
-
-    def next(self):
-        while 1:
-            line = self.mFile.readline()
-            if not line:
-                raise StopIteration
-            if line[0] != "#":
-                return line
-
-
 def main(argv=None):
     """script main.
 
@@ -134,20 +113,19 @@ def main(argv=None):
     else:
         outfile = options.stdout
 
-    while 1:
-        line = sys.stdin.readline()
-
-        if not line:
-            E.Stop()
-            sys.exit(0)
-
-        if line[0] == "#":
-            continue
-
-        first_line = line
-        break
+    if options.large:
+        dialect = None
+    else:
+        dialect = options.csv_dialect
 
-    old_fields = first_line[:-1].split("\t")
+    counter = E.Counter()
+    old_fields, chunks = CSV.iterateTableChunks(options.stdin,
+                                                pad_incomplete=True,
+                                                dialect=dialect,
+                                                counter=counter)
+    if not old_fields:
+        E.Stop()
+        sys.exit(0)
 
     fields = []
     for f in input_fields:
@@ -165,42 +143,26 @@ def main(argv=None):
         fields = set(fields)
         fields = [x for x in old_fields if x not in fields]
 
-    if options.large:
-        reader = CSV.DictReaderLarge(CommentStripper(sys.stdin),
-                                     fieldnames=old_fields,
-                                     dialect=options.csv_dialect)
-    else:
-        reader = csv.DictReader(CommentStripper(sys.stdin),
-                                fieldnames=old_fields,
-                                dialect=options.csv_dialect)
-
-    writer = csv.DictWriter(outfile,
-                            fields,
-                            dialect=options.csv_dialect,
-                            lineterminator=options.csv_lineterminator,
-                            extrasaction='ignore')
-
-    print "\t".join(fields)
-
-    first_row = True
-    ninput, noutput, nerrors = 0, 0, 0
-
-    while 1:
-        ninput += 1
-        try:
-            row = reader.next()
-        except _csv.Error, msg:
-            options.stderr.write("# error while parsing: %s\n" % (msg))
-            nerrors += 1
-            continue
-        except StopIteration:
-            break
-        if not row:
-            break
-        writer.writerow(row)
-        noutput += 1
-
-    E.info("ninput=%i, noutput=%i, nerrors=%i" % (ninput, noutput, nerrors))
+    # select columns by position, the last column of a given
+    # name is taken as in a dictionary
+    map_field2column = dict([(y, x) for x, y in enumerate(old_fields)])
+    columns = [map_field2column[x] for x in fields]
+
+    writer = csv.writer(outfile,
+                        dialect=options.csv_dialect,
+                        lineterminator=options.csv_lineterminator)
+
+    options.stdout.write("\t".join(fields) + "\n")
+
+    ninput, noutput = 0, 0
+
+    for chunk in chunks:
+        ninput += len(chunk)
+        writer.writerows([[row[x] for x in columns] for row in chunk])
+        noutput += len(chunk)
+
+    E.info("ninput=%i, noutput=%i, nerrors=%i" %
+           (ninput + counter.errors, noutput, counter.errors))
 
     E.Stop()
 
@@ -15,8 +15,17 @@ Count the number of alignments to each reference in outfmt6.
 Counts are based on various options specified by --method.
 
 best       This will take the best alignment as judged by the highest
-           bitscore.
+           bitscore. Ties are broken at random, using --random-seed
+           (0 by default) so that counts are reproducible.
 
+Alignments are read in chunks of --chunk-size lines. With --sum-cog,
+genes are mapped to functions (COGs) and both gene and COG counts
+are computed in the same pass. Use --output-gene-counts to output
+the gene counts as well.
+
+If several files are given as arguments, a table with one column
+of counts per file is output. Files can be processed in parallel
+with --num-threads.
 
 
 
@@ -42,6 +51,8 @@ Command line options
 '''
 
 import sys
+import itertools
+import multiprocessing
 
 import CGAT.Experiment as E
 from CGAT.Diamond import *
@@ -60,6 +71,41 @@ def readCogMap(cog_map):
     return gene2cog
 
 
+def countFile(args):
+    '''
+    count best alignments in a file.
+
+    Returns dictionaries of gene and COG counts.
+    '''
+    infile, map_gene2cog, chunksize, seed = args
+    if isinstance(infile, str):
+        infile = IOTools.openFile(infile)
+    return count_best_alignments(infile,
+                                 map_gene2cog,
+                                 chunksize=chunksize,
+                                 seed=seed)
+
+
+def writeCounts(outfile, counts):
+    '''
+    write a table of counts
+    '''
+    outfile.write("ref\tcount\n")
+    for ref, count in counts.iteritems():
+        outfile.write("\t".join([ref, str(count)]) + "\n")
+
+
+def writeMatrix(outfile, counts, headers):
+    '''
+    write a table of counts with one column per input file
+    '''
+    outfile.write("\t".join(["ref"] + headers) + "\n")
+    refs = sorted(set().union(*counts))
+    for ref in refs:
+        outfile.write("\t".join(
+            [ref] + [str(x.get(ref, 0)) for x in counts]) + "\n")
+
+
 def main(argv=None):
     """script main.
 
@@ -93,14 +139,31 @@ def main(argv=None):
                       help="""number of queries to evaluate-
                               will take the first n in the file""")
 
+    parser.add_option("--output-gene-counts", dest="output_gene_counts",
+                      action="store_true",
+                      help="with --sum-cog, also output gene counts to "
+                      "the file given by --output-filename-pattern "
+                      "[%default]")
+
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      help="number of alignments to read at a time "
+                      "[%default]")
+
+    parser.add_option("--num-threads", dest="num_threads", type="int",
+                      help="number of processes to use if several "
+                      "input files are given [%default]")
+
     parser.set_defaults(method=None,
                         sum_cog=False,
                         evaluate_cog=False,
                         cog_map=None,
-                        nsamples=10000)
+                        nsamples=10000,
+                        output_gene_counts=False,
+                        chunk_size=1000000,
+                        num_threads=1)
 
     # add common options (-h/--help, ...) and parse command line
-    (options, args) = E.Start(parser, argv=argv)
+    (options, args) = E.Start(parser, argv=argv, add_output_options=True)
 
     if options.evaluate_cog:
         assert options.cog_map, """must specify an annotation
@@ -118,17 +181,14 @@ def main(argv=None):
         c = 0
         for alignments in query_iterator(alignment_iterator(options.stdin)):
             c += 1
-            scores = []
             if c <= options.nsamples:
-                for alignment in alignments:
-                    scores.append(alignment.score)
-                    best = max(scores)
-                    best_alignments = [
-                        x for x in alignments if x.score == best]
-                    if len(best_alignments) > 1:
-                        best_alignments = random.sample(best_alignments, 1)
-                    best_alignment = best_alignments[0]
-                    best_cog = gene2cog[best_alignment.ref]
+                best = max([float(x.score) for x in alignments])
+                best_alignments = [
+                    x for x in alignments if float(x.score) == best]
+                if len(best_alignments) > 1:
+                    best_alignments = random.sample(best_alignments, 1)
+                best_alignment = best_alignments[0]
+                best_cog = gene2cog[best_alignment.ref]
                 pbest = float(len(
                     [gene2cog[x.ref]
                      for x in alignments
@@ -144,8 +204,6 @@ def main(argv=None):
                 break
         return
 
-    # container for counts
-    counts = collections.defaultdict(int)
     E.info("counting alignments")
     assert options.method, "required option --method"
     if options.method == "best":
@@ -158,28 +216,56 @@ def main(argv=None):
 
             E.info("""reading gene to function (COG) mapping from %s"""
                    % options.cog_map)
-            gene2cog = readCogMap(options.cog_map)
+            map_gene2cog = build_cog_map(readCogMap(options.cog_map))
             E.info("loaded gene to function (COG) mapping")
+        else:
+            map_gene2cog = None
+
+        # ties are broken deterministically
+        if options.random_seed is None:
+            seed = 0
+        else:
+            seed = options.random_seed
+
+        if args:
+            filenames = args
+        else:
+            filenames = [options.stdin]
 
-            E.info("summing functional assignments")
-            query_it = query_iterator(alignment_iterator(options.stdin))
-            for best in best_alignment_iterator(query_it):
-                cog = gene2cog[best.ref]
-                # removing uassigned or multiple assignments
-                if cog == "unknown" or cog.find(";") != -1:
-                    continue
-                counts[cog] += 1
+        if len(filenames) > 1 and options.num_threads > 1:
+            pool = multiprocessing.Pool(options.num_threads)
+            mapper = pool.imap
         else:
-            E.info("counting best alignments")
-            query_it = query_iterator(alignment_iterator(options.stdin))
-            for best in best_alignment_iterator(query_it):
-                counts[best.ref] += 1
+            pool = None
+            mapper = itertools.imap
+
+        results = list(mapper(
+            countFile,
+            [(x, map_gene2cog, options.chunk_size, seed)
+             for x in filenames]))
+
+        if pool:
+            pool.close()
+            pool.join()
         E.info("finished counting")
 
         E.info("writing results")
-        options.stdout.write("ref\tcount\n")
-        for ref, count in counts.iteritems():
-            options.stdout.write("\t".join([ref, str(count)]) + "\n")
+        if options.sum_cog:
+            outputs = [(options.stdout, [x[1] for x in results])]
+            if options.output_gene_counts:
+                outputs.append((E.openOutputFile("genes"),
+                                [x[0] for x in results]))
+        else:
+            outputs = [(options.stdout, [x[0] for x in results])]
+
+        for outfile, counts in outputs:
+            if len(counts) == 1:
+                writeCounts(outfile, counts[0])
+            else:
+                writeMatrix(outfile, counts, args)
+
+            if outfile != options.stdout:
+                outfile.close()
 
     # write footer and output benchmark information.
     E.Stop()
@@ -71,73 +71,48 @@ Documentation
 
 For read counts to be correct the NH flag to be set correctly.
 
+The comparison is implemented as a compiled multi-way merge. With
+``--sort-order=coordinate``, coordinate sorted and indexed BAM files
+are compared. Alignments are merged by position and matched by a key
+built from the read name, flag and cigar string. The output lists
+each alignment with a column per file indicating whether the alignment
+is present in that file. Contigs are split into regions of
+``--region-size`` that are processed in parallel
+(``--num-threads``).
+
+``--output-reads=different`` restricts the output to reads or
+alignments that differ between files and ``--output-summary``
+outputs summary counts to a separate file.
+
 Command line options
 --------------------
 
 '''
 
 import sys
+import collections
 import itertools
+import multiprocessing
 import pysam
 import CGAT.Experiment as E
 
+try:
+    import pyximport
+    pyximport.install(build_in_temp=False)
+    import _diff_bam
+except ImportError:
+    import CGAT._diff_bam as _diff_bam
 
-class multiway_groupby(object):
-    # [k for k, g in groupby('AAAABBBCCDAABBB')] --> A B C D A B
-    # [list(g) for k, g in groupby('AAAABBBCCD')] --> AAAA BBB CC D
-
-    def __init__(self, iterables, key=None):
-        # set up iterators
-        self.it = [itertools.groupby(iterable, key) for iterable in iterables]
-
-        # todo: catch StopIterator for empty iterables
-        self.current = [next(self.it[x]) for x in xrange(len(iterables))]
-
-        # decide on target key
-        self.targetkey = min([x[0] for x in self.current if x[0] is not None])
-
-    def __iter__(self):
-        return self
-
-    def next(self):
 
-        # check if all iterators exhausted
-        if not any(self.it):
-            raise StopIteration
+def compareRegion(args):
+    """compare alignments in a region of coordinate sorted BAM files.
 
-        # yield all that correspond to target key and update
-        result = []
-        targetkey = self.targetkey
-        updated = 0
-
-        for x, y in enumerate(self.current):
-            key, val = y
-            if key and key == targetkey:
-                # save result (instantiate to prevent overwriting)
-                # in next method
-                result.append(list(val))
-                # advance
-                try:
-                    self.current[x] = next(self.it[x])
-                except StopIteration:
-                    self.it[x] = None
-                    self.current[x] = (None, None)
-                updated += 1
-            else:
-                # return empty result
-                result.append([])
-
-        assert updated > 0, "no updates - infinite loop"
-
-        # decide which is target key
-        try:
-            self.targetkey = min([x[0]
-                                  for x in self.current if x[0] is not None])
-        except ValueError:
-            # if all are None, sequence is empty
-            self.targetkey = None
-
-        return targetkey, result
+    This is a helper for distributing regions over processes.
+    """
+    filenames, contig, start, end, output_reads = args
+    counts, reads = _diff_bam.compareCoordinateSorted(
+        filenames, contig, start, end, output_reads=output_reads)
+    return contig, counts, reads
 
 
 def main(argv=None):
@@ -158,8 +133,38 @@ def main(argv=None):
         help="',' separated list of labels used as headers. "
         " Should correspond in order to command line arguments [%default]")
 
+    parser.add_option(
+        "--sort-order", dest="sort_order", type="choice",
+        choices=("name", "coordinate"),
+        help="sort order of BAM files [%default]")
+
+    parser.add_option(
+        "--output-reads", dest="output_reads", type="choice",
+        choices=("all", "different", "none"),
+        help="reads to output. ``different`` outputs only reads whose "
+        "alignments differ between files [%default]")
+
+    parser.add_option(
+        "--output-summary", dest="output_summary", action="store_true",
+        help="output summary counts [%default]")
+
+    parser.add_option(
+        "--region-size", dest="region_size", type="int",
+        help="size of regions processed in parallel for coordinate "
+        "sorted files [%default]")
+
+    parser.add_option(
+        "--num-threads", dest="num_threads", type="int",
+        help="number of processes to use for coordinate sorted "
+        "files [%default]")
+
     parser.set_defaults(
         headers=None,
+        sort_order="name",
+        output_reads="all",
+        output_summary=False,
+        region_size=10000000,
+        num_threads=1,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -182,59 +187,81 @@ def main(argv=None):
     else:
         headers = ["file%i" % x for x in range(1, len(infiles) + 1)]
 
-    options.stdout.write("read\tnlocations\tnmatched\t%s\t%s\n" %
-                         ("\t".join(["%s_nh" % x for x in headers]),
-                          "\t".join(["%s_loc" % x for x in headers])))
-
-    ninput, noutput = 0, 0
-    for readname, result in multiway_groupby(infiles, key=lambda x: x.qname):
-        ninput += 1
-        nmatches = 0
-        locations = set()
-
-        # build location directory
-        for r in result:
-            for rr in r:
-                if rr.is_unmapped:
-                    continue
-                locations.add((rr.tid, rr.pos))
-
-        # permit a certain fuzzyness in locations
-        # as some mappers clip and others don't.
-        locations = list(locations)
-        locations.sort()
-        pos2loc = {}
-        last_tid, last_pos, nlocations = None, 0, -1
-        for tid, pos in locations:
-            if tid != last_tid or pos - last_pos > max_distance:
-                nlocations += 1
-            pos2loc[(tid, pos)] = nlocations
-            last_tid, last_pos = tid, pos
-        nlocations += 1
-
-        # code locations
-        codes, nh = [], []
-        for r in result:
-            c = []
-            for rr in r:
-                if rr.is_unmapped:
-                    continue
-                c.append(pos2loc[(rr.tid, rr.pos)])
-            codes.append(",".join(map(str, sorted(c))))
-            nh.append(len(c))
-            if len(c):
-                nmatches += 1
-
-        noutput += 1
-        options.stdout.write("%s\t%i\t%i\t%s\t%s\n" % (
-            readname,
-            nlocations,
-            nmatches,
-            "\t".join(
-                ["%i" % x for x in nh]),
-            "\t".join(codes)))
-
-    E.info("ninput=%i, noutput=%i" % (ninput, noutput))
+    if options.sort_order == "name":
+
+        if options.output_reads != "none":
+            options.stdout.write(
+                "read\tnlocations\tnmatched\t%s\t%s\n" %
+                ("\t".join(["%s_nh" % x for x in headers]),
+                 "\t".join(["%s_loc" % x for x in headers])))
+
+        counter = _diff_bam.compareNameSorted(
+            infiles,
+            options.stdout,
+            max_distance=max_distance,
+            output_reads=options.output_reads)
+
+        if options.output_summary:
+            outf = E.openOutputFile("summary")
+            outf.write("category\tcounts\n")
+            for category in ("input", "identical", "different",
+                             "missing", "output"):
+                outf.write("%s\t%i\n" % (category, counter[category]))
+            outf.close()
+
+        E.info(str(counter))
+
+    elif options.sort_order == "coordinate":
+
+        if options.output_reads != "none":
+            options.stdout.write("contig\tpos\tread\tflag\t%s\n" %
+                                 "\t".join(headers))
+
+        regions = []
+        for contig, length in zip(infiles[0].references,
+                                  infiles[0].lengths):
+            for start in range(0, length, options.region_size):
+                regions.append((args, contig, start,
+                                min(length, start + options.region_size),
+                                options.output_reads))
+
+        E.info("comparing %i regions using %i processes" %
+               (len(regions), options.num_threads))
+
+        if options.num_threads > 1:
+            pool = multiprocessing.Pool(options.num_threads)
+            results = pool.imap(compareRegion, regions)
+        else:
+            results = itertools.imap(compareRegion, regions)
+
+        nfiles = len(infiles)
+        pattern_counts = collections.defaultdict(int)
+        for contig, counts, reads in results:
+            for pattern, count in counts.iteritems():
+                pattern_counts[pattern] += count
+            for pos, qname, flag, pattern in zip(*reads):
+                options.stdout.write("%s\t%i\t%s\t%i\t%s\n" % (
+                    contig, pos, qname, flag,
+                    "\t".join(["%i" % ((pattern >> x) & 1)
+                               for x in range(nfiles)])))
+
+        if options.num_threads > 1:
+            pool.close()
+            pool.join()
+
+        if options.output_summary:
+            outf = E.openOutputFile("summary")
+            outf.write("%s\tcounts\n" % "\t".join(headers))
+            for pattern, count in sorted(pattern_counts.items()):
+                outf.write("%s\t%i\n" % (
+                    "\t".join(["%i" % ((pattern >> x) & 1)
+                               for x in range(nfiles)]),
+                    count))
+            outf.close()
+
+        all_pattern = (1 << nfiles) - 1
+        E.info("nalignments=%i, nidentical=%i" % (
+            sum(pattern_counts.values()), pattern_counts[all_pattern]))
 
     # write footer and output benchmark information.
     E.Stop()
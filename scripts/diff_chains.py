@@ -75,184 +75,62 @@ import sys
 import re
 import optparse
 import collections
+import numpy
 
 import CGAT.IOTools as IOTools
 import CGAT.Experiment as E
+import CGAT.Chain as Chain
 import alignlib_lite
 
 
-def chain_iterator(infile):
-    lines = []
-    for line in infile:
-
-        if line.startswith("#"):
-            continue
-        if line.strip() == "":
-            continue
-        if line.startswith("chain"):
-            if lines:
-                yield lines
-            lines = []
-        lines.append(line)
-
-    yield lines
-
-
-def validateChain(infile):
+def validateChain(index):
     '''validate a chain file.
 
     No overlapping target coordinates.
     '''
 
-    pairs_t2q = collections.defaultdict(alignlib_lite.py_makeAlignmentBlocks)
-    pairs_q2t = collections.defaultdict(alignlib_lite.py_makeAlignmentBlocks)
-
-    for lines in chain_iterator(infile):
-
-        (_,
-         _,
-         target_contig,
-         target_length,
-         target_strand,
-         target_start,
-         target_end,
-         query_contig,
-         query_length,
-         query_strand,
-         query_start,
-         query_end,
-         alignment_id) = lines[0][:-1].split()
-
-        (query_start,
-         query_end,
-         query_length,
-         target_start,
-         target_end,
-         target_length) = \
-            [int(x) for x in
-             (query_start,
-              query_end,
-              query_length,
-              target_start,
-              target_end,
-              target_length)]
-
-        # target_strand is always positive
-        assert(target_strand == "+")
-
-        map_target2query = pairs_t2q[target_contig]
-        map_query2target = pairs_q2t[query_contig]
-
-        qstart, tstart = query_start, target_start
-
-        for line in lines[1:-1]:
-            size, dt, dq = [int(x) for x in line[:-1].split()]
-            map_target2query.addDiagonal(tstart,
-                                         tstart + size,
-                                         0)
-            map_query2target.addDiagonal(qstart,
-                                         qstart + size,
-                                         0)
-
-            qstart += size + dq
-            tstart += size + dt
-
-        size = int(lines[-1][:-1])
-        map_target2query.addDiagonal(tstart,
-                                     tstart + size,
-                                     0)
-        map_query2target.addDiagonal(qstart,
-                                     qstart + size,
-                                     0)
-
-    try:
-        x = map_query2target.mapRowToCol(0)
-    except RuntimeError:
+    def hasOverlaps(contigs, starts, sizes):
+        order = numpy.lexsort((starts, contigs))
+        contigs, starts, ends = contigs[order], starts[order], \
+            starts[order] + sizes[order]
+        same = contigs[1:] == contigs[:-1]
+        return (same & (starts[1:] < ends[:-1])).any()
+
+    block_chain = numpy.repeat(numpy.arange(len(index)),
+                               numpy.diff(index.chain_offsets))
+
+    if hasOverlaps(index.chain_query[block_chain],
+                   index.block_query_start,
+                   index.block_size):
         E.info("query is not unique - this is ok.")
 
-    try:
-        x = map_target2query.mapRowToCol(0)
-    except RuntimeError:
+    if hasOverlaps(index.chain_target[block_chain],
+                   index.block_target_start,
+                   index.block_size):
         E.info("target is not unique")
         return False
 
     return True
 
 
-def buildPairs(infile):
-    '''read a chain file.
+def buildPairs(index):
+    '''build target2query alignments from a
+    :class:`Chain.ChainIndex`.
 
-    build target2query alignments.
     The target is always on the positive strand.
     '''
     pairs = collections.defaultdict(alignlib_lite.py_makeAlignmentBlocks)
 
-    def chain_iterator(infile):
-        lines = []
-        for line in infile:
+    for header, tstarts, qstarts, sizes in index.iterChains():
 
-            if line.startswith("#"):
-                continue
-            if line.strip() == "":
-                continue
-            if line.startswith("chain"):
-                if lines:
-                    yield lines
-                lines = []
-            lines.append(line)
-
-        yield lines
-
-    for lines in chain_iterator(infile):
-
-        (_,
-         _,
-         target_contig,
-         target_length,
-         target_strand,
-         target_start,
-         target_end,
-         query_contig,
-         query_length,
-         query_strand,
-         query_start,
-         query_end,
-         alignment_id) = lines[0][:-1].split()
-
-        (query_start,
-         query_end,
-         query_length,
-         target_start,
-         target_end,
-         target_length) = \
-            [int(x) for x in
-             (query_start,
-              query_end,
-              query_length,
-              target_start,
-              target_end,
-              target_length)]
-
-        # target_strand is always positive
-        assert(target_strand == "+")
-
-        map_target2query = pairs[(target_contig, query_contig, query_strand)]
-
-        qstart, tstart = query_start, target_start
-
-        for line in lines[1:-1]:
-            size, dt, dq = [int(x) for x in line[:-1].split()]
-            map_target2query.addDiagonal(tstart,
-                                         tstart + size,
-                                         qstart - tstart)
-            qstart += size + dq
-            tstart += size + dt
-
-        size = int(lines[-1][:-1])
-
-        map_target2query.addDiagonal(tstart,
-                                     tstart + size,
-                                     qstart - tstart)
+        map_target2query = pairs[(header.target_contig,
+                                  header.query_contig,
+                                  header.query_strand)]
+
+        for tstart, qstart, size in zip(tstarts, qstarts, sizes):
+            map_target2query.addDiagonal(int(tstart),
+                                         int(tstart + size),
+                                         int(qstart - tstart))
 
     return pairs
 
@@ -354,10 +232,14 @@ def main(argv=None):
     parser.add_option("-r", "--restrict", dest="restrict", type="string",
                       help="restrict analysis to a chromosome pair (chr1:chr1:+) [%default]")
 
+    parser.add_option("--cache-index", dest="use_cache", action="store_true",
+                      help="cache parsed chain files on disk [%default]")
+
     parser.set_defaults(
         output_mismatches=False,
         output_unique=False,
-        restrict=None
+        restrict=None,
+        use_cache=False,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -368,22 +250,27 @@ def main(argv=None):
 
     filename_chain1, filename_chain2 = args
 
+    index1 = Chain.loadChainIndex(filename_chain1,
+                                  use_cache=options.use_cache)
+    index2 = Chain.loadChainIndex(filename_chain2,
+                                  use_cache=options.use_cache)
+
     E.info("validating chain 1")
-    if not validateChain(IOTools.openFile(filename_chain1)):
+    if not validateChain(index1):
         E.warn("validation failed - exiting")
         return 1
 
     E.info("validating chain 2")
-    if not validateChain(IOTools.openFile(filename_chain2)):
+    if not validateChain(index2):
         E.warn("validation failed - exiting")
         return 1
 
     E.info("building pairs for %s" % filename_chain1)
-    pairs1 = buildPairs(IOTools.openFile(filename_chain1))
+    pairs1 = buildPairs(index1)
     E.info("read %i pairs" % len(pairs1))
 
     E.info("building pairs for %s" % filename_chain2)
-    pairs2 = buildPairs(IOTools.openFile(filename_chain2))
+    pairs2 = buildPairs(index2)
     E.info("read %i pairs" % len(pairs2))
 
     if options.restrict:
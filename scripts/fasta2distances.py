@@ -12,6 +12,11 @@ Purpose
 
 This script computes various distances between sequences.
 
+Sequences are read in pairs of consecutive sequences. Pairs are
+processed in batches (``--batch-size``) that are counted at once
+(see :mod:`PairwiseDistances`) and that can be distributed over
+several processes (``--num-threads``).
+
 Usage
 -----
 
@@ -30,122 +35,97 @@ Command line options
 
 '''
 import sys
-import math
+import itertools
+import multiprocessing
+import numpy
 import CGAT.Experiment as E
-import CGAT.Genomics as Genomics
 import CGAT.FastaIterator as FastaIterator
+import CGAT.PairwiseDistances as PairwiseDistances
 
 
-def FilterAlignedPairForPositions(seq1, seq2, method):
-    """given the method, return a set of aligned sequences
-    only containing certain positions.
+def countSubstitutions(sequences, pairs, method, gap_char="-"):
+    """return substitution matrices for *pairs* of *sequences*
+    after filtering positions with *method*.
 
     Available filters:
     all:        do nothing.
-    codon1,codon2,codon3: return 1st, 2nd, 3rd codon positions only.
+    codon1,codon2,codon3: use 1st, 2nd, 3rd codon positions only.
     d4: only changes within fourfold-degenerate sites
     """
 
-    l1 = len(seq1)
-    l2 = len(seq2)
-
     if method == "all":
-        return seq1, seq2
+        pass
     elif method == "codon1":
-        return ("".join([seq1[x] for x in range(0, l1, 3)]),
-                "".join([seq2[x] for x in range(0, l2, 3)]))
+        sequences = [x[0::3] for x in sequences]
     elif method == "codon2":
-        return ("".join([seq1[x] for x in range(1, l1, 3)]),
-                "".join([seq2[x] for x in range(1, l2, 3)]))
+        sequences = [x[1::3] for x in sequences]
     elif method == "codon3":
-        return ("".join([seq1[x] for x in range(2, l1, 3)]),
-                "".join([seq2[x] for x in range(2, l2, 3)]))
+        sequences = [x[2::3] for x in sequences]
     elif method == "d4":
-        s1 = []
-        s2 = []
-        for x in range(0, l1, 3):
-            codon1 = seq1[x:x + 3]
-            codon2 = seq2[x:x + 3]
-            try:
-                aa1, deg11, deg12, deg13 = Genomics.GetDegeneracy(codon1)
-                aa2, deg11, deg22, deg23 = Genomics.GetDegeneracy(codon2)
-            except KeyError:
-                continue
-            if aa1 == aa2 and deg13 == 4 and deg23 == 4:
-                s1.append(codon1[2])
-                s2.append(codon2[2])
-        return "".join(s1), "".join(s2)
-
+        return PairwiseDistances.calculateSequencePairs(
+            PairwiseDistances.countDegenerateSubstitutions,
+            lambda s: PairwiseDistances.encodeDegenerateSites(
+                s, gap_char=gap_char, ignore_case=True),
+            sequences, pairs)
+    else:
+        raise ValueError("unknown filter %s" % method)
 
-# ------------------------------------------------------------------------
-def CalculateDistanceJC69(info, do_gamma=False, alpha=None):
-    """return Jukes-Cantor distance.
-    """
-    try:
-        p = float(info.mNDifferent) / info.mNAligned
-
-        if do_gamma:
-            # not done yet
-            distance = 0.75 * alpha * (pow(1 - 4 * p / 3, -1 / alpha) - 1)
-            variance = p * (1 - p) / (pow(1 - 4 * p / 3, -2 / (alpha + 1)) * L)
-        else:
-            distance = -0.75 * math.log(1.0 - 4.0 * p / 3.0)
-            variance = p * (1.0 - p) / \
-                (math.pow(1.0 - 4.0 * p / 3, 2.0) * info.mNAligned)
-    except:
-        raise ValueError
-
-    return distance, variance
+    return PairwiseDistances.calculateSequencePairs(
+        PairwiseDistances.countSubstitutions,
+        lambda s: (PairwiseDistances.encodeNucleotides(
+            s, gap_char=gap_char),),
+        sequences, pairs)
 
-# ------------------------------------------------------------------------
 
+def formatDistance(value):
+    if numpy.isnan(value):
+        return "nan"
+    return "%6.4f" % value
 
-def CalculateDistanceT92(info):
-    """
-    P,Q: transitions, transversions frequencies
-    q: G+C content
 
-    d = -2q(1 - q)loge(1 - P/[2q(1 - q)] - Q) -[1 -2q(1 -q)]loge(1 - 2Q)/2,(4.18)
-    V(d) = [c12P + c32Q - (c1P + c3Q)2]/n,(4.19)
-    where c1 = 1/(1 - P/[2q(1 - q)] - Q), c2 = 1/(1 - 2Q), c3 = 2q(1 - q)(c1 - c2) + c2, and q is the G+C content
+def computeDistances(args):
+    """compute distances for a batch of sequence pairs.
 
-    Note: result is undefined if
-        the number of transversions is >= 0.5
-        the G+C content is 0
-
-    raises ValueErrors for undefined results
+    Returns a list of output rows.
     """
-    gc = info.getGCContent()
-
-    # if there are no GC or no AT pairs: result is undefined
-    if gc == 0 or gc == 1:
-        raise ValueError
 
-    wg = 2.0 * gc * (1.0 - gc)
+    batch, filters, fields, gap_char = args
 
-    P = float(info.mNTransitions) / info.mNAligned
-    Q = float(info.mNTransversions) / info.mNAligned
+    sequences = []
+    for title1, sequence1, title2, sequence2 in batch:
+        sequences.append(sequence1)
+        sequences.append(sequence2)
+    pairs = [(x, x + 1) for x in range(0, len(sequences), 2)]
 
-    a1 = 1.0 - P / wg - Q
-    if a1 <= 0:
-        raise ValueError
+    columns = []
+    for f in filters:
 
-    a2 = 1.0 - 2.0 * Q
-    if a2 <= 0:
-        raise ValueError
+        matrices = countSubstitutions(sequences, pairs, f, gap_char)
+        indices = PairwiseDistances.getPairIndices(matrices)
 
-    # print a1, a2, wg, gc, "p=", P, "q=", Q, str(info)
+        for field in fields:
 
-    distance = -wg * math.log(a1) - 0.5 * (1.0 - wg) * math.log(a2)
+            if field in ("aligned", "unaligned1", "unaligned2",
+                         "transversions", "transitions", "identical"):
+                c = ["%i" % x for x in indices[field]]
+            elif field == "jc69":
+                c = map(formatDistance,
+                        PairwiseDistances.calculateJC69(matrices)[0])
+            elif field == "t92":
+                c = map(formatDistance,
+                        PairwiseDistances.calculateT92(matrices)[0])
+            else:
+                raise ValueError("Unknown field %s" % field)
 
-    c1 = 1 / a1
-    c2 = 1 / a2
-    c3 = wg * (c1 - c2) + c2
+            columns.append(c)
 
-    variance = (
-        c1 * c1 * P + c3 * c3 * Q - math.pow(c1 * P + c3 * Q, 2.0)) / info.mNAligned
+    rows = []
+    for x, record in enumerate(batch):
+        rows.append("%s\t%s\t%s" % (record[0],
+                                    record[2],
+                                    "\t".join([c[x] for c in columns])))
 
-    return distance, variance
+    return rows
 
 # ------------------------------------------------------------------------
 
@@ -166,12 +146,18 @@ def main(argv=None):
                       help="Filters to use for filtering sequences [all|codon1|codon2|codon3|d4].")
     parser.add_option("--fields", dest="fields", type="string",
                       help="Fields to output [aligned|nunaligned1|nunaligned2|identical|transitions|transversions|jc69|t92].")
+    parser.add_option("--batch-size", dest="batch_size", type="int",
+                      help="number of sequence pairs to process in a batch [%default].")
+    parser.add_option("--num-threads", dest="num_threads", type="int",
+                      help="number of processes to use for computing distances [%default].")
 
     parser.set_defaults(
         filename_map=None,
         filters="all,codon1,codon2,codon3,d4",
         gap_char="-",
         fields="aligned,unaligned1,unaligned2,identical,transitions,transversions,jc69,t92",
+        batch_size=1000,
+        num_threads=1,
     )
 
     (options, args) = E.Start(parser, add_pipe_options=True)
@@ -187,71 +173,55 @@ def main(argv=None):
 
     options.stdout.write("\t".join(headers) + "\n")
 
-    while 1:
-        try:
-            cur_record = iterator.next()
-            if cur_record is None:
+    def iterate_pairs():
+        while 1:
+            try:
+                cur_record = iterator.next()
+                if cur_record is None:
+                    break
+                first_record = cur_record
+                cur_record = iterator.next()
+                if cur_record is None:
+                    break
+                second_record = cur_record
+
+            except StopIteration:
                 break
-            first_record = cur_record
-            cur_record = iterator.next()
-            if cur_record is None:
+
+            if len(first_record.sequence) != len(second_record.sequence):
+                raise ValueError("sequences %s and %s of unequal length" % (
+                    first_record.title, second_record.title))
+
+            if len(first_record.sequence) % 3 != 0:
+                raise ValueError("sequence %s not multiple of 3" %
+                                 first_record.title)
+
+            yield (first_record.title, first_record.sequence,
+                   second_record.title, second_record.sequence)
+
+    def iterate_args():
+        pairs = iterate_pairs()
+        while 1:
+            batch = list(itertools.islice(pairs, options.batch_size))
+            if not batch:
                 break
-            second_record = cur_record
-
-        except StopIteration:
-            break
-
-        if len(first_record.sequence) != len(second_record.sequence):
-            raise "sequences %s and %s of unequal length" % (
-                first_record.title, second_record.title)
-
-        if len(first_record.sequence) % 3 != 0:
-            raise "sequence %s not multiple of 3" % first_record.title
-
-        # old: Bio.Alphabet.IUPAC.extended_dna.letters
-        alphabet = "ACGT" + options.gap_char
-
-        result = []
-        for f in options.filters:
-
-            s1, s2 = FilterAlignedPairForPositions(first_record.sequence,
-                                                   second_record.sequence,
-                                                   f)
-
-            info = Genomics.CalculatePairIndices(s1, s2, options.gap_char)
-
-            for field in options.fields:
-
-                if field == "aligned":
-                    c = "%i" % info.mNAligned
-                elif field == "unaligned1":
-                    c = "%i" % info.mNUnaligned1
-                elif field == "unaligned2":
-                    c = "%i" % info.mNUnaligned2
-                elif field == "transversions":
-                    c = "%i" % info.mNTransversions
-                elif field == "transitions":
-                    c = "%i" % info.mNTransitions
-                elif field == "identical":
-                    c = "%i" % info.mNIdentical
-                elif field == "jc69":
-                    try:
-                        c = "%6.4f" % CalculateDistanceJC69(info)[0]
-                    except ValueError:
-                        c = "nan"
-                elif field == "t92":
-                    try:
-                        c = "%6.4f" % CalculateDistanceT92(info)[0]
-                    except ValueError:
-                        c = "nan"
-                else:
-                    raise "Unknown field %s" % field
-
-                result.append(c)
-
-        options.stdout.write("%s\t%s\t%s\n" % (first_record.title,
-                                               second_record.title,
-                                               "\t".join(result)))
+            yield (batch, options.filters, options.fields,
+                   options.gap_char)
+
+    if options.num_threads > 1:
+        pool = multiprocessing.Pool(options.num_threads)
+        results = pool.imap(computeDistances, iterate_args())
+    else:
+        pool = None
+        results = itertools.imap(computeDistances, iterate_args())
+
+    for rows in results:
+        for row in rows:
+            options.stdout.write(row + "\n")
+
+    if pool:
+        pool.close()
+        pool.join()
 
     E.Stop()
 
@@ -62,6 +62,10 @@ mask-stops
 mask-seg
    mask sequence by running seg
 
+mask-seg-native
+   mask sequence with the native SEG implementation. Its output
+   has not been validated against seg.
+
 mask-bias
    mask sequence by running bias
 
@@ -174,6 +178,7 @@ def main(argv=None):
                  "map-codons",
                  "remove-gaps",
                  "mask-seg",
+                 "mask-seg-native",
                  "mask-bias",
                  "mask-codons",
                  "mask-incomplete-codons",
@@ -580,6 +585,10 @@ def main(argv=None):
                 masker = Masker.MaskerSeg()
                 sequence = masker(sequence)
 
+            elif method == "mask-seg-native":
+                masker = Masker.MaskerSeg(method="native")
+                sequence = masker(sequence)
+
             elif method == "shuffle":
                 s = list(sequence)
                 random.shuffle(s)
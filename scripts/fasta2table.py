@@ -114,6 +114,8 @@ Command line options
 import sys
 import re
 import math
+import itertools
+import multiprocessing
 
 import CGAT.Experiment as E
 import CGAT.Genomics as Genomics
@@ -124,6 +126,78 @@ import CGAT.FastaIterator as FastaIterator
 # ------------------------------------------------------------------------
 
 
+def getCounter(section, seqtype="na", gap_chars="xXnN", reference_codons=[]):
+    '''return a counter for *section*.'''
+
+    if seqtype == "na":
+        if section == "length":
+            s = SequenceProperties.SequencePropertiesLength()
+        elif section == "sequence":
+            s = SequenceProperties.SequencePropertiesSequence()
+        elif section == "hid":
+            s = SequenceProperties.SequencePropertiesHid()
+        elif section == "na":
+            s = SequenceProperties.SequencePropertiesNA()
+        elif section == "gaps":
+            s = SequenceProperties.SequencePropertiesGaps(gap_chars)
+        elif section == "cpg":
+            s = SequenceProperties.SequencePropertiesCpg()
+        elif section == "dn":
+            s = SequenceProperties.SequencePropertiesDN()
+        # these sections requires sequence length to be a multiple of 3
+        elif section == "aa":
+            s = SequenceProperties.SequencePropertiesAA()
+        elif section == "degeneracy":
+            s = SequenceProperties.SequencePropertiesDegeneracy()
+        elif section == "codon-bias":
+            s = SequenceProperties.SequencePropertiesBias(reference_codons)
+        elif section == "codons":
+            s = SequenceProperties.SequencePropertiesCodons()
+        elif section == "codon-usage":
+            s = SequenceProperties.SequencePropertiesCodonUsage()
+        elif section == "codon-translator":
+            s = SequenceProperties.SequencePropertiesCodonTranslator()
+        else:
+            raise ValueError("unknown section %s" % section)
+    elif seqtype == "aa":
+        if section == "length":
+            s = SequenceProperties.SequencePropertiesLength()
+        elif section == "sequence":
+            s = SequenceProperties.SequencePropertiesSequence()
+        elif section == "hid":
+            s = SequenceProperties.SequencePropertiesHid()
+        elif section == "aa":
+            s = SequenceProperties.SequencePropertiesAminoAcids()
+        else:
+            raise ValueError("unknown section %s" % section)
+    return s
+
+
+def computeProperties(args):
+    '''compute properties for a batch of sequences.
+
+    Returns a list of output rows and a list of counters with the
+    totals for each section.
+    '''
+
+    batch, sections, seqtype, gap_chars, reference_codons = args
+
+    totals = [getCounter(section, seqtype, gap_chars, reference_codons)
+              for section in sections]
+
+    rows = []
+    for id, sequence in batch:
+        fields = []
+        for section, total in zip(sections, totals):
+            s = getCounter(section, seqtype, gap_chars, reference_codons)
+            s.loadSequence(sequence, seqtype)
+            total.addProperties(s)
+            fields.extend(s.getFields())
+        rows.append("\t".join([id] + fields))
+
+    return rows, totals
+
+
 def main(argv=None):
 
     parser = E.OptionParser(version="%prog version: $Id$",
@@ -163,6 +237,15 @@ def main(argv=None):
         help="add a row with column totals at the end of the table"
         "[%default]")
 
+    parser.add_option(
+        "--batch-size", dest="batch_size", type="int",
+        help="number of sequences to process in a batch [%default]")
+
+    parser.add_option(
+        "--num-threads", dest="num_threads", type="int",
+        help="number of processes to use for computing properties "
+        "[%default]")
+
     parser.set_defaults(
         filename_weights=None,
         pseudocounts=1,
@@ -172,6 +255,8 @@ def main(argv=None):
         gap_chars='xXnN',
         split_id=False,
         add_total=False,
+        batch_size=1000,
+        num_threads=1,
     )
 
     (options, args) = E.Start(parser, argv=argv)
@@ -213,56 +298,13 @@ def main(argv=None):
 
     iterator = FastaIterator.FastaIterator(options.stdin)
 
-    def getCounter(section):
-
-        if options.seqtype == "na":
-            if section == "length":
-                s = SequenceProperties.SequencePropertiesLength()
-            elif section == "sequence":
-                s = SequenceProperties.SequencePropertiesSequence()
-            elif section == "hid":
-                s = SequenceProperties.SequencePropertiesHid()
-            elif section == "na":
-                s = SequenceProperties.SequencePropertiesNA()
-            elif section == "gaps":
-                s = SequenceProperties.SequencePropertiesGaps(
-                    options.gap_chars)
-            elif section == "cpg":
-                s = SequenceProperties.SequencePropertiesCpg()
-            elif section == "dn":
-                s = SequenceProperties.SequencePropertiesDN()
-            # these sections requires sequence length to be a multiple of 3
-            elif section == "aa":
-                s = SequenceProperties.SequencePropertiesAA()
-            elif section == "degeneracy":
-                s = SequenceProperties.SequencePropertiesDegeneracy()
-            elif section == "codon-bias":
-                s = SequenceProperties.SequencePropertiesBias(reference_codons)
-            elif section == "codons":
-                s = SequenceProperties.SequencePropertiesCodons()
-            elif section == "codon-usage":
-                s = SequenceProperties.SequencePropertiesCodonUsage()
-            elif section == "codon-translator":
-                s = SequenceProperties.SequencePropertiesCodonTranslator()
-            else:
-                raise ValueError("unknown section %s" % section)
-        elif options.seqtype == "aa":
-            if section == "length":
-                s = SequenceProperties.SequencePropertiesLength()
-            elif section == "sequence":
-                s = SequenceProperties.SequencePropertiesSequence()
-            elif section == "hid":
-                s = SequenceProperties.SequencePropertiesHid()
-            elif section == "aa":
-                s = SequenceProperties.SequencePropertiesAminoAcids()
-            else:
-                raise ValueError("unknown section %s" % section)
-        return s
-
     # setup totals
     totals = {}
     for section in options.sections:
-        totals[section] = getCounter(section)
+        totals[section] = getCounter(section,
+                                     options.seqtype,
+                                     options.gap_chars,
+                                     reference_codons)
 
     options.stdout.write("id")
     for section in options.sections:
@@ -271,32 +313,46 @@ def main(argv=None):
     options.stdout.write("\n")
     options.stdout.flush()
 
-    s = getCounter("hid")
-    s.loadSequence("AAAAAAAAA", "na")
+    def iterate_batches():
+        for cur_record in iterator:
 
-    for cur_record in iterator:
+            sequence = re.sub(" ", "", cur_record.sequence).upper()
 
-        sequence = re.sub(" ", "", cur_record.sequence).upper()
+            if len(sequence) == 0:
+                raise ValueError("empty sequence %s" % cur_record.title)
 
-        if len(sequence) == 0:
-            raise ValueError("empty sequence %s" % cur_record.title)
+            id = rx.search(cur_record.title).groups()[0]
 
-        id = rx.search(cur_record.title).groups()[0]
+            if options.split_id is True:
+                id = id.split()[0]
 
-        if options.split_id is True:
-            options.stdout.write("%s" % id.split()[0])
-        else:
-            options.stdout.write("%s" % id)
-        options.stdout.flush()
+            yield id, sequence
 
-        for section in options.sections:
-            s = getCounter(section)
-            s.loadSequence(sequence, options.seqtype)
-            totals[section].addProperties(s)
+    def iterate_args():
+        records = iterate_batches()
+        while 1:
+            batch = list(itertools.islice(records, options.batch_size))
+            if not batch:
+                break
+            yield (batch, options.sections, options.seqtype,
+                   options.gap_chars, reference_codons)
 
-            options.stdout.write("\t" + "\t".join(s.getFields()))
+    if options.num_threads > 1:
+        pool = multiprocessing.Pool(options.num_threads)
+        results = pool.imap(computeProperties, iterate_args())
+    else:
+        pool = None
+        results = itertools.imap(computeProperties, iterate_args())
 
-        options.stdout.write("\n")
+    for rows, batch_totals in results:
+        for row in rows:
+            options.stdout.write(row + "\n")
+        for section, total in zip(options.sections, batch_totals):
+            totals[section].addProperties(total)
+
+    if pool:
+        pool.close()
+        pool.join()
 
     if options.add_total:
         options.stdout.write("total")
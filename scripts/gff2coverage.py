@@ -108,7 +108,10 @@ Command line options
 
 import sys
 import math
+import itertools
 import collections
+import multiprocessing
+import numpy
 
 import CGAT.Experiment as E
 import CGAT.IndexedFasta as IndexedFasta
@@ -126,10 +129,7 @@ def printValues(contig, max_size, window_size, values, options):
         outfile.write("\tabs_%s\trel_%s" % (feature, feature))
     outfile.write("\n")
 
-    max_vv = []
-
-    for f in range(len(options.features)):
-        max_vv.append(float(max(map(lambda x: x[f], values))))
+    max_vv = [float(x) for x in values.max(axis=0)]
 
     bin = 0
     for vv in values:
@@ -139,38 +139,80 @@ def printValues(contig, max_size, window_size, values, options):
         for x in range(len(options.features)):
             outfile.write("\t%i\t%s" % (
                 vv[x],
-                options.value_format % (vv[x] / max_vv[x])))
+                options.value_format % (float(vv[x]) / max_vv[x])))
         outfile.write("\n")
         bin += window_size
 
     outfile.close()
 
 
-def processChunk(contig, chunk, options, fasta=None):
+def readIntervals(infile, features):
+    """read intervals from a :term:`gff` formatted file.
+
+    Returns a dictionary mapping each contig to lists of starts,
+    ends, strands and the index of the feature in *features*
+    (-1 for other features).
     """
-    This function requires segments to be non-overlapping.
+
+    map_feature2index = dict([(y, x) for x, y in enumerate(features)])
+
+    contigs = collections.defaultdict(lambda: ([], [], [], []))
+    for entry in GTF.iterator(infile):
+        starts, ends, strands, codes = contigs[entry.contig]
+        starts.append(entry.start)
+        ends.append(entry.end)
+        strands.append(entry.strand)
+        codes.append(map_feature2index.get(entry.feature, -1))
+
+    return contigs
+
+
+def checkOverlaps(contig, starts, ends, strands):
+    """raise ValueError if intervals on the same strand overlap.
+
+    Intervals are sorted by start and compared against the
+    largest end of all preceding intervals.
     """
 
-    if len(chunk) == 0:
-        return
-
-    # check whether there are overlapping features or not
-    checked = []
-    for feature in chunk:
-        checked.append(feature)
-        others = [x for x in chunk if x not in checked]
-        for otherFeature in others:
-            if GTF.Overlap(feature, otherFeature):
-                raise ValueError(" Histogram could not be created"
-                                 " since the file contains overlapping "
-                                 "features! \n%s\n%s  "
-                                 % (feature, otherFeature))
-    # clear auxiliary list
-    del checked[:]
-
-    # compute max_coordinate for the histogram
-    max_coordinate = max(map(lambda x: x.end, chunk))
-    # compute window size
+    for strand in numpy.unique(strands):
+        index = numpy.nonzero(strands == strand)[0]
+        index = index[numpy.argsort(starts[index], kind="mergesort")]
+        s, e = starts[index], ends[index]
+        max_ends = numpy.maximum.accumulate(e)[:-1]
+        overlaps = (max_ends > s[1:]) & (e[1:] > s[1:])
+        if overlaps.any():
+            x = numpy.nonzero(overlaps)[0][0] + 1
+            y = numpy.argmax(e[:x])
+            raise ValueError(" Histogram could not be created"
+                             " since the file contains overlapping "
+                             "features! \n%s:%i-%i (%s)\n%s:%i-%i (%s)  "
+                             % (contig, s[y], e[y], strand,
+                                contig, s[x], e[x], strand))
+
+
+def computeCoverage(starts, ends, positions):
+    """return the number of bases covered by intervals before each
+    position.
+
+    The coverage is the sum of a ramp starting at each start
+    minus a ramp starting at each end.
+    """
+
+    starts = numpy.sort(starts)
+    ends = numpy.sort(ends)
+    cum_starts = numpy.concatenate(([0], numpy.cumsum(starts)))
+    cum_ends = numpy.concatenate(([0], numpy.cumsum(ends)))
+    nstarts = numpy.searchsorted(starts, positions)
+    nends = numpy.searchsorted(ends, positions)
+
+    return (nstarts * positions - cum_starts[nstarts]) - \
+        (nends * positions - cum_ends[nends])
+
+
+def getWindows(contig, max_coordinate, options, fasta=None):
+    """return maximum coordinate, window size and number of bins
+    for the histogram of a contig."""
+
     if options.window_size:
         window_size = options.window_size
         num_bins = int(math.ceil((float(max_coordinate) / window_size)))
@@ -189,40 +231,37 @@ def processChunk(contig, chunk, options, fasta=None):
         raise ValueError("please specify a window size of provide "
                          "genomic sequence with number of bins.")
 
-    values = [[] for x in range(num_bins)]
+    return max_coordinate, window_size, num_bins
 
-    # do several parses for each feature, slow, but easier to code
-    # alternatively: sort by feature and location.
-    for feature in options.features:
-        total = 0
-        bin = 0
-        end = window_size
-        for entry in chunk:
-            if entry.feature != feature:
-                continue
-
-            while end < entry.start:
-                values[bin].append(total)
-                bin += 1
-                end += window_size
-
-            while entry.end > end:
-                seg_start = max(entry.start, end - window_size)
-                seg_end = min(entry.end, end)
-                total += seg_end - seg_start
-                values[bin].append(total)
-                end += window_size
-                bin += 1
-            else:
-                seg_start = max(entry.start, end - window_size)
-                seg_end = min(entry.end, end)
-                total += seg_end - seg_start
 
-        while bin < num_bins:
-            values[bin].append(total)
-            bin += 1
+def processContig(args):
+    """compute the cumulative coverage of features in windows
+    along a contig.
+
+    This function requires segments to be non-overlapping.
+
+    Returns a tuple of contig, maximum coordinate, window size
+    and an array of values with one row per bin and one column
+    per feature.
+    """
+
+    (contig, starts, ends, strands, codes, nfeatures,
+     max_coordinate, window_size, num_bins) = args
+
+    checkOverlaps(contig, starts, ends, strands)
+
+    # the last bin collects everything up to the end of the contig
+    positions = numpy.arange(1, num_bins + 1, dtype=numpy.int64) * \
+        window_size
+    if num_bins > 0:
+        positions[-1] = max(positions[-1], max_coordinate)
 
-    printValues(contig, max_coordinate, window_size, values, options)
+    values = numpy.zeros((num_bins, nfeatures), dtype=numpy.int64)
+    for x in range(nfeatures):
+        take = codes == x
+        values[:, x] = computeCoverage(starts[take], ends[take], positions)
+
+    return contig, max_coordinate, window_size, values
 
 
 def main(argv=None):
@@ -261,6 +300,11 @@ def main(argv=None):
                       help="methods to apply. "
                       "[default=%default]")
 
+    parser.add_option("--num-threads", dest="num_threads", type="int",
+                      help="number of processes to use for computing "
+                      "histograms. Contigs are processed in parallel. "
+                      "[default=%default]")
+
     parser.set_defaults(
         genome_file=None,
         window_size=None,
@@ -268,6 +312,7 @@ def main(argv=None):
         value_format="%6.4f",
         features=[],
         method="genomic",
+        num_threads=1,
     )
 
     (options, args) = E.Start(parser, add_output_options=True)
@@ -279,23 +324,34 @@ def main(argv=None):
 
     if options.method == "histogram":
 
-        gff = GTF.readFromFile(options.stdin)
-
-        gff.sort(lambda x, y: cmp((x.contig, x.start), (y.contig, y.start)))
-
-        chunk = []
-        last_contig = None
-
-        for entry in gff:
-
-            if last_contig != entry.contig:
-                processChunk(last_contig, chunk, options, fasta)
-                last_contig = entry.contig
-                chunk = []
+        contigs = readIntervals(options.stdin, options.features)
+
+        def _iterate_contigs():
+            for contig in sorted(contigs.keys()):
+                starts, ends, strands, codes = contigs[contig]
+                max_coordinate, window_size, num_bins = getWindows(
+                    contig, max(ends), options, fasta)
+                yield (contig,
+                       numpy.array(starts, dtype=numpy.int64),
+                       numpy.array(ends, dtype=numpy.int64),
+                       numpy.array(strands),
+                       numpy.array(codes, dtype=numpy.int32),
+                       len(options.features),
+                       max_coordinate, window_size, num_bins)
+
+        if options.num_threads > 1:
+            pool = multiprocessing.Pool(options.num_threads)
+            results = pool.imap(processContig, _iterate_contigs())
+        else:
+            pool = None
+            results = itertools.imap(processContig, _iterate_contigs())
 
-            chunk.append(entry)
+        for contig, max_coordinate, window_size, values in results:
+            printValues(contig, max_coordinate, window_size, values, options)
 
-        processChunk(last_contig, chunk, options, fasta)
+        if pool:
+            pool.close()
+            pool.join()
 
     elif options.method == "genomic":
         intervals = collections.defaultdict(int)
@@ -56,7 +56,9 @@ option and a given :term:`gff` formatted file::
  --maskregions-bed-file=intervals.gff < features.gff > features.fasta
 
 where ``--masker`` can take the following values: ``dust``, ``dustmasker``,
-and ``softmask``.
+``dust-native`` and ``softmask``. ``dust`` and ``dustmasker`` run the
+external tool, while ``dust-native`` uses the native DUST implementation
+in :mod:`CGAT.Masker`.
 
 Options
 -------
@@ -95,7 +97,7 @@ Options
   by
 
 ``--masker``
-  Masker type to use: dust, dustmasker, soft or none
+  Masker type to use: dust, dustmasker, dust-native, soft or none
 
 Command line options
 --------------------
@@ -176,7 +178,8 @@ def main(argv=None):
 
     parser.add_option(
         "--masker", dest="masker", type="choice",
-        choices=("dust", "dustmasker", "softmask", "none"),
+        choices=("dust", "dustmasker", "dust-native", "softmask",
+                 "none"),
         help="apply masker [%default].")
 
     parser.set_defaults(
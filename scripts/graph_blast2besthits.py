@@ -10,9 +10,23 @@ graph_blast2besthits.py -
 Purpose
 -------
 
-.. todo::
-   
-   describe purpose of the script.
+Parse blast graph and only output best hits for each query per
+genome. Note that the blast graph has to be sorted by query_token and
+sbjct_token.
+
+The genome of a token is extracted with a regular expression
+(``--pattern-genome``). Hits to the query's own genome are ignored.
+Hits are ranked by E-Value, score or percent identity
+(``--method``). If several hits have the same best value, all are
+output.
+
+With ``--score-factor`` and ``--pide-factor``, all hits with a
+score higher than the factor times the score of the first hit or
+with a percent identity within the offset of the percent identity
+of the first hit are output.
+
+Links of several queries are processed together in chunks of at
+least ``--chunk-size`` links.
 
 Usage
 -----
@@ -33,109 +47,107 @@ Command line options
 '''
 import sys
 import re
-import getopt
+import numpy
 import CGAT.Experiment as E
 import CGAT.BlastAlignments as BlastAlignments
+import CGAT.LinkGraph as LinkGraph
 
 
-USAGE = """python %s [OPTIONS] < graph.in > graph.out
-
-Version: $Id: graph_blast2besthits.py 2782 2009-09-10 11:40:29Z andreas $
-
-Parse blast graph and only output best hits for each query per
-genome. Note that the blast graph has been sorted by query_token and
-sbjct_token.
-
-Options:
--h, --help                      print this message.
--v, --verbose=                  loglevel.
--p, --pattern-genome=           pattern to extract genome
--m, --method=                   method [blast|score|pid]
--s, --score-factor=             thresholding on score (multiplicative)
--i, --pide-factor=              thresholding on pide (additive)
-""" % sys.argv[0]
-
-param_long_options = ["help", "verbose=", "pattern-genome=", "method=",
-                      "score-factor=", "pide-factor=",
-                      "version"]
-
-param_short_options = "hv:p:f:i"
-
-param_loglevel = 1
-param_method = "evalue"
-param_filename_self_scores = None
-param_pattern_genome = "^([^|]+)|"
-param_method = "evalue"
+def getBestHits(queries, genomes, query_genomes,
+                evalues, scores, pids,
+                method="evalue",
+                score_threshold_factor=1.0,
+                pide_threshold_factor=0.0):
+    """return indices of best hits per query and genome.
 
-param_score_threshold_factor = 1.0
-param_pide_threshold_factor = 0.0
+    *queries* are consecutive query numbers and *genomes* are the
+    ranks of the hit genomes in sorted order. Hits to *query_genomes*
+    are ignored.
 
-# ------------------------------------------------------------------------
-
-
-def PrintMatches(matches, method=None, filter=None,
-                 score_threshold_factor=1.0,
-                 pide_threshold_factor=0.0):
-    """print best match per organism (sorted by E-Value).
-
-    If there are several matches with the same E-Value, all are printed.
+    Indices are returned sorted by query, genome and primary score.
     """
 
-    orgs = matches.keys()
-    orgs.sort()
-
     if method == "evalue":
-        f1 = lambda x, y: cmp(x.mEvalue, y.mEvalue)
-        f2 = lambda x: x.mEvalue
+        primary = evalues
     elif method == "score":
-        f1 = lambda x, y: -cmp(x.score, y.score)
-        f2 = lambda x: x.score
+        primary = -scores
     elif method == "pid":
-        f1 = lambda x, y: -cmp(x.mPercentIdentity, y.mPercentIdentity)
-        f2 = lambda x: x.mPercentIdentity
+        primary = -pids
     else:
-        raise "unknown method"
-
-    noutput = 0
+        raise ValueError("unknown method %s" % method)
+
+    index = numpy.flatnonzero(genomes != query_genomes)
+    order = index[numpy.lexsort((index, primary[index],
+                                 genomes[index], queries[index]))]
+    if len(order) == 0:
+        return order
+
+    queries, genomes = queries[order], genomes[order]
+    starts = numpy.flatnonzero(numpy.concatenate(
+        ([True],
+         (queries[1:] != queries[:-1]) | (genomes[1:] != genomes[:-1]))))
+    sizes = numpy.diff(numpy.append(starts, len(order)))
+
+    # thresholds are set from the first hit in the input
+    first = numpy.minimum.reduceat(order, starts)
+    score_threshold = numpy.repeat(
+        (scores[first] * score_threshold_factor).astype(numpy.int64), sizes)
+    pide_threshold = numpy.repeat(
+        (pids[first] + pide_threshold_factor).astype(numpy.int64), sizes)
+
+    scores, pids, primary = scores[order], pids[order], primary[order]
+
+    if score_threshold_factor != 1.0 and pide_threshold_factor >= 0.0:
+        # take best match and all within score threshold factor
+        selected = (scores > score_threshold) | (pids >= pide_threshold)
+    else:
+        # take all with same primary score up to the first hit
+        # below the score threshold
+        ok = (primary == numpy.repeat(primary[starts], sizes)) & \
+            (scores >= score_threshold)
+        nfailed = numpy.cumsum(~ok)
+        nfailed -= numpy.repeat((nfailed - ~ok)[starts], sizes)
+        selected = nfailed == 0
 
-    for org in orgs:
+    return order[selected]
 
-        if filter and filter == org:
-            continue
 
-        m = matches[org]
-        score_threshold = int(m[0].score * score_threshold_factor)
-        pide_threshold = int(m[0].mPercentIdentity + pide_threshold_factor)
+def writeBestHits(outfile, links, rx, **kwargs):
+    """write best hits within *links* to *outfile*.
 
-        if param_loglevel >= 2:
-            print "# %i matches for %s, min_score=%i" % (len(m), org, score_threshold)
+    returns the number of links written.
+    """
 
-        if param_loglevel >= 3:
-            for mm in m:
-                print str(mm)
+    genomes = LinkGraph.Tokens()
+    codes = numpy.array(
+        [genomes.encode(rx.search(x.mSbjctToken).groups()[0])
+         for x in links], dtype=numpy.int64)
+    ranks = genomes.getRanks()
 
-        m.sort(f1)
+    query_tokens = numpy.array([x.mQueryToken for x in links])
+    queries = numpy.cumsum(numpy.concatenate(
+        ([0], query_tokens[1:] != query_tokens[:-1])))
 
-        s = f2(m[0])
-        x = 0
+    def _getQueryGenome(token):
+        genome = rx.search(token).groups()[0]
+        if genome and genome in genomes.map_token2id:
+            return ranks[genomes.map_token2id[genome]]
+        return -1
 
-        if score_threshold_factor != 1.0 and pide_threshold_factor >= 0.0:
-            # take best match and all within score threshold factor
-            for x in range(len(m)):
-                if m[x].score > score_threshold or \
-                        m[x].mPercentIdentity >= pide_threshold:
-                    print str(m[x])
-                    noutput += 1
-        else:
-            # write all with same primary score
-            while x < len(m) and s == f2(m[x]) and m[x].score >= score_threshold:
-                print str(m[x])
-                x += 1
-                noutput += 1
+    index = getBestHits(
+        queries,
+        ranks[codes],
+        numpy.array([_getQueryGenome(x.mQueryToken) for x in links],
+                    dtype=numpy.int64),
+        numpy.array([x.mEvalue for x in links], dtype=numpy.float64),
+        numpy.array([x.score for x in links], dtype=numpy.int64),
+        numpy.array([x.mPercentIdentity for x in links], dtype=numpy.int64),
+        **kwargs)
 
-    return noutput
+    for x in index:
+        outfile.write(str(links[x]) + "\n")
 
-# ------------------------------------------------------------------------
+    return len(index)
 
 
 def main(argv=None):
@@ -147,42 +159,48 @@ def main(argv=None):
     if argv is None:
         argv = sys.argv
 
-    try:
-        optlist, args = getopt.getopt(
-            sys.argv[1:], param_short_options, param_long_options)
-    except getopt.error, msg:
-        print USAGE, msg
-        sys.exit(2)
-
-    for o, a in optlist:
-        if o in ("-v", "--verbose"):
-            param_loglevel = int(a)
-        elif o in ("--version", ):
-            print "version="
-            sys.exit(0)
-        elif o in ("-h", "--help"):
-            print USAGE
-            sys.exit(0)
-        elif o in ("-p", "--pattern-genome"):
-            param_pattern_genome = a
-        elif o in ("-m", "--method"):
-            param_method = a
-        elif o in ("-s", "--score-factor"):
-            param_score_threshold_factor = float(a)
-        elif o in ("-i", "--pide-factor"):
-            param_pide_threshold_factor = float(a)
-
-    print E.GetHeader()
-    print E.GetParams()
-
-    ninput, noutput, nskipped, nfailed = 0, 0, 0, 0
-
+    parser = E.OptionParser(
+        version="%prog version: $Id: graph_blast2besthits.py 2782 2009-09-10 11:40:29Z andreas $",
+        usage=globals()["__doc__"])
+
+    parser.add_option("-p", "--pattern-genome", dest="pattern_genome",
+                      type="string",
+                      help="pattern to extract genome [%default].")
+    parser.add_option("-m", "--method", dest="method", type="choice",
+                      choices=("evalue", "score", "pid"),
+                      help="method to select best hits [%default].")
+    parser.add_option("-s", "--score-factor", dest="score_threshold_factor",
+                      type="float",
+                      help="thresholding on score (multiplicative) "
+                      "[%default].")
+    parser.add_option("-i", "--pide-factor", dest="pide_threshold_factor",
+                      type="float",
+                      help="thresholding on pide (additive) [%default].")
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      help="minimum number of links to process at a time "
+                      "[%default].")
+
+    parser.set_defaults(
+        pattern_genome="^([^|]+)|",
+        method="evalue",
+        score_threshold_factor=1.0,
+        pide_threshold_factor=0.0,
+        chunk_size=100000,
+    )
+
+    (options, args) = E.Start(parser, argv=argv)
+
+    rx = re.compile(options.pattern_genome)
+
+    kwargs = {"method": options.method,
+              "score_threshold_factor": options.score_threshold_factor,
+              "pide_threshold_factor": options.pide_threshold_factor}
+
+    ninput, noutput = 0, 0
     last_query_token = None
-    rx = re.compile(param_pattern_genome)
-
-    matches = {}
+    links = []
 
-    for line in sys.stdin:
+    for line in options.stdin:
 
         if line[0] == "#":
             continue
@@ -191,42 +209,30 @@ def main(argv=None):
         try:
             link.Read(line)
         except ValueError:
-            sys.stderr.write("parsing error in line %s\n" % line[:-1])
+            options.stderr.write("parsing error in line %s\n" % line[:-1])
             continue
 
         ninput += 1
         if link.mQueryToken != last_query_token:
-            if last_query_token:
-                noutput += PrintMatches(matches,
-                                        method=param_method,
-                                        filter=rx.search(
-                                            last_query_token).groups()[0],
-                                        score_threshold_factor=param_score_threshold_factor,
-                                        pide_threshold_factor=param_pide_threshold_factor)
-            matches = {}
+            if len(links) >= options.chunk_size:
+                noutput += writeBestHits(options.stdout, links, rx, **kwargs)
+                links = []
             last_query_token = link.mQueryToken
 
-        org = rx.search(link.mSbjctToken).groups()[0]
-
-        if org not in matches:
-            matches[org] = []
-        matches[org].append(link)
+        links.append(link)
 
-    noutput += PrintMatches(matches,
-                            method=param_method,
-                            filter=rx.search(last_query_token).groups()[0],
-                            score_threshold_factor=param_score_threshold_factor,
-                            pide_threshold_factor=param_pide_threshold_factor)
+    if links:
+        noutput += writeBestHits(options.stdout, links, rx, **kwargs)
 
-    print "# ninput=%i, noutput=%i" % (ninput, noutput)
+    options.stdout.write("# ninput=%i, noutput=%i\n" % (ninput, noutput))
 
-    print E.GetFooter()
+    E.Stop()
 
     if noutput == 0:
         if ninput == 0:
-            raise "no output, because no input."
+            raise ValueError("no output, because no input.")
         else:
-            raise "no output."
+            raise ValueError("no output.")
 
 
 if __name__ == "__main__":
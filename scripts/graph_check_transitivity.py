@@ -17,6 +17,16 @@ for every two edges A->B and B->C check whether A->C exists.
 
 Edges are taken to be undirected.
 
+With ``--use-subsets``, the third field contains a redundancy code
+and each pair of codes is tested only once. The triplet tested for
+a pair of codes is the first one when triplets are sorted by the
+tokens of the three vertices and then by the codes.
+
+The graph is held in memory as integer encoded arrays (see
+:mod:`LinkGraph`). With ``--save-graph`` the graph is saved to
+disk and can be re-used with ``--load-graph``, which memory-maps
+the saved arrays instead of parsing the links again.
+
 Usage
 -----
 
@@ -35,7 +45,9 @@ Command line options
 
 '''
 import sys
+import numpy
 import CGAT.Experiment as E
+import CGAT.LinkGraph as LinkGraph
 
 
 def main(argv=None):
@@ -60,6 +72,12 @@ def main(argv=None):
                       help="report interval for processing.")
     parser.add_option("--use-subsets", dest="subsets", action="store_true",
                       help="do subset calculation. Third field contains a redundancy code.")
+    parser.add_option("--save-graph", dest="save_graph", type="string",
+                      help="save graph to files starting with this prefix "
+                      "[%default].")
+    parser.add_option("--load-graph", dest="load_graph", type="string",
+                      help="load graph saved with --save-graph instead of "
+                      "reading links from stdin [%default].")
 
     parser.set_defaults(
         filename_missing=None,
@@ -67,97 +85,90 @@ def main(argv=None):
         report_step1=100000,
         report_step2=10000,
         subsets=False,
+        save_graph=None,
+        load_graph=None,
     )
 
     (options, args) = E.Start(parser)
 
-    # retrieve data
-    vals = {}
-    niterations = 0
-    ninput = 0
-
-    for line in sys.stdin:
-        if line[0] == "#":
-            continue
-
-        niterations += 1
-
-        if options.loglevel >= 1 and (niterations % options.report_step1 == 0):
-            options.stdlog.write("# input: %i\n" % (niterations))
-            options.stdlog.flush()
-
-        v1, v2, w = line[:-1].split("\t")[:3]
-
-        if v1 == v2:
-            continue
-
-        if v1 not in vals:
-            vals[v1] = []
-        if v2 not in vals:
-            vals[v2] = []
-
-        if not options.subsets:
-            w = ninput
-
-        vals[v1].append((v2, w))
-        vals[v2].append((v1, w))
-
-        ninput += 1
+    if options.load_graph:
+        graph = LinkGraph.loadLinkGraph(options.load_graph)
+    else:
+        # each link has a code. Links with the same code are
+        # counted only once in subset calculations.
+        if options.subsets:
+            codes = LinkGraph.Tokens()
+            tokens, sources, targets, weights = LinkGraph.readLinks(
+                options.stdin, columns=(2,),
+                convert=codes.encode, chunk_size=options.report_step1,
+                remove_self_links=True)
+        else:
+            tokens, sources, targets, weights = LinkGraph.readLinks(
+                options.stdin, columns=(),
+                chunk_size=options.report_step1,
+                remove_self_links=True)
+            weights = numpy.arange(len(sources), dtype=numpy.float64)
+            weights = weights.reshape((-1, 1))
+
+        graph = LinkGraph.buildLinkGraph(tokens, sources, targets,
+                                         weights, symmetric=True)
+        if options.save_graph:
+            graph.save(options.save_graph)
+
+    ninput = graph.getNumLinks() // 2
+    nkeys = len(graph)
+    E.info("read graph with %i vertices and %i links" % (nkeys, ninput))
 
     # make everything unique
-    for key, v1 in vals.items():
-        vals[key] = tuple(set(v1))
-
-    keys = vals.keys()
-    keys.sort()
-    niterations = 0
-    nkeys = len(keys)
-    missing = []
-    ntotal = 0
-    nfound = 0
-    counted = {}
-    nremoved = 0
+    graph = graph.sortLinks().removeDuplicates()
+
+    # all paths v1 -> v2 -> v3 with link codes c2 and c3
+    first, second = graph.getPaths()
+    v1, v3 = graph.targets[first], graph.targets[second]
+    v2 = graph.getSources()[first]
+    codes = graph.weights[:, 0].astype(numpy.int64)
+    c2, c3 = codes[first], codes[second]
+
+    # test paths ordered by vertex tokens
+    ranks = graph.tokens.getRanks()
+    order = numpy.lexsort((c3, c2, ranks[v3], ranks[v2], ranks[v1]))
+    # do not do self-comparisons
+    valid = ((v1 != v3) & (c2 != c3))[order]
+    c2, c3 = c2[order], c3[order]
+
+    # each pair of link codes is tested once at its first valid
+    # path. Later paths with the same codes are removed. Paths are
+    # grouped by codes keeping the path order within a group.
+    by_key = numpy.lexsort((numpy.arange(len(order)), c3, c2))
+    c2, c3, valid = c2[by_key], c3[by_key], valid[by_key]
+    starts = numpy.flatnonzero(
+        numpy.concatenate(([True],
+                           (c2[1:] != c2[:-1]) | (c3[1:] != c3[:-1]))))
+    ntested = numpy.cumsum(valid)
+    ntested -= numpy.repeat((ntested - valid)[starts],
+                            numpy.diff(numpy.append(starts, len(valid))))
+    is_tested = valid & (ntested == 1)
+    nremoved = numpy.count_nonzero(ntested >= 1) - \
+        numpy.count_nonzero(is_tested)
+
+    index = order[numpy.sort(by_key[is_tested])]
+    v1, v2, v3 = v1[index], v2[index], v3[index]
+    is_found = graph.hasLinks(v1, v3)
+
+    ntotal = len(index)
+    nfound = numpy.count_nonzero(is_found)
+
+    decode = graph.tokens.decode
+    missing = zip(decode(v1[~is_found]),
+                  decode(v2[~is_found]),
+                  decode(v3[~is_found]))
 
     if options.filename_found:
         outfile_found = open(options.filename_found, "w")
-
-    for v1 in keys:
-
-        niterations += 1
-
-        if options.loglevel >= 1 and (niterations % options.report_step2 == 0):
-            options.stdlog.write("# loop: %i\n" % (niterations))
-            options.stdlog.flush()
-
-        for v2, c2 in vals[v1]:
-
-            # only to half-symmetric test
-
-            for v3, c3 in vals[v2]:
-                if (c2, c3) in counted:
-                    nremoved += 1
-                    # print "v1=", v1, "v2=", v2, "v3=", v3, "c2=", c2, "c3=",
-                    # c3, "removed"
-                    continue
-
-                # do not do self-comparisons
-                if v1 == v3:
-                    continue
-                if c2 == c3:
-                    continue
-
-                counted[(c2, c3)] = True
-                ntotal += 1
-                if v3 in map(lambda x: x[0], vals[v1]) or v1 in map(lambda x: x[0], vals[v3]):
-                    nfound += 1
-                    if options.filename_found:
-                        outfile_found.write("\t".join((v1, v2, v3)) + "\n")
-                    # print "v1=", v1, "v2=", v2, "v3=", v3, "c2=", c2, "c3=",
-                    # c3, "found"
-                else:
-                    missing.append((v1, v2, v3))
-                    # print "v1=", v1, "v2=", v2, "v3=", v3, "c2=", c2, "c3=",
-                    # c3, "missing"
+        for triplet in zip(decode(v1[is_found]),
+                           decode(v2[is_found]),
+                           decode(v3[is_found])):
+            outfile_found.write("\t".join(triplet) + "\n")
 
     nmissing = len(missing)
 
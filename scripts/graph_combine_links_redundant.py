@@ -12,6 +12,12 @@ Purpose
 
 remove redundant links from a sorted graph.
 
+Consecutive links between the same pair of tokens are combined into
+a single link. The output lists the minimum, maximum, number, total
+and average of the weights in the third column.
+
+Links are processed in chunks of ``--chunk-size`` links.
+
 Usage
 -----
 
@@ -29,19 +35,11 @@ Command line options
 --------------------
 
 '''
-import os
 import sys
-import string
-import re
-import getopt
+import numpy
 
 import CGAT.Experiment as E
-
-param_long_options = ["verbose=", "help", "version"]
-param_short_options = "v:h"
-
-param_loglevel = 1
-# ------------------------------------------------------------
+import CGAT.LinkGraph as LinkGraph
 
 
 def main(argv=None):
@@ -53,66 +51,53 @@ def main(argv=None):
     if argv is None:
         argv = sys.argv
 
-    try:
-        optlist, args = getopt.getopt(sys.argv[1:],
-                                      param_short_options, param_long_options)
-    except getopt.error, msg:
-        print globals()["__doc__"], msg
-        sys.exit(2)
+    parser = E.OptionParser(
+        version="%prog version: $Id$",
+        usage=globals()["__doc__"])
 
-    for o, a in optlist:
-        if o in ("-v", "--verbose"):
-            param_loglevel = int(a)
-        elif o in ("--version", ):
-            print "version="
-            sys.exit(0)
-        elif o in ("-h", "--help"):
-            print globals()["__doc__"]
-            sys.exit(0)
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      help="number of links to process at a time "
+                      "[%default].")
 
-    if len(args) > 0:
-        print USAGE, "no arguments required."
-        sys.exit(1)
+    parser.set_defaults(
+        chunk_size=1000000,
+    )
 
-    print E.GetHeader()
-    print E.GetParams()
+    (options, args) = E.Start(parser, argv=argv)
 
-    print "token1\ttoken2\tmin\tmax\tcount\ttotal\tavg"
+    options.stdout.write("token1\ttoken2\tmin\tmax\tcount\ttotal\tavg\n")
 
-    last = None
-    n = 0
-
-    for line in sys.stdin:
+    tokens = LinkGraph.Tokens()
 
-        if line[0] == "#":
-            continue
+    def _write(sources, targets, weights):
+        sources, targets, minima, maxima, counts, totals = \
+            LinkGraph.combineLinks(sources, targets, weights)
+        for t1, t2, mmin, mmax, n, mtotal in zip(
+                tokens.decode(sources), tokens.decode(targets),
+                minima.tolist(), maxima.tolist(),
+                counts.tolist(), totals.tolist()):
+            options.stdout.write("\t".join(map(str, (
+                t1, t2, mmin, mmax, n, mtotal, mtotal / n))) + "\n")
 
-        data = line[:-1].split("\t")[:3]
-        # ignore header lines
-        try:
-            data[2] = float(data[2])
-        except ValueError:
-            continue
-
-        if not last:
-            last = data
-            mmin, mmax, mtotal, n = data[2], data[2], data[2], 1
-            continue
+    # the last run of links in a chunk might continue in the next
+    # chunk and is output with the next chunk.
+    last = None
+    for sources, targets, weights in LinkGraph.iterateLinks(
+            options.stdin, tokens=tokens, chunk_size=options.chunk_size):
 
-        if last[0] != data[0] or last[1] != data[1]:
-            print string.join(map(str, (last[0], last[1], mmin, mmax, n, mtotal, mtotal / n)), "\t")
-            last = data
-            mmin, mmax, mtotal, n = data[2], data[2], 0, 0
+        weights = weights[:, 0]
+        if last:
+            sources, targets, weights = [numpy.concatenate(x) for x in
+                                         zip(last, (sources, targets, weights))]
 
-        mtotal += data[2]
-        mmin = min(mmin, data[2])
-        mmax = max(mmax, data[2])
-        n += 1
+        start = LinkGraph.getRunStarts(sources, targets)[-1]
+        _write(sources[:start], targets[:start], weights[:start])
+        last = sources[start:], targets[start:], weights[start:]
 
     if last:
-        print string.join(map(str, (last[0], last[1], mmin, mmax, n, mtotal, mtotal / n)), "\t")
+        _write(*last)
 
-    print E.GetFooter()
+    E.Stop()
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
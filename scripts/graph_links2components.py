@@ -0,0 +1,139 @@
+'''
+graph_links2components.py - connected components of a graph
+============================================================
+
+:Author: Andreas Heger
+:Release: $Id$
+:Date: |today|
+:Tags: Python
+
+Purpose
+-------
+
+Compute the connected components of a graph given as a list of
+links. Each link is a line with two tokens in the first two fields.
+Further fields are ignored.
+
+The output lists each token together with the number of its
+component. Components are numbered from 1 in the order their first
+token appears in the input. The last line gives the total number of
+components, the output can thus be used in place of the output of
+``ga_components``, for example in :file:`optic/components2clusters.py`.
+
+Methods
+-------
+
+bulk
+   Tokens are mapped to integer ids and links are added to a
+   union-find structure in chunks of ``--chunk-size`` links
+   (see :class:`Components.ArrayComponents`).
+
+per-edge
+   Links are added one at a time to a
+   :class:`Components.IComponents` object. This method is slower
+   and is kept to benchmark the bulk method.
+
+With ``--tokens-database`` the map of tokens to ids is kept in an
+sqlite database instead of memory. This is slower, but permits
+graphs with more tokens than fit into memory.
+
+Usage
+-----
+
+Example::
+
+   python graph_links2components.py < graph.links > graph.components
+
+Type::
+
+   python graph_links2components.py --help
+
+for command line help.
+
+Command line options
+--------------------
+
+'''
+import sys
+import numpy
+import CGAT.Experiment as E
+import CGAT.Components as Components
+import CGAT.LinkGraph as LinkGraph
+
+
+def main(argv=None):
+    """script main.
+
+    parses command line options in sys.argv, unless *argv* is given.
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    parser = E.OptionParser(version="%prog version: $Id$",
+                            usage=globals()["__doc__"])
+
+    parser.add_option("-m", "--method", dest="method", type="choice",
+                      choices=("bulk", "per-edge"),
+                      help="method to compute components [%default].")
+    parser.add_option("--tokens-database", dest="tokens_database",
+                      type="string",
+                      help="keep map of tokens to ids in this sqlite "
+                      "database [%default].")
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      help="number of links to process at a time "
+                      "[%default].")
+
+    parser.set_defaults(
+        method="bulk",
+        tokens_database=None,
+        chunk_size=1000000,
+    )
+
+    (options, args) = E.Start(parser, argv=argv)
+
+    if options.tokens_database:
+        tokens = LinkGraph.DiskTokens(options.tokens_database)
+    else:
+        tokens = LinkGraph.Tokens()
+
+    if options.method == "bulk":
+        tokens, components = Components.readComponents(
+            options.stdin, tokens=tokens, chunk_size=options.chunk_size)
+        labels = components.getLabels()
+
+    elif options.method == "per-edge":
+        components = Components.IComponents()
+        for sources, targets, weights in LinkGraph.iterateLinks(
+                options.stdin, columns=(), tokens=tokens,
+                chunk_size=options.chunk_size):
+            for a, b in zip(sources.tolist(), targets.tolist()):
+                components.add(a, b)
+
+        # number components in order of their first token
+        roots = numpy.array([components.get(x) for x in range(len(tokens))],
+                            dtype=numpy.int64)
+        roots, first, labels = numpy.unique(roots,
+                                            return_index=True,
+                                            return_inverse=True)
+        ranks = numpy.empty(len(first), dtype=numpy.int64)
+        ranks[numpy.argsort(first)] = numpy.arange(len(first))
+        labels = ranks[labels]
+
+    ncomponents = len(numpy.unique(labels))
+
+    options.stdout.write("# token\tvertex\n")
+    for token, label in zip(tokens, labels.tolist()):
+        options.stdout.write("%s\t%i\n" % (token, label + 1))
+    options.stdout.write(
+        "# total number of components: %i\n" % ncomponents)
+
+    E.info("ntokens=%i, ncomponents=%i" % (len(tokens), ncomponents))
+
+    if options.tokens_database:
+        tokens.close()
+
+    E.Stop()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
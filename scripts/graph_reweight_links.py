@@ -10,9 +10,34 @@ graph_reweight_links.py -
 Purpose
 -------
 
-.. todo::
-   
-   describe purpose of the script.
+Rescore the links in a BLAST graph. New scores are saved in the
+third column, overwriting the E-Value.
+
+Methods:
+
+kimura
+   set third column to kimura two parameter score from pid
+
+bitscore
+   set third column to bitscore from score.
+
+normalize-product
+   normalize third column by dividing with self-scores
+   new = old * old / self1 / self2
+
+normalize-max
+   normalize third column by max(old/self1), max(old/self2)
+
+normalize-min
+   normalize third column by min(old/self1), min(old/self2)
+
+normalize-avg
+   normalize third column by avg((old/self1 + old/self2) / 2)
+
+Self-scores are read from a tab-separated file with tokens in the
+first and scores in the second column (``--self-scores``).
+
+Links are rescored in chunks of ``--chunk-size`` links.
 
 Usage
 -----
@@ -32,64 +57,11 @@ Command line options
 
 '''
 import sys
-import string
-import getopt
-import CGAT.Experiment as E
 import math
-
-USAGE = """python %s [OPTIONS] < graph.in > graph.out
-
-Version: $Id: graph_reweight_links.py 2782 2009-09-10 11:40:29Z andreas $
-
-Wrapper for rescoring blast alignments.
-
-Options:
--h, --help                      print this message.
--v, --verbose=                  loglevel.
--m, --method=                   method to use for scoring [bitscore|normalize]
--f, --self-score=               filename with self-scores
---lambda=                       lambda for bitscore calculation
---k=                            K for bitscore calculation
---expected=                     expected score in matrix
-
--d, --distance-method=                 convert to distance (# = maximum distance)
-
-new scores are saved in third column (overwriting the E-Value)
-
-Methods:
-
-kimura                          = set third column to kimura two parameter score from pid
-bitscore                        = set third column to bitscore from score.
-normalize-product               = normalize third column by dividing with self-scores
-                                new = old * old / self1 / self2
-normalize-max                   = normalize third column by max(old/self1), max(old/self2)
-normalize-min                   = normalize third column by min(old/self1), min(old/self2)
-normalize-avg                   = normalize third column by avg((old/self1 + old/self2) / 2)
-
-Format:
-
-blast                           = Blast graph
-edges                           = edge list (weighted)
-
-""" % sys.argv[0]
-
-param_long_options = ["help", "verbose=", "method=", "lambda=", "k=", "self-scores=", "expected=", "distance=",
-                      "version"]
-
-param_short_options = "hv:m:f:o:d:"
-
-param_loglevel = 1
-param_method = "bitscore"
-param_filename_self_scores = None
-param_format = "blast"
-param_lambda = 0.267
-param_K = 0.0410
-param_expected = -0.5209
-param_gop = -11.0
-param_gep = -1.0
-param_max_distance = 0.0
-
-# ------------------------------------------------------------------------
+import numpy
+import CGAT.Experiment as E
+import CGAT.IOTools as IOTools
+import CGAT.LinkGraph as LinkGraph
 
 
 def main(argv=None):
@@ -101,41 +73,46 @@ def main(argv=None):
     if argv is None:
         argv = sys.argv
 
-    try:
-        optlist, args = getopt.getopt(
-            sys.argv[1:], param_short_options, param_long_options)
-    except getopt.error, msg:
-        print USAGE, msg
-        sys.exit(2)
-
-    for o, a in optlist:
-        if o in ("-v", "--verbose"):
-            param_loglevel = int(a)
-        elif o in ("--version", ):
-            print "version="
-            sys.exit(0)
-        elif o in ("-h", "--help"):
-            print USAGE
-            sys.exit(0)
-        elif o in ("-m", "--method"):
-            param_method = a
-        elif o in ("-f", "--self-scores"):
-            param_filename_self_scores = a
-        elif o == "--lambda":
-            param_lambda = float(a)
-        elif o == "--k":
-            param_K = float(a)
-        elif o == "--expected":
-            param_expected = float(a)
-        elif o in ("-d", "--distance-method"):
-            param_max_distance = float(a)
-
-    print E.GetHeader()
-    print E.GetParams()
-
-    if param_filename_self_scores:
+    parser = E.OptionParser(
+        version="%prog version: $Id: graph_reweight_links.py 2782 2009-09-10 11:40:29Z andreas $",
+        usage=globals()["__doc__"])
+
+    parser.add_option("-m", "--method", dest="method", type="choice",
+                      choices=("kimura", "bitscore", "normalize-product",
+                               "normalize-max", "normalize-min",
+                               "normalize-avg"),
+                      help="method to use for scoring [%default].")
+    parser.add_option("-f", "--self-scores", dest="filename_self_scores",
+                      type="string",
+                      help="filename with self-scores [%default].")
+    parser.add_option("--lambda", dest="lambda_", type="float",
+                      help="lambda for bitscore calculation [%default].")
+    parser.add_option("--k", dest="K", type="float",
+                      help="K for bitscore calculation [%default].")
+    parser.add_option("--expected", dest="expected", type="float",
+                      help="expected score in matrix [%default].")
+    parser.add_option("-d", "--distance", dest="max_distance", type="float",
+                      help="convert to distance by subtracting the score "
+                      "from this maximum distance [%default].")
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      help="number of links to process at a time "
+                      "[%default].")
+
+    parser.set_defaults(
+        method="bitscore",
+        filename_self_scores=None,
+        lambda_=0.267,
+        K=0.0410,
+        expected=-0.5209,
+        max_distance=0.0,
+        chunk_size=1000000,
+    )
+
+    (options, args) = E.Start(parser, argv=argv)
+
+    if options.filename_self_scores:
         self_scores = {}
-        for line in open(param_filename_self_scores, "r"):
+        for line in IOTools.openFile(options.filename_self_scores, "r"):
             if line[0] == "#":
                 continue
             d = line[:-1].split("\t")[:2]
@@ -143,63 +120,69 @@ def main(argv=None):
                 self_scores[d[0]] = 0.0
             self_scores[d[0]] = max(self_scores[d[0]], float(d[1]))
 
-    if param_method == "kimura":
-        a = 0
-        f = lambda x: x < 0.85 and 0.0000001 - \
-            math.log(1.0 - x - 0.2 * x * x) or 5.2030
-
-    elif param_method == "bitscore":
-        a = 1
-        lK = math.log(param_K)
+    if options.method == "kimura":
+        def f(x):
+            x = (100.0 - x) / 100.0
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                return numpy.where(
+                    x < 0.85,
+                    0.0000001 - numpy.log(1.0 - x - 0.2 * x * x),
+                    5.2030)
+
+    elif options.method == "bitscore":
+        lK = math.log(options.K)
         l2 = math.log(2)
-        f = lambda x: (param_lambda * x - lK) / l2
-
-    elif param_method in ("normalize-product", "normalize-max", "normalize-min", "normalize-avg"):
-        a = 2
-        if param_method == "normalize-product":
-            f = lambda x, y, z: x * x / self_scores[y] / self_scores[z]
-        elif param_method == "normalize-max":
-            f = lambda x, y, z: max(x / self_scores[y], x / self_scores[z])
-        elif param_method == "normalize-min":
-            f = lambda x, y, z: min(x / self_scores[y], x / self_scores[z])
-        elif param_method == "normalize-avg":
-            f = lambda x, y, z: (x / self_scores[y] + x / self_scores[z]) / 2.0
-    else:
-        raise "unknown method %s" % param_method
+
+        def f(x):
+            return (options.lambda_ * x - lK) / l2
+
+    elif options.method.startswith("normalize"):
+        if not options.filename_self_scores:
+            raise ValueError(
+                "method %s requires self-scores" % options.method)
+        if options.method == "normalize-product":
+            f = lambda x, y, z: x * x / y / z
+        elif options.method == "normalize-max":
+            f = lambda x, y, z: numpy.maximum(x / y, x / z)
+        elif options.method == "normalize-min":
+            f = lambda x, y, z: numpy.minimum(x / y, x / z)
+        elif options.method == "normalize-avg":
+            f = lambda x, y, z: (x / y + x / z) / 2.0
 
     ninput, noutput, nskipped, nfailed = 0, 0, 0, 0
 
-    for line in sys.stdin:
+    # self-scores indexed by token id
+    tokens = LinkGraph.Tokens()
+    scores = numpy.zeros(0)
 
-        if line[0] == "#":
-            continue
+    for sources, targets, weights in LinkGraph.iterateLinks(
+            options.stdin, tokens=tokens, chunk_size=options.chunk_size):
 
-        token1, token2, score = line.split("\t")[:3]
-        try:
-            score = float(score)
-        except ValueError:
-            # ignore headers
-            continue
-        ninput += 1
+        ninput += len(sources)
+        weights = weights[:, 0]
 
-        if a == 0:
-            score = f((100.0 - score) / 100.0)
-        elif a == 1:
-            score = f(score)
-        elif a == 2:
-            score = f(score, token1, token2)
+        if options.method.startswith("normalize"):
+            scores = numpy.append(
+                scores,
+                [self_scores[x] for x in tokens.tokens[len(scores):]])
+            weights = f(weights, scores[sources], scores[targets])
+        else:
+            weights = f(weights)
 
-        if param_max_distance:
-            score = param_max_distance - score
+        if options.max_distance:
+            weights = options.max_distance - weights
 
-        print string.join(map(str, (token1, token2, score)), "\t")
+        for token1, token2, score in zip(tokens.decode(sources),
+                                         tokens.decode(targets),
+                                         weights.tolist()):
+            options.stdout.write("%s\t%s\t%s\n" % (token1, token2, str(score)))
 
-        noutput += 1
+        noutput += len(sources)
 
-    print "# ninput=%i, noutput=%i, nskipped=%i, failed=%i" % (
-        ninput, noutput, nskipped, nfailed)
+    options.stdout.write("# ninput=%i, noutput=%i, nskipped=%i, failed=%i\n" % (
+        ninput, noutput, nskipped, nfailed))
 
-    print E.GetFooter()
+    E.Stop()
 
 
 if __name__ == "__main__":
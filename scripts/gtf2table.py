@@ -447,6 +447,25 @@ convention. A summary is `here
 For unstranded protocols, all reads and pairs are considered to matching
 in the sense direction.
 
+Barcodes
+++++++++
+
+With ``--use-barcodes``, the counters ``read-counts`` and
+``read-fullcounts`` count each barcode and UMI only once per gene
+and category. With ``--no-collapse-umis``, all reads are counted.
+By default, the barcode is the last field of the read
+identifier, where fields are separated by underscores. Barcodes and
+UMIs can also be extracted with a regular expression
+(``--barcode-regex``) or taken from tags (``--barcode-tag`` and
+``--umi-tag``). Reads without these tags are skipped.
+
+The table output contains the counts summed over all barcodes. The
+counts per barcode can be written as a sparse matrix with
+``--barcode-counts-format``. With ``mtx``, a matrix in Matrix Market
+format is written together with files listing its rows (gene and
+category) and columns (barcodes). With ``npz``, the coordinates and
+counts are saved in a compressed numpy archive.
+
 Usage
 -----
 
@@ -3981,7 +4000,53 @@ def main(argv=None):
                       "by underscores, e.g. "
                       "@READ:ILLUMINA:STUFF_NAMINGSTUFF_UMI. "
                       "When true, unique counts are returned. "
-                      "Currently only compatible with count-reads")
+                      "Currently only compatible with read-counts "
+                      "and read-fullcounts")
+
+    parser.add_option("--barcode-regex",
+                      dest="barcode_regex",
+                      type="string",
+                      help="regular expression to extract barcode and "
+                      "UMI from the read identifier. The expression "
+                      "should contain the named groups 'barcode' and "
+                      "optionally 'umi', e.g. "
+                      "'_(?P<barcode>[ACGTN]+)_(?P<umi>[ACGTN]+)$' "
+                      "[default=%default].")
+
+    parser.add_option("--barcode-tag",
+                      dest="barcode_tag",
+                      type="string",
+                      help="take barcode from this tag in the bam file, "
+                      "for example CB [default=%default].")
+
+    parser.add_option("--umi-tag",
+                      dest="umi_tag",
+                      type="string",
+                      help="take UMI from this tag in the bam file, "
+                      "for example UB [default=%default].")
+
+    parser.add_option("--collapse-umis",
+                      dest="collapse_umis",
+                      action="store_true",
+                      help="with --use-barcodes, count only the first "
+                      "read of each barcode and UMI per gene and "
+                      "category [default=%default].")
+
+    parser.add_option("--no-collapse-umis",
+                      dest="collapse_umis",
+                      action="store_false",
+                      help="with --use-barcodes, count all reads of "
+                      "each barcode and UMI.")
+
+    parser.add_option("--barcode-counts-format",
+                      dest="barcode_counts_format",
+                      type="choice",
+                      choices=("mtx", "npz"),
+                      help="output counts per barcode as a sparse "
+                      "matrix in Matrix Market format (mtx) or as a "
+                      "compressed numpy archive (npz). Files are named "
+                      "according to --output-filename-pattern "
+                      "[default=%default].")
 
     parser.add_option("--sample-probability",
                       dest="sample_probability",
@@ -4034,6 +4099,11 @@ def main(argv=None):
         prefixes=[],
         minimum_mapping_quality=0,
         use_barcodes=False,
+        barcode_regex=None,
+        barcode_tag=None,
+        umi_tag=None,
+        collapse_umis=True,
+        barcode_counts_format=None,
         sample_probability=1.0
     )
 
@@ -4141,6 +4211,10 @@ def main(argv=None):
                 bam_files,
                 multi_mapping=options.multi_mapping,
                 use_barcodes=options.use_barcodes,
+                barcode_regex=options.barcode_regex,
+                barcode_tag=options.barcode_tag,
+                umi_tag=options.umi_tag,
+                collapse_umis=options.collapse_umis,
                 sample_probability=options.sample_probability,
                 minimum_mapping_quality=options.minimum_mapping_quality,
                 options=options,
@@ -4149,6 +4223,11 @@ def main(argv=None):
             counters.append(_gtf2table.CounterReadCountsFull(
                 bam_files,
                 multi_mapping=options.multi_mapping,
+                use_barcodes=options.use_barcodes,
+                barcode_regex=options.barcode_regex,
+                barcode_tag=options.barcode_tag,
+                umi_tag=options.umi_tag,
+                collapse_umis=options.collapse_umis,
                 sample_probability=options.sample_probability,
                 minimum_mapping_quality=options.minimum_mapping_quality,
                 options=options,
@@ -4323,6 +4402,27 @@ def main(argv=None):
 
         cc.output += 1
 
+    for counter in counters:
+        barcode_counts = getattr(counter, "barcode_counts", None)
+        if barcode_counts is None:
+            continue
+        if isinstance(counter, _gtf2table.CounterReadCounts):
+            name = "read-counts"
+        else:
+            name = "read-fullcounts"
+        if barcode_counts.nskipped:
+            E.warn("%s: skipped %i reads without barcode or UMI tag" %
+                   (name, barcode_counts.nskipped))
+        if options.barcode_counts_format:
+            pattern = options.output_filename_pattern % (
+                "%s_barcodes_%%s" % name)
+            E.info("writing counts for %i barcodes" %
+                   len(barcode_counts.barcodes))
+            if options.barcode_counts_format == "mtx":
+                barcode_counts.writeMatrixMarket(pattern)
+            elif options.barcode_counts_format == "npz":
+                barcode_counts.writeNumpy(pattern % "counts.npz")
+
     E.info("%s" % str(cc))
     for counter in counters:
         E.info("%s\t%s" % (repr(counter), str(counter.counter)))
@@ -12,12 +12,39 @@ Purpose
 
 liftover coordinates using a liftover formatted file from the ucsc.
 
+The chain file is parsed into an index of ungapped blocks (see
+:mod:`CGAT.Chain`). With ``--cache-index``, the index is saved next
+to the chain file as :file:`<chain>.index.npz` and subsequent runs
+load the cached index instead of parsing the chain file.
+
+The following input formats are recognized (``--input-format``):
+
+residues
+   tab-separated contig, start, end. Each residue in the range is
+   mapped and output with its mapped position. This is the default.
+
+bed
+   :term:`bed` formatted intervals.
+
+gtf
+   :term:`gtf` formatted intervals.
+
+psl
+   :term:`psl` formatted alignments. The target side of the
+   alignment is mapped.
+
+Intervals spanning several ungapped blocks are split at block
+boundaries and one interval is output per mapped segment. psl
+alignments are only output if all blocks map to the same contig and
+strand.
+
 Usage
 -----
 
 Example::
 
-   python liftover.py --help
+   python liftover.py --map=hg19ToHg38.over.chain.gz --input-format=bed
+      < in.bed > out.bed
 
 Type::
 
@@ -31,114 +58,186 @@ Command line options
 '''
 
 import sys
+import copy
+import itertools
 import numpy
 import CGAT.Experiment as E
 import CGAT.IOTools as IOTools
+import CGAT.Chain as Chain
+import CGAT.Bed as Bed
+import CGAT.GTF as GTF
+import CGAT.Blat as Blat
 
 
-def readLiftOver(infile, chromosome,
-                 chromosome_size=250000000,
-                 report_step=1000000):
-    """read a matrix. There probably is a routine for this in Numpy, which
-    I haven't found yet.
-    """
-
-    if options.loglevel >= 2:
-        print "## started reading mapping information"
-        sys.stdout.flush()
-
-    map_position = numpy.zeros((chromosome_size,), numpy.int)
+def mapEntries(index, entries):
+    '''map a batch of interval entries.
 
-    # signed character for chromosme, negative values for negative strands
-    map_chromosome = numpy.zeros((chromosome_size,), numpy.int8)
+    *entries* are objects with ``contig``, ``start`` and ``end``
+    attributes. Entries are grouped by contig and mapped in bulk.
 
-    map_id2chromosome = ["", ]
-    map_chromosome2id = {}
-    n = 0
+    Returns a list with one list of segments per entry. Each segment
+    is a tuple of (query contig, start, end, strand).
+    '''
+    results = [[] for x in entries]
 
-    for line in infile:
+    contigs = {}
+    for x, entry in enumerate(entries):
+        contigs.setdefault(entry.contig, []).append(x)
 
-        n += 1
-
-        if not (n % report_step):
-            if options.loglevel >= 2:
-                print "# iteration %i" % n
-                sys.stdout.flush()
-
-        if line[:5] == "chain":
-            (chr_x, size_x, strand_x, first_x, last_x,
-             chr_y, size_y, strand_y, first_y, last_y,
-             dontknow) = line[:-1].split(" ")[2:]
-
-            if strand_x == "-":
-                raise "what shall I do with negative strands?"
-
-            x = int(first_x)
-
-            # revert coordinates for negative strands (it seems that
-            # the mapping file uses reverse coordinates, while liftover
-            # output doesn't)
-            # add 1 to coordinates, because 0 is flag for unmappable.
-            if strand_y == "-":
-                invert = True
-                # no +1, because already one past current residue (due to open
-                # bracket)
-                y = int(size_y) - int(first_y)
-            else:
-                invert = False
-                y = int(first_y) + 1
-
-            if chr_x != chromosome:
-                keep = False
-            else:
-                keep = True
-                if options.loglevel >= 3:
-                    print "# adding alignment", line[:-1]
+    for contig, indices in contigs.iteritems():
+        indices = numpy.array(indices)
+        starts = numpy.array([entries[x].start for x in indices])
+        ends = numpy.array([entries[x].end for x in indices])
+        (intervals, chains, segment_start, segment_end,
+         query_ids, qs, qe, strands) = index.mapIntervals(
+            contig, starts, ends)
+        for x, query_id, start, end, strand in zip(
+                indices[intervals], query_ids, qs, qe, strands):
+            results[x].append((index.query_contigs[query_id],
+                               start, end,
+                               ("+", "-")[int(strand < 0)]))
 
-            continue
-
-        elif line.strip() == "":
-            keep = False
-            continue
+    return results
 
-        elif keep:
 
-            data = map(int, line[:-1].split("\t"))
+def flipStrand(strand, mapped_strand):
+    '''return strand of a feature after mapping.'''
+    if mapped_strand == "+" or strand not in "+-":
+        return strand
+    if strand == "+":
+        return "-"
+    return "+"
 
-            if len(data) == 3:
-                size, increment_x, increment_y = data
-            else:
-                size, increment_x, increment_y = data[0], 0, 0
 
-            # add position
-            if invert:
-                map_position[x:x + size] = numpy.arrayrange(y, y - size, -1)
-            else:
-                map_position[x:x + size] = numpy.arrayrange(y, y + size, 1)
+def liftResidues(index, infile, outfile, chromosome, counter):
+    '''map all residues in ranges given in *infile*.'''
 
-            if chr_y not in map_id2chromosome:
-                map_chromosome2id[chr_y] = len(map_id2chromosome)
-                map_id2chromosome.append(chr_y)
+    for line in infile:
 
-            id = map_chromosome2id[chr_y]
-            if strand_y == "-":
-                id = -id
+        if line[0] == "#":
+            continue
 
-            # add chromsome
-            map_chromosome[x:x + size] = id
+        data = line[:-1].split("\t")
 
-            x += increment_x + size
-            if invert:
-                y -= increment_y + size
-            else:
-                y += increment_y + size
+        contig = data[0]
+        range_from, range_to = int(data[1]), int(data[2])
+        counter.input += 1
 
-            if y < 0:
-                raise "illegal mapping: %i -> %i for %s %s:%s-%s(%s) to %s %s: %s-%s(%s)" % (x, y,
-                                                                                             chr_x, strand_x, first_x, last_x, size_x,
-                                                                                             chr_y, strand_y, first_y, last_y, size_y)
+        if chromosome and contig != chromosome:
+            counter.skipped += 1
+            continue
 
-    return map_position, map_chromosome, map_chromosome2id, map_id2chromosome
+        positions = numpy.arange(range_from, range_to)
+        chains, query_ids, query_positions, strands = index.mapPoints(
+            contig, positions)
+        mapped = chains >= 0
+        counter.mapped_residues += mapped.sum()
+        counter.unmapped_residues += len(positions) - mapped.sum()
+
+        outfile.write("".join(
+            ["%s\t%i\t%s\t%s\t%i\n" %
+             (contig, x, index.query_contigs[y], ("+", "-")[int(s < 0)], z)
+             for x, y, z, s in zip(positions[mapped],
+                                   query_ids[mapped],
+                                   query_positions[mapped],
+                                   strands[mapped])]))
+        counter.output += 1
+
+
+def liftIntervals(index, iterator, outfile, counter, chunk_size=100000):
+    '''map :term:`bed` or :term:`gtf` entries from *iterator*.'''
+
+    while 1:
+        entries = [x for x in itertools.islice(iterator, chunk_size)]
+        if not entries:
+            break
+
+        for entry, segments in zip(entries, mapEntries(index, entries)):
+            counter.input += 1
+            if not segments:
+                counter.unmapped += 1
+                continue
+            if len(segments) > 1:
+                counter.split += 1
+
+            for contig, start, end, strand in segments:
+                if isinstance(entry, Bed.Bed):
+                    new_entry = copy.copy(entry)
+                    new_entry.fields = list(entry.fields)
+                    if len(entry.fields) >= 3:
+                        new_entry.fields[2] = flipStrand(
+                            entry.fields[2], strand)
+                else:
+                    # gtf entries are read as pysam proxies
+                    new_entry = GTF.Entry()
+                    new_entry.copy(entry)
+                    new_entry.strand = flipStrand(entry.strand, strand)
+                new_entry.contig = contig
+                new_entry.start, new_entry.end = start, end
+                outfile.write("%s\n" % str(new_entry))
+                counter.output += 1
+
+
+def liftPsl(index, match):
+    '''map the target side of a psl alignment.
+
+    Returns a new :class:`Blat.Match` or None if the alignment could
+    not be mapped onto a single contig and strand.
+    '''
+
+    sizes = numpy.array(match.mBlockSizes)
+    target_starts = numpy.array(match.mSbjctBlockStarts)
+    query_starts = numpy.array(match.mQueryBlockStarts)
+
+    (blocks, chains, segment_start, segment_end,
+     query_ids, qs, qe, strands) = index.mapIntervals(
+        match.mSbjctId, target_starts, target_starts + sizes)
+
+    if len(blocks) == 0:
+        return None
+    if (query_ids != query_ids[0]).any() or \
+       (strands != strands[0]).any():
+        return None
+
+    new_sizes = segment_end - segment_start
+    new_query_starts = query_starts[blocks] + \
+        segment_start - target_starts[blocks]
+    new_target_starts = qs
+    query_length = match.mQueryLength
+    strand = match.strand
+
+    if strands[0] < 0:
+        # mapping reverses the alignment, express query on other strand
+        new_query_starts = query_length - new_query_starts - new_sizes
+        order = numpy.argsort(new_target_starts)
+        new_sizes = new_sizes[order]
+        new_query_starts = new_query_starts[order]
+        new_target_starts = new_target_starts[order]
+        strand = flipStrand(strand[0], "-") + strand[1:]
+
+    # chains might rearrange blocks
+    if (numpy.diff(new_query_starts) < 0).any():
+        return None
+
+    psl = copy.copy(match)
+    psl.strand = strand
+    psl.mSbjctId = index.query_contigs[query_ids[0]]
+    psl.mSbjctLength = index.query_sizes[query_ids[0]]
+    psl.mSbjctFrom = new_target_starts[0]
+    psl.mSbjctTo = new_target_starts[-1] + new_sizes[-1]
+    psl.mNBlocks = len(new_sizes)
+    psl.mBlockSizes = list(new_sizes)
+    psl.mQueryBlockStarts = list(new_query_starts)
+    psl.mSbjctBlockStarts = list(new_target_starts)
+
+    query_from = new_query_starts[0]
+    query_to = new_query_starts[-1] + new_sizes[-1]
+    if strand[0] == "-":
+        query_from, query_to = query_length - query_to, \
+            query_length - query_from
+    psl.mQueryFrom, psl.mQueryTo = query_from, query_to
+
+    return psl
 
 
 def main(argv=None):
@@ -151,64 +250,62 @@ def main(argv=None):
         argv = sys.argv
 
     parser = E.OptionParser(
-        version="%prog version: $Id$")
+        version="%prog version: $Id$",
+        usage=globals()["__doc__"])
 
     parser.add_option("-c", "--chromosome", dest="chromosome", type="string",
-                      help="chromosome to take.")
+                      help="restrict residue mapping to a chromosome "
+                      "[%default]")
 
     parser.add_option("-m", "--map", dest="filename_map", type="string",
                       help="filename with mapping info.",
                       metavar="FILE")
 
+    parser.add_option("-i", "--input-format", dest="input_format",
+                      type="choice",
+                      choices=("residues", "bed", "gtf", "psl"),
+                      help="input format [%default]")
+
+    parser.add_option("--cache-index", dest="use_cache", action="store_true",
+                      help="cache the parsed chain file on disk [%default]")
+
     parser.set_defaults(
         filename_map="",
         chromosome=None,
+        input_format="residues",
+        use_cache=False,
     )
 
-    (options, args) = E.Start(parser)
+    (options, args) = E.Start(parser, argv=argv)
 
     if options.filename_map == "":
-        raise "please specify the file with the liftover mapping information."
-
-    if not options.chromosome:
-        raise "please give a chromosome."
-
-    map_position, map_chromosome, map_chromosome2id, \
-        map_id2chromosome = readLiftOver(
-            IOTools.openFile(options.filename_map, "r"),
-            options.chromosome)
-
-    l = 0
-
-    for line in options.stdin:
-
-        if line[0] == "#":
-            continue
-
-        data = line[:-1].split("\t")
-
-        chromosome = data[0]
-        range_from, range_to = int(data[1]), int(data[2])
-        l += 1
-
-        if chromosome == options.chromosome:
-
-            if options.loglevel >= 1:
-                print "#", l, ":", line[:-1]
-
-            for x in range(range_from, range_to):
-                if map_position[x]:
-                    id = map_chromosome[x]
-                    if id > 0:
-                        c = "+"
-                    else:
-                        c = "-"
-                        id = -id
-
-                    print "%s\t%i\t%s\t%s\t%i" % (chromosome, x, map_id2chromosome[id], c, map_position[x] - 1)
-                else:
-                    pass
-                    # print "%s\t%i\tna" % (chromosome, x )
+        raise ValueError(
+            "please specify the file with the liftover mapping information.")
+
+    index = Chain.loadChainIndex(options.filename_map,
+                                 use_cache=options.use_cache)
+
+    counter = E.Counter()
+    outfile = options.stdout
+
+    if options.input_format == "residues":
+        liftResidues(index, options.stdin, outfile,
+                     options.chromosome, counter)
+    elif options.input_format == "bed":
+        liftIntervals(index, Bed.iterator(options.stdin), outfile, counter)
+    elif options.input_format == "gtf":
+        liftIntervals(index, GTF.iterator(options.stdin), outfile, counter)
+    elif options.input_format == "psl":
+        for match in Blat.iterator(options.stdin):
+            counter.input += 1
+            psl = liftPsl(index, match)
+            if psl is None:
+                counter.unmapped += 1
+                continue
+            outfile.write("%s\n" % str(psl))
+            counter.output += 1
+
+    E.info("%s" % str(counter))
 
     E.Stop()
 
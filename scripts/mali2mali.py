@@ -95,6 +95,11 @@ exclude-with-frameshift
 Parameters are given to the option parameters in a comma-separated list in the order
 that the edit operations are called upon.
 
+With ``--backend=array`` the multiple alignment is held as a
+two-dimensional array and column operations such as removing gaps,
+masking or marking codons are applied to all sequences at once. This
+is much faster for large alignments.
+
 Usage
 -----
 
@@ -403,9 +408,16 @@ def main(argv=sys.argv):
     parser.add_option("-a", "--mask-char", dest="mask_char", type="string",
                       help="character to identify/set masked characters [default=%default].")
 
+    parser.add_option("--backend", dest="backend", type="choice",
+                      choices=("string", "array"),
+                      help="multiple alignment representation. ``array`` "
+                      "applies column operations to all sequences at once "
+                      "[default=%default].")
+
     parser.set_defaults(
         input_format="fasta",
         output_format="fasta",
+        backend="string",
         methods="",
         parameters="",
         mask_char="x",
@@ -422,6 +434,8 @@ def main(argv=sys.argv):
     # 1. read multiple alignment in various formats
     if options.allow_duplicates:
         mali = Mali.SequenceCollection()
+    elif options.backend == "array":
+        mali = Mali.MaliArray()
     else:
         mali = Mali.Mali()
 
@@ -17,6 +17,12 @@ Default output is as a list of pairwise distances.
 REV: is NOT the general 12 parameter model, but - like in PAML -
 denotes the 9 parameter GTR model.
 
+With ``--method=own``, distances are computed for all pairs at once
+(see :mod:`PairwiseDistances`). Nucleotide distances available are
+JC69, K80, T92, TN93 and LogDet, protein and nucleotide sequences can
+be compared by PID and POVL. Use ``--num-threads`` to distribute the
+pairs over several processes.
+
 Usage
 -----
 
@@ -37,7 +43,6 @@ Command line options
 import sys
 import re
 import time
-import math
 import tempfile
 import shutil
 import CGAT.Experiment as E
@@ -46,6 +51,7 @@ import CGAT.Genomics as Genomics
 import CGAT.WrapperPhylip as WrapperPhylip
 import CGAT.WrapperCodeML as WrapperCodeML
 import CGAT.RateEstimation as RateEstimation
+import CGAT.PairwiseDistances as PairwiseDistances
 
 # ------------------------------------------------------------------------
 # ------------------------------------------------------------------------
@@ -60,102 +66,6 @@ def writeModel(grammar, section, options):
         outfile.close()
 
 
-def CalculateDistancePOVL(seq1, seq2, gap_chars=(".", "-")):
-    """calculate overlap distance between two sequences."""
-    naligned, nunaligned = 0, 0
-    for c1, c2 in zip(seq1.upper(), seq2.upper()):
-        if c1 in gap_chars or c2 in gap_chars:
-            if not (c1 in gap_chars and c2 in gap_chars):
-                nunaligned += 1
-        else:
-            naligned += 1
-
-    return 100.0 * float(naligned) / float(nunaligned + naligned), 0
-
-
-def CalculateDistancePID(seq1, seq2,
-                         gap_chars=("-", "."),
-                         mask_chars=("X"),
-                         ):
-
-    nidentical, naligned, nunaligned = 0, 0, 0
-    for c1, c2 in zip(seq1.upper(), seq2.upper()):
-        if c1 in gap_chars or c2 in gap_chars:
-            nunaligned += 1
-            continue
-        naligned += 1
-        if c1 == c2:
-            nidentical += 1
-
-    return 100.0 * float(nidentical) / naligned, 0
-
-
-def CalculateDistanceJC69(info, do_gamma=False, alpha=None):
-    """return Jukes-Cantor distance.
-    """
-
-    p = float(info.mNDifferent) / info.mNAligned
-
-    if do_gamma:
-        # not done yet
-        distance = 0.75 * alpha * (pow(1 - 4 * p / 3, -1 / alpha) - 1)
-        variance = p * (1 - p) / (pow(1 - 4 * p / 3, -2 / (alpha + 1)) * L)
-
-    else:
-        distance = -0.75 * math.log(1.0 - 4.0 * p / 3.0)
-        variance = p * (1.0 - p) / \
-            (math.pow(1.0 - 4.0 * p / 3, 2.0) * info.mNAligned)
-
-    return distance, variance
-
-
-def CalculateDistanceT92(info):
-    """
-    P,Q: transitions, transversions frequencies
-    q: G+C content
-
-    d = -2q(1 - q)loge(1 - P/[2q(1 - q)] - Q) -[1 -2q(1 -q)]loge(1 - 2Q)/2,(4.18)
-    V(d) = [c12P + c32Q - (c1P + c3Q)2]/n,(4.19)
-    where c1 = 1/(1 - P/[2q(1 - q)] - Q), c2 = 1/(1 - 2Q), c3 = 2q(1 - q)(c1 - c2) + c2, and q is the G+C content
-
-    Note: result is undefined if
-        the number of transversions is >= 0.5
-        the G+C content is 0
-
-    """
-    gc = info.getGCContent()
-
-    # if there are no GC or no AT pairs: result is undefined
-    if gc == 0 or gc == 1:
-        return -1, -1
-
-    wg = 2.0 * gc * (1.0 - gc)
-
-    P = float(info.mNTransitions) / info.mNAligned
-    Q = float(info.mNTransversions) / info.mNAligned
-
-    a1 = 1.0 - P / wg - Q
-    if a1 <= 0:
-        return -1, -1
-
-    a2 = 1.0 - 2.0 * Q
-    if a2 <= 0:
-        return -1, -1
-
-    # print a1, a2, wg, gc, "p=", P, "q=", Q, str(info)
-
-    distance = -wg * math.log(a1) - 0.5 * (1.0 - wg) * math.log(a2)
-
-    c1 = 1 / a1
-    c2 = 1 / a2
-    c3 = wg * (c1 - c2) + c2
-
-    variance = (
-        c1 * c1 * P + c3 * c3 * Q - math.pow(c1 * P + c3 * Q, 2.0)) / info.mNAligned
-
-    return distance, variance
-
-
 def writePhylipResult(result, options):
     """write result of phylip run."""
 
@@ -195,6 +105,27 @@ def runDNADIST(mali, pairs, options):
     writePhylipResult(result, options)
 
 
+def calculateIdentities(sequences, pairs, options):
+    """compute percent identity or overlap for all pairs."""
+
+    if options.distance == "PID":
+        f = PairwiseDistances.calculatePID
+    elif options.distance == "POVL":
+        f = PairwiseDistances.calculatePOVL
+    else:
+        raise ValueError("distance %s not implemented for method %s" %
+                         (options.distance, options.method))
+
+    counts = PairwiseDistances.calculateSequencePairs(
+        PairwiseDistances.countIdentities,
+        lambda s: (PairwiseDistances.encodeSequences(s),
+                   PairwiseDistances.encodeGaps(s)),
+        [x.upper() for x in sequences], pairs,
+        num_threads=options.num_threads)
+
+    return f(counts)
+
+
 def printValue(value, format="%f"):
     if value == "na":
         return "na"
@@ -614,6 +545,10 @@ def main(argv=None):
     parser.add_option("--xrate-min-increment", dest="xrate_min_increment", type=float,
                       help="minimum increment to stop iteration in xrate.")
 
+    parser.add_option("--num-threads", dest="num_threads", type="int",
+                      help="number of processes to use for computing "
+                      "distances [default=%default].")
+
     parser.set_defaults(
         input_format="fasta",
         filename_tree=None,
@@ -640,6 +575,7 @@ def main(argv=None):
         test_xrate=False,
         xrate_min_increment=None,
         is_codons=False,
+        num_threads=1,
     )
 
     (options, args) = E.Start(parser)
@@ -713,38 +649,57 @@ def main(argv=None):
                 h = Genomics.SequencePairInfo().getHeader()
             options.stdout.write("seq1\tseq2\tdist\tvar\t%s\n" % (h))
 
-            for x, y in pairs:
+            sequences = [mali[x] for x in ids]
+            matrices = PairwiseDistances.calculateSequencePairs(
+                PairwiseDistances.countSubstitutions,
+                lambda s: (PairwiseDistances.encodeNucleotides(s),),
+                sequences, pairs,
+                num_threads=options.num_threads)
+
+            if options.is_codons:
+                synonymous = PairwiseDistances.calculateSequencePairs(
+                    PairwiseDistances.countSynonymous,
+                    lambda s: (PairwiseDistances.encodeSequences(s),
+                               PairwiseDistances.encodeAminoAcids(s)),
+                    sequences, pairs,
+                    num_threads=options.num_threads)
+            else:
+                synonymous = [None] * len(pairs)
+
+            nsites = None
+            if options.distance in PairwiseDistances.NA_DISTANCES:
+                if options.sites == "d4":
+                    nsites = PairwiseDistances.calculateSequencePairs(
+                        PairwiseDistances.countDegenerateSubstitutions,
+                        PairwiseDistances.encodeDegenerateSites,
+                        sequences, pairs,
+                        num_threads=options.num_threads)
+                    nsites = nsites.sum(axis=2).sum(axis=1)
+                else:
+                    raise ValueError("unknown sites %s" % options.sites)
+
+                distances, variances = PairwiseDistances.calculateDistances(
+                    matrices, options.distance)
+            else:
+                distances, variances = calculateIdentities(
+                    sequences, pairs, options)
+
+            for index, pair in enumerate(pairs):
+                x, y = pair
                 id_x = ids[x]
                 npairs += 1
 
                 id_y = ids[y]
 
-                info = Genomics.CalculatePairIndices(
-                    mali[id_x], mali[id_y], with_codons=options.is_codons)
-
-                if options.distance in ("T92", "JC69"):
-                    if options.sites == "d4":
-                        seq1, seq2 = Genomics.GetDegenerateSites(
-                            mali[id_x], mali[id_y], position=3, degeneracy=4)
-
-                        if len(seq1) < options.min_sites:
-                            nskipped_length += 1
-                            continue
-                    else:
-                        raise "unknown sites %s" % options.sites
-
-                if options.distance == "T92":
-                    distance, variance = CalculateDistanceT92(info)
-                elif options.distance == "JC69":
-                    distance, variance = CalculateDistanceJC69(info)
-                elif options.distance == "PID":
-                    distance, variance = CalculateDistancePID(
-                        mali[id_x], mali[id_y])
-                elif options.distance == "POVL":
-                    distance, variance = CalculateDistancePOVL(
-                        mali[id_x], mali[id_y])
+                if nsites is not None and nsites[index] < options.min_sites:
+                    nskipped_length += 1
+                    continue
+
+                distance, variance = distances[index], variances[index]
 
                 if distance >= 0:
+                    info = PairwiseDistances.buildPairInfo(
+                        matrices[index], synonymous[index])
                     options.stdout.write("\t".join(map(str, (id_x, id_y,
                                                              options.format % distance,
                                                              options.format % variance, info))) + "\n")
@@ -779,20 +734,18 @@ def main(argv=None):
         else:
             options.stdout.write("id1\tid2\tdist\tvar\n")
 
+            distances, variances = calculateIdentities(
+                [mali[x] for x in ids], pairs, options)
+
             # iterate over all pairs of sequences
-            for x, y in pairs:
+            for index, pair in enumerate(pairs):
+                x, y = pair
                 id_x = ids[x]
                 npairs += 1
 
                 id_y = ids[y]
 
-                if options.distance == "PID":
-                    distance, variance = CalculateDistancePID(
-                        mali[id_x], mali[id_y])
-                elif options.distance == "POVL":
-                    # percentage overlap
-                    distance, variance = CalculateDistancePOVL(
-                        mali[id_x], mali[id_y])
+                distance, variance = distances[index], variances[index]
 
                 if distance >= 0:
                     options.stdout.write("\t".join((id_x, id_y,
@@ -111,9 +111,9 @@ def main(argv=None):
 
     ntotal, nok, nfailed = 0, 0, 0
     ntopology, ntaxa, nleaves = 0, 0, 0
-    for t in nexus2.trees:
+    index = TreeTools.TreeCollectionIndex(nexus2.trees)
+    for is_ok, reason in index.isCompatible(reference_tree):
         ntotal += 1
-        is_ok, reason = TreeTools.IsCompatible(reference_tree, t)
         if is_ok:
             nok += 1
         else:
@@ -35,6 +35,15 @@ for command line help.
 Command line options
 --------------------
 
+Transcript sequences are read from the genome once and kept in an
+in-memory cache of the most recently used transcripts
+(``--cache-size``), so that neighbouring variants in the same
+transcript share the sequence. Codon changes are still evaluated
+separately for each variant.
+
+With ``--num-threads``, contigs are processed in parallel. The input
+needs to be grouped by contig for this to be efficient.
+
 .. note::
    The script currently uses ``variant`` in two meanings:
    
@@ -51,8 +60,13 @@ Command line options
 import os
 import sys
 import re
+import copy
+import shutil
+import tempfile
 import optparse
+import itertools
 import collections
+import multiprocessing
 
 import numpy
 import CGAT.Experiment as E
@@ -638,6 +652,98 @@ def getCDSPosition(exons, start, end, fasta=None, lcontig=None):
                             exon_skipping))
 
 
+class TranscriptSequence(object):
+
+    '''genomic sequence of the region spanned by a transcript.
+
+    The sequence is read once from the genome and sequence requests
+    within the region are served from memory. The class implements
+    the :meth:`getSequence` and :meth:`getLength` methods of
+    :class:`IndexedFasta.IndexedFasta` so that it can be used in its
+    place. Requests outside the region are passed on to the genome.
+    '''
+
+    def __init__(self, fasta, contig, start, end):
+        self.mFasta = fasta
+        self.mContig = fasta.getToken(contig)
+        self.mLength = fasta.getLength(contig)
+        self.mStart = max(0, start)
+        self.mEnd = min(self.mLength, end)
+        self.mSequence = fasta.getSequence(
+            self.mContig, "+", self.mStart, self.mEnd)
+
+    def getLength(self, contig):
+        return self.mFasta.getLength(contig)
+
+    def getToken(self, contig):
+        return self.mFasta.getToken(contig)
+
+    def getSequence(self, contig, strand="+", start=0, end=0,
+                    converter=None, as_array=False):
+        '''return sequence for *contig*:*start*-*end* on *strand*.
+
+        Requests with a *converter* or for an array are passed on to
+        the genome.
+        '''
+
+        if converter or as_array:
+            return self.mFasta.getSequence(contig, strand, start, end,
+                                           converter=converter,
+                                           as_array=as_array)
+
+        is_negative_strand = str(strand) in ("-", "0", "-1")
+        if is_negative_strand:
+            first, last = self.mLength - end, self.mLength - start
+        else:
+            first, last = start, end
+
+        if end == 0 or first < self.mStart or last > self.mEnd or \
+                self.mFasta.getToken(contig) != self.mContig:
+            return self.mFasta.getSequence(contig, strand, start, end)
+
+        s = self.mSequence[first - self.mStart:last - self.mStart]
+        if is_negative_strand:
+            s = Genomics.complement(s)
+        return s
+
+
+class TranscriptCache(object):
+
+    '''cache of transcript sequences.
+
+    The cache keeps the sequences of the *size* most recently used
+    transcripts. Sequences are extended by *margin* bases on either
+    side of a transcript.
+    '''
+
+    def __init__(self, fasta, size=100, margin=500):
+        self.mFasta = fasta
+        self.mSize = size
+        self.mMargin = margin
+        self.mCache = collections.OrderedDict()
+        self.mCounts = E.Counter()
+
+    def get(self, exons):
+        '''return :class:`TranscriptSequence` for transcript *exons*.'''
+
+        transcript_id = exons[0].transcript_id
+        try:
+            sequence = self.mCache.pop(transcript_id)
+            self.mCounts.hits += 1
+        except KeyError:
+            self.mCounts.misses += 1
+            sequence = TranscriptSequence(
+                self.mFasta,
+                exons[0].contig,
+                min([x.start for x in exons]) - self.mMargin,
+                max([x.end for x in exons]) + self.mMargin)
+            if len(self.mCache) >= self.mSize:
+                self.mCache.popitem(last=False)
+
+        self.mCache[transcript_id] = sequence
+        return sequence
+
+
 class Counter(object):
 
     '''annotator for single bases in the genome.'''
@@ -655,6 +761,33 @@ class Counter(object):
         '''return header'''
         return "\t".join(self.mHeader)
 
+    def clone(self, pattern):
+        '''return an empty copy of this counter.
+
+        Annotations are shared with the copy, counts are not. The copy
+        writes its output to files named by *pattern*.
+        '''
+        counter = copy.copy(self)
+        counter.mFilenamePattern = pattern
+        counter.reset()
+        return counter
+
+    def reset(self):
+        '''reset counts.'''
+        pass
+
+    def close(self):
+        '''close output files opened during counting.'''
+        pass
+
+    def getResults(self):
+        '''return counts for merging with :meth:`mergeResults`.'''
+        return None
+
+    def mergeResults(self, results):
+        '''add counts returned by :meth:`getResults` of a clone.'''
+        pass
+
 
 class CounterGenes(Counter):
 
@@ -677,9 +810,19 @@ class CounterGenes(Counter):
         self.mExons = exons
         E.info("indexed %i exons on %i contigs" % (nexons, len(exons)))
 
+        self.reset()
+
+    def reset(self):
         # create counter
         self.mCounts = collections.defaultdict(int)
 
+    def getResults(self):
+        return dict(self.mCounts)
+
+    def mergeResults(self, results):
+        for key, value in results.iteritems():
+            self.mCounts[key] += value
+
     def update(self, snp):
         '''update with snp.'''
 
@@ -762,7 +905,8 @@ class CounterTranscripts(Counter):
     # introns smaller than this size are considered to be frameshifts
     mMinIntronSize = 5
 
-    def __init__(self, filename_exons, seleno, *args, **kwargs):
+    def __init__(self, filename_exons, seleno, cache_size=100,
+                 *args, **kwargs):
         Counter.__init__(self, *args, **kwargs)
 
         transcripts = IndexedGenome.IndexedGenome()
@@ -789,6 +933,27 @@ class CounterTranscripts(Counter):
         # create counter
         self.mCounts = collections.defaultdict(int)
 
+        self.mCacheSize = cache_size
+        self.reset()
+
+        self.mOutfileTranscripts = IOTools.openFile(
+            self.mFilenamePattern % "translation", "w")
+        self.mOutfileTranscripts.write(
+            "transcript_id\tvariant_id\tlast_exon_start\t%s\tseq_na\tseq_aa\n" % "\t".join(TranslationEffect._fields))
+
+        self.mOutfileSplicing = IOTools.openFile(
+            self.mFilenamePattern % "splicing", "w")
+        self.mOutfileSplicing.write(
+            "transcript_id\tvariant_id\t%s\n" % "\t".join(SplicingEffect._fields))
+
+    def reset(self):
+        '''reset variants and open output files for variant effects.'''
+
+        self.mTranscriptVariants = {}
+        self.mSequenceCache = TranscriptCache(self.mFasta,
+                                              size=self.mCacheSize,
+                                              margin=self.mSize)
+
         self.mOutfileIntron = IOTools.openFile(
             self.mFilenamePattern % "intron", "w")
         self.mOutfileIntron.write(
@@ -817,17 +982,41 @@ class CounterTranscripts(Counter):
             "cds_end",
             "cds_len")) + "\n")
 
-        self.mOutfileTranscripts = IOTools.openFile(
-            self.mFilenamePattern % "translation", "w")
-        self.mOutfileTranscripts.write(
-            "transcript_id\tvariant_id\tlast_exon_start\t%s\tseq_na\tseq_aa\n" % "\t".join(TranslationEffect._fields))
-
-        self.mOutfileSplicing = IOTools.openFile(
-            self.mFilenamePattern % "splicing", "w")
-        self.mOutfileSplicing.write(
-            "transcript_id\tvariant_id\t%s\n" % "\t".join(SplicingEffect._fields))
-
-        self.mTranscriptVariants = {}
+    def close(self):
+        self.mOutfileIntron.close()
+        self.mOutfileCds.close()
+        E.debug("sequence cache: %s" % str(self.mSequenceCache.mCounts))
+
+    def getResults(self):
+        '''return variants and names of files with variant effects.'''
+        # convert to tuples for pickling
+        variants = dict([(key, (map(tuple, v.cds_variants),
+                                map(tuple, v.splice_variants)))
+                         for key, v in self.mTranscriptVariants.iteritems()])
+        return (variants,
+                self.mFilenamePattern % "intron",
+                self.mFilenamePattern % "cds")
+
+    def mergeResults(self, results):
+        variants, filename_intron, filename_cds = results
+
+        for transcript_id, (cds_variants, splice_variants) in \
+                variants.iteritems():
+            if transcript_id not in self.mTranscriptVariants:
+                self.mTranscriptVariants[
+                    transcript_id] = TranscriptVariant._make(([], []))
+            v = self.mTranscriptVariants[transcript_id]
+            v.cds_variants.extend(map(CdsVariant._make, cds_variants))
+            v.splice_variants.extend(
+                map(SpliceVariant._make, splice_variants))
+
+        # append output without header
+        for filename, outfile in ((filename_intron, self.mOutfileIntron),
+                                  (filename_cds, self.mOutfileCds)):
+            inf = IOTools.openFile(filename)
+            inf.readline()
+            shutil.copyfileobj(inf, outfile)
+            inf.close()
 
     def getVariantRange(self, snp):
         '''return effective range of a variant.
@@ -898,11 +1087,15 @@ class CounterTranscripts(Counter):
 
         return reference_base, variant_seq, variant_bases
 
-    def collectSplicingEffects(self, snp, r, variant, reference_base, variant_seq, variant_bases):
+    def collectSplicingEffects(self, snp, r, variant, reference_base, variant_seq, variant_bases,
+                               fasta=None):
         '''compute effects of a variant on a transcript.
 
         The effects are independent of any other variants.
 
+        If *fasta* is given, sequences are taken from it instead of
+        the genome.
+
         return a list of splicing effects.
         '''
         intron_effects, intron_changes = [], []
@@ -910,11 +1103,14 @@ class CounterTranscripts(Counter):
         if r.nc_start is None:
             return intron_effects, intron_changes
 
+        if fasta is None:
+            fasta = self.mFasta
+
         contig = snp.chromosome
 
         lvariant = len(variant_seq)
 
-        intron_seq = self.mFasta.getSequence(
+        intron_seq = fasta.getSequence(
             contig, r.strand, r.intron_start, r.intron_end).upper()
         is_frameshift = len(intron_seq) < self.mMinIntronSize
 
@@ -1205,6 +1401,9 @@ class CounterTranscripts(Counter):
 
             transcript_id = exons[0].transcript_id
 
+            # sequence is shared between variants in the same transcript
+            fasta = self.mSequenceCache.get(exons)
+
             all_splice_changes, all_splice_effects, all_cds_effects = [
             ], [], []
             for variant in variants_to_test:
@@ -1218,7 +1417,7 @@ class CounterTranscripts(Counter):
 
                 r = getCDSPosition(exons,
                                    variant.start, variant.end,
-                                   self.mFasta)
+                                   fasta)
 
                 if not r:
                     continue
@@ -1233,7 +1432,8 @@ class CounterTranscripts(Counter):
                                                         reference_base, variant_seq, variant_bases)
 
                 splice_effects, splice_changes = self.collectSplicingEffects(snp, r, variant,
-                                                                             reference_base, variant_seq, variant_bases)
+                                                                             reference_base, variant_seq, variant_bases,
+                                                                             fasta=fasta)
 
                 if len(splice_effects) + len(cds_effects) == 0:
                     counts.no_effect += 1
@@ -2114,11 +2314,23 @@ class CounterContigs(Counter):
 
     def __init__(self, *args, **kwargs):
         Counter.__init__(self, *args, **kwargs)
+        self.reset()
 
+    def reset(self):
         # create counter
         self.mCountsSNPs = collections.defaultdict(int)
         self.mCountsIndels = collections.defaultdict(int)
 
+    def getResults(self):
+        return dict(self.mCountsSNPs), dict(self.mCountsIndels)
+
+    def mergeResults(self, results):
+        snps, indels = results
+        for key, value in snps.iteritems():
+            self.mCountsSNPs[key] += value
+        for key, value in indels.iteritems():
+            self.mCountsIndels[key] += value
+
     def update(self, snp):
         '''update with snp.'''
 
@@ -2146,6 +2358,39 @@ class CounterContigs(Counter):
                                  "%i" % total_snps)) + "\n")
 
 
+# counters used by worker processes, see countContig()
+WORKER_MODULES = None
+
+
+def initWorker(genome_file):
+    '''open the genome in a worker process.
+
+    Workers must not share the file handle of the parent process as
+    reading from the genome moves the file position.
+    '''
+    if genome_file:
+        fasta = IndexedFasta.IndexedFasta(genome_file)
+    else:
+        fasta = None
+    for module in WORKER_MODULES:
+        module.mFasta = fasta
+
+
+def countContig(args):
+    '''count variants on a contig in a worker process.
+
+    returns the number of variants and the results of each counter.
+    '''
+    snps, pattern = args
+    modules = [module.clone(pattern) for module in WORKER_MODULES]
+    for snp in snps:
+        for module in modules:
+            module.update(snp)
+    for module in modules:
+        module.close()
+    return len(snps), [module.getResults() for module in modules]
+
+
 def main(argv=None):
     """script main.
 
@@ -2176,6 +2421,10 @@ def main(argv=None):
                       help="input format [default=%default].")
     parser.add_option("--vcf-sample", dest="vcf_sample", type="string",
                       help="sample id in vcf file to analyse [default=%default].")
+    parser.add_option("--cache-size", dest="cache_size", type="int",
+                      help="number of transcript sequences to keep in memory [default=%default].")
+    parser.add_option("--num-threads", dest="num_threads", type="int",
+                      help="number of processes to use. Contigs are processed in parallel [default=%default].")
 
     parser.set_defaults(
         genome_file=None,
@@ -2185,6 +2434,8 @@ def main(argv=None):
         modules=[],
         input_format="pileup",
         vcf_sample=None,
+        cache_size=100,
+        num_threads=1,
     )
 
     # add common options (-h/--help, ...) and parse command line
@@ -2233,24 +2484,47 @@ def main(argv=None):
                     "please supply exon information (--filename-exons)")
             modules.append(CounterTranscripts(options.filename_exons, fasta=fasta,
                                               pattern=options.output_filename_pattern,
-                                              seleno=seleno))
+                                              seleno=seleno,
+                                              cache_size=options.cache_size))
 
         elif module == "contig-counts":
             modules.append(CounterContigs(fasta=fasta))
 
     options.stdout.write("\t".join([x.getHeader() for x in modules]) + "\n")
 
-    for snp in iterator:
-        ninput += 1
-
-        # translate chromosome according to fasta
-        if fasta:
-            snp = snp._replace(chromosome=fasta.getToken(snp.chromosome))
-
-        for module in modules:
-            module.update(snp)
+    # translate chromosome according to fasta
+    if fasta:
+        iterator = (snp._replace(chromosome=fasta.getToken(snp.chromosome))
+                    for snp in iterator)
+
+    if options.num_threads > 1:
+        # process contigs in parallel. Workers count into copies of
+        # the modules, which are then merged.
+        global WORKER_MODULES
+        WORKER_MODULES = modules
+        tmpdir = tempfile.mkdtemp()
+
+        jobs = ((list(snps), os.path.join(tmpdir, "%i.%%s" % x))
+                for x, (contig, snps) in enumerate(
+                    itertools.groupby(iterator,
+                                      key=lambda x: x.chromosome)))
+
+        pool = multiprocessing.Pool(options.num_threads,
+                                    initializer=initWorker,
+                                    initargs=(options.genome_file,))
+        for nsnps, results in pool.imap(countContig, jobs):
+            ninput += nsnps
+            for module, result in zip(modules, results):
+                module.mergeResults(result)
+        pool.close()
+        pool.join()
+        shutil.rmtree(tmpdir)
+    else:
+        for snp in iterator:
+            ninput += 1
 
-        # if ninput > 1000: break
+            for module in modules:
+                module.update(snp)
 
     for module in modules:
         module.writeTable(options.stdout)
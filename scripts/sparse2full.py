@@ -12,6 +12,20 @@ Purpose
 
 convert a sparse matrix to adjacency matrix and vice versa.
 
+The input is read twice. The first pass collects the row and column
+tokens, the second pass fills the matrix in blocks of entries. Input
+that can not be re-read, for example from a pipe, is copied to a
+temporary file first. Weights are kept verbatim as strings. With
+``--use-memmap`` the matrix is kept in a temporary file on disk
+instead of in memory.
+
+With ``--output-format=npz`` no dense matrix is built. The entries are
+saved as coordinate arrays (``row``, ``col``, ``weight``) together
+with the row and column names in a compressed numpy archive. The
+filename is set by ``--output-filename-pattern``. Weights are saved
+as strings as they appear in the input, so that values that are not
+numbers, such as ``na``, are kept.
+
 Usage
 -----
 
@@ -32,8 +46,13 @@ Command line options
 
 import sys
 import string
+import tempfile
+import numpy
 import CGAT.Experiment as E
 
+# number of lines and rows to process at a time
+BLOCK_SIZE = 100000
+
 
 def CountElements(matrix, default_value):
     """count elements that are of default value and those that aren't."""
@@ -48,24 +67,264 @@ def CountElements(matrix, default_value):
     return ndefault, nfound
 
 
+class Chunk(object):
+
+    """lines of a matrix between positions *start* and *end* in
+    *infile*.
+
+    Comments and empty lines are skipped. The lines are read again
+    from the file each time the chunk is iterated over.
+    """
+
+    def __init__(self, infile, start, end):
+        self.infile = infile
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        self.infile.seek(self.start)
+        pos = self.start
+        while pos < self.end:
+            line = self.infile.readline()
+            if not line:
+                break
+            pos += len(line)
+            if line[0] != "#" and len(line[:-1]) > 0:
+                yield line
+
+
+def iterateChunks(infile):
+    """iterate over matrices in *infile*.
+
+    Matrices are separated by lines starting with ``>``. Input that
+    is not seekable is copied into a temporary file first.
+
+    yields tuples of separator line and :class:`Chunk`. The separator
+    is None if there are no separators.
+    """
+
+    try:
+        start = infile.tell()
+        infile.seek(start)
+    except IOError:
+        tmpfile = tempfile.TemporaryFile()
+        for line in infile:
+            tmpfile.write(line)
+        infile, start = tmpfile, 0
+
+    infile.seek(start)
+    separators = []
+    pos = start
+    for line in iter(infile.readline, ""):
+        if line[0] == ">":
+            separators.append((pos, line))
+        pos += len(line)
+
+    if not separators:
+        yield None, Chunk(infile, start, pos)
+        return
+
+    separators.append((pos, None))
+    for x in range(len(separators) - 1):
+        separator_start, separator = separators[x]
+        yield separator, Chunk(infile,
+                               separator_start + len(separator),
+                               separators[x + 1][0])
+
+
+def buildArray(shape, dtype, value, use_memmap=False):
+    """return an array of *shape* filled with *value*.
+
+    If *use_memmap* is set, the array is kept in a temporary
+    memory-mapped file.
+    """
+    if use_memmap and shape[0] * shape[1] > 0:
+        a = numpy.memmap(tempfile.TemporaryFile(),
+                         dtype=dtype, mode="w+", shape=shape)
+    else:
+        a = numpy.empty(shape, dtype=dtype)
+    a[:] = value
+    return a
+
+
+def convertTokens(tokens):
+    """convert tokens to int or, if that fails, float.
+
+    returns converted tokens and the converter.
+    """
+    try:
+        return set(map(int, tokens)), int
+    except ValueError:
+        return set(map(float, tokens)), float
+
+
+def iterateEntries(fields, options, map_token2row, map_token2col,
+                   row_converter=str, col_converter=str):
+    """iterate over matrix entries in *fields* in blocks.
+
+    Entries are returned in the order in which they are set in the
+    matrix, including entries mirrored for symmetric matrices.
+
+    yields tuples of rows, columns, weights and replicates together
+    with a tuple of rows and columns of entries whose replicate count
+    is incremented by one. Replicates are None unless the input
+    contains replicates.
+    """
+
+    rows, cols, weights, replicates = [], [], [], []
+    increment_rows, increment_cols = [], []
+
+    def _build():
+        return (numpy.array(rows, dtype=numpy.int64),
+                numpy.array(cols, dtype=numpy.int64),
+                weights,
+                numpy.array(replicates, dtype=numpy.int64)
+                if replicates else None,
+                (numpy.array(increment_rows, dtype=numpy.int64),
+                 numpy.array(increment_cols, dtype=numpy.int64)))
+
+    input_format = options.input_format
+    symmetric = not options.asymmetric
+
+    for data in fields:
+        row_token = row_converter(data[0])
+        col_token = col_converter(data[1])
+
+        if input_format == "row-col-weight":
+            r, c = map_token2row[row_token], map_token2col[col_token]
+            rows.append(r)
+            cols.append(c)
+            weights.append(data[2])
+            increment_rows.append(r)
+            increment_cols.append(c)
+            if symmetric:
+                r, c = map_token2col[col_token], map_token2row[row_token]
+                rows.append(r)
+                cols.append(c)
+                weights.append(data[2])
+                increment_rows.append(r)
+                increment_cols.append(c)
+
+        elif input_format == "row-col-weight-replicates":
+            rows.append(map_token2row[row_token])
+            cols.append(map_token2col[col_token])
+            weights.append(data[2])
+            replicates.append(int(data[3]))
+            if symmetric:
+                rows.append(map_token2col[col_token])
+                cols.append(map_token2row[row_token])
+                weights.append(data[2])
+                replicates.append(int(data[3]))
+
+        elif input_format == "row-col-weight-weight":
+            rows.append(map_token2row[row_token])
+            cols.append(map_token2col[col_token])
+            weights.append(data[2])
+            rows.append(map_token2col[col_token])
+            cols.append(map_token2row[row_token])
+            weights.append(data[3])
+            increment_rows.append(map_token2row[row_token])
+            increment_cols.append(map_token2col[col_token])
+            increment_rows.append(map_token2row[col_token])
+            increment_cols.append(map_token2col[row_token])
+
+        if len(rows) >= BLOCK_SIZE:
+            yield _build()
+            rows, cols, weights, replicates = [], [], [], []
+            increment_rows, increment_cols = [], []
+
+    if rows:
+        yield _build()
+
+
+def getLastEntries(rows, cols, ncols):
+    """return indices of the last entry for each row/column pair."""
+    keys = rows * ncols + cols
+    keys, index = numpy.unique(keys[::-1], return_index=True)
+    return len(rows) - 1 - index
+
+
+def writeMatrix(outfile, matrix, replicates, titles,
+                row_tokens, col_tokens, options):
+    """write *matrix* to *outfile* in blocks of rows."""
+
+    if options.output_format == "square":
+
+        if titles:
+            outfile.write("%s" % titles[0])
+
+        for col_token, index in col_tokens:
+            outfile.write("\t%s" % col_token)
+        outfile.write("\n")
+
+        for start in range(0, len(matrix), BLOCK_SIZE):
+            block = matrix[start:start + BLOCK_SIZE].tolist()
+            outfile.write("".join(
+                ["%s\t%s\n" % (row_tokens[start + x][0], "\t".join(row))
+                 for x, row in enumerate(block)]))
+
+    elif options.output_format == "phylip":
+
+        if len(row_tokens) != len(col_tokens):
+            raise ValueError("phylip needs symmetric matrices.")
+
+        outfile.write("%i\n" % len(row_tokens))
+
+        for start in range(0, len(matrix), BLOCK_SIZE):
+            block = matrix[start:start + BLOCK_SIZE].tolist()
+            outfile.write("".join(
+                ["%-10s\t%s\n" % (row_tokens[start + x][0],
+                                   " ".join(["  %10s" % y for y in row]))
+                 for x, row in enumerate(block)]))
+
+    elif options.output_format == "phylip-replicates":
+
+        if len(row_tokens) != len(col_tokens):
+            raise ValueError("phylip needs symmetric matrices.")
+
+        outfile.write("%i\n" % len(row_tokens))
+
+        for start in range(0, len(matrix), BLOCK_SIZE):
+            block = matrix[start:start + BLOCK_SIZE].tolist()
+            block_replicates = replicates[start:start + BLOCK_SIZE].tolist()
+            outfile.write("".join(
+                ["%-10s%s\n" % (row_tokens[start + x][0],
+                                 "".join([" %10s %i" % y
+                                          for y in zip(row, rr)]))
+                 for x, (row, rr) in enumerate(zip(block,
+                                                   block_replicates))]))
+
+
 def Sparse2Matrix(outfile, matrix_id, lines, options,
                   in_map_token2row={},
                   in_map_token2col={}):
+    """convert sparse matrix in *lines* to a full matrix.
 
-    # remove comments
-    lines = filter(lambda x: x[0] != "#" and len(x[:-1]) > 0, lines)
+    *lines* is iterated over twice. The first pass collects the row
+    and column tokens, the second pass fills a matrix of strings.
+    """
 
-    if len(lines) == 0:
+    try:
+        first = iter(lines).next()
+    except StopIteration:
         raise IOError("no input")
 
     # forget about titles
-    titles = lines[0][:-1].split("\t")
+    skip_header = False
+    titles = first[:-1].split("\t")
     if titles[2] not in ("na", "NaN"):
         try:
             v = float(titles[2])
             titles = None
         except ValueError:
-            del lines[0]
+            skip_header = True
+
+    def iterateFields():
+        it = iter(lines)
+        if skip_header:
+            it.next()
+        for line in it:
+            yield line[:-1].split("\t")
 
     if in_map_token2row:
         map_token2row = in_map_token2row
@@ -84,42 +343,38 @@ def Sparse2Matrix(outfile, matrix_id, lines, options,
         has_row_names = len(map_token2row) > 0
         has_col_names = len(map_token2col) > 0
 
+        if options.input_format == "row-col-weight-weight":
+            weight_columns = (2, 3)
+        else:
+            weight_columns = (2,)
+
+        # first pass: collect tokens and the width of weights
+        width = max(len(options.default), len(options.default_diagonal), 1)
+        row_tokens, col_tokens = set(), set()
+        for data in iterateFields():
+            row_tokens.add(data[0])
+            col_tokens.add(data[1])
+            for x in weight_columns:
+                width = max(width, len(data[x]))
+
         # if either row/column names are not given:
         if not map_token2row or not map_token2col:
-            row_tokens = map(lambda x: string.split(x[:-1], "\t")[0], lines)
-            col_tokens = map(lambda x: string.split(x[:-1], "\t")[1], lines)
 
             if options.input_format == "row-col-weight-weight":
                 # merge row and col tokens
-                row_tokens.extend(col_tokens)
+                row_tokens.update(col_tokens)
                 col_tokens = row_tokens
 
             if options.is_numeric:
-                try:
-                    row_tokens = map(int, row_tokens)
-                    row_converter = int
-                except ValueError:
-                    row_tokens = map(float, row_tokens)
-                    row_converter = float
-
-                try:
-                    col_tokens = map(int, col_tokens)
-                    col_converter = int
-                except ValueError:
-                    col_tokens = map(float, col_tokens)
-                    col_converter = float
-
-            row_tokens.sort()
-            col_tokens.sort()
+                row_tokens, row_converter = convertTokens(row_tokens)
+                col_tokens, col_converter = convertTokens(col_tokens)
 
             if not has_row_names:
-                for row_token in row_tokens:
-                    if row_token not in map_token2row:
-                        map_token2row[row_token] = len(map_token2row)
+                for row_token in sorted(row_tokens):
+                    map_token2row[row_token] = len(map_token2row)
             if not has_col_names:
-                for col_token in col_tokens:
-                    if col_token not in map_token2col:
-                        map_token2col[col_token] = len(map_token2col)
+                for col_token in sorted(col_tokens):
+                    map_token2col[col_token] = len(map_token2col)
 
         if not options.asymmetric:
             for col_token in map_token2col.keys():
@@ -127,118 +382,86 @@ def Sparse2Matrix(outfile, matrix_id, lines, options,
                     map_token2row[col_token] = len(map_token2row)
             map_token2col = map_token2row
 
-        matrix = [[options.default for j in range(len(map_token2col))] for i in range(
-            len(map_token2row))]
-
-        if len(map_token2col) == len(map_token2row):
-            for j in range(len(map_token2col)):
-                matrix[j][j] = options.default_diagonal
-
-        # replicate counts
-        replicates = [[0 for j in range(len(map_token2col))]
-                      for i in range(len(map_token2row))]
-
-        if options.input_format == "row-col-weight":
-            for line in lines:
-                row_token, col_token, weight = string.split(
-                    line[:-1], "\t")[:3]
-                row_token, col_token = row_converter(
-                    row_token), col_converter(col_token)
-                matrix[map_token2row[row_token]][
-                    map_token2col[col_token]] = weight
-                replicates[map_token2row[row_token]][
-                    map_token2col[col_token]] += 1
-                if not options.asymmetric:
-                    matrix[map_token2col[col_token]][
-                        map_token2row[row_token]] = weight
-                    replicates[map_token2col[col_token]][
-                        map_token2row[row_token]] += 1
-
-        elif options.input_format == "row-col-weight-replicates":
-            for line in lines:
-                row_token, col_token, weight, n = string.split(
-                    line[:-1], "\t")[:4]
-                matrix[map_token2row[row_token]][
-                    map_token2col[col_token]] = weight
-                replicates[map_token2row[row_token]][
-                    map_token2col[col_token]] = int(n)
-                if not options.asymmetric:
-                    matrix[map_token2col[col_token]][
-                        map_token2row[row_token]] = weight
-                    replicates[map_token2col[col_token]][
-                        map_token2row[row_token]] = int(n)
-
-        elif options.input_format == "row-col-weight-weight":
-            for line in lines:
-                row_token, col_token, weight1, weight2 = string.split(
-                    line[:-1], "\t")[:4]
-                matrix[map_token2row[row_token]][
-                    map_token2col[col_token]] = weight1
-                matrix[map_token2col[col_token]][
-                    map_token2row[row_token]] = weight2
-                replicates[map_token2row[row_token]][
-                    map_token2col[col_token]] += 1
-                replicates[map_token2row[col_token]][
-                    map_token2col[row_token]] += 1
-
         col_tokens = map_token2col.items()
         col_tokens.sort(lambda x, y: cmp(x[1], y[1]))
         row_tokens = map_token2row.items()
         row_tokens.sort(lambda x, y: cmp(x[1], y[1]))
+        nrows, ncols = len(row_tokens), len(col_tokens)
 
-        ndefault, nfound = CountElements(matrix, options.default)
+        if options.output_format == "npz":
+            matrix, replicates = None, None
+            coordinates = [], [], []
+        else:
+            matrix = buildArray((nrows, ncols), "S%i" % width,
+                                options.default,
+                                use_memmap=options.use_memmap)
+            if nrows == ncols:
+                numpy.fill_diagonal(matrix, options.default_diagonal)
+
+            # replicate counts
+            if options.output_format == "phylip-replicates":
+                replicates = buildArray((nrows, ncols), numpy.int64, 0,
+                                        use_memmap=options.use_memmap)
+            else:
+                replicates = None
+
+        # second pass: fill matrix, later entries overwrite earlier ones
+        for rows, cols, weights, block_replicates, increments in \
+                iterateEntries(iterateFields(), options,
+                               map_token2row, map_token2col,
+                               row_converter, col_converter):
+            last = getLastEntries(rows, cols, ncols)
+            rows, cols = rows[last], cols[last]
+            weights = numpy.array(weights, dtype="S%i" % width)[last]
+
+            if matrix is None:
+                for x, y in zip(coordinates, (rows, cols, weights)):
+                    x.append(y)
+                continue
+
+            matrix[rows, cols] = weights
+            if replicates is not None:
+                if block_replicates is None:
+                    numpy.add.at(replicates, increments, 1)
+                else:
+                    replicates[rows, cols] = block_replicates[last]
+
+        if matrix is None:
+            rows, cols, weights = [numpy.concatenate(x) if x else
+                                   numpy.zeros(0, dtype=numpy.int64)
+                                   for x in coordinates]
+            last = getLastEntries(rows, cols, ncols)
+            nfound = len(last)
+            ndefault = nrows * ncols - nfound
+        else:
+            ndefault = numpy.count_nonzero(matrix == options.default)
+            nfound = nrows * ncols - ndefault
 
         # Apply filtering to decide whether matrix should be output
 
         # 1. Filter by number of rows/columns
-        if (options.filter_numrows and len(row_tokens) != options.filter_numrows) or\
-                (options.filter_numcols and len(col_tokens) != options.filter_numcols):
+        if (options.filter_numrows and nrows != options.filter_numrows) or\
+                (options.filter_numcols and ncols != options.filter_numcols):
             if options.loglevel >= 1:
                 options.stdlog.write("# id=%s, nrows=%i, ncols=%i, nfound=%i, ndefault=%i\n" % (
-                    matrix_id, len(row_tokens), len(col_tokens), nfound, ndefault))
+                    matrix_id, nrows, ncols, nfound, ndefault))
             return False
 
-        if options.output_format == "square":
-
-            if titles:
-                outfile.write("%s" % titles[0])
-
-            for col_token, index in col_tokens:
-                outfile.write("\t%s" % col_token)
-            outfile.write("\n")
-
-            for row in range(len(matrix)):
-                outfile.write(
-                    "%s\t%s\n" % (row_tokens[row][0], string.join(matrix[row], "\t")))
-
-        elif options.output_format == "phylip":
-
-            if len(row_tokens) != len(col_tokens):
-                raise ValueError, "phylip needs symmetric matrices."
-
-            outfile.write("%i\n" % len(row_tokens))
-
-            for row in range(len(matrix)):
-                outfile.write(
-                    "%-10s\t%s\n" % (row_tokens[row][0], " ".join(map(lambda x: "  %10s" % x, matrix[row]))))
-
-        elif options.output_format == "phylip-replicates":
-
-            if len(row_tokens) != len(col_tokens):
-                raise ValueError, "phylip needs symmetric matrices."
-
-            outfile.write("%i\n" % len(row_tokens))
+        if options.output_format == "npz":
+            numpy.savez_compressed(
+                options.output_filename_pattern % ("%s.npz" % matrix_id),
+                row=rows[last],
+                col=cols[last],
+                weight=weights[last],
+                row_names=numpy.array([str(x[0]) for x in row_tokens]),
+                col_names=numpy.array([str(x[0]) for x in col_tokens]))
+        else:
+            writeMatrix(outfile, matrix, replicates, titles,
+                        row_tokens, col_tokens, options)
 
-            for row in range(len(matrix)):
-                outfile.write("%-10s" % row_tokens[row][0])
-                rr = matrix[row]
-                re = replicates[row]
-                for c in range(len(matrix[row])):
-                    outfile.write(" %10s %i" % (rr[c], re[c]))
-                outfile.write("\n")
     else:
         if not options.row_names or not options.col_names:
-            raise "Please specify row and column range."
+            raise ValueError("Please specify row and column range.")
 
         row_range = eval(options.row_names)
         col_range = eval(options.col_names)
@@ -251,8 +474,8 @@ def Sparse2Matrix(outfile, matrix_id, lines, options,
             map_col[col_range[x]] = x
 
         matrix = [[options.default for j in col_range] for i in row_range]
-        for line in lines:
-            row_token, col_token, weight = string.split(line[:-1], "\t")[:3]
+        for data in iterateFields():
+            row_token, col_token, weight = data[:3]
 
             row_pos = map_row[int(float(row_token))]
             col_pos = map_col[int(float(col_token))]
@@ -278,6 +501,8 @@ def Sparse2Matrix(outfile, matrix_id, lines, options,
             outfile.write("%i\t%s\n" %
                           (row_range[row], "\t".join(map(str, matrix[row]))))
 
+        row_tokens, col_tokens = row_range, col_range
+
     if options.loglevel >= 1:
         options.stdlog.write("# id=%s, nrows=%i, ncols=%i, nfound=%i, ndefault=%i\n" % (
             matrix_id, len(row_tokens), len(col_tokens), nfound, ndefault))
@@ -302,7 +527,7 @@ def main(argv=None):
                       help="format.")
 
     parser.add_option("-o", "--output-format", dest="output_format", type="choice",
-                      choices=("square", "phylip", "phylip-replicates"),
+                      choices=("square", "phylip", "phylip-replicates", "npz"),
                       help="output format.")
 
     parser.add_option("-i", "--input-format", dest="input_format", type="choice",
@@ -349,6 +574,10 @@ def main(argv=None):
     parser.add_option("--map-tsv-file", dest="filename_map", type="string",
                       help="filename with mapping between input and output chunks.")
 
+    parser.add_option("--use-memmap", dest="use_memmap", action="store_true",
+                      help="keep matrices in temporary memory-mapped files "
+                      "instead of memory [%default].")
+
     parser.set_defaults(
         default="0",
         default_diagonal="0",
@@ -366,9 +595,10 @@ def main(argv=None):
         filter_numrows=0,
         filename_map=None,
         write_separators=True,
+        use_memmap=False,
     )
 
-    (options, args) = E.Start(parser)
+    (options, args) = E.Start(parser, add_output_options=True)
 
     if options.full2sparse:
         # convert a full matrix to a sparse matrix
@@ -422,19 +652,11 @@ def main(argv=None):
                 "## Map between matrices in input file and output matrices.\nnew\told\n")
 
         # convert a sparse matrix to a full matrix
-        lines = filter(lambda x: x[0] != "#", sys.stdin.readlines())
-
-        chunks = filter(lambda x: lines[x][0] == ">", range(len(lines)))
+        chunks = list(iterateChunks(options.stdin))
 
-        if not chunks:
-            chunks = [-1]
+        if chunks[0][0] is None:
             options.write_separators = False
 
-        chunks.append(len(lines))
-
-        if options.loglevel >= 2:
-            print "# processing chunks:", chunks
-
         map_token2row = {}
         map_token2col = {}
 
@@ -466,12 +688,13 @@ def main(argv=None):
 
         noutput = 0
 
-        for x in range(len(chunks) - 1):
+        for x, chunk in enumerate(chunks):
 
+            separator, lines = chunk
             if options.write_separators:
-                options.stdout.write(lines[chunks[x]])
+                options.stdout.write(separator)
 
-            output = Sparse2Matrix(options.stdout, str(x + 1), lines[chunks[x] + 1:chunks[x + 1]],
+            output = Sparse2Matrix(options.stdout, str(x + 1), lines,
                                    options,
                                    map_token2row, map_token2col)
 
@@ -16,7 +16,8 @@ Methods working on all tables:
 ++++++++++++++++++++++++++++++
 
 transpose
-   transpose a table
+   transpose a table. Large tables are transposed in chunks of
+   ``--chunk-size`` rows using temporary files.
 
 split-fields
    Split muliple-value fields in each row at ``--separator``. Output
@@ -80,7 +81,8 @@ rank
 
 fdr
    compute an FDR over selected columns. Replaces the columns
-   with the qvalues.
+   with the qvalues. The method is set with ``--fdr-method``.
+   ``qvalue`` computes Storey's qvalues.
 
 Usage
 -----
@@ -108,6 +110,8 @@ import math
 import types
 import itertools
 import collections
+import tempfile
+import numpy
 
 import CGAT.Experiment as E
 import CGAT.CSV as CSV
@@ -136,40 +140,84 @@ def getColumns(fields, columns="all"):
 ##########################################################
 
 
-def readAndTransposeTable(infile, options):
-    """read table from infile and transpose
-    """
-    rows = []
-    if options.transpose_format == "default":
+def iterateTransposeRows(infile, options):
+    """iterate over rows of an un-transposed table."""
 
-        for line in infile:
-            if line[0] == "#":
-                continue
-            rows.append(line[:-1].split("\t"))
-
-    elif options.transpose_format == "separated":
-        for line in infile:
-            if line[0] == "#":
-                continue
+    for line in infile:
+        if line[0] == "#":
+            continue
+        if options.transpose_format == "default":
+            yield line[:-1].split("\t")
+        elif options.transpose_format == "separated":
             key, vals = line[:-1].split("\t")
-            row = [key] + vals.split(options.separator)
-            rows.append(row)
+            yield [key] + vals.split(options.separator)
 
-    ncols = max(map(lambda x: len(x), rows))
-    nrows = len(rows)
 
-    new_rows = [[""] * nrows for x in range(ncols)]
+def writeTransposedChunk(rows):
+    """write transposed *rows* to a temporary file.
 
-    for r in range(0, len(rows)):
-        for c in range(0, len(rows[r])):
-            new_rows[c][r] = rows[r][c]
+    returns the filename, the number of rows and the number
+    of columns in the chunk.
+    """
+    ncols = max(map(len, rows))
+    outfile = tempfile.NamedTemporaryFile(delete=False)
+    for column in itertools.izip_longest(*rows, fillvalue=""):
+        outfile.write("\t".join(column) + "\n")
+    outfile.close()
+    return outfile.name, len(rows), ncols
+
+
+def readAndTransposeTable(infile, options):
+    """read table from infile and transpose
 
-    if options.set_transpose_field:
-        new_rows[0][0] = options.set_transpose_field
+    Tables with more than ``--chunk-size`` rows are transposed in
+    chunks that are stored in temporary files and then merged.
+    """
+    rows = []
+    chunks = []
+    for row in iterateTransposeRows(infile, options):
+        rows.append(row)
+        if len(rows) >= options.chunk_size:
+            chunks.append(writeTransposedChunk(rows))
+            rows = []
+
+    if not chunks:
+        new_rows = [list(x) for x in
+                    itertools.izip_longest(*rows, fillvalue="")]
+
+        if options.set_transpose_field:
+            new_rows[0][0] = options.set_transpose_field
+
+        for row in new_rows:
+            options.stdout.write("\t".join(row) + "\n")
+        return
+
+    if rows:
+        chunks.append(writeTransposedChunk(rows))
+
+    E.info("merging %i transposed chunks" % len(chunks))
+    ncols = max([x[2] for x in chunks])
+    infiles = [open(x[0]) for x in chunks]
+
+    for c in range(ncols):
+        row = []
+        for inf, chunk in zip(infiles, chunks):
+            filename, nrows, chunk_ncols = chunk
+            if c < chunk_ncols:
+                row.append(inf.readline()[:-1])
+            else:
+                row.append("\t".join([""] * nrows))
+
+        if c == 0 and options.set_transpose_field:
+            row[0] = "\t".join(
+                [options.set_transpose_field] + row[0].split("\t")[1:])
 
-    for row in new_rows:
         options.stdout.write("\t".join(row) + "\n")
 
+    for inf, chunk in zip(infiles, chunks):
+        inf.close()
+        os.unlink(chunk[0])
+
 ##########################################################
 ##########################################################
 ##########################################################
@@ -177,65 +225,73 @@ def readAndTransposeTable(infile, options):
 
 def readAndGroupTable(infile, options):
     """read table from infile and group.
+
+    Rows with values that are neither numbers nor missing are
+    removed before grouping with a numeric function.
     """
-    fields, table = CSV.ReadTable(
-        infile, with_header=options.has_headers, as_rows=True)
-    options.columns = getColumns(fields, options.columns)
-    assert options.group_column not in options.columns
-
-    converter = float
-    new_fields = [fields[options.group_column]] + [fields[x]
-                                                   for x in options.columns]
-
-    if options.group_function == "min":
-        f = min
-    elif options.group_function == "max":
-        f = max
-    elif options.group_function == "sum":
-        f = lambda z: reduce(lambda x, y: x + y, z)
-    elif options.group_function == "mean":
-        f = scipy.mean
+    group_column = options.group_column
+
+    def _getColumns(fields):
+        options.columns = getColumns(fields, options.columns)
+        assert group_column not in options.columns
+        return options.columns
+
+    if options.group_function in ("cat", "uniq"):
+        dtype = str
+    else:
+        dtype = float
+
+    fields, table = CSV.readTypedTable(
+        infile, columns=_getColumns, dtype=dtype,
+        with_header=options.has_headers,
+        chunk_size=options.chunk_size)
+
+    new_fields = [fields[group_column]] + [fields[x]
+                                           for x in options.columns]
+
+    # the mean is output with the precision of numpy
+    format = None
+    if options.group_function in ("min", "max", "sum", "mean"):
+        f = options.group_function
+        if f == "mean":
+            format = "%r"
     elif options.group_function == "cat":
         f = lambda x: ";".join([y for y in x if y != ""])
-        converter = str
     elif options.group_function == "uniq":
         f = lambda x: ";".join([y for y in set(x) if y != ""])
-        converter = str
     elif options.group_function == "stats":
         f = lambda x: str(Stats.DistributionalParameters(x))
         # update headers
-        new_fields = [fields[options.group_column]]
+        new_fields = [fields[group_column]]
         for c in options.columns:
             new_fields += list(map(lambda x: "%s_%s" %
                                    (fields[c], x), Stats.DistributionalParameters().getHeaders()))
 
-    # convert values to floats (except for group_column)
-    # Delete rows with unconvertable values and not in options.columns
-    new_table = []
-    for row in table:
-        skip = False
-        new_row = [row[options.group_column]]
-
-        for c in options.columns:
-            if row[c] == options.missing_value:
-                new_row.append(row[c])
-            else:
-                try:
-                    new_row.append(converter(row[c]))
-                except ValueError:
-                    skip = True
-                    break
-        if not skip:
-            new_table.append(new_row)
-    table = new_table
-
-    new_rows = CSV.GroupTable(table,
-                              group_column=0,
-                              group_function=f)
+    columns = [table[c] for c in options.columns]
+    keys = table[group_column].values
+    if dtype == str:
+        for column in columns:
+            column.setMissing(column.values == options.missing_value,
+                              options.missing_value)
+    else:
+        # remove rows with values that are neither numbers nor missing
+        keep = numpy.ones(len(table[group_column]), dtype=numpy.bool)
+        for column in columns:
+            if column.valid is not None:
+                keep &= column.valid | \
+                    (column.strings == options.missing_value)
+        if not keep.all():
+            columns = [x.select(keep) for x in columns]
+            keys = keys[keep]
+
+    keys, new_columns = CSV.groupColumns(keys, columns, f,
+                                         missing_value=options.missing_value)
+    new_columns = [x.tolist(format) if isinstance(x, CSV.Column) else x
+                   for x in new_columns]
 
     options.stdout.write("\t".join(new_fields) + "\n")
-    for row in new_rows:
-        options.stdout.write("\t".join(map(str, row)) + "\n")
+    for key, row in zip(keys, zip(*new_columns)):
+        options.stdout.write("\t".join([key] + map(str, row)) + "\n")
 
 ##########################################################
 ##########################################################
@@ -281,33 +337,38 @@ def readAndCollapseTable(infile, options, missing_value=""):
     column. Outputs a table with multiple columns for each row name.
     '''
 
-    fields, table = CSV.ReadTable(
-        infile, with_header=options.has_headers, as_rows=True)
+    fields, chunks = CSV.iterateTableChunks(
+        infile, with_header=options.has_headers,
+        chunk_size=options.chunk_size)
 
     if len(fields) != 2:
         raise NotImplementedError("can only work on tables with two columns")
 
     values = collections.defaultdict(list)
 
-    # column header after which to add
-    separator = table[0][0]
-    row_names = set([x[0] for x in table])
-
-    row_name, value = table[0]
-
-    values[row_name].append(value)
-    added = set([row_name])
-    for row_name, value in table[1:]:
-        if row_name == separator:
-            for r in row_names:
-                if r not in added:
-                    values[r].append(missing_value)
-            added = set()
-
-        values[row_name].append(value)
-        added.add(row_name)
-
-    for r in row_names:
+    # values are collected per row name in a hash table. A new
+    # column starts at each occurrence of the first row name.
+    separator = None
+    added = set()
+    for chunk in chunks:
+        for row_name, value in chunk:
+            if separator is None:
+                separator = row_name
+            elif row_name == separator:
+                for r in values:
+                    if r not in added:
+                        values[r].append(missing_value)
+                added = set()
+
+            if row_name not in values and separator != row_name:
+                # row name first seen in a later column
+                values[row_name].extend(
+                    [missing_value] * (len(values[separator]) -
+                                       (separator in added)))
+            values[row_name].append(value)
+            added.add(row_name)
+
+    for r in values:
         if r not in added:
             values[r].append(missing_value)
 
@@ -423,6 +484,7 @@ def main(argv=None):
         choices=("transpose", "normalize-by-max", "normalize-by-value",
                  "multiply-by-value",
                  "percentile", "remove-header", "normalize-by-table",
+                 "rank",
                  "upper-bound", "lower-bound", "kullback-leibler",
                  "expand", "compress", "fdr", "grep"),
         help="""actions to perform on table.""")
@@ -452,6 +514,12 @@ def main(argv=None):
         choices=("default", "separated", ),
         help="input format of un-transposed table")
 
+    parser.add_option(
+        "--chunk-size", dest="chunk_size", type="int",
+        help="number of rows to transpose in memory. Larger tables "
+        "are transposed in chunks using temporary files "
+        "[%default].")
+
     parser.add_option(
         "--expand", dest="expand_table", action="store_true",
         help="expand table - multi-value cells with be expanded over "
@@ -522,7 +590,8 @@ def main(argv=None):
     parser.add_option(
         "--fdr-method", dest="fdr_method", type="choice",
         choices=(
-            "BH", "bonferroni", "holm", "hommel", "hochberg", "BY"),
+            "BH", "bonferroni", "holm", "hommel", "hochberg", "BY",
+            "qvalue"),
         help="method to perform multiple testing correction by controlling "
         "the fdr [default=%default].")
 
@@ -559,6 +628,7 @@ def main(argv=None):
         transpose=False,
         set_transpose_field=None,
         transpose_format="default",
+        chunk_size=1000000,
         group=False,
         group_column=0,
         group_function="mean",
@@ -715,30 +785,25 @@ def main(argv=None):
         ######################################################################
         ######################################################################
         ######################################################################
-        # Apply remainder of transformations
-        fields, table = CSV.ReadTable(
-            options.stdin, with_header=options.has_headers, as_rows=False)
-        # convert columns to list
-        table = [list(x) for x in table]
+        # Apply remainder of transformations. The table is read in
+        # chunks and the selected columns are converted to numbers.
+        def _getColumns(fields):
+            options.columns = getColumns(fields, options.columns)
+            return options.columns
+
+        fields, table = CSV.readTypedTable(
+            options.stdin, columns=_getColumns, dtype=numpy.float,
+            with_header=options.has_headers,
+            chunk_size=options.chunk_size)
 
         ncols = len(fields)
-        if len(table) == 0:
+        if len(table) == 0 or len(table[0]) == 0:
             raise ValueError("table is empty")
 
         nrows = len(table[0])
 
         E.info("processing table with %i rows and %i columns" % (nrows, ncols))
 
-        options.columns = getColumns(fields, options.columns)
-
-        # convert all values to float
-        for c in options.columns:
-            for r in range(nrows):
-                try:
-                    table[c][r] = float(table[c][r])
-                except ValueError:
-                    continue
-
         for method in options.methods:
 
             if method == "normalize-by-value":
@@ -747,7 +812,7 @@ def main(argv=None):
                 del options.parameters[0]
 
                 for c in options.columns:
-                    table[c] = map(lambda x: x / value, table[c])
+                    table[c].setValues(table[c].values / value)
 
             elif method == "multiply-by-value":
 
@@ -755,31 +820,32 @@ def main(argv=None):
                 del options.parameters[0]
 
                 for c in options.columns:
-                    table[c] = map(lambda x: x * value, table[c])
+                    table[c].setValues(table[c].values * value)
 
             elif method == "normalize-by-max":
 
                 for c in options.columns:
-                    m = max(table[c])
-                    table[c] = map(lambda x: x / m, table[c])
+                    column = table[c]
+                    if column.valid is None:
+                        m = column.values.max()
+                    else:
+                        m = column.values[column.valid].max()
+                    column.setValues(column.values / m)
 
             elif method == "kullback-leibler":
                 options.stdout.write("category1\tcategory2\tkl1\tkl2\tmean\n")
                 format = options.format
                 if format is None:
                     format = "%f"
-                    
+
                 for x in range(0, len(options.columns) - 1):
                     for y in range(x + 1, len(options.columns)):
                         c1 = options.columns[x]
                         c2 = options.columns[y]
-                        e1 = 0
-                        e2 = 0
-                        for z in range(nrows):
-                            p = table[c1][z]
-                            q = table[c2][z]
-                            e1 += p * math.log(p / q)
-                            e2 += q * math.log(q / p)
+                        p = table[c1].values
+                        q = table[c2].values
+                        e1 = numpy.sum(p * numpy.log(p / q))
+                        e2 = numpy.sum(q * numpy.log(q / p))
 
                         options.stdout.write("%s\t%s\t%s\t%s\t%s\n" % (
                             fields[c1], fields[c2],
@@ -791,12 +857,24 @@ def main(argv=None):
 
             elif method == "rank":
 
+                # ties are ranked by position. Cells that are not
+                # numbers are ranked after numbers by their value.
                 for c in options.columns:
-                    tt = table[c]
-                    t = zip(tt, range(nrows))
-                    t.sort()
-                    for i, n in zip(map(lambda x: x[1], t), range(nrows)):
-                        tt[i] = n
+                    column = table[c]
+                    if column.valid is None:
+                        order = numpy.argsort(column.values, kind="mergesort")
+                    else:
+                        valid = numpy.flatnonzero(column.valid)
+                        invalid = numpy.flatnonzero(~column.valid)
+                        order = numpy.concatenate((
+                            valid[numpy.argsort(column.values[valid],
+                                                kind="mergesort")],
+                            numpy.array(sorted(
+                                invalid, key=lambda x: column.strings[x]),
+                                dtype=numpy.int)))
+                    ranks = numpy.empty(nrows, dtype=numpy.int)
+                    ranks[order] = numpy.arange(nrows)
+                    table[c] = CSV.Column(ranks)
 
             elif method in ("lower-bound", "upper-bound"):
 
@@ -805,38 +883,41 @@ def main(argv=None):
                 new_value = float(options.parameters[0])
                 del options.parameters[0]
 
-                if method == "upper-bound":
-                    for c in options.columns:
-                        for r in range(nrows):
-                            if isinstance(table[c][r], float) and \
-                                    table[c][r] > boundary:
-                                table[c][r] = new_value
-                else:
-                    for c in options.columns:
-                        for r in range(nrows):
-                            if isinstance(table[c][r], float) and \
-                                    table[c][r] < boundary:
-                                table[c][r] = new_value
+                for c in options.columns:
+                    values = table[c].values
+                    if method == "upper-bound":
+                        outside = values > boundary
+                    else:
+                        outside = values < boundary
+                    table[c].setValues(numpy.where(outside, new_value, values))
 
             elif method == "fdr":
-                pvalues = []
                 for c in options.columns:
-                    pvalues.extend(table[c])
-
-                assert max(pvalues) <= 1.0, "pvalues > 1 in table: max=%s" % \
-                    str(max(pvalues))
-                assert min(pvalues) >= 0, "pvalue < 0 in table: min=%s" % \
-                    str(min(pvalues))
+                    if table[c].valid is not None:
+                        raise ValueError(
+                            "column %s contains values that are not "
+                            "numbers" % fields[c])
+                pvalues = numpy.concatenate(
+                    [table[c].values for c in options.columns])
+
+                assert pvalues.max() <= 1.0, "pvalues > 1 in table: max=%s" % \
+                    str(pvalues.max())
+                assert pvalues.min() >= 0, "pvalue < 0 in table: min=%s" % \
+                    str(pvalues.min())
 
                 # convert to str to avoid test for float downstream
-                qvalues = map(
-                    str, Stats.adjustPValues(pvalues,
-                                             method=options.fdr_method))
+                pvalues = pvalues.tolist()
+                if options.fdr_method == "qvalue":
+                    qvalues = Stats.doFDRPython(pvalues).mQValues
+                else:
+                    qvalues = Stats.adjustPValues(pvalues,
+                                                  method=options.fdr_method)
+                qvalues = numpy.array(map(str, qvalues), dtype=object)
 
                 if options.fdr_add_column is None:
                     x = 0
                     for c in options.columns:
-                        table[c] = qvalues[x:x + nrows]
+                        table[c] = CSV.Column(qvalues[x:x + nrows])
                         x += nrows
                 else:
                     # add new column headers
@@ -844,12 +925,12 @@ def main(argv=None):
                         fields.append(options.fdr_add_column)
                     else:
                         for co in options.columns:
-                            fields.append(options.fdr_add_column + fields[c])
+                            fields.append(options.fdr_add_column + fields[co])
 
                     x = 0
                     for c in options.columns:
                         # add a new column
-                        table.append(qvalues[x:x + nrows])
+                        table.append(CSV.Column(qvalues[x:x + nrows]))
                         x += nrows
                     ncols += len(options.columns)
 
@@ -857,35 +938,28 @@ def main(argv=None):
 
                 other_table_name = options.parameters[0]
                 del options.parameters[0]
-                other_fields, other_table = CSV.ReadTable(
+                other_fields, other_table = CSV.readTypedTable(
                     open(other_table_name, "r"),
-                    with_header=options.has_headers,
-                    as_rows=False)
-
-                # convert all values to float
-                for c in options.columns:
-                    for r in range(nrows):
-                        try:
-                            other_table[c][r] = float(other_table[c][r])
-                        except ValueError:
-                            continue
+                    columns=lambda x: options.columns,
+                    dtype=numpy.float,
+                    with_header=options.has_headers)
 
-                # set 0s to 1 in the other matrix
+                # cells are set to missing if either value is not a
+                # number or the divisor is 0
                 for c in options.columns:
-                    for r in range(nrows):
-                        if isinstance(table[c][r], float) and \
-                                isinstance(other_table[c][r], float) and \
-                                other_table[c][r] != 0:
-                            table[c][r] /= other_table[c][r]
-                        else:
-                            table[c][r] = options.missing_value
+                    column, other = table[c], other_table[c]
+                    divide = other.values != 0
+                    for x in (column.valid, other.valid):
+                        if x is not None:
+                            divide &= x
+                    column.setValues(
+                        column.values /
+                        numpy.where(divide, other.values, 1.0),
+                        where=divide)
+                    column.setMissing(~divide, options.missing_value)
 
         # convert back
-        if options.format is not None:
-            for c in options.columns:
-                for r in range(nrows):
-                    if isinstance(table[c][r], float):
-                        table[c][r] = format % table[c][r]
+        table = [x.tolist(options.format) for x in table]
 
         options.stdout.write("\t".join(fields) + "\n")
         if options.sort_rows:
@@ -897,13 +971,10 @@ def main(argv=None):
                     continue
                 r = old2new[x]
                 options.stdout.write(
-                    "\t".join(map(str,
-                                  [table[c][r] for c in range(ncols)])) + "\n")
+                    "\t".join([table[c][r] for c in range(ncols)]) + "\n")
         else:
-            for r in range(nrows):
-                options.stdout.write(
-                    "\t".join(map(str,
-                                  [table[c][r] for c in range(ncols)])) + "\n")
+            for row in zip(*table):
+                options.stdout.write("\t".join(row) + "\n")
 
     E.Stop()
 
@@ -115,19 +115,23 @@ def main(argv=None):
     if options.method == "non-redundant":
         # compute non-redudant trees
         template_trees = []
+        template_clades = []
         template_counts = []
+        index = TreeTools.TreeCollectionIndex()
         ntree = 0
         for tree in nexus.trees:
 
+            clades = TreeTools.TreeClades(tree, index)
             for x in range(0, len(template_trees)):
-                is_compatible, reason = TreeTools.IsCompatible(
-                    tree, template_trees[x])
+                is_compatible, reason = clades.isCompatible(
+                    template_clades[x])
                 if is_compatible:
                     template_counts[x] += 1
                     break
             else:
                 template_counts.append(1)
                 template_trees.append(tree)
+                template_clades.append(clades)
 
             if options.loglevel >= 2:
                 options.stdlog.write(
@@ -104,10 +104,14 @@ def main(argv=sys.argv):
 
     infile.writeHeader(options.stdout, order=sort_order)
 
-    for vcf in infile:
-        if sort_order:
-            vcf.order = sort_order
-        options.stdout.write(str(vcf) + "\n")
+    if sort_order:
+        # permute sample columns without building genotype dictionaries
+        indices = infile.getSampleIndices(sort_order)
+        for vcf in infile:
+            options.stdout.write(vcf.toString(indices) + "\n")
+    else:
+        for vcf in infile:
+            options.stdout.write(str(vcf) + "\n")
 
     E.Stop()
 
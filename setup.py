@@ -210,6 +210,7 @@ Components = Extension(
     'CGAT.Components',
     ['CGAT/Components/Components.pyx',
      'CGAT/Components/connected_components.cpp', ],
+    include_dirs=[numpy.get_include()],
     library_dirs=[],
     libraries=[],
     language="c++",
@@ -235,6 +236,24 @@ Timeseries = Extension(
     language="c",
 )
 
+# Parsing of psl formatted files
+Blat = Extension(
+    "CGAT.cblat",
+    ["CGAT/cblat.pyx"],
+    library_dirs=[],
+    libraries=[],
+    language="c",
+)
+
+# Low complexity masking
+Masker = Extension(
+    "CGAT.cmasker",
+    ["CGAT/cmasker.pyx"],
+    library_dirs=[],
+    libraries=[],
+    language="c",
+)
+
 # automatically build pyximport script extensions
 pyx_files = glob.glob("scripts/*.pyx")
 script_extensions = []
@@ -266,7 +285,7 @@ for pyx_file in pyx_files:
     )
 
 
-ext_modules = [Components, NCL, Timeseries] + script_extensions
+ext_modules = [Components, NCL, Timeseries, Blat, Masker] + script_extensions
 
 setup(
     # package information
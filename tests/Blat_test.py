@@ -0,0 +1,153 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the Blat.py module.
+
+Matches parsed by the compiled parser in :mod:`cblat` are compared
+against matches parsed in python.
+"""
+
+import array
+import os
+import unittest
+import CGAT.Blat as Blat
+
+
+class PythonMatch(Blat.Match):
+    '''a match class that is always parsed in python.'''
+    pass
+
+
+class ParseLinesCheck(unittest.TestCase):
+
+    filename = os.path.join(os.path.dirname(__file__),
+                            "chain2psl.py", "out.psl")
+
+    def setUp(self):
+        self.lines = [x for x in open(self.filename) if not x.startswith("#")]
+
+    def testPython(self):
+        matches = Blat.parseLines(self.lines, factory=PythonMatch)
+        self.assertEqual([str(x) + "\n" for x in matches], self.lines)
+
+    @unittest.skipIf(Blat.cblat is None, "cblat is not compiled")
+    def testCompiled(self):
+        compiled = Blat.parseLines(self.lines)
+        python = Blat.parseLines(self.lines, factory=PythonMatch)
+        self.assertEqual([str(x) for x in compiled],
+                         [str(x) for x in python])
+        for x, y in zip(compiled, python):
+            self.assertEqual(x.mBlockSizes, y.mBlockSizes)
+            self.assertEqual(x.mQueryBlockStarts, y.mQueryBlockStarts)
+            self.assertEqual(x.mSbjctBlockStarts, y.mSbjctBlockStarts)
+            self.assertEqual((x.mQueryCoverage, x.mSbjctCoverage, x.mPid),
+                             (y.mQueryCoverage, y.mSbjctCoverage, y.mPid))
+
+
+class BlockFieldCheck(unittest.TestCase):
+
+    def checkBlocks(self, match):
+        for x in (match.mBlockSizes,
+                  match.mQueryBlockStarts,
+                  match.mSbjctBlockStarts):
+            self.assertTrue(isinstance(x, array.array))
+            self.assertEqual(x.typecode, "i")
+
+    def testParsed(self):
+        match = Blat.parseLines(
+            ["10\t0\t0\t0\t0\t0\t1\t5\t+\tq\t10\t0\t10\tt\t100\t20\t35\t2"
+             "\t4,6,\t0,4,\t20,29,\n"])[0]
+        self.checkBlocks(match)
+        self.assertEqual(list(match.mSbjctBlockStarts), [20, 29])
+
+    def testSet(self):
+        match = Blat.Match()
+        self.checkBlocks(match)
+        match.mBlockSizes = [4, 6]
+        match.mQueryBlockStarts = (0, 4)
+        match.mSbjctBlockStarts = [20, 29]
+        self.checkBlocks(match)
+        self.assertEqual(list(match.mBlockSizes), [4, 6])
+
+    def testSwitchTargetStrand(self):
+        match = Blat.parseLines(
+            ["10\t0\t0\t0\t0\t0\t1\t5\t+\tq\t10\t0\t10\tt\t100\t20\t35\t2"
+             "\t4,6,\t0,4,\t20,29,\n"])[0]
+        match.switchTargetStrand()
+        self.checkBlocks(match)
+        self.assertEqual(list(match.mBlockSizes), [6, 4])
+        self.assertEqual(list(match.mSbjctBlockStarts), [65, 76])
+
+
+class InvalidNumberCheck(unittest.TestCase):
+
+    valid = ("10\t0\t0\t0\t0\t0\t1\t5\t+\tq\t10\t0\t10\tt\t100\t20\t35"
+             "\t2\t4,6,\t0,4,\t20,29,\n")
+
+    def buildLine(self, field, value):
+        data = self.valid[:-1].split("\t")
+        data[field] = value
+        return "\t".join(data) + "\n"
+
+    def checkInvalid(self, factory):
+        for field in (0, 10, 17):
+            for value in ("1x0", "abc", ""):
+                line = self.buildLine(field, value)
+                self.assertRaises(Blat.ParsingError,
+                                  Blat.parseLines, [line], factory)
+
+    def testPython(self):
+        self.checkInvalid(PythonMatch)
+
+    @unittest.skipIf(Blat.cblat is None, "cblat is not compiled")
+    def testCompiled(self):
+        self.checkInvalid(Blat.Match)
+
+    def testIterator(self):
+        lines = [self.valid, self.buildLine(1, "1x0"), self.valid]
+        matches = Blat.iterator(iter(lines))
+        self.assertEqual(str(matches.next()) + "\n", self.valid)
+        self.assertRaises(Blat.ParsingError, matches.next)
+
+
+class ComponentsCheck(unittest.TestCase):
+
+    lines = ("10\t0\t0\t0\t0\t0\t1\t5\t+\tq\t10\t0\t10\tt\t1000\t20\t35"
+             "\t2\t4,6,\t0,4,\t20,29,\n",
+             "10\t0\t0\t0\t0\t0\t0\t0\t+\tq\t10\t0\t10\tt\t1000\t100"
+             "\t110\t0\t,\t,\t,\n",
+             "10\t0\t0\t0\t0\t0\t0\t0\t+\tq\t10\t0\t10\tt\t1000\t500"
+             "\t510\t0\t,\t,\t,\n")
+
+    def testWithoutBlocks(self):
+        matches = Blat.parseLines(self.lines, factory=PythonMatch)
+        self.assertEqual(matches[1].mNBlocks, 0)
+        # matches are too far apart to require an alignment
+        for match in matches:
+            match.mMapTarget2Query = None
+        components = Blat.getComponents(matches)
+        self.assertEqual(sorted(map(sorted, components)),
+                         [[0], [1], [2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
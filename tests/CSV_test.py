@@ -0,0 +1,99 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the chunked table reader in CSV.py."""
+
+import unittest
+import numpy
+
+import CGAT.CSV as CSV
+
+
+class ChunkedTableCheck(unittest.TestCase):
+
+    lines = ["# comment\n",
+             "gene\tcount\tscore\n",
+             "a\t1\t0.5\n",
+             "b\t2\tna\n",
+             "c\t3\t1e-3\n",
+             "a\t4\t2\n",
+             "d\t5\tnan\n"]
+
+    def testChunkSizeInvariance(self):
+        fields, rows = CSV.ReadTable(self.lines)
+        for chunk_size in (1, 2, 3, 100):
+            f, chunks = CSV.iterateTableChunks(iter(self.lines),
+                                               chunk_size=chunk_size)
+            self.assertEqual(f, fields)
+            chunks = list(chunks)
+            self.assertTrue(max(map(len, chunks)) <= chunk_size)
+            self.assertEqual(sum(chunks, []), rows)
+
+    def testIncompleteRows(self):
+        lines = self.lines + ["e\t6\n"]
+        self.assertRaises(ValueError, CSV.ReadTable, lines)
+        fields, rows = CSV.ReadTable(lines, ignore_incomplete=True)
+        self.assertEqual(len(rows), 5)
+        fields, chunks = CSV.iterateTableChunks(iter(lines),
+                                                pad_incomplete=True)
+        self.assertEqual(list(chunks)[-1][-1], ["e", "6", ""])
+
+    def testTypeInference(self):
+        for chunk_size in (1, 2, 100):
+            fields, columns = CSV.readTypedTable(iter(self.lines),
+                                                 chunk_size=chunk_size)
+            self.assertEqual(fields, ["gene", "count", "score"])
+            self.assertEqual(columns[0].values.tolist(),
+                             ["a", "b", "c", "a", "d"])
+            self.assertEqual(columns[1].values.tolist(), [1, 2, 3, 4, 5])
+            score = columns[2]
+            self.assertEqual(score.valid.tolist(),
+                             [True, False, True, True, True])
+            self.assertEqual(score.tolist(),
+                             ["0.5", "na", "0.001", "2.0", "nan"])
+
+    def testGroupNumeric(self):
+        fields, columns = CSV.readTypedTable(iter(self.lines))
+        keys, grouped = CSV.groupColumns(columns[0].values,
+                                         columns[1:2],
+                                         "sum")
+        self.assertEqual(keys, ["a", "b", "c", "d"])
+        self.assertEqual(grouped[0].tolist(), ["5.0", "2.0", "3.0", "5.0"])
+
+        keys, grouped = CSV.groupColumns(columns[0].values,
+                                         columns[2:3],
+                                         "max")
+        # b has no number, nan counts as missing
+        self.assertEqual(grouped[0].tolist(), ["2.0", "na", "0.001", "na"])
+
+    def testGroupFunction(self):
+        fields, columns = CSV.readTypedTable(iter(self.lines),
+                                             dtype=str)
+        keys, grouped = CSV.groupColumns(columns[0].values,
+                                         columns[1:],
+                                         lambda x: ";".join(x))
+        self.assertEqual(grouped[0], ["1;4", "2", "3", "5"])
+        self.assertEqual(grouped[1], ["0.5;2", "na", "1e-3", "nan"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the Chain.py module.
+
+The tests use two hand-written chains on chr1:
+
+1. chrA, positive strand: blocks 100-130, 140-160 and 160-200 map
+   to 0-30, 30-50 and 60-100.
+2. chrB, negative strand: block 300-350 maps to 10-60 on the
+   reverse strand of chrB (length 200), i.e. 140-190 on the forward
+   strand.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy
+import CGAT.Chain as Chain
+
+CHAINS = """chain 1000 chr1 1000 + 100 200 chrA 500 + 0 100 1
+30 10 0
+20 0 10
+40
+
+chain 500 chr1 1000 + 300 350 chrB 200 - 10 60 2
+50
+
+"""
+
+
+class ChainCheck(unittest.TestCase):
+    '''base class for tests on an index of :data:`CHAINS`.'''
+
+    def setUp(self):
+        self.index = Chain.ChainIndex()
+        self.index.read(CHAINS.splitlines(True))
+
+    def checkEqual(self, index):
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.getNumBlocks(), 4)
+        self.assertEqual(index.target_contigs, ["chr1"])
+        self.assertEqual(index.query_contigs, ["chrA", "chrB"])
+        self.assertEqual(index.query_sizes, [500, 200])
+        self.assertEqual(
+            index.mapInterval("chr1", 90, 400),
+            [("chrA", 0, 30, "+"), ("chrA", 30, 50, "+"),
+             ("chrA", 60, 100, "+"), ("chrB", 140, 190, "-")])
+
+
+class ChainIndexCheck(ChainCheck):
+
+    def testRead(self):
+        self.checkEqual(self.index)
+
+    def testGetChain(self):
+        header, tstart, qstart, size = self.index.getChain(0)
+        self.assertEqual(header.query_contig, "chrA")
+        self.assertEqual(header.chain_id, 1)
+        self.assertEqual(list(tstart), [100, 140, 160])
+        self.assertEqual(list(qstart), [0, 30, 60])
+        self.assertEqual(list(size), [30, 20, 40])
+
+        header, tstart, qstart, size = self.index.getChain(1)
+        self.assertEqual(header.query_strand, "-")
+        self.assertEqual((header.query_start, header.query_end), (10, 60))
+
+    def testMapPoints(self):
+        positions = [99, 100, 129, 130, 135, 140, 159, 160, 199, 200,
+                     300, 349, 350]
+        chains, query_ids, query_positions, strands = \
+            self.index.mapPoints("chr1", positions)
+        self.assertEqual(list(chains),
+                         [-1, 0, 0, -1, -1, 0, 0, 0, 0, -1, 1, 1, -1])
+        self.assertEqual(list(query_ids),
+                         [-1, 0, 0, -1, -1, 0, 0, 0, 0, -1, 1, 1, -1])
+        self.assertEqual(list(query_positions),
+                         [-1, 0, 29, -1, -1, 30, 49, 60, 99, -1,
+                          189, 140, -1])
+        self.assertEqual(list(strands),
+                         [0, 1, 1, 0, 0, 1, 1, 1, 1, 0, -1, -1, 0])
+
+    def testMapPoint(self):
+        self.assertEqual(self.index.mapPoint("chr1", 145), ("chrA", 35, "+"))
+        self.assertEqual(self.index.mapPoint("chr1", 300), ("chrB", 189, "-"))
+        self.assertEqual(self.index.mapPoint("chr1", 250), None)
+        self.assertEqual(self.index.mapPoint("chr2", 145), None)
+
+    def testMapIntervals(self):
+        (intervals, chains, segment_start, segment_end,
+         query_ids, qs, qe, strands) = self.index.mapIntervals(
+            "chr1", [90, 300, 500, 130], [150, 310, 600, 140])
+        self.assertEqual(list(intervals), [0, 0, 1])
+        self.assertEqual(list(chains), [0, 0, 1])
+        self.assertEqual(list(segment_start), [100, 140, 300])
+        self.assertEqual(list(segment_end), [130, 150, 310])
+        self.assertEqual(list(query_ids), [0, 0, 1])
+        self.assertEqual(list(qs), [0, 30, 180])
+        self.assertEqual(list(qe), [30, 40, 190])
+        self.assertEqual(list(strands), [1, 1, -1])
+
+    def testMapIntervalsUnknownContig(self):
+        result = self.index.mapIntervals("chr2", [0, 100], [100, 200])
+        for x in result:
+            self.assertEqual(len(x), 0)
+
+    def testNegativeStrand(self):
+        # every base of the reverse strand chain maps to the
+        # reverse complement position
+        positions = numpy.arange(300, 350)
+        chains, query_ids, query_positions, strands = \
+            self.index.mapPoints("chr1", positions)
+        self.assertEqual(list(query_positions), range(189, 139, -1))
+        self.assertEqual(self.index.mapInterval("chr1", 340, 360),
+                         [("chrB", 140, 150, "-")])
+
+
+class ChainCacheCheck(ChainCheck):
+
+    def setUp(self):
+        ChainCheck.setUp(self)
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "test.over.chain")
+        with open(self.filename, "w") as outf:
+            outf.write(CHAINS)
+        self.cache = self.filename + ".index.npz"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testSaveLoad(self):
+        filename = os.path.join(self.tmpdir, "saved.npz")
+        self.index.save(filename)
+        index = Chain.ChainIndex()
+        index.load(filename)
+        self.checkEqual(index)
+
+    def testNoCache(self):
+        self.checkEqual(Chain.loadChainIndex(self.filename, use_cache=False))
+        self.assertFalse(os.path.exists(self.cache))
+
+    def testCache(self):
+        self.checkEqual(Chain.loadChainIndex(self.filename))
+        self.assertTrue(os.path.exists(self.cache))
+
+        # a chain file older than the cache is not read again
+        with open(self.filename, "w") as outf:
+            outf.write("")
+        past = time.time() - 60
+        os.utime(self.filename, (past, past))
+        self.checkEqual(Chain.loadChainIndex(self.filename))
+
+    def testOutdatedCache(self):
+        Chain.loadChainIndex(self.filename)
+        # a chain file newer than the cache is read again
+        with open(self.filename, "w") as outf:
+            outf.write(CHAINS.split("\n\n")[0] + "\n")
+        future = time.time() + 60
+        os.utime(self.filename, (future, future))
+        index = Chain.loadChainIndex(self.filename)
+        self.assertEqual(len(index), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the Components extension.
+
+Components from :class:`Components.ArrayComponents` are compared
+against :class:`Components.IComponents`.
+"""
+
+import random
+import StringIO
+import unittest
+import numpy
+import CGAT.Components as Components
+
+
+def getPartition(components):
+    return sorted([sorted(x) for x in components])
+
+
+class ArrayComponentsCheck(unittest.TestCase):
+
+    nvertices = 200
+    nedges = 150
+
+    def setUp(self):
+        random.seed(1)
+        self.sources = numpy.array([random.randint(0, self.nvertices - 1)
+                                    for x in range(self.nedges)])
+        self.targets = numpy.array([random.randint(0, self.nvertices - 1)
+                                    for x in range(self.nedges)])
+
+        self.expected = Components.IComponents()
+        self.njoins = 0
+        for x in range(self.nvertices):
+            self.expected.add(x, x)
+        for a, b in zip(self.sources, self.targets):
+            self.njoins += self.expected.add(int(a), int(b))
+
+    def checkComponents(self, components):
+        self.assertEqual(components.getNumNodes(), self.nvertices)
+        self.assertEqual(getPartition(components.getComponents()),
+                         getPartition(self.expected.getComponents()))
+        self.assertEqual(components.getNumComponents(),
+                         len(self.expected.getComponents()))
+
+    def testAddEdges(self):
+        components = Components.ArrayComponents(self.nvertices)
+        self.assertEqual(components.addEdges(self.sources, self.targets),
+                         self.njoins)
+        self.checkComponents(components)
+
+    def testIncremental(self):
+        components = Components.ArrayComponents()
+        for start in range(0, self.nedges, 7):
+            components.addEdges(self.sources[start:start + 7],
+                                self.targets[start:start + 7])
+        components.resize(self.nvertices)
+        self.checkComponents(components)
+
+    def testLabels(self):
+        components = Components.ArrayComponents(self.nvertices)
+        components.addEdges(self.sources, self.targets)
+        labels = components.getLabels()
+        for a, b in zip(self.sources, self.targets):
+            self.assertEqual(labels[a], labels[b])
+        # components are numbered in order of their first vertex
+        first = [numpy.flatnonzero(labels == x)[0]
+                 for x in range(components.getNumComponents())]
+        self.assertEqual(first, sorted(first))
+
+    def testReadComponents(self):
+        infile = StringIO.StringIO(
+            "#comment\n" +
+            "".join(["v%i\tv%i\t1\n" % x
+                     for x in zip(self.sources, self.targets)]))
+        tokens, components = Components.readComponents(infile,
+                                                        chunk_size=11)
+        result = [sorted([int(tokens[y][1:]) for y in x])
+                  for x in components.getComponents()]
+        expected = [x for x in self.expected.getComponents()
+                    if len(x) > 1 or x[0] in self.sources
+                    or x[0] in self.targets]
+        self.assertEqual(sorted(result), getPartition(expected))
+
+    def testInvalid(self):
+        components = Components.ArrayComponents()
+        self.assertRaises(ValueError, components.addEdges, [0, 1], [1])
+        self.assertRaises(ValueError, components.addEdges, [-1], [1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the Counts.py module.
+
+Spike-in clusters are checked against means computed with pandas.
+"""
+
+import unittest
+import numpy as np
+import pandas as pd
+import CGAT.Counts as Counts
+
+
+class ShuffleClusterCheck(unittest.TestCase):
+
+    tracks_map = {"A": ["a1", "a2"], "B": ["b1", "b2"]}
+    groups = ["A", "B"]
+    i_bins = np.arange(0, 100, 10)
+    c_bins = np.arange(-50, 50, 10)
+
+    def setUp(self):
+        np.random.seed(1)
+        nrows = 1000
+        self.df = pd.DataFrame(
+            {"contig": ["chr1"] * nrows,
+             "position": np.cumsum(np.random.randint(1, 60, nrows))})
+        for track in ("a1", "a2", "b1", "b2"):
+            self.df[track] = np.random.uniform(0, 100, nrows)
+        self.clusters = Counts.findClusters(
+            self.df, 100, 5, self.tracks_map, self.groups)
+
+    def shuffle(self, **kwargs):
+        return Counts.shuffleCluster(
+            self.i_bins, self.c_bins, self.tracks_map, self.groups,
+            "relative", 3, 4, self.clusters, 4, 1, 1, seed=1, **kwargs)
+
+    def testSpikes(self):
+        indices, counts = self.shuffle()
+        self.assertTrue(counts.sum() > 0)
+        self.assertTrue(counts.max() <= 3)
+        for key, spikes in indices.items():
+            self.assertEqual(len(spikes), counts[key])
+            for (c1s, c1e, c2s, c2e, s1, e1, s2, e2) in spikes:
+                self.assertTrue(c1s <= s1 and e1 <= c1e)
+                self.assertTrue(c2s <= s2 and e2 <= c2e)
+                self.assertEqual(e1 - s1, key[2])
+                mean1 = self.df.ix[s1:e1, self.tracks_map["A"]].values.mean()
+                mean2 = self.df.ix[s2:e2, self.tracks_map["B"]].values.mean()
+                change_idx, initial_idx = Counts.means2idxarrays(
+                    [mean1], [mean2], self.i_bins, self.c_bins, "relative")
+                self.assertEqual((initial_idx[0], change_idx[0]), key[:2])
+
+    def testThreads(self):
+        indices1, counts1 = self.shuffle()
+        indices2, counts2 = self.shuffle(num_threads=2)
+        self.assertEqual(indices1, indices2)
+        self.assertTrue(np.all(counts1 == counts2))
+
+if __name__ == "__main__":
+    unittest.main()
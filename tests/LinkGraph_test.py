@@ -0,0 +1,150 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the LinkGraph.py module.
+
+Graphs are compared against dictionaries of lists of links.
+"""
+
+import os
+import random
+import shutil
+import StringIO
+import tempfile
+import unittest
+import numpy
+import CGAT.LinkGraph as LinkGraph
+
+
+def buildLinks(nvertices, nlinks, seed=1):
+    '''return a link table as text and as a list of tuples.'''
+    random.seed(seed)
+    links = [("v%i" % random.randint(0, nvertices),
+              "v%i" % random.randint(0, nvertices),
+              float(random.randint(0, 10)))
+             for x in range(nlinks)]
+    text = "#comment\ntoken1\ttoken2\tweight\n" + \
+        "".join(["%s\t%s\t%s\n" % x for x in links])
+    return text, links
+
+
+class LinkGraphCheck(unittest.TestCase):
+
+    nvertices = 20
+    nlinks = 100
+
+    def setUp(self):
+        self.text, self.links = buildLinks(self.nvertices, self.nlinks)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def readGraph(self, **kwargs):
+        return LinkGraph.readLinkGraph(StringIO.StringIO(self.text),
+                                       **kwargs)
+
+    def getExpected(self, symmetric=False):
+        expected = {}
+        for v1, v2, w in self.links:
+            expected.setdefault(v1, []).append((v2, w))
+            if symmetric:
+                expected.setdefault(v2, []).append((v1, w))
+        return expected
+
+    def checkGraph(self, graph, expected):
+        self.assertEqual(graph.getNumLinks(),
+                         sum([len(x) for x in expected.values()]))
+        for token, links in expected.items():
+            targets, weights = graph.getLinks(token)
+            self.assertEqual(
+                sorted(links),
+                sorted(zip(graph.tokens.decode(targets), weights[:, 0])))
+
+    def testRead(self):
+        tokens, sources, targets, weights = LinkGraph.readLinks(
+            StringIO.StringIO(self.text), chunk_size=7)
+        self.assertEqual(self.links,
+                         zip(tokens.decode(sources),
+                             tokens.decode(targets),
+                             weights[:, 0]))
+
+    def testBuild(self):
+        self.checkGraph(self.readGraph(), self.getExpected())
+
+    def testSymmetric(self):
+        self.checkGraph(self.readGraph(symmetric=True),
+                        self.getExpected(symmetric=True))
+
+    def testHasLinks(self):
+        graph = self.readGraph().sortLinks()
+        expected = set([(x[0], x[1]) for x in self.links])
+        tokens = graph.tokens
+        sources, targets = zip(*[(x, y) for x in range(len(tokens))
+                                 for y in range(len(tokens))])
+        result = graph.hasLinks(sources, targets)
+        for x, y, r in zip(sources, targets, result):
+            self.assertEqual((tokens[x], tokens[y]) in expected, r)
+
+    def testRemoveDuplicates(self):
+        graph = self.readGraph().sortLinks().removeDuplicates()
+        expected = dict([(x, list(set(y)))
+                         for x, y in self.getExpected().items()])
+        self.checkGraph(graph, expected)
+
+    def testPaths(self):
+        graph = self.readGraph(symmetric=True)
+        first, second = graph.getPaths()
+        sources = graph.getSources()
+        self.assertTrue(numpy.all(sources[first] == sources[second]))
+        self.assertEqual(len(first),
+                         numpy.sum(graph.getDegrees() ** 2))
+
+    def testSaveLoad(self):
+        graph = self.readGraph()
+        prefix = os.path.join(self.tmpdir, "graph")
+        graph.save(prefix)
+        loaded = LinkGraph.loadLinkGraph(prefix)
+        self.assertEqual(graph.tokens.tokens, loaded.tokens.tokens)
+        self.assertTrue(numpy.all(graph.offsets == loaded.offsets))
+        self.checkGraph(loaded, self.getExpected())
+
+    def testCombineLinks(self):
+        links = sorted(self.links)
+        tokens = LinkGraph.Tokens()
+        sources = numpy.array([tokens.encode(x[0]) for x in links])
+        targets = numpy.array([tokens.encode(x[1]) for x in links])
+        weights = numpy.array([x[2] for x in links])
+        result = LinkGraph.combineLinks(sources, targets, weights)
+
+        expected = {}
+        for v1, v2, w in links:
+            expected.setdefault((v1, v2), []).append(w)
+
+        self.assertEqual(len(expected), len(result[0]))
+        for v1, v2, mmin, mmax, n, total in zip(*result):
+            w = expected[(tokens[v1], tokens[v2])]
+            self.assertEqual((min(w), max(w), len(w), sum(w)),
+                             (mmin, mmax, n, total))
+
+if __name__ == "__main__":
+    unittest.main()
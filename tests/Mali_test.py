@@ -0,0 +1,215 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the Mali.py class.
+
+Column operations of the string backend (:class:`Mali.Mali`) and
+the array backend (:class:`Mali.MaliArray`) are applied to a small
+alignment with known results.
+
+To benchmark both backends on the operations used by mali2mali.py,
+type::
+
+   python tests/Mali_test.py --benchmark
+"""
+
+import sys
+import time
+import random
+import string
+import unittest
+import CGAT.Mali as Mali
+
+# operations used by mali2mali.py
+OPERATIONS = (
+    ("remove-all-gaps",
+     lambda mali: mali.removeGaps(minimum_gaps=len(mali))),
+    ("remove-any-gaps",
+     lambda mali: mali.removeGaps(minimum_gaps=1)),
+    ("remove-some-gaps",
+     lambda mali: mali.removeGaps(minimum_gaps=3)),
+    ("remove-some-gaps-codons",
+     lambda mali: mali.removeGaps(minimum_gaps=3, frame=3)),
+    ("remove-stops",
+     lambda mali: mali.removePattern(
+         lambda x: x.upper() in ("TAG", "TAA", "TGA"),
+         allowed_matches=0,
+         minimum_matches=1,
+         delete_frame=3,
+         search_frame=3)),
+    ("mark-codons",
+     lambda mali: mali.markCodons()),
+    ("propagate-masks",
+     lambda mali: mali.propagateMasks(mask_char="x")),
+    ("propagate-transitions",
+     lambda mali: mali.propagateTransitions()),
+    ("mask-columns",
+     lambda mali: mali.maskColumns(range(0, mali.getNumColumns(), 7))),
+    ("filter-3rd",
+     lambda mali: mali.takeColumns(range(2, mali.getNumColumns(), 3))),
+)
+
+
+# four codon sequences with gaps, lower case and masked residues
+# and stop codons (TGA and TAG)
+ALIGNMENT = (("seq1", "ATGTGATAGGTx"),
+             ("seq2", "ATGC-A-.Ggtc"),
+             ("seq3", "ATGCCAT-GGTC"),
+             ("seq4", "ATaCCATAGG-C"))
+
+
+def buildMali(mali, alignment=ALIGNMENT):
+    '''fill *mali* with *alignment*.'''
+    for identifier, sequence in alignment:
+        mali.addSequence(identifier, 0, -1, sequence)
+    return mali
+
+
+def buildRandomMali(mali, nsequences, ncolumns, seed=1):
+    '''fill *mali* with a random alignment for benchmarking.'''
+    random.seed(seed)
+    alphabet = "ACGTACGTACGTacgtx--."
+    for x in range(nsequences):
+        mali.addSequence(
+            "seq%i" % x, 0, -1,
+            "".join([random.choice(alphabet) for y in range(ncolumns)]))
+    return mali
+
+
+def getRows(mali):
+    return [mali[x] for x in mali.getIdentifiers()]
+
+
+class MaliCheck(unittest.TestCase):
+
+    '''test column operations on :data:`ALIGNMENT`.'''
+
+    backend = Mali.Mali
+
+    def check(self, f, expected):
+        mali = buildMali(self.backend())
+        f(mali)
+        self.assertEqual(getRows(mali), expected)
+
+    def testRemoveAllGaps(self):
+        self.check(lambda mali: mali.removeGaps(minimum_gaps=len(mali)),
+                   [x[1] for x in ALIGNMENT])
+
+    def testRemoveAnyGaps(self):
+        self.check(lambda mali: mali.removeGaps(minimum_gaps=1),
+                   ["ATGTAGGx", "ATGCAGgc", "ATGCAGGC", "ATaCAGGC"])
+
+    def testRemoveSomeGaps(self):
+        self.check(lambda mali: mali.removeGaps(minimum_gaps=2),
+                   ["ATGTGATGGTx", "ATGC-A-Ggtc",
+                    "ATGCCATGGTC", "ATaCCATGG-C"])
+
+    def testRemoveSomeGapsCodons(self):
+        self.check(lambda mali: mali.removeGaps(minimum_gaps=2, frame=3),
+                   ["ATGTGAGTx", "ATGC-Agtc", "ATGCCAGTC", "ATaCCAG-C"])
+
+    def testRemoveStops(self):
+        self.check(lambda mali: mali.removePattern(
+            lambda x: x.upper() in ("TAG", "TAA", "TGA"),
+            allowed_matches=0,
+            minimum_matches=1,
+            delete_frame=3,
+            search_frame=3),
+            ["ATGGTx", "ATGgtc", "ATGGTC", "ATaG-C"])
+
+    def testMarkCodons(self):
+        self.check(lambda mali: mali.markCodons(),
+                   ["ATGtgaTAGgtx", "ATGc-a-.Ggtc",
+                    "ATGccaT-Ggtc", "ATAccaTAGg-c"])
+
+    def testPropagateMasks(self):
+        self.check(lambda mali: mali.propagateMasks(mask_char="x"),
+                   ["ATGTGATAGGTx", "ATGC-A-.Ggtx",
+                    "ATGCCAT-GGTx", "ATaCCATAGG-x"])
+
+    def testPropagateTransitions(self):
+        self.check(lambda mali: mali.propagateTransitions(),
+                   ["ATgTGATAGgtx", "ATgC-A-.Ggtc",
+                    "ATgCCAT-Ggtc", "ATaCCATAGg-c"])
+
+    def testMaskColumns(self):
+        self.check(lambda mali: mali.maskColumns([0, 4, 7]),
+                   ["xTGTxATxGGTx", "xTGC-A-.Ggtc",
+                    "xTGCxAT-GGTC", "xTaCxATxGG-C"])
+
+    def testTakeColumns(self):
+        self.check(lambda mali: mali.takeColumns([2, 5, 8, 11]),
+                   ["GAGx", "GAGc", "GAGC", "aAGC"])
+
+    def testMapColumns(self):
+        self.check(lambda mali: mali.mapColumns([0, 4, 6], string.lower),
+                   ["aTGTgAtAGGTx", "aTGC-A-.Ggtc",
+                    "aTGCcAt-GGTC", "aTaCcAtAGG-C"])
+
+    def testShuffle(self):
+        random.seed(2)
+        self.check(lambda mali: mali.shuffle(frame=3),
+                   ["TGAATGTAGGTx", "C-AATG-.Ggtc",
+                    "CCAATGT-GGTC", "CCAATaTAGG-C"])
+
+    def testGetColumns(self):
+        mali = buildMali(self.backend())
+        self.assertEqual(mali.getColumns(),
+                         ["AAAA", "TTTT", "GGGa", "TCCC", "G-CC", "AAAA",
+                          "T-TT", "A.-A", "GGGG", "GgGG", "TtT-", "xcCC"])
+
+    def testConsensus(self):
+        mali = buildMali(self.backend())
+        self.assertEqual(mali.getConsensus(), "ATGCCATAGGTC")
+        self.assertEqual(mali.getConsensus(mark_with_gaps=True),
+                         "ATGC-A--GG-C")
+
+
+class MaliArrayCheck(MaliCheck):
+
+    backend = Mali.MaliArray
+
+    def testMarkCodonsRaisesError(self):
+        mali = buildMali(self.backend())
+        mali.takeColumns(range(10))
+        self.assertRaises(ValueError, mali.markCodons)
+
+
+def benchmark(nsequences=1000, ncolumns=9999, outfile=sys.stdout):
+    '''time operations for string and array backends.'''
+
+    outfile.write("operation\tstring\tarray\n")
+    for name, f in OPERATIONS:
+        times = []
+        for cls in (Mali.Mali, Mali.MaliArray):
+            mali = buildRandomMali(cls(), nsequences, ncolumns)
+            t = time.time()
+            f(mali)
+            times.append(time.time() - t)
+        outfile.write("%s\t%s\n" % (name,
+                                    "\t".join(["%.3f" % x for x in times])))
+
+if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        benchmark()
+    else:
+        unittest.main()
@@ -21,9 +21,43 @@
 ##########################################################################
 """unit testing module for the Tree.py class."""
 
+import os
+import collections
 import CGAT.Masker as Masker
+import CGAT.FastaIterator as FastaIterator
 import unittest
 
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+def readIntervals(filename):
+    '''return intervals in *filename* by sequence identifier.'''
+    intervals = collections.defaultdict(list)
+    with open(filename) as inf:
+        inf.readline()
+        for line in inf:
+            identifier, start, end = line[:-1].split("\t")
+            intervals[identifier].append((int(start), int(end)))
+    return intervals
+
+
+class ApplyMaskIntervalsCheck(unittest.TestCase):
+
+    def testSoftMask(self):
+        """test soft masking of intervals."""
+        self.assertEqual(Masker.applyMaskIntervals(
+            "ACGTACGT", [(0, 2), (5, 6)]), "acGTAcGT")
+
+    def testHardMask(self):
+        """test hard masking of intervals."""
+        self.assertEqual(Masker.applyMaskIntervals(
+            "ACGTACGT", [(1, 3)], soft_mask=False), "ANNTACGT")
+
+    def testDefaultMethods(self):
+        """test that the external tools are used by default."""
+        self.assertEqual(Masker.MaskerSeg().method, "external")
+        self.assertEqual(Masker.MaskerDustMasker().method, "external")
+
 
 class SegCheck(unittest.TestCase):
 
@@ -54,8 +88,100 @@ class SegCheck(unittest.TestCase):
             "gttcggccacatcaagctg")
 
 
+class SegNativeCheck(SegCheck):
+
+    mMasker = Masker.MaskerSeg(method="native")
+
+    def testBatch(self):
+        """test batch masking."""
+        self.assertEqual(self.mMasker.maskSequences(
+            ["ACDEFGHIKLWWWWWWWWWWWWWWwwwwwwwwwwwacdefghikl"] * 2,
+            num_threads=2),
+            ["ACDEFGHIKLwwwwwwwwwwwwwwwwwwwwwwwwwACDEFGHIKL"] * 2)
+
+
 class DustMaskerCheck(unittest.TestCase):
     mMasker = Masker.MaskerDustMasker()
 
+
+class DustNativeCheck(unittest.TestCase):
+
+    mMasker = Masker.MaskerDustMasker(method="native")
+
+    def testEmpty(self):
+        """test empty input."""
+        self.assertEqual(self.mMasker(""), "")
+
+    def testNucleotide(self):
+        """test nucleotide input."""
+        self.assertEqual(self.mMasker(
+            "TTAGTTGTGCCGCAGCGAAGTAGTGCTTGAAATATGCGAC"
+            "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+            "CCCTAAGTAGGAGCGTATGCGCCCAGTAACCAATGCCTGT"),
+            "TTAGTTGTGCCGCAGCGAAGTAGTGCTTGAAATATGCGAC"
+            "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"
+            "CCCTAAGTAGGAGCGTATGCGCCCAGTAACCAATGCCTGT")
+
+    def testIntervals(self):
+        """test that N breaks low complexity regions."""
+        self.assertEqual(Masker.dust("A" * 100), [(0, 100)])
+        self.assertEqual(Masker.dust("A" * 50 + "N" + "A" * 50),
+                         [(0, 50), (51, 101)])
+
+    def testMaskSequences(self):
+        """test hard masking with dust-native."""
+        self.assertEqual(
+            Masker.maskSequences(["ACGTGCATTGAC" + "t" * 80],
+                                 "dust-native"),
+            ["ACGTGCATTGAC" + "N" * 80])
+
+
+class DustReferenceCheck(unittest.TestCase):
+
+    '''compare native DUST against reference intervals.
+
+    The reference intervals were computed with the SDUST
+    implementation in pydustmasker 3.3.0 (window 64, level 20),
+    an independent implementation of the symmetric DUST
+    algorithm.
+    '''
+
+    def checkReference(self, fasta_file, reference_file):
+        reference = readIntervals(reference_file)
+        with open(fasta_file) as inf:
+            sequences = list(FastaIterator.iterate(inf))
+        self.assertTrue(len(sequences) > 0)
+        for entry in sequences:
+            self.assertEqual(Masker.dust(entry.sequence),
+                             reference[entry.title],
+                             "mismatch in %s" % entry.title)
+
+    def testSequences(self):
+        """test sequences with repeats and unknown bases."""
+        self.checkReference(
+            os.path.join(DATA_DIR, "lowcomplexity.fasta"),
+            os.path.join(DATA_DIR, "lowcomplexity.dust.tsv"))
+
+    def testGenome(self):
+        """test yeast chromosome I."""
+        self.checkReference(
+            os.path.join(os.path.dirname(__file__),
+                         "index_fasta.py", "chrI.fa"),
+            os.path.join(DATA_DIR, "chrI.dust.tsv"))
+
+
+@unittest.skipIf(Masker.cmasker is None, "cmasker is not compiled")
+class DustReferencePythonCheck(DustReferenceCheck):
+
+    '''compare the python implementation of DUST against
+    reference intervals.'''
+
+    def setUp(self):
+        self.cmasker = Masker.cmasker
+        Masker.cmasker = None
+
+    def tearDown(self):
+        Masker.cmasker = self.cmasker
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,304 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the PairwiseDistances.py module.
+
+Counts are compared against the per-pair functions in
+:mod:`Genomics`. Distances are compared against per-pair
+implementations of the formulas on a nucleotide alignment.
+"""
+
+import os
+import math
+import random
+import unittest
+import numpy
+import CGAT.Genomics as Genomics
+import CGAT.PairwiseDistances as PairwiseDistances
+
+
+def readAlignment():
+    '''return sequences of the nucleotide alignment used for
+    mali2rates.py.'''
+    sequences = []
+    for line in open(os.path.join(os.path.dirname(__file__),
+                                  "mali2rates.py", "mali.fasta")):
+        if not line.startswith(">"):
+            sequences.append(line[:-1])
+    return sequences
+
+
+def distanceJC69(info):
+    '''return Jukes-Cantor distance and variance.'''
+    p = float(info.mNDifferent) / info.mNAligned
+    distance = -0.75 * math.log(1.0 - 4.0 * p / 3.0)
+    variance = p * (1.0 - p) / \
+        (math.pow(1.0 - 4.0 * p / 3, 2.0) * info.mNAligned)
+    return distance, variance
+
+
+def distanceT92(info):
+    '''return Tamura (1992) distance and variance.'''
+    gc = info.getGCContent()
+    wg = 2.0 * gc * (1.0 - gc)
+    P = float(info.mNTransitions) / info.mNAligned
+    Q = float(info.mNTransversions) / info.mNAligned
+    a1 = 1.0 - P / wg - Q
+    a2 = 1.0 - 2.0 * Q
+    distance = -wg * math.log(a1) - 0.5 * (1.0 - wg) * math.log(a2)
+    c1 = 1 / a1
+    c2 = 1 / a2
+    c3 = wg * (c1 - c2) + c2
+    variance = (c1 * c1 * P + c3 * c3 * Q -
+                math.pow(c1 * P + c3 * Q, 2.0)) / info.mNAligned
+    return distance, variance
+
+
+def distanceK80(info):
+    '''return Kimura (1980) distance and variance.'''
+    P = float(info.mNTransitions) / info.mNAligned
+    Q = float(info.mNTransversions) / info.mNAligned
+    a1 = 1.0 / (1.0 - 2.0 * P - Q)
+    a2 = 1.0 / (1.0 - 2.0 * Q)
+    a3 = (a1 + a2) / 2.0
+    distance = 0.5 * math.log(a1) + 0.25 * math.log(a2)
+    variance = (a1 * a1 * P + a3 * a3 * Q -
+                math.pow(a1 * P + a3 * Q, 2.0)) / info.mNAligned
+    return distance, variance
+
+
+def distanceTN93(seq1, seq2):
+    '''return Tamura and Nei (1993) distance computed from the
+    aligned nucleotides of *seq1* and *seq2*.'''
+    aligned = [(x, y) for x, y in zip(seq1, seq2)
+               if x in "ACGT" and y in "ACGT"]
+    n = float(len(aligned))
+    freqs = {}
+    for c in "ACGT":
+        freqs[c] = sum([(x == c) + (y == c) for x, y in aligned]) / (2 * n)
+    fr = freqs["A"] + freqs["G"]
+    fy = freqs["C"] + freqs["T"]
+    P1 = len([1 for x, y in aligned if set((x, y)) == set("AG")]) / n
+    P2 = len([1 for x, y in aligned if set((x, y)) == set("CT")]) / n
+    Q = len([1 for x, y in aligned
+             if (x in "AG") != (y in "AG")]) / n
+    k1 = 2.0 * freqs["A"] * freqs["G"] / fr
+    k2 = 2.0 * freqs["C"] * freqs["T"] / fy
+    k3 = 2.0 * (fr * fy - freqs["A"] * freqs["G"] * fy / fr -
+                freqs["C"] * freqs["T"] * fr / fy)
+    return -k1 * math.log(1.0 - P1 / k1 - Q / (2.0 * fr)) - \
+        k2 * math.log(1.0 - P2 / k2 - Q / (2.0 * fy)) - \
+        k3 * math.log(1.0 - Q / (2.0 * fr * fy))
+
+
+def distanceLogDet(seq1, seq2):
+    '''return the LogDet distance computed from the aligned
+    nucleotides of *seq1* and *seq2*.'''
+    aligned = [(x, y) for x, y in zip(seq1, seq2)
+               if x in "ACGT" and y in "ACGT"]
+    F = numpy.zeros((4, 4))
+    for x, y in aligned:
+        F["ACGT".index(x), "ACGT".index(y)] += 1.0 / len(aligned)
+    return -0.25 * (math.log(numpy.linalg.det(F)) -
+                    0.5 * (sum(map(math.log, F.sum(axis=1))) +
+                           sum(map(math.log, F.sum(axis=0)))))
+
+
+def buildSequences(nsequences, ncolumns, seed=1):
+    '''return random sequences derived from a common ancestor.'''
+    random.seed(seed)
+    ancestor = [random.choice("ACGT") for x in range(ncolumns)]
+    sequences = []
+    for x in range(nsequences):
+        rate = random.random() * 0.5
+        sequence = list(ancestor)
+        for y in range(ncolumns):
+            if random.random() < rate:
+                sequence[y] = random.choice("ACGTACGTACGT-.Nacg")
+        sequences.append("".join(sequence))
+    return sequences
+
+
+class PairwiseDistancesCheck(unittest.TestCase):
+
+    nsequences = 20
+    ncolumns = 99
+
+    def setUp(self):
+        self.sequences = buildSequences(self.nsequences, self.ncolumns)
+        self.pairs = [(x, y) for x in range(self.nsequences - 1)
+                      for y in range(x + 1, self.nsequences)]
+
+    def getMatrices(self, **kwargs):
+        return PairwiseDistances.calculatePairs(
+            PairwiseDistances.countSubstitutions,
+            (PairwiseDistances.encodeNucleotides(self.sequences),),
+            self.pairs, **kwargs)
+
+    def testSubstitutions(self):
+        matrices = self.getMatrices()
+        for index, pair in enumerate(self.pairs):
+            x, y = pair
+            info = Genomics.CalculatePairIndices(self.sequences[x],
+                                                 self.sequences[y])
+            self.assertTrue(numpy.all(info.mMatrix == matrices[index]))
+            self.assertEqual(
+                str(info),
+                str(PairwiseDistances.buildPairInfo(matrices[index])))
+
+    def testBlocks(self):
+        self.assertTrue(numpy.all(self.getMatrices() ==
+                                  self.getMatrices(block_size=7)))
+
+    def testSynonymous(self):
+        synonymous = PairwiseDistances.calculatePairs(
+            PairwiseDistances.countSynonymous,
+            (PairwiseDistances.encodeSequences(self.sequences),
+             PairwiseDistances.encodeAminoAcids(self.sequences)),
+            self.pairs)
+        for index, pair in enumerate(self.pairs):
+            x, y = pair
+            info = Genomics.CalculatePairIndices(self.sequences[x],
+                                                 self.sequences[y],
+                                                 with_codons=True)
+            self.assertEqual((info.mNSynonymous, info.mNNonSynonymous),
+                             tuple(synonymous[index]))
+
+    def testDegenerateSites(self):
+        matrices = PairwiseDistances.calculatePairs(
+            PairwiseDistances.countDegenerateSubstitutions,
+            PairwiseDistances.encodeDegenerateSites(self.sequences),
+            self.pairs)
+        for index, pair in enumerate(self.pairs):
+            x, y = pair
+            seq1, seq2 = Genomics.GetDegenerateSites(self.sequences[x],
+                                                     self.sequences[y])
+            info = Genomics.CalculatePairIndices(seq1, seq2)
+            self.assertTrue(numpy.all(info.mMatrix == matrices[index]))
+
+    def testJC69(self):
+        matrices = self.getMatrices()
+        distances, variances = PairwiseDistances.calculateJC69(matrices)
+        for index, pair in enumerate(self.pairs):
+            x, y = pair
+            info = Genomics.CalculatePairIndices(self.sequences[x],
+                                                 self.sequences[y])
+            p = float(info.mNDifferent) / info.mNAligned
+            if p >= 0.75:
+                self.assertTrue(numpy.isnan(distances[index]))
+            else:
+                self.assertAlmostEqual(
+                    -0.75 * math.log(1.0 - 4.0 * p / 3.0),
+                    distances[index])
+
+    def testIdenticalSequences(self):
+        sequences = ["ACGTTGCAAC" * 10] * 2
+        matrices = PairwiseDistances.calculatePairs(
+            PairwiseDistances.countSubstitutions,
+            (PairwiseDistances.encodeNucleotides(sequences),),
+            [(0, 1)])
+        for method in PairwiseDistances.NA_DISTANCES:
+            distances, variances = PairwiseDistances.calculateDistances(
+                matrices, method)
+            self.assertAlmostEqual(distances[0], 0.0)
+
+    def testSequencePairs(self):
+        sequences = ["ACGT", "ACGA", "AC", "AG"]
+        matrices = PairwiseDistances.calculateSequencePairs(
+            PairwiseDistances.countSubstitutions,
+            lambda s: (PairwiseDistances.encodeNucleotides(s),),
+            sequences, [(0, 1), (2, 3)])
+        indices = PairwiseDistances.getPairIndices(matrices)
+        self.assertEqual(list(indices["aligned"]), [4, 2])
+        self.assertEqual(list(indices["identical"]), [3, 1])
+        self.assertRaises(ValueError,
+                          PairwiseDistances.calculateSequencePairs,
+                          PairwiseDistances.countSubstitutions,
+                          lambda s: (PairwiseDistances.encodeNucleotides(s),),
+                          sequences, [(0, 2)])
+
+
+class AlignmentDistancesCheck(unittest.TestCase):
+
+    '''compare distances on a nucleotide alignment against
+    per-pair computations.'''
+
+    def setUp(self):
+        self.sequences = readAlignment()
+        self.pairs = [(x, y) for x in range(len(self.sequences) - 1)
+                      for y in range(x + 1, len(self.sequences))]
+        self.matrices = PairwiseDistances.calculatePairs(
+            PairwiseDistances.countSubstitutions,
+            (PairwiseDistances.encodeNucleotides(self.sequences),),
+            self.pairs, block_size=5)
+
+    def checkInfo(self, method, f):
+        distances, variances = PairwiseDistances.calculateDistances(
+            self.matrices, method)
+        for index, pair in enumerate(self.pairs):
+            x, y = pair
+            info = Genomics.CalculatePairIndices(self.sequences[x],
+                                                 self.sequences[y])
+            distance, variance = f(info)
+            self.assertAlmostEqual(distance, distances[index])
+            self.assertAlmostEqual(variance, variances[index])
+
+    def checkSequences(self, method, f):
+        distances, variances = PairwiseDistances.calculateDistances(
+            self.matrices, method)
+        for index, pair in enumerate(self.pairs):
+            x, y = pair
+            self.assertAlmostEqual(
+                f(self.sequences[x], self.sequences[y]),
+                distances[index])
+
+    def testJC69(self):
+        self.checkInfo("JC69", distanceJC69)
+
+    def testT92(self):
+        self.checkInfo("T92", distanceT92)
+
+    def testK80(self):
+        self.checkInfo("K80", distanceK80)
+
+    def testTN93(self):
+        self.checkSequences("TN93", distanceTN93)
+
+    def testLogDet(self):
+        self.checkSequences("LogDet", distanceLogDet)
+
+    def testFirstPair(self):
+        # counts of the first pair: 357 aligned positions with
+        # 12 transitions and 11 transversions
+        indices = PairwiseDistances.getPairIndices(self.matrices)
+        self.assertEqual((indices["aligned"][0],
+                          indices["transitions"][0],
+                          indices["transversions"][0]),
+                         (357, 12, 11))
+        distances, variances = PairwiseDistances.calculateJC69(
+            self.matrices[:1])
+        self.assertAlmostEqual(distances[0],
+                               -0.75 * math.log(1.0 - 4.0 / 3.0 * 23 / 357))
+
+
+if __name__ == "__main__":
+    unittest.main()
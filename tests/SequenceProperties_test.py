@@ -0,0 +1,94 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the counting functions in
+SequenceProperties.py.
+
+Counts are compared against counts done by hand. Lower case
+characters and N are counted as characters other than ACGT.
+"""
+
+import unittest
+import CGAT.Genomics as Genomics
+from CGAT.SequenceProperties import *
+
+
+class CountingTest(unittest.TestCase):
+
+    def testEncodeSequence(self):
+        sequence = "ACGTNacgt"
+        self.assertEqual(list(encodeSequence(sequence)),
+                         [ord(x) for x in sequence])
+        self.assertEqual(len(encodeSequence("")), 0)
+
+    def testCountCharacters(self):
+        counts = countCharacters("AACgN")
+        self.assertEqual(counts[ord("A")], 2)
+        self.assertEqual(counts[ord("C")], 1)
+        self.assertEqual(counts[ord("g")], 1)
+        self.assertEqual(counts[ord("G")], 0)
+        self.assertEqual(counts[ord("N")], 1)
+        self.assertEqual(counts.sum(), 5)
+
+    def testCountDinucleotides(self):
+        # AC, CG, GT, TN, Na, ac, cg, gt, tA, AC
+        counts = countDinucleotides("ACGTNacgtAC")
+        self.assertEqual(counts.shape, (5, 5))
+        self.assertEqual(counts[0, 1], 2)
+        self.assertEqual(counts[1, 2], 1)
+        self.assertEqual(counts[2, 3], 1)
+        self.assertEqual(counts[3, 4], 1)
+        self.assertEqual(counts[4, 0], 1)
+        self.assertEqual(counts[4, 4], 4)
+        self.assertEqual(counts.sum(), 10)
+
+    def testCountDinucleotidesShort(self):
+        self.assertEqual(countDinucleotides("A").sum(), 0)
+
+    def testCountCodons(self):
+        # ACG, TNa and cgt, the last two characters are ignored
+        counts = countCodons("ACGTNacgtAC")
+        self.assertEqual(counts.shape, (5, 5, 5))
+        self.assertEqual(counts[0, 1, 2], 1)
+        self.assertEqual(counts[3, 4, 4], 1)
+        self.assertEqual(counts[4, 4, 4], 1)
+        self.assertEqual(counts.sum(), 3)
+
+    def testCountDistinctCodons(self):
+        self.assertEqual(countDistinctCodons("ATGTAAatgNNNATGTGGA"),
+                         {"ATG": 2, "TAA": 1, "atg": 1,
+                          "NNN": 1, "TGG": 1})
+        self.assertEqual(countDistinctCodons("AT"), {})
+
+    def testCountSenseCodons(self):
+        # stop codons, lower case codons and codons with N are
+        # not counted
+        sequence = "ATGTAAatgNNNATGTGG"
+        counts = countSenseCodons(sequence)
+        self.assertEqual(counts["ATG"], 2)
+        self.assertEqual(counts["TGG"], 1)
+        self.assertFalse("TAA" in counts)
+        self.assertEqual(sum(counts.values()), 3)
+        self.assertEqual(counts, Genomics.CountCodons(sequence))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -440,5 +440,87 @@ class TestPValueAdust(unittest.TestCase):
     def testNone(self):
         self.check("none")
 
+
+class TestEstimatePi0s(unittest.TestCase):
+
+    def testPi0s(self):
+        pvalues = [0.01, 0.2, 0.5, 0.5, 0.9]
+        pi0s = Stats.estimatePi0s(pvalues, (0.0, 0.5, 0.8))
+        self.assertAlmostEqual(pi0s[0], 1.0)
+        self.assertAlmostEqual(pi0s[1], 3.0 / 5.0 / 0.5)
+        self.assertAlmostEqual(pi0s[2], 1.0 / 5.0 / 0.2)
+
+    def testNaN(self):
+        pvalues = [0.01, numpy.nan, 0.5]
+        self.assertRaises(ValueError, Stats.estimatePi0s,
+                          pvalues, (0.0, 0.5))
+        self.assertRaises(ValueError, Stats.doFDRPython,
+                          pvalues, vlambda=0.5)
+
+
+class TestVectorisedTests(unittest.TestCase):
+
+    '''compare tests over many rows against single tests.'''
+
+    nrows = 50
+
+    def setUp(self):
+        numpy.random.seed(1)
+        self.values1 = numpy.random.normal(size=(self.nrows, 5))
+        self.values2 = numpy.random.normal(0.5, 2.0, size=(self.nrows, 4))
+        # constant rows
+        self.values1[3] = 1.0
+        self.values2[3] = 2.0
+
+    def testWelchsTTest(self):
+        result = Stats.doWelchsTTests(self.values1, self.values2)
+        for x, values1, values2 in zip(range(self.nrows),
+                                       self.values1, self.values2):
+            if x == 3:
+                self.assertTrue(numpy.isnan(result.mPValue[x]))
+                continue
+            expected = Stats.doWelchsTTest(
+                len(values1), numpy.mean(values1), numpy.std(values1),
+                len(values2), numpy.mean(values2), numpy.std(values2))
+            for key, value in vars(expected).items():
+                self.assertAlmostEqual(value, getattr(result, key)[x])
+
+    def testPairedTTest(self):
+        result = Stats.doPairedTTests(self.values1[:, :4], self.values2)
+        for x, values1, values2 in zip(range(self.nrows),
+                                       self.values1, self.values2):
+            if x == 3:
+                self.assertTrue(numpy.isnan(result.pvalue[x]))
+                continue
+            expected = scipy.stats.ttest_rel(values1[:4], values2)
+            self.assertAlmostEqual(expected[0], result.statistic[x])
+            self.assertAlmostEqual(expected[1], result.pvalue[x])
+
+    def testMannWhitneyUTest(self):
+        # integer values to create ties
+        values1 = numpy.random.randint(0, 5, size=(self.nrows, 6))
+        values2 = numpy.random.randint(0, 6, size=(self.nrows, 7))
+        result = Stats.doMannWhitneyUTests(values1, values2)
+        for x in range(self.nrows):
+            expected = scipy.stats.mannwhitneyu(values1[x], values2[x],
+                                                use_continuity=True,
+                                                alternative="two-sided")
+            self.assertAlmostEqual(expected.statistic, result.statistic[x])
+            # R does not apply continuity correction if U equals its mean
+            if expected.statistic * 2 == 6 * 7:
+                self.assertEqual(result.pvalue[x], 1.0)
+            else:
+                self.assertAlmostEqual(expected.pvalue, result.pvalue[x])
+
+    def testMannWhitneyUTestMissing(self):
+        values1 = numpy.array([[1.0, 2.0, numpy.nan, 4.0]])
+        values2 = numpy.array([[3.0, 5.0, 6.0]])
+        result = Stats.doMannWhitneyUTests(values1, values2)
+        expected = scipy.stats.mannwhitneyu([1.0, 2.0, 4.0], values2[0],
+                                            use_continuity=True,
+                                            alternative="two-sided")
+        self.assertAlmostEqual(expected.statistic, result.statistic[0])
+        self.assertAlmostEqual(expected.pvalue, result.pvalue[0])
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,196 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the native suffix array index in
+SuffixArray.py and SaryFasta.py.
+
+Matches found with the index are compared against a naive string
+search.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import CGAT.SuffixArray as SuffixArray
+import CGAT.SaryFasta as SaryFasta
+
+SEQUENCES = [("seq1", "ACGTACGTTTGACCA"),
+             ("seq2", "GATTACAGATTACA"),
+             ("seq3", "TTTTACGTA"),
+             ("seq4", "ccgtacgg")]
+
+# CCAG spans the boundary between seq1 and seq2
+PATTERNS = ["ACGT", "GATTACA", "A", "TTT", "GTAC", "CCAG", "NNN",
+            "ACGTACGTTTGACCA", "TACGG"]
+
+
+def naiveLocate(pattern, reverse_complement=False):
+    '''return matches of *pattern* in :data:`SEQUENCES`.
+
+    Palindromic patterns are only matched on the forward strand.
+    '''
+    patterns = [("+", pattern)]
+    reverse = pattern.translate(SuffixArray.COMPLEMENT)[::-1]
+    if reverse_complement and reverse != pattern:
+        patterns.append(("-", reverse))
+    matches = []
+    for name, sequence in SEQUENCES:
+        sequence = sequence.upper()
+        for strand, p in patterns:
+            pos = sequence.find(p)
+            while pos >= 0:
+                matches.append((name, strand, pos))
+                pos = sequence.find(p, pos + 1)
+    return sorted(matches)
+
+
+class BuildSuffixArrayCheck(unittest.TestCase):
+
+    def check(self, text):
+        sa = SuffixArray.buildSuffixArray(
+            numpy.fromstring(text, dtype=numpy.uint8))
+        self.assertEqual(list(sa),
+                         sorted(range(len(text)), key=lambda x: text[x:]))
+
+    def testEmpty(self):
+        self.assertEqual(len(SuffixArray.buildSuffixArray(
+            numpy.zeros(0, dtype=numpy.uint8))), 0)
+
+    def testTooLong(self):
+        text = numpy.zeros(1, dtype=numpy.uint8)
+        max_part_size = SuffixArray.MAX_PART_SIZE
+        SuffixArray.MAX_PART_SIZE = 0
+        try:
+            self.assertRaises(ValueError,
+                              SuffixArray.buildSuffixArray, text)
+        finally:
+            SuffixArray.MAX_PART_SIZE = max_part_size
+
+    def testMaxPartSize(self):
+        # the largest key must not overflow
+        multiplier = SuffixArray.MAX_PART_SIZE + 1
+        self.assertTrue((multiplier - 1) * multiplier + multiplier - 1 <
+                        2 ** 63)
+        multiplier += 1
+        self.assertFalse((multiplier - 1) * multiplier + multiplier - 1 <
+                         2 ** 63)
+
+    def testTexts(self):
+        for text in ("A", "banana", "mississippi", "AAAAAAAAA",
+                     "ACGTACGTTTGACCA\0GATTACAGATTACA\0"):
+            self.check(text)
+
+
+class SuffixArrayIndexCheck(unittest.TestCase):
+
+    part_size = 100000000
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = SuffixArray.createSuffixArrayIndex(
+            os.path.join(self.tmpdir, "test.sai"),
+            iter(SEQUENCES),
+            part_size=self.part_size)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testCount(self):
+        self.assertEqual(self.index.count(["GATTACA", "CCAG", "A"]),
+                         [2, 0, 13])
+        self.assertEqual(self.index.count(PATTERNS),
+                         [len(naiveLocate(x)) for x in PATTERNS])
+
+    def testCountReverseComplement(self):
+        self.assertEqual(self.index.count(PATTERNS, reverse_complement=True),
+                         [len(naiveLocate(x, True)) for x in PATTERNS])
+
+    def testLocate(self):
+        for pattern, matches in zip(PATTERNS, self.index.locate(PATTERNS)):
+            self.assertEqual(sorted(matches), naiveLocate(pattern))
+
+    def testLocateReverseComplement(self):
+        for pattern, matches in zip(
+                PATTERNS, self.index.locate(PATTERNS,
+                                            reverse_complement=True)):
+            self.assertEqual(sorted(matches), naiveLocate(pattern, True))
+
+    def testCountPalindrome(self):
+        # ACGT and GTAC are their own reverse complement
+        self.assertEqual(self.index.count(["ACGT", "GTAC", "acgt"],
+                                          reverse_complement=True),
+                         [3, 2, 3])
+        self.assertEqual(self.index.count(["ACGT"]), [3])
+
+    def testLowerCase(self):
+        self.assertEqual(self.index.count(["tacgg", "TACGG"]), [1, 1])
+
+    def testEmptyPattern(self):
+        self.assertRaises(ValueError, self.index.count, ["ACGT", ""])
+        self.assertEqual(self.index.count([]), [])
+
+
+class SuffixArrayIndexPartsCheck(SuffixArrayIndexCheck):
+
+    # one sequence per part
+    part_size = 16
+
+    def testParts(self):
+        self.assertEqual(len(self.index.mParts), len(SEQUENCES))
+
+
+class SaryFastaCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tmpdir, "test.fasta")
+        with open(filename, "w") as outf:
+            for name, sequence in SEQUENCES:
+                outf.write(">%s\n%s\n" % (name, sequence))
+        self.dbname = os.path.join(self.tmpdir, "test")
+        SaryFasta.createDatabase(self.dbname, [filename],
+                                 buf_size=16,
+                                 method="native")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self, pattern):
+        names = [x[0] for x in naiveLocate(pattern)]
+        return [x for x, y in SEQUENCES if x in names]
+
+    def testSearch(self):
+        fasta = SaryFasta.SaryFasta(self.dbname)
+        self.assertTrue(fasta.mNativeIndex is not None)
+        for pattern in PATTERNS:
+            self.assertEqual(fasta.search(pattern), self.expected(pattern))
+        self.assertEqual(fasta["GATTACA"], ["seq2"])
+
+    def testSearchBatch(self):
+        fasta = SaryFasta.SaryFasta(self.dbname)
+        self.assertEqual(fasta.searchBatch(PATTERNS),
+                         [self.expected(x) for x in PATTERNS])
+
+if __name__ == "__main__":
+    unittest.main()
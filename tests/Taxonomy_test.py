@@ -0,0 +1,156 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the Taxonomy.py module."""
+
+import os
+import gzip
+import collections
+import random
+import unittest
+import CGAT.Taxonomy as Taxonomy
+import CGAT.LCA as LCA
+import CGAT.Metaphlan as Metaphlan
+
+TESTS_DIR = os.path.dirname(__file__)
+
+
+def buildRows(nreads, seed=1):
+    '''return random assignments for two levels.'''
+    random.seed(seed)
+    rows = []
+    for x in range(nreads):
+        rows.append((random.choice(("A", "B", "NA")),
+                     random.choice(("a", "b", "c", "d", "NA"))))
+    return rows
+
+
+class TaxonomyTableCheck(unittest.TestCase):
+
+    levels = ("upper", "lower")
+
+    def setUp(self):
+        self.rows = buildRows(100)
+        self.table = Taxonomy.TaxonomyTable(self.levels)
+        for row in self.rows:
+            self.table.add(row)
+
+    def testCounts(self):
+        for x, level in enumerate(self.levels):
+            expected = collections.defaultdict(int)
+            for row in self.rows:
+                if row[x] != "NA":
+                    expected[row[x]] += 1
+            taxa, counts = self.table.getCounts(level)
+            self.assertEqual(dict(zip(taxa, counts)), expected)
+            self.assertEqual(self.table.countAssigned()[x],
+                             sum(expected.values()))
+            self.assertEqual(self.table.countDistinct()[x],
+                             len(expected))
+
+    def testMatrix(self):
+        other = Taxonomy.TaxonomyTable(self.levels)
+        other.add(("C", "NA"))
+        other.add(("A", "NA"))
+        taxa, matrix = Taxonomy.buildMatrix((self.table, other), "upper")
+        self.assertEqual(taxa, ["A", "B", "C"])
+        self.assertEqual(list(matrix[:, 1]), [1, 0, 1])
+        self.assertEqual(matrix[:, 0].sum(),
+                         self.table.countAssigned()[0])
+
+    def testColumnAfterAdd(self):
+        column = self.table.getColumn("upper")
+        values = list(column)
+        # add enough reads to reallocate the underlying storage
+        for row in buildRows(10000, seed=2):
+            self.table.add(row)
+        self.assertEqual(list(column), values)
+        self.assertEqual(len(self.table.getColumn("upper")),
+                         len(self.rows) + 10000)
+        self.assertRaises(ValueError, column.__setitem__, 0, 1)
+
+    def testEmpty(self):
+        table = Taxonomy.TaxonomyTable(self.levels)
+        self.assertEqual(list(table.countAssigned()), [0, 0])
+        taxa, counts = table.getCounts("upper")
+        self.assertEqual(len(counts), 0)
+
+    def testAddColumns(self):
+        table = Taxonomy.TaxonomyTable(self.levels)
+        for x in range(0, len(self.rows), 30):
+            table.addColumns(zip(*self.rows[x:x + 30]))
+        self.assertEqual(table.nreads, self.table.nreads)
+        self.assertEqual(table.taxa, self.table.taxa)
+        for level in self.levels:
+            self.assertEqual(list(table.getColumn(level)),
+                             list(self.table.getColumn(level)))
+
+    def testAddColumnsEmptyCells(self):
+        table = Taxonomy.TaxonomyTable(self.levels)
+        table.addColumns((("A", None, "B"), ("NA", "a", None)))
+        self.assertEqual(list(table.getColumn("upper")), [0, -1, 1])
+        self.assertEqual(list(table.getColumn("lower")), [-1, 0, -1])
+        self.assertEqual(table.nreads, 3)
+
+
+class ReadTableCheck(unittest.TestCase):
+
+    def testLCA(self):
+        filename = os.path.join(TESTS_DIR, "lca2table.py",
+                                "stool-WT-R1.diamond.lca.small.gz")
+        expected = Taxonomy.TaxonomyTable(LCA.LEVELS)
+        for lca in LCA.iterate(gzip.open(filename)):
+            expected.add([getattr(lca, x) for x in LCA.ATTRIBUTES])
+
+        chunk_size = LCA.CHUNK_SIZE
+        try:
+            for LCA.CHUNK_SIZE in (7, chunk_size):
+                table = LCA.readTable(gzip.open(filename))
+                self.assertEqual(table.nreads, 1000)
+                self.assertEqual(table.taxa, expected.taxa)
+                for level in LCA.LEVELS:
+                    self.assertEqual(list(table.getColumn(level)),
+                                     list(expected.getColumn(level)))
+        finally:
+            LCA.CHUNK_SIZE = chunk_size
+
+    def testMetaphlan(self):
+        filename = os.path.join(TESTS_DIR, "metaphlan2table.py",
+                                "readmap.metaphlan")
+        expected = Taxonomy.TaxonomyTable(Metaphlan.LEVELS,
+                                          missing=("unclassified",))
+        for read in Metaphlan.read_map_iterator(open(filename)):
+            expected.add((read.kingdom, read.phylum, read.c_lass,
+                          read.order, read.family, read.genus,
+                          read.species))
+
+        for chunk_size in (7, 100000):
+            table = Metaphlan.read_map_table(open(filename),
+                                             chunk_size=chunk_size)
+            self.assertEqual(table.nreads, 705)
+            self.assertEqual(table.taxa, expected.taxa)
+            for level in Metaphlan.LEVELS:
+                self.assertEqual(list(table.getColumn(level)),
+                                 list(expected.getColumn(level)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the TreeTools.py module.
+
+The clade index (:class:`TreeTools.TreeCollectionIndex`) is compared
+against the tree based functions in :mod:`TreeTools`.
+"""
+
+import copy
+import unittest
+import CGAT.TreeTools as TreeTools
+
+
+class TreeCollectionIndexCheck(unittest.TestCase):
+
+    trees = [
+        "((A:1,B:1):1,(C:1,D:1):1,(E:1,F:1):1);",
+        "((A:1,B:1):1,((C:1,D:1):1,(E:1,F:1):1):1);",
+        "((A:1,C:1):1,(B:1,D:1):1,(E:1,F:1):1);",
+        "(A:1,B:1,C:1,D:1,E:1,F:1);",
+        "(((A:1,B:1):1,C:1):1,(D:1,(E:1,F:1):1):1);",
+        "((A:1,B:1):1,(C:1,D:1):1,E:1);",
+    ]
+
+    queries = [("A", "B"), ("C", "D"), ("A", "C"),
+               ("A",), ("D", "E", "F"), ("A", "X")]
+
+    def setUp(self):
+        self.nexus = [TreeTools.Newick2Nexus(x).trees[0] for x in self.trees]
+        self.index = TreeTools.TreeCollectionIndex(self.nexus)
+
+    def testCompatible(self):
+        for reference in self.nexus:
+            result = self.index.isCompatible(reference)
+            for tree, r in zip(self.nexus, result):
+                try:
+                    expected = TreeTools.IsCompatible(
+                        copy.deepcopy(reference), copy.deepcopy(tree))
+                except TreeTools.Bio.Nexus.Trees.TreeError:
+                    continue
+                self.assertEqual(expected, r)
+
+    def testMonophyletic(self):
+        for taxa in self.queries:
+            result = self.index.isMonophyletic(taxa)
+            for tree, r in zip(self.nexus, result):
+                self.assertEqual(
+                    TreeTools.IsMonophyleticForTaxa(copy.deepcopy(tree),
+                                                    taxa), r)
+
+    def testCommonAncestor(self):
+        for taxa in self.queries:
+            result = self.index.getCommonAncestor(taxa)
+            for tree, r in zip(self.nexus, result):
+                self.assertEqual(
+                    TreeTools.GetCommonAncestor(copy.deepcopy(tree),
+                                                taxa), r)
+
+    def testSubsets(self):
+        for tree, clades in zip(self.nexus, self.index):
+            expected = [sorted(x) for x in
+                        TreeTools.GetSubsets(tree, with_decoration=False)]
+            result = [sorted(self.index.decode(x))
+                      for x in clades.getSubsets()]
+            self.assertEqual(expected, result)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the VCF.py module.
+
+Blocks of genotypes (:meth:`VCF.VCFFile.iterateBlocks`) are compared
+against the genotypes of individual records.
+"""
+
+import os
+import unittest
+import numpy
+import CGAT.VCF as VCF
+
+VCF_FILE = os.path.join(os.path.dirname(__file__),
+                        "vcf2vcf.py", "example_human_g1k.vcf")
+
+
+class VCFFileCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.entries = list(VCF.VCFFile(open(VCF_FILE)))
+
+    def testEntry(self):
+        for entry, line in zip(self.entries,
+                               [x for x in open(VCF_FILE)
+                                if not x.startswith("#")]):
+            self.assertEqual(str(entry), line[:-1])
+            self.assertEqual(entry.genotypes[entry.samples[0]],
+                             line[:-1].split("\t")[9])
+
+    def testReorder(self):
+        for entry in self.entries:
+            order = list(reversed(entry.samples))
+            expected = entry.toString([2, 1, 0])
+            entry.order = order
+            self.assertEqual(str(entry), expected)
+
+    def testBlocks(self):
+        infile = VCF.VCFFile(open(VCF_FILE))
+        samples = list(reversed(infile.samples))
+        blocks = list(infile.iterateBlocks(block_size=10,
+                                           samples=samples,
+                                           fields=("DP", "GQ")))
+        self.assertEqual(sum([len(x.pos) for x in blocks]),
+                         len(self.entries))
+
+        alleles = numpy.concatenate([x.alleles for x in blocks])
+        gq = numpy.concatenate([x.values["GQ"] for x in blocks])
+        for entry, a, q in zip(self.entries, alleles, gq):
+            keys = entry.format.split(":")
+            for sample, aa, qq in zip(samples, a, q):
+                fields = entry.genotypes[sample].split(":")
+                gt = fields[keys.index("GT")]
+                if gt == "./.":
+                    self.assertEqual(list(aa), [-1, -1])
+                else:
+                    self.assertEqual(list(aa),
+                                     map(int, gt.replace("|", "/").split("/")))
+                if len(fields) > keys.index("GQ"):
+                    self.assertEqual(qq, float(fields[keys.index("GQ")]))
+                else:
+                    self.assertTrue(numpy.isnan(qq))
+
+        self.assertTrue(numpy.all(blocks[0].missing ==
+                                  (blocks[0].alleles[:, :, 0] < 0)))
+        self.assertTrue(numpy.all(numpy.isnan(blocks[0].values["DP"])))
+
+if __name__ == "__main__":
+    unittest.main()
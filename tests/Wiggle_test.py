@@ -0,0 +1,102 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the BigWigWriter class in Wiggle.py.
+
+Files written by :class:`Wiggle.BigWigWriter` are read back with
+the bigwig reader in bx-python.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from bx.bbi.bigwig_file import BigWigFile
+import CGAT.Wiggle as Wiggle
+
+
+class BigWigWriterCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "test.bw")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, contig_sizes, data):
+        '''write *data*, a list of contigs and runs, to a bigwig file.'''
+        writer = Wiggle.BigWigWriter(open(self.filename, "wb"),
+                                     contig_sizes)
+        for contig, runs in data:
+            writer.add(contig,
+                       [x[0] for x in runs],
+                       [x[1] for x in runs],
+                       [x[2] for x in runs])
+        writer.close()
+        return BigWigFile(open(self.filename, "rb"))
+
+    def testRoundTrip(self):
+        contig_sizes = {"chr1": 1000, "chr2": 500, "chr3": 100}
+        data = [("chr1", [(10, 20, 1.0), (20, 25, 2.5), (100, 150, 1.0)]),
+                ("chr2", [(0, 500, 0.25)])]
+        bw = self.write(contig_sizes, data)
+        for contig, runs in data:
+            self.assertEqual(bw.get(contig, 0, contig_sizes[contig]), runs)
+        self.assertEqual(bw.get("chr1", 15, 22), [(15, 20, 1.0),
+                                                  (20, 22, 2.5)])
+        self.assertEqual(bw.get("chr3", 0, 100), [])
+
+    def testManySections(self):
+        # more records than fit into a single data section
+        runs = [(x * 10, x * 10 + 5, float(x % 7))
+                for x in range(3 * Wiggle.BigWigWriter.items_per_slot)]
+        bw = self.write({"chr1": 100000}, [("chr1", runs)])
+        self.assertEqual(bw.get("chr1", 0, 100000), runs)
+        self.assertEqual(bw.get("chr1", 15000, 15006), [(15000, 15005, 2.0)])
+
+    def testManyContigs(self):
+        # more contigs than fit into a single index node
+        ncontigs = Wiggle.BigWigWriter.block_size + 10
+        contigs = ["contig%03i" % x for x in range(ncontigs)]
+        data = [(contig, [(x, x + 1, float(x))])
+                for x, contig in enumerate(contigs)]
+        bw = self.write(dict([(x, 1000) for x in contigs]), data)
+        for contig, runs in data:
+            self.assertEqual(bw.get(contig, 0, 1000), runs)
+
+    def testReference(self):
+        filename = os.path.join(os.path.dirname(__file__),
+                                "bam2wiggle.py", "paired_shiftextend.bw")
+        runs = BigWigFile(open(filename, "rb")).get("chr1", 0, 249250621)
+        bw = self.write({"chr1": 249250621}, [("chr1", runs)])
+        self.assertEqual(bw.get("chr1", 0, 249250621), runs)
+
+    def testDuplicateContig(self):
+        writer = Wiggle.BigWigWriter(open(self.filename, "wb"),
+                                     {"chr1": 1000})
+        writer.add("chr1", [0], [10], [1.0])
+        self.assertRaises(ValueError, writer.add, "chr1", [20], [30], [1.0])
+        writer.close()
+
+if __name__ == "__main__":
+    unittest.main()
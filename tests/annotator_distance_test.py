@@ -0,0 +1,183 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the batch sampling in annotator_distance.py.
+
+Counts for a batch of samples are compared against counts
+computed sample by sample.
+"""
+
+import os
+import imp
+import unittest
+import numpy
+
+annotator_distance = imp.load_source(
+    "annotator_distance",
+    os.path.join(os.path.dirname(__file__), "..", "scripts",
+                 "annotator_distance.py"))
+
+# segment positions for three samples in the workspace 100-300.
+# The second sample has a segment in the middle of the workspace
+# and a segment close to the right end.
+WORKSPACE = (100, 300)
+STARTS = numpy.array([[100, 130, 250],
+                      [105, 195, 280],
+                      [150, 220, 260]], numpy.int64)
+ENDS = numpy.array([[110, 170, 290],
+                    [120, 205, 299],
+                    [160, 240, 300]], numpy.int64)
+
+
+class SampleCountsCheck(unittest.TestCase):
+
+    labels = ("a", "b", "c")
+    left_labels = ("a", "c")
+    right_labels = ("b", "c")
+
+    def checkCounter(self, counter, num_bins, resolution):
+        start, end = WORKSPACE
+        batch = annotator_distance.SampleCounts(
+            counter, self.labels, len(STARTS), num_bins, resolution)
+        batch.addCounts(STARTS, ENDS, start, end,
+                        self.left_labels, self.right_labels)
+        # add a second workspace to check accumulation
+        batch.addCounts(STARTS[:, :2], ENDS[:, :2], start, end,
+                        self.left_labels, ())
+
+        for x in range(len(STARTS)):
+            c = counter(self.labels, num_bins, resolution, dtype=numpy.int64)
+            c.addCounts(zip(STARTS[x], ENDS[x]), start, end,
+                        self.left_labels, self.right_labels)
+            c.addCounts(zip(STARTS[x, :2], ENDS[x, :2]), start, end,
+                        self.left_labels, ())
+            for label in self.labels:
+                self.assertEqual(list(batch.mCounts[label][x]),
+                                 list(c.mCounts[label]))
+                self.assertEqual(batch.mTotals[label][x], c.mTotals[label])
+                self.assertEqual(batch.mOutOfBounds[label][x],
+                                 c.mOutOfBounds[label])
+
+    def testTranscription(self):
+        self.checkCounter(annotator_distance.CounterTranscription, 200, 1)
+
+    def testTranscriptionResolution(self):
+        self.checkCounter(annotator_distance.CounterTranscription, 10, 7)
+
+    def testClosestDistance(self):
+        self.checkCounter(annotator_distance.CounterClosestDistance, 200, 1)
+
+    def testClosestDistanceResolution(self):
+        self.checkCounter(annotator_distance.CounterClosestDistance, 5, 7)
+
+    def testAllDistances(self):
+        self.checkCounter(annotator_distance.CounterAllDistances, 200, 1)
+
+    def testAllDistancesResolution(self):
+        self.checkCounter(annotator_distance.CounterAllDistances, 5, 7)
+
+
+class SamplerCheck(unittest.TestCase):
+
+    num_samples = 100
+
+    def getGaps(self, starts, ends, work_start):
+        '''return gaps before each segment.'''
+        previous = numpy.hstack(
+            (numpy.zeros((len(starts), 1), numpy.int64) + work_start,
+             ends[:, :-1]))
+        return starts - previous
+
+    def checkSamples(self, sampler, observed, work_start, work_end):
+        starts, ends = sampler(observed, work_start, work_end).sampleBatch(
+            self.num_samples, numpy.random.RandomState(1))
+        lengths = sorted([e - s for s, e in observed])
+        self.assertEqual(starts.shape, (self.num_samples, len(observed)))
+        for x in range(self.num_samples):
+            self.assertEqual(sorted(ends[x] - starts[x]), lengths)
+        self.assertTrue((starts >= work_start).all())
+        self.assertTrue((ends <= work_end).all())
+        self.assertTrue((starts[:, 1:] >= ends[:, :-1]).all())
+        return starts, ends
+
+    def testPermutation(self):
+        self.checkSamples(annotator_distance.SamplerPermutation,
+                          [(110, 120), (150, 180), (200, 205)], 100, 300)
+
+    def testGaps(self):
+        observed = [(110, 120), (150, 180), (200, 205)]
+        starts, ends = self.checkSamples(annotator_distance.SamplerGaps,
+                                         observed, 100, 300)
+        # three of the four gaps are used
+        gaps = self.getGaps(starts, ends, 100)
+        for x in range(self.num_samples):
+            self.assertEqual(
+                len(set(gaps[x]).intersection((10, 30, 20, 95))), 3)
+
+    def testGapsAtEdge(self):
+        # segments touch the workspace end, so there are as many gaps
+        # as segments. All gaps are used in every sample.
+        observed = [(110, 120), (150, 180), (200, 300)]
+        starts, ends = self.checkSamples(annotator_distance.SamplerGaps,
+                                         observed, 100, 300)
+        gaps = self.getGaps(starts, ends, 100)
+        for x in range(self.num_samples):
+            self.assertEqual(sorted(gaps[x]), [10, 20, 30])
+        self.assertTrue((ends[:, -1] == 300).all())
+
+    def testGapsAdjacent(self):
+        # adjacent segments leave fewer gaps than segments
+        observed = [(100, 120), (120, 180), (180, 200)]
+        starts, ends = self.checkSamples(annotator_distance.SamplerGaps,
+                                         observed, 100, 300)
+        gaps = self.getGaps(starts, ends, 100)
+        for x in range(self.num_samples):
+            self.assertEqual(sorted(gaps[x]), [0, 0, 100])
+
+
+class MediansCounter:
+
+    '''counter returning fixed medians of simulated samples.'''
+
+    def __init__(self, medians):
+        self.medians = medians
+
+    def getMedians(self, label):
+        return self.medians[label]
+
+
+class SimulatedPValuesCheck(unittest.TestCase):
+
+    def testPooled(self):
+        # p-values are computed per counter and label and pooled
+        # over all counters and labels
+        counters = [MediansCounter({"a": [3, 1, 2, 4], "b": [5, 5, 5, 5]}),
+                    MediansCounter({"a": [10, 20, 20, 30], "b": [7, 8, 9, 6]})]
+        self.assertEqual(
+            list(annotator_distance.getSimulatedPValues(counters,
+                                                        ("a", "b"))),
+            sorted([0.25, 0.5, 0.75, 1.0] * 2 +
+                   [0.625] * 4 +
+                   [0.25, 0.625, 0.625, 1.0]))
+
+if __name__ == "__main__":
+    unittest.main()
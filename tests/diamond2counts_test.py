@@ -0,0 +1,126 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for counting best alignments in
+diamond2counts.py.
+"""
+
+import os
+import imp
+import subprocess
+import sys
+import unittest
+import cStringIO as StringIO
+
+SCRIPT = os.path.join(os.path.dirname(__file__), "..", "scripts",
+                      "diamond2counts.py")
+DATA_DIR = os.path.join(os.path.dirname(__file__), "diamond2counts.py")
+
+diamond2counts = imp.load_source("diamond2counts", SCRIPT)
+
+FILES = ["stool-WT-R1.diamond.small.tsv.gz",
+         "part.diamond.small.tsv.gz"]
+
+# three queries with tied best scores. The alignment with score
+# 90 must never be chosen.
+TIES = "".join(["\t".join((qid, ref) + ("0",) * 9 + (score,)) + "\n"
+                for qid, ref, score in
+                (("q1", "geneA", "100"), ("q1", "geneB", "100"),
+                 ("q1", "geneC", "90"),
+                 ("q2", "geneA", "50"), ("q2", "geneB", "50"),
+                 ("q3", "geneC", "90"), ("q3", "geneA", "100"),
+                 ("q3", "geneB", "100"))])
+
+
+def runScript(args):
+    '''run diamond2counts.py in the test data directory and
+    return the output without comments.'''
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(SCRIPT), "-v", "0"] + args,
+        cwd=DATA_DIR)
+    return [x for x in output.split("\n") if x and not x.startswith("#")]
+
+
+def readTable(lines):
+    '''return a dictionary of counts per column.'''
+    header = lines[0].split("\t")
+    counts = [{} for x in header[1:]]
+    for line in lines[1:]:
+        fields = line.split("\t")
+        for x, count in enumerate(fields[1:]):
+            if count != "0":
+                counts[x][fields[0]] = int(count)
+    return counts
+
+
+class CountTiesCheck(unittest.TestCase):
+
+    def count(self, seed, chunksize=1000000):
+        genes, cogs = diamond2counts.countFile(
+            (StringIO.StringIO(TIES), None, chunksize, seed))
+        return genes
+
+    def testBestOnly(self):
+        for seed in range(20):
+            genes = self.count(seed)
+            self.assertEqual(sum(genes.values()), 3)
+            self.assertFalse("geneC" in genes)
+
+    def testSeeded(self):
+        for seed in range(5):
+            self.assertEqual(self.count(seed), self.count(seed))
+            self.assertEqual(self.count(seed), self.count(seed, 1))
+
+    def testSeedsDiffer(self):
+        results = set([tuple(sorted(self.count(seed).items()))
+                       for seed in range(20)])
+        self.assertTrue(len(results) > 1)
+
+
+class SeveralFilesCheck(unittest.TestCase):
+
+    def testMatrix(self):
+        matrix = runScript(["--method=best"] + FILES)
+        self.assertEqual(matrix[0], "\t".join(["ref"] + FILES))
+        counts = readTable(matrix)
+        for x, filename in enumerate(FILES):
+            single = runScript(["--method=best",
+                                "--stdin=%s" % filename])
+            self.assertEqual(counts[x], readTable(single)[0])
+
+    def testThreads(self):
+        self.assertEqual(
+            runScript(["--method=best"] + FILES),
+            runScript(["--method=best", "--num-threads=2"] + FILES))
+
+    def testCogs(self):
+        matrix = runScript(["--method=best", "--sum-cog",
+                            "--cog-map=gene2cog2.tsv.gz",
+                            "--chunk-size=7"] + FILES)
+        counts = readTable(matrix)
+        single = runScript(["--method=best", "--sum-cog",
+                            "--cog-map=gene2cog2.tsv.gz",
+                            "--stdin=%s" % FILES[0]])
+        self.assertEqual(counts[0], readTable(single)[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the histogram computation in
+gff2coverage.py.
+"""
+
+import os
+import imp
+import unittest
+import numpy
+
+gff2coverage = imp.load_source(
+    "gff2coverage",
+    os.path.join(os.path.dirname(__file__), "..", "scripts",
+                 "gff2coverage.py"))
+
+
+class CheckOverlapsCheck(unittest.TestCase):
+
+    def check(self, intervals):
+        starts, ends, strands = zip(*intervals)
+        gff2coverage.checkOverlaps("chr1",
+                                   numpy.array(starts, dtype=numpy.int64),
+                                   numpy.array(ends, dtype=numpy.int64),
+                                   numpy.array(strands))
+
+    def testAdjacent(self):
+        self.check([(20, 30, "+"), (0, 10, "+"), (10, 20, "+")])
+
+    def testOppositeStrands(self):
+        self.check([(0, 10, "+"), (5, 15, "-")])
+
+    def testOverlap(self):
+        self.assertRaises(ValueError, self.check,
+                          [(0, 10, "+"), (20, 30, "+"), (25, 40, "+")])
+
+    def testContained(self):
+        # the second interval is compared against the end of the
+        # first, not only its immediate predecessor
+        self.assertRaises(ValueError, self.check,
+                          [(0, 100, "-"), (10, 20, "-"), (50, 60, "-")])
+
+    def testEmptyInterval(self):
+        self.check([(0, 10, "+"), (5, 5, "+")])
+
+
+class ComputeCoverageCheck(unittest.TestCase):
+
+    def testAgainstNaive(self):
+        starts = numpy.array([0, 15, 40, 42], dtype=numpy.int64)
+        ends = numpy.array([10, 30, 41, 50], dtype=numpy.int64)
+        positions = numpy.arange(0, 60, 7, dtype=numpy.int64)
+        covered = numpy.zeros(60, dtype=numpy.int64)
+        for start, end in zip(starts, ends):
+            covered[start:end] += 1
+        self.assertEqual(
+            list(gff2coverage.computeCoverage(starts, ends, positions)),
+            [covered[:x].sum() for x in positions])
+
+
+class ProcessContigCheck(unittest.TestCase):
+
+    def process(self, num_bins, window_size, max_coordinate):
+        return gff2coverage.processContig(
+            ("chr1",
+             numpy.array([0, 26], dtype=numpy.int64),
+             numpy.array([2, 30], dtype=numpy.int64),
+             numpy.array(["+", "+"]),
+             numpy.array([0, 0], dtype=numpy.int32),
+             1, max_coordinate, window_size, num_bins))[3]
+
+    def testLastBin(self):
+        # the last bin extends to the end of the contig
+        self.assertEqual(list(self.process(4, 7, 30)[:, 0]), [2, 2, 2, 6])
+
+    def testNoBins(self):
+        self.assertEqual(self.process(0, 7, 30).shape, (0, 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the BarcodeCounts class in _gtf2table.pyx.
+
+The module is imported in the same way as in :file:`gtf2table.py`.
+"""
+
+import os
+import sys
+import itertools
+import shutil
+import tempfile
+import unittest
+import numpy
+import pysam
+# import compiled extensions before pyximport is installed
+import CGAT.IndexedGenome
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+try:
+    import pyximport
+    pyximport.install(build_in_temp=False)
+    import _gtf2table
+except ImportError:
+    import CGAT._gtf2table as _gtf2table
+
+
+class Read(object):
+    '''a read with a name only.'''
+
+    def __init__(self, qname):
+        self.qname = qname
+
+
+class BarcodeCountsCheck(unittest.TestCase):
+
+    categories = ("exonic", "intronic")
+
+    def count(self, reads, collapse_umis=True):
+        '''count *reads* given as tuples of gene, barcode, umi and
+        category.'''
+        counts = _gtf2table.BarcodeCounts(
+            self.categories,
+            barcode_regex="_(?P<umi>[ACGT]+)_(?P<barcode>[ACGT]+)$",
+            collapse_umis=collapse_umis)
+        result = []
+        for gene, gene_reads in itertools.groupby(reads, lambda x: x[0]):
+            counts.startGene(gene)
+            for gene, barcode, umi, category in gene_reads:
+                barcode_id, umi_id = counts.getBarcode(
+                    Read("read_%s_%s" % (umi, barcode)))
+                counts.add(barcode_id, umi_id, category, 1.0)
+            result.append(list(counts.finishGene()))
+        return counts, result
+
+    reads = [("gene1", "CCCC", "AAA", 0),
+             ("gene1", "CCCC", "AAA", 0),
+             ("gene1", "CCCC", "AAA", 1),
+             ("gene1", "CCCC", "GGG", 0),
+             ("gene1", "TTTT", "AAA", 0),
+             ("gene2", "CCCC", "AAA", 0),
+             ("gene2", "CCCC", "AAA", 0)]
+
+    def testCollapse(self):
+        counts, result = self.count(self.reads)
+        self.assertEqual(result, [[3, 1], [1, 0]])
+        self.assertEqual(list(counts.gene_index), [0, 0, 0, 1])
+        self.assertEqual(list(counts.barcode_index), [0, 0, 1, 0])
+        self.assertEqual(list(counts.category_index), [0, 1, 0, 0])
+        self.assertEqual(list(counts.counts), [2, 1, 1, 1])
+
+    def testNoCollapse(self):
+        counts, result = self.count(self.reads, collapse_umis=False)
+        self.assertEqual(result, [[4, 1], [2, 0]])
+        self.assertEqual(list(counts.counts), [3, 1, 1, 2])
+
+    def testMatrix(self):
+        counts, result = self.count(self.reads)
+        matrix = counts.getMatrix().toarray()
+        self.assertEqual(matrix.shape, (4, 2))
+        self.assertEqual(matrix.tolist(),
+                         [[2, 1], [1, 0], [1, 0], [0, 0]])
+
+    def testNumpy(self):
+        counts, result = self.count(self.reads)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "counts.npz")
+            counts.writeNumpy(filename)
+            data = numpy.load(filename)
+            self.assertEqual(list(data["counts"]), [2, 1, 1, 1])
+            self.assertEqual(list(data["gene_ids"]), ["gene1", "gene2"])
+            self.assertEqual(list(data["barcodes"]), ["CCCC", "TTTT"])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class GetBarcodeCheck(unittest.TestCase):
+
+    filename = os.path.join(os.path.dirname(__file__),
+                            "gtf2table.py", "barcodes.bam")
+
+    def setUp(self):
+        self.reads = list(pysam.AlignmentFile(self.filename, "rb"))
+
+    def testReadName(self):
+        counts = _gtf2table.BarcodeCounts(("exonic",))
+        self.assertEqual([counts.getBarcode(x) for x in self.reads],
+                         [(0, -1)] * 3 + [(1, -1)] * 3)
+        self.assertEqual(counts.barcodes, ["CCCC", "TTTT"])
+
+    def testRegex(self):
+        counts = _gtf2table.BarcodeCounts(
+            ("exonic",),
+            barcode_regex="_(?P<umi>[ACGT]+)_(?P<barcode>[ACGT]+)$")
+        self.assertEqual([counts.getBarcode(x) for x in self.reads],
+                         [(0, 0), (0, 0), (0, 1), (1, 0), (1, 0), (1, 2)])
+
+    def testTags(self):
+        counts = _gtf2table.BarcodeCounts(("exonic",),
+                                          barcode_tag="CB",
+                                          umi_tag="UB")
+        self.assertEqual([counts.getBarcode(x) for x in self.reads],
+                         [(0, 0), (0, 0), (0, 1), (1, 0), (1, 0), (-1, -1)])
+        self.assertEqual(counts.nskipped, 1)
+
+if __name__ == "__main__":
+    unittest.main()
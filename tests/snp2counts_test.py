@@ -0,0 +1,160 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the transcript sequence cache in snp2counts.py.
+
+Sequences served from the cache are compared against sequences
+read from the genome.
+"""
+
+import os
+import imp
+import shutil
+import tempfile
+import unittest
+import pysam
+import CGAT.GTF as GTF
+import CGAT.IndexedFasta as IndexedFasta
+
+snp2counts = imp.load_source(
+    "snp2counts",
+    os.path.join(os.path.dirname(__file__), "..", "scripts", "snp2counts.py"))
+
+# 60 bases on chr1, 20 bases on chr2
+GENOME = {"chr1": "ACGTACCGGTTAACCGGATGCATGCAATTGGCCAAGCTTGACTGAGCTCAGTACGATCGA",
+          "chr2": "TTTTGGGGCCCCAAAAGGGG"}
+
+
+def buildExons(transcript_id, strand, coordinates):
+    '''return exons of a transcript on chr1.'''
+    exons = []
+    for start, end, frame in coordinates:
+        e = GTF.Entry()
+        e.contig, e.strand, e.feature = "chr1", strand, "CDS"
+        e.start, e.end, e.frame = start, end, frame
+        e.gene_id = e.transcript_id = transcript_id
+        exons.append(e)
+    return exons
+
+
+class GenomeCheck(unittest.TestCase):
+    '''base class for tests with a small indexed genome.'''
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tmpdir, "genome.fa")
+        with open(filename, "w") as outf:
+            for contig, sequence in sorted(GENOME.items()):
+                outf.write(">%s\n%s\n" % (contig, sequence))
+        pysam.faidx(filename)
+        self.filename = filename
+        self.fasta = IndexedFasta.IndexedFasta(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+class TranscriptSequenceCheck(GenomeCheck):
+
+    def testPositiveStrand(self):
+        sequence = snp2counts.TranscriptSequence(self.fasta, "chr1", 10, 40)
+        for start, end in ((10, 40), (12, 13), (25, 31)):
+            self.assertEqual(sequence.getSequence("chr1", "+", start, end),
+                             GENOME["chr1"][start:end])
+
+    def testNegativeStrand(self):
+        sequence = snp2counts.TranscriptSequence(self.fasta, "chr1", 10, 40)
+        # negative strand coordinates of forward strand 10-40
+        for start, end in ((20, 50), (30, 33)):
+            self.assertEqual(sequence.getSequence("chr1", "-", start, end),
+                             self.fasta.getSequence("chr1", "-", start, end))
+        self.assertEqual(sequence.getSequence("chr1", "-", 47, 50), "TTA")
+
+    def testOutsideRegion(self):
+        sequence = snp2counts.TranscriptSequence(self.fasta, "chr1", 10, 40)
+        self.assertEqual(sequence.getSequence("chr1", "+", 5, 15),
+                         GENOME["chr1"][5:15])
+        self.assertEqual(sequence.getSequence("chr2", "+", 12, 16), "AAAA")
+
+    def testConverter(self):
+        sequence = snp2counts.TranscriptSequence(self.fasta, "chr1", 10, 40)
+        converter = IndexedFasta.getConverter("one-closed")
+        self.assertEqual(
+            sequence.getSequence("chr1", "+", 11, 20, converter=converter),
+            self.fasta.getSequence("chr1", "+", 11, 20, converter=converter))
+
+    def testClipped(self):
+        sequence = snp2counts.TranscriptSequence(self.fasta, "chr1", -10, 100)
+        self.assertEqual(sequence.mSequence, GENOME["chr1"])
+
+    def testCDSPosition(self):
+        for strand in ("+", "-"):
+            exons = buildExons("t1", strand, ((10, 19, 0), (30, 42, 0)))
+            sequence = snp2counts.TranscriptSequence(self.fasta, "chr1",
+                                                     0, 60)
+            for start in range(10, 42):
+                self.assertEqual(
+                    snp2counts.getCDSPosition(exons, start, start + 1,
+                                              sequence),
+                    snp2counts.getCDSPosition(exons, start, start + 1,
+                                              self.fasta))
+
+
+class TranscriptCacheCheck(GenomeCheck):
+
+    def testHits(self):
+        cache = snp2counts.TranscriptCache(self.fasta, size=2, margin=5)
+        t1 = buildExons("t1", "+", ((10, 19, 0), (30, 42, 0)))
+        sequence = cache.get(t1)
+        self.assertEqual((sequence.mStart, sequence.mEnd), (5, 47))
+        self.assertTrue(cache.get(t1) is sequence)
+        self.assertEqual((cache.mCounts.hits, cache.mCounts.misses), (1, 1))
+
+    def testEviction(self):
+        cache = snp2counts.TranscriptCache(self.fasta, size=2, margin=0)
+        t1 = buildExons("t1", "+", ((10, 19, 0),))
+        t2 = buildExons("t2", "+", ((20, 29, 0),))
+        t3 = buildExons("t3", "+", ((30, 39, 0),))
+        cache.get(t1)
+        cache.get(t2)
+        # t1 is most recently used, t2 is evicted
+        cache.get(t1)
+        cache.get(t3)
+        self.assertEqual(list(cache.mCache.keys()), ["t1", "t3"])
+        cache.get(t2)
+        self.assertEqual((cache.mCounts.hits, cache.mCounts.misses), (1, 4))
+
+class WorkerCheck(GenomeCheck):
+
+    def testGenomeIsReopened(self):
+        module = snp2counts.CounterContigs(fasta=self.fasta)
+        snp2counts.WORKER_MODULES = [module]
+        try:
+            snp2counts.initWorker(self.filename)
+        finally:
+            snp2counts.WORKER_MODULES = None
+        self.assertFalse(module.mFasta is self.fasta)
+        self.assertEqual(module.mFasta.getSequence("chr2", "+", 0, 8),
+                         "TTTTGGGG")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+##########################################################################
+#
+#   MRC FGU Computational Genomics Group
+#
+#   $Id$
+#
+#   Copyright (C) 2009 Andreas Heger
+#
+#   This program is free software; you can redistribute it and/or
+#   modify it under the terms of the GNU General Public License
+#   as published by the Free Software Foundation; either version 2
+#   of the License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+##########################################################################
+"""unit testing module for the npz output of sparse2full.py.
+
+The coordinates in the archive are compared against the square
+matrix built from the same input.
+"""
+
+import os
+import imp
+import shutil
+import tempfile
+import optparse
+import unittest
+import StringIO
+import numpy
+
+sparse2full = imp.load_source(
+    "sparse2full",
+    os.path.join(os.path.dirname(__file__), "..", "scripts", "sparse2full.py"))
+
+LINES = ["a\tb\t1\n",
+         "a\tc\tna\n",
+         "b\td\t3.5\n",
+         "c\td\tna\n",
+         "a\tb\t2\n"]
+
+
+class NpzCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def buildOptions(self, output_format):
+        return optparse.Values(dict(
+            format="string",
+            input_format="row-col-weight",
+            output_format=output_format,
+            asymmetric=False,
+            default="0",
+            default_diagonal="0",
+            is_numeric=False,
+            use_memmap=False,
+            filter_numrows=0,
+            filter_numcols=0,
+            loglevel=0,
+            stdlog=StringIO.StringIO(),
+            output_filename_pattern=os.path.join(self.tmpdir, "%s")))
+
+    def testNpz(self):
+        outfile = StringIO.StringIO()
+        sparse2full.Sparse2Matrix(outfile, "1", LINES,
+                                  self.buildOptions("square"))
+        lines = outfile.getvalue().splitlines()
+        col_names = lines[0].split("\t")[1:]
+        matrix = dict([(x.split("\t")[0], x.split("\t")[1:])
+                       for x in lines[1:]])
+
+        sparse2full.Sparse2Matrix(None, "1", LINES,
+                                  self.buildOptions("npz"))
+        data = numpy.load(os.path.join(self.tmpdir, "1.npz"))
+        self.assertEqual(list(data["row_names"]), ["a", "b", "c", "d"])
+        self.assertEqual(list(data["col_names"]), col_names)
+        # symmetric input: each link is stored in both directions
+        self.assertEqual(len(data["weight"]), 8)
+        for row, col, weight in zip(data["row"],
+                                    data["col"],
+                                    data["weight"]):
+            self.assertEqual(
+                matrix[data["row_names"][row]][col], weight)
+        self.assertEqual(sorted(data["weight"]),
+                         ["2", "2", "3.5", "3.5", "na", "na", "na", "na"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -17,8 +17,33 @@ CGAT_TASK_ID
 CGAT_TASK_STEPSIZE
    The number of tests to run within a chunk
 
+Benchmarking
+------------
+
+If run as a script, the tests are run as benchmarks. Each selected
+test is run repeatedly and the wall time, CPU time, peak resident set
+size and bytes read and written are recorded. Output is not checked
+against the references. For example::
+
+   python tests/test_scripts.py --regex="gtf2table.py" --repeats=5
+
+The measurements are compared against baselines stored in
+:file:`tests/benchmarks.json` and a regression is reported if a
+measurement exceeds the baseline by more than ``--threshold``. Use
+``--update-baseline`` to create the file or to store the current
+measurements as the new baseline.
+
+Larger inputs can be generated from the test data with ``--scale``.
+Files matching ``--scale-pattern`` are replicated the given number of
+times, for example::
+
+   python tests/test_scripts.py --regex="gtf2table.py/read-counts" \\
+       --scale=100
+
+Baselines are kept separately for each scale.
 """
 
+import sys
 import subprocess
 import tempfile
 import os
@@ -29,6 +54,9 @@ import gzip
 import yaml
 import time
 import hashlib
+import json
+import optparse
+import itertools
 
 from nose.tools import ok_
 
@@ -69,29 +97,11 @@ def compute_checksum(filename):
     '''return md5 checksum of file.'''
     return hashlib.md5(open(filename, 'rb').read()).hexdigest()
 
-#########################################
-# List of tests to perform.
-#########################################
-# The fields are:
-
-
-def check_script(test_name, script, stdin,
-                 options, outputs,
-                 references, workingdir):
-    '''check script.
-
-    # 1. Name of the script
-    # 2. Filename to use as stdin
-    # 3. Option string
-    # 4. List of output files to collect
-    # 5. List of reference files
-    workingdir - directory of test data
-    '''
-    tmpdir = tempfile.mkdtemp()
-
-    t1 = time.time()
 
-    stdout = os.path.join(tmpdir, 'stdout')
+def build_statement(script, stdin, options, stdout,
+                    workingdir, tmpdir):
+    '''return statement to run *script* with test data in
+    *workingdir* and output in *tmpdir*.'''
     if stdin:
         if stdin.endswith(".gz"):
             # zcat on osX requires .Z suffix
@@ -116,6 +126,35 @@ def check_script(test_name, script, stdin,
                  " %(options)s"
                  " > %(stdout)s'") % locals()
 
+    return statement
+
+
+#########################################
+# List of tests to perform.
+#########################################
+# The fields are:
+
+
+def check_script(test_name, script, stdin,
+                 options, outputs,
+                 references, workingdir):
+    '''check script.
+
+    # 1. Name of the script
+    # 2. Filename to use as stdin
+    # 3. Option string
+    # 4. List of output files to collect
+    # 5. List of reference files
+    workingdir - directory of test data
+    '''
+    tmpdir = tempfile.mkdtemp()
+
+    t1 = time.time()
+
+    stdout = os.path.join(tmpdir, 'stdout')
+    statement = build_statement(script, stdin, options, stdout,
+                                workingdir, tmpdir)
+
     process = subprocess.Popen(statement,
                                shell=True,
                                stdout=subprocess.PIPE,
@@ -178,8 +217,8 @@ def check_script(test_name, script, stdin,
     ok_(not fail, msg)
 
 
-def test_scripts():
-    '''yield list of scripts to test.'''
+def get_scriptdirs():
+    '''return list of test directories of scripts to test.'''
 
     scriptdirs = glob.glob("tests/*.py")
 
@@ -225,7 +264,44 @@ def test_scripts():
     except TypeError:
         pass
 
-    for scriptdir in scriptdirs:
+    return scriptdirs
+
+
+def iterate_scriptdir(scriptdir):
+    '''iterate over tests in *scriptdir*.
+
+    Yields tuples of test name, path to script and a dictionary
+    with the test description from :file:`tests.yaml`.
+    '''
+
+    script_name = os.path.basename(scriptdir)
+
+    fn = '%s/tests.yaml' % scriptdir
+    if not os.path.exists(fn):
+        return
+
+    script_tests = yaml.load(open(fn))
+
+    for test, values in script_tests.items():
+
+        # deal with scripts in subdirectories. These are prefixed
+        # by a "<subdir>_" for example: optic_compare_projects.py
+        # is optic/compare_procjets.py
+        if "_" in script_name:
+            parts = script_name.split("_")
+            if os.path.exists(os.path.join(
+                    "scripts", parts[0], "_".join(parts[1:]))):
+                script_name = os.path.join(parts[0], "_".join(parts[1:]))
+
+        yield (test,
+               os.path.abspath(os.path.join("scripts", script_name)),
+               values)
+
+
+def test_scripts():
+    '''yield list of scripts to test.'''
+
+    for scriptdir in get_scriptdirs():
 
         script_name = os.path.basename(scriptdir)
 
@@ -233,27 +309,12 @@ def test_scripts():
         yield (check_main,
                os.path.abspath(os.path.join("scripts", script_name)))
 
-        fn = '%s/tests.yaml' % scriptdir
-        if not os.path.exists(fn):
-            continue
-
-        script_tests = yaml.load(open(fn))
-
-        for test, values in script_tests.items():
+        for test, script, values in iterate_scriptdir(scriptdir):
             check_script.description = os.path.join(scriptdir, test)
 
-            # deal with scripts in subdirectories. These are prefixed
-            # by a "<subdir>_" for example: optic_compare_projects.py
-            # is optic/compare_procjets.py
-            if "_" in script_name:
-                parts = script_name.split("_")
-                if os.path.exists(os.path.join(
-                        "scripts", parts[0], "_".join(parts[1:]))):
-                    script_name = os.path.join(parts[0], "_".join(parts[1:]))
-
             yield(check_script,
                   test,
-                  os.path.abspath(os.path.join("scripts", script_name)),
+                  script,
                   values.get('stdin', None),
                   values['options'],
                   values['outputs'],
@@ -272,3 +333,385 @@ def _read(fn):
             for line in inf:
                 if not line.startswith("#"):
                     yield line
+
+
+#########################################
+# Benchmarking
+#########################################
+# version of the format of the baseline file
+BENCHMARK_VERSION = 1
+
+BENCHMARK_BASELINE = "tests/benchmarks.json"
+
+# metrics checked for regressions
+BENCHMARK_METRICS = ("wall", "cpu", "max_rss")
+
+# files in a test directory that are replicated when scaling
+BENCHMARK_SCALE_PATTERN = r"\.(gtf|gff|bed|fastq|fq|bam)(\.gz)?$"
+
+# lines that are kept only once when replicating text files
+HEADER_PATTERN = re.compile("^(#|track|browser)")
+
+# identifiers in gtf files that are made unique when replicating
+GTF_ID_PATTERN = re.compile('(gene_id|transcript_id) "([^"]*)"')
+GTF_GENE_PATTERN = re.compile('gene_id "([^"]*)"')
+
+
+def read_io_counters():
+    '''return bytes read and written by this process and
+    all children that have been waited for.
+
+    Returns None if the counters are not available (they are
+    only provided by Linux).
+    '''
+    try:
+        with open("/proc/self/io") as inf:
+            values = dict([x[:-1].split(": ") for x in inf])
+    except IOError:
+        return None
+    return int(values["rchar"]), int(values["wchar"])
+
+
+def is_position_sorted(lines):
+    '''return True if gtf *lines* are sorted by contig and start.'''
+    seen, last_contig, last_start = set(), None, None
+    for line in lines:
+        fields = line.split("\t")
+        contig, start = fields[0], int(fields[3])
+        if contig != last_contig:
+            if contig in seen:
+                return False
+            seen.add(contig)
+        elif start < last_start:
+            return False
+        last_contig, last_start = contig, start
+    return True
+
+
+def scale_text_file(infile, outfile, scale):
+    '''write *scale* copies of text file *infile* to *outfile*.
+
+    Header lines are written once. Copies follow the original record
+    to maintain the sort order. A record is a line, four lines in
+    fastq files and, in gtf files not sorted by position, all
+    consecutive lines of a gene. Gene and transcript identifiers in
+    gtf files are suffixed with the number of the copy.
+    '''
+    is_gtf = re.search("\.gtf(\.gz)?$", infile)
+    if infile.endswith(".gz"):
+        lines = gzip.open(infile).readlines()
+    else:
+        lines = open(infile).readlines()
+
+    if outfile.endswith(".gz"):
+        outf = gzip.open(outfile, "w")
+    else:
+        outf = open(outfile, "w")
+
+    header = [x for x in lines if HEADER_PATTERN.search(x)]
+    body = [x for x in lines if not HEADER_PATTERN.search(x)]
+
+    if re.search("\.(fastq|fq)(\.gz)?$", infile):
+        records = [body[x:x + 4] for x in range(0, len(body), 4)]
+    elif is_gtf and not is_position_sorted(body):
+        records = [list(x[1]) for x in itertools.groupby(
+            body, lambda x: GTF_GENE_PATTERN.search(x).group(1))]
+    else:
+        records = [[x] for x in body]
+
+    outf.write("".join(header))
+    for record in records:
+        outf.write("".join(record))
+        for copy in range(1, scale):
+            if is_gtf:
+                outf.write("".join(
+                    [GTF_ID_PATTERN.sub('\\1 "\\2_%i"' % copy, x)
+                     for x in record]))
+            else:
+                outf.write("".join(record))
+    outf.close()
+
+
+def scale_bam_file(infile, outfile, scale):
+    '''write *scale* copies of each read in *infile* to *outfile*.
+
+    Copies follow the original read to maintain the sort order
+    and their names are suffixed with the number of the copy.
+    '''
+    import pysam
+    samfile = pysam.Samfile(infile, "rb")
+    outf = pysam.Samfile(outfile, "wb", template=samfile)
+    for read in samfile.fetch(until_eof=True):
+        qname = read.qname
+        for copy in range(scale):
+            if copy > 0:
+                read.qname = "%s_%i" % (qname, copy)
+            outf.write(read)
+    outf.close()
+    samfile.close()
+    if os.path.exists(infile + ".bai"):
+        pysam.index(outfile)
+
+
+def scale_directory(workingdir, tmpdir, scale,
+                    pattern=BENCHMARK_SCALE_PATTERN):
+    '''create a copy of the test data in *workingdir* in *tmpdir*
+    with files matching *pattern* replicated *scale* times.
+
+    Files with a tabix index are not scaled. Other files are linked.
+
+    Returns the directory with the scaled test data.
+    '''
+    rx = re.compile(pattern)
+    scaledir = os.path.join(tmpdir, "data")
+    os.mkdir(scaledir)
+
+    filenames = set(os.listdir(workingdir))
+    for filename in sorted(filenames):
+        infile = os.path.abspath(os.path.join(workingdir, filename))
+        outfile = os.path.join(scaledir, filename)
+        if os.path.exists(outfile):
+            continue
+        if rx.search(filename) and \
+           filename + ".tbi" not in filenames and \
+           not os.path.isdir(infile):
+            if filename.endswith(".bam"):
+                scale_bam_file(infile, outfile, scale)
+            else:
+                scale_text_file(infile, outfile, scale)
+        else:
+            os.symlink(infile, outfile)
+
+    return scaledir
+
+
+def run_benchmark(script, stdin, options, workingdir, repeats=3):
+    '''run *script* *repeats* times and measure resource usage.
+
+    Returns a dictionary with the median wall and CPU time in
+    seconds, the maximum resident set size in kilobytes and the
+    median number of bytes read and written.
+    '''
+    measurements = []
+    for x in range(repeats):
+        tmpdir = tempfile.mkdtemp()
+        stdout = os.path.join(tmpdir, 'stdout')
+        statement = build_statement(script, stdin, options, stdout,
+                                    workingdir, tmpdir)
+        stderr = open(os.path.join(tmpdir, "stderr"), "w+")
+
+        io_start = read_io_counters()
+        t1 = time.time()
+        process = subprocess.Popen(statement,
+                                   shell=True,
+                                   stdout=stderr,
+                                   stderr=stderr,
+                                   cwd=tmpdir)
+        pid, status, rusage = os.wait4(process.pid, 0)
+        t2 = time.time()
+        io_end = read_io_counters()
+        process.returncode = status
+
+        if status != 0:
+            stderr.seek(0)
+            msg = "error in statement: %s; stderr=%s" % \
+                (statement, stderr.read())
+            stderr.close()
+            shutil.rmtree(tmpdir)
+            raise OSError(msg)
+        stderr.close()
+
+        max_rss = rusage.ru_maxrss
+        # osX reports bytes
+        if sys.platform == "darwin":
+            max_rss //= 1024
+
+        values = {"wall": t2 - t1,
+                  "cpu": rusage.ru_utime + rusage.ru_stime,
+                  "max_rss": max_rss}
+        if io_start is not None and io_end is not None:
+            values["read"] = io_end[0] - io_start[0]
+            values["written"] = io_end[1] - io_start[1]
+        measurements.append(values)
+
+        if not DEBUG:
+            shutil.rmtree(tmpdir)
+
+    def median(values):
+        values = sorted(values)
+        return values[len(values) // 2]
+
+    result = {"repeats": repeats,
+              "max_rss": max([x["max_rss"] for x in measurements])}
+    for key in ("wall", "cpu", "read", "written"):
+        if key in measurements[0]:
+            result[key] = median([x[key] for x in measurements])
+    return result
+
+
+def load_baseline(filename):
+    '''load baseline measurements from *filename*.'''
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as inf:
+        data = json.load(inf)
+    if data.get("version") != BENCHMARK_VERSION:
+        raise ValueError(
+            "baseline %s has version %s, expected %i" %
+            (filename, data.get("version"), BENCHMARK_VERSION))
+    return data["benchmarks"]
+
+
+def save_baseline(filename, benchmarks):
+    '''save baseline measurements to *filename*.'''
+    with open(filename, "w") as outf:
+        json.dump({"version": BENCHMARK_VERSION,
+                   "benchmarks": benchmarks},
+                  outf, indent=4, sort_keys=True)
+        outf.write("\n")
+
+
+def check_regression(result, baseline, threshold):
+    '''return metrics in *result* that exceed *baseline* by more
+    than the fraction *threshold*.'''
+    regressions = []
+    for metric in BENCHMARK_METRICS:
+        if metric not in result or not baseline.get(metric):
+            continue
+        if result[metric] > baseline[metric] * (1.0 + threshold):
+            regressions.append(metric)
+    return regressions
+
+
+def benchmark_scripts(argv=None):
+    '''run benchmarks on script tests and compare against a
+    baseline.
+
+    Returns the number of regressions.
+    '''
+    parser = optparse.OptionParser(usage=globals()["__doc__"])
+
+    parser.add_option(
+        "--regex", dest="regex", type="string",
+        help="regular expression to select tests by "
+        "<script>/<test> [%default]")
+
+    parser.add_option(
+        "--repeats", dest="repeats", type="int",
+        help="number of times to run each test [%default]")
+
+    parser.add_option(
+        "--scale", dest="scale", type="int",
+        help="replicate test data this many times [%default]")
+
+    parser.add_option(
+        "--scale-pattern", dest="scale_pattern", type="string",
+        help="regular expression selecting test data to "
+        "replicate [%default]")
+
+    parser.add_option(
+        "--threshold", dest="threshold", type="float",
+        help="fraction by which a metric may exceed the baseline "
+        "before a regression is reported [%default]")
+
+    parser.add_option(
+        "--baseline-file", dest="baseline", type="string",
+        help="json file with baseline measurements [%default]")
+
+    parser.add_option(
+        "--update-baseline", dest="update_baseline", action="store_true",
+        help="store measurements as new baseline [%default]")
+
+    parser.set_defaults(
+        regex=None,
+        repeats=3,
+        scale=1,
+        scale_pattern=BENCHMARK_SCALE_PATTERN,
+        threshold=0.2,
+        baseline=BENCHMARK_BASELINE,
+        update_baseline=False,
+    )
+
+    (options, args) = parser.parse_args(argv)
+
+    if options.regex:
+        rx = re.compile(options.regex)
+    else:
+        rx = None
+
+    baseline = load_baseline(options.baseline)
+    columns = ("wall", "cpu", "max_rss", "read", "written")
+
+    sys.stdout.write("\t".join(
+        ("test", "scale") + columns +
+        ("baseline_wall", "status", "regressions")) + "\n")
+
+    nregressions = 0
+    for scriptdir in get_scriptdirs():
+        for test, script, values in iterate_scriptdir(scriptdir):
+            name = "%s/%s" % (os.path.basename(scriptdir), test)
+            if test == "version" or (rx and not rx.search(name)):
+                continue
+
+            tmpdir = tempfile.mkdtemp()
+            if options.scale > 1:
+                workingdir = scale_directory(scriptdir, tmpdir,
+                                             options.scale,
+                                             options.scale_pattern)
+            else:
+                workingdir = scriptdir
+
+            try:
+                result = run_benchmark(script,
+                                       values.get('stdin', None),
+                                       values['options'],
+                                       workingdir,
+                                       repeats=options.repeats)
+            except OSError, msg:
+                sys.stderr.write("benchmark %s failed: %s\n" % (name, msg))
+                continue
+            finally:
+                shutil.rmtree(tmpdir)
+
+            result["scale"] = options.scale
+            key = "%s/x%i" % (name, options.scale)
+
+            if key in baseline:
+                regressions = check_regression(result, baseline[key],
+                                               options.threshold)
+                if regressions:
+                    status = "regression"
+                    nregressions += 1
+                else:
+                    status = "ok"
+                baseline_wall = "%.3f" % baseline[key]["wall"]
+            else:
+                regressions = []
+                status = "new"
+                baseline_wall = "na"
+
+            fields = []
+            for column in columns:
+                if column not in result:
+                    fields.append("na")
+                elif column in ("wall", "cpu"):
+                    fields.append("%.3f" % result[column])
+                else:
+                    fields.append("%i" % result[column])
+
+            sys.stdout.write("\t".join(
+                [name, str(options.scale)] + fields +
+                [baseline_wall, status, ",".join(regressions)]) + "\n")
+            sys.stdout.flush()
+
+            if options.update_baseline:
+                baseline[key] = result
+
+    if options.update_baseline:
+        save_baseline(options.baseline, baseline)
+
+    return nregressions
+
+
+if __name__ == "__main__":
+    sys.exit(benchmark_scripts() > 0)